@@ -5,8 +5,10 @@
 @file mi/core/driver_scheduler.py
 @author Bill French
 @brief Provides task/event scheduling for drivers
-uses the PolledScheduler and provides a common, simplified interface
-for instrument and platform drivers.
+uses the TimerWheelScheduler and provides a common, simplified interface
+for instrument and platform drivers. All the jobs in a driver process
+share the timer wheel's one thread; a PolledScheduler can be passed in
+to run them on apscheduler as before.
 
 The scheduler is configured by passing a configuration dictionary
 to the constructor or my calling add_config.  Calling add_config
@@ -127,7 +129,7 @@ import inspect
 from mi.core.log import get_logger; log = get_logger()
 
 from mi.core.common import BaseEnum
-from mi.core.scheduler import PolledScheduler
+from mi.core.timer_wheel import TimerWheelScheduler
 from mi.core.exceptions import SchedulerException
 
 class TriggerType(BaseEnum):
@@ -176,7 +178,7 @@ class DriverScheduler(object):
     jobs.
     """
 
-    def __init__(self, config = None):
+    def __init__(self, config = None, scheduler = None):
         """
         config structure:
         {
@@ -186,8 +188,12 @@ class DriverScheduler(object):
             }
         }
         @param config: job configuration structure.
+        @param scheduler: scheduler to add the jobs to, a TimerWheelScheduler
+                          on the process wide timer service if None
         """
-        self._scheduler = PolledScheduler()
+        if(scheduler == None):
+            scheduler = TimerWheelScheduler()
+        self._scheduler = scheduler
         if(config):
             self.add_config(config)
 
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.inotify
+@file mi/core/inotify.py
+@brief Minimal ctypes binding to the Linux inotify API, just enough to
+watch directories for files being created, written and moved.
+
+Inotify() raises InotifyUnavailable where there is no inotify, so callers
+can fall back to polling.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import errno
+import struct
+import ctypes
+import ctypes.util
+from collections import namedtuple
+
+# event masks from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0x800
+IN_CLOEXEC = 0x80000
+
+# struct inotify_event without the name that follows it
+EVENT_HEADER = struct.Struct('iIII')
+
+InotifyEvent = namedtuple('InotifyEvent', 'wd mask cookie name')
+
+
+class InotifyUnavailable(Exception):
+    """
+    inotify can't be used here
+    """
+
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1
+            libc.inotify_add_watch
+        except (OSError, AttributeError) as e:
+            raise InotifyUnavailable('no inotify in libc: %s' % e)
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc = libc
+    return _libc
+
+
+class Inotify(object):
+    """
+    An inotify instance. Its file descriptor can be selected on, and
+    read_events() reads what is waiting without blocking.
+    """
+
+    def __init__(self):
+        """
+        @raises InotifyUnavailable if there is no inotify or the instance
+        limit is reached
+        """
+        libc = _get_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise InotifyUnavailable('inotify_init1 failed: %s' % os.strerror(ctypes.get_errno()))
+        self._buffer = ''
+
+    def add_watch(self, path, mask):
+        """
+        @param path Path to watch
+        @param mask IN_ event mask
+        @retval The watch descriptor events for the path carry
+        @raises InotifyUnavailable if the watch limit is reached
+        @raises OSError if the path can't be watched
+        """
+        wd = _get_libc().inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise InotifyUnavailable('inotify watch limit reached')
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def read_events(self):
+        """
+        @retval List of InotifyEvent waiting to be read, may be empty
+        """
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    break
+                raise
+            if not data:
+                break
+            self._buffer += data
+
+        events = []
+        buffer = self._buffer
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buffer):
+            (wd, mask, cookie, length) = EVENT_HEADER.unpack_from(buffer, offset)
+            end = offset + EVENT_HEADER.size + length
+            if end > len(buffer):
+                break
+            name = buffer[offset + EVENT_HEADER.size:end].rstrip('\0')
+            events.append(InotifyEvent(wd, mask, cookie, name))
+            offset = end
+        self._buffer = buffer[offset:]
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -11,10 +11,379 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import re
+import sre_parse
+import sre_constants
+import string
+from collections import deque
+
 from mi.core.log import get_logger ; log = get_logger()
 
 from mi.core.exceptions import SampleException
 
+# Consumed bytes are only released from the front of the storage buffer once
+# at least this many have piled up and they make up at least half of it.
+COMPACT_THRESHOLD = 65536
+
+# Regex opcodes whose outcome depends on data outside of the match itself.
+# A pattern using any of these is never treated as width bounded.
+_CONTEXT_OPCODES = (sre_constants.AT, sre_constants.ASSERT,
+                    sre_constants.ASSERT_NOT, sre_constants.GROUPREF,
+                    sre_constants.GROUPREF_EXISTS)
+
+# compiled regex -> maximum match width (None if unbounded)
+_regex_widths = {}
+
+
+def resumable_sieve(sieve_fn):
+    """
+    Decorator marking a sieve function as resumable. A resumable sieve takes
+    an optional start_index keyword. Called without it, it behaves like any
+    other sieve and returns a list of (start, end) tuples. Called with it, it
+    only looks for blocks starting at or after start_index and returns a
+    tuple of (list, resume_index), where resume_index is the position the
+    next scan of the same data (plus whatever has been appended to it) can
+    safely start from. Everything before resume_index must be settled: no
+    block can start there no matter what data arrives later. The chunker
+    leaves the settled data out of what it hands the sieve next time, so
+    the sieve must not look behind start_index.
+    """
+    sieve_fn.resumable = True
+    return sieve_fn
+
+
+def is_resumable_sieve(sieve_fn):
+    """
+    @param sieve_fn A sieve function, bound method or functools.partial
+    @retval True if the sieve supports the resumable interface
+    """
+    sieve_fn = getattr(sieve_fn, 'func', sieve_fn)
+    return getattr(sieve_fn, 'resumable', False)
+
+
+class SieveAdapter(object):
+    """
+    Adapts a plain sieve that only returns a list of (start, end) tuples to
+    the resumable interface. Nothing is ever reported as settled so the
+    whole region after the last data block is sieved every time, just as it
+    always has been.
+    """
+    resumable = True
+
+    def __init__(self, sieve_fn):
+        self.sieve_fn = sieve_fn
+
+    def __call__(self, raw_data, start_index=None):
+        result = self.sieve_fn(raw_data)
+        if start_index is None:
+            return result
+        return (result, 0)
+
+
+def regex_max_width(regex):
+    """
+    Work out the longest string a compiled regex can match.
+    @param regex A compiled regex
+    @retval The maximum match width, None if it is unbounded or the pattern
+        looks outside of the match (anchors, lookarounds, back references)
+    """
+    if regex not in _regex_widths:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+        (low, high) = parsed.getwidth()
+        if high >= sre_constants.MAXREPEAT or _uses_context(parsed):
+            _regex_widths[regex] = None
+        else:
+            _regex_widths[regex] = high
+    return _regex_widths[regex]
+
+
+def _uses_context(parsed):
+    """
+    @param parsed A parsed (sre_parse) pattern
+    @retval True if any part of the pattern depends on surrounding data
+    """
+    for (op, av) in parsed:
+        if op in _CONTEXT_OPCODES:
+            return True
+        if op == sre_constants.BRANCH:
+            children = av[1]
+        elif op == sre_constants.SUBPATTERN:
+            children = [av[-1]]
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            children = [av[2]]
+        else:
+            children = []
+        for child in children:
+            if _uses_context(child):
+                return True
+    return False
+
+
+def _regex_literal_prefix(parsed, flags):
+    """
+    @param parsed A parsed (sre_parse) pattern
+    @param flags The flags the pattern was compiled with
+    @retval The literal string every match has to start with, possibly empty
+    """
+    if flags & sre_parse.SRE_FLAG_IGNORECASE:
+        return ''
+    prefix = []
+    for (op, av) in parsed:
+        if op != sre_constants.LITERAL or av > 255:
+            break
+        prefix.append(chr(av))
+    return ''.join(prefix)
+
+
+_CATEGORY_CHARS = {
+    sre_constants.CATEGORY_DIGIT: string.digits,
+    sre_constants.CATEGORY_SPACE: string.whitespace,
+    sre_constants.CATEGORY_WORD: string.ascii_letters + string.digits + '_',
+}
+
+
+def _regex_first_chars(parsed, flags):
+    """
+    Work out which characters a match of a parsed pattern can start with.
+    @param parsed A parsed (sre_parse) pattern
+    @param flags The flags the pattern was compiled with
+    @retval A set of characters, None if it can't be narrowed down (the
+        pattern can start with anything, can match an empty string, or is
+        too clever for this)
+    """
+    for (op, av) in parsed:
+        if op == sre_constants.LITERAL:
+            chars = set([unichr(av)]) if av > 255 else set([chr(av)])
+        elif op == sre_constants.IN:
+            chars = set()
+            for (item_op, item_av) in av:
+                if item_op == sre_constants.LITERAL:
+                    chars.add(chr(item_av) if item_av < 256 else unichr(item_av))
+                elif item_op == sre_constants.RANGE and item_av[1] < 256:
+                    chars.update(chr(c) for c in range(item_av[0], item_av[1] + 1))
+                elif item_op == sre_constants.CATEGORY and item_av in _CATEGORY_CHARS:
+                    chars.update(_CATEGORY_CHARS[item_av])
+                else:
+                    return None
+        elif op == sre_constants.BRANCH:
+            chars = set()
+            for branch in av[1]:
+                branch_chars = _regex_first_chars(branch, flags)
+                if branch_chars is None:
+                    return None
+                chars.update(branch_chars)
+        elif op == sre_constants.SUBPATTERN:
+            chars = _regex_first_chars(av[-1], flags)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] > 0:
+            chars = _regex_first_chars(av[2], flags)
+        else:
+            return None
+
+        if chars is not None and flags & sre_parse.SRE_FLAG_IGNORECASE:
+            chars = set(chars) | set(c.swapcase() for c in chars)
+        return chars
+    return None
+
+
+class _RegexEntry(object):
+    """
+    A regex registered with a TaggedSieve
+    """
+    def __init__(self, tag, regex):
+        if isinstance(regex, basestring):
+            regex = re.compile(regex)
+        self.tag = tag
+        self.regex = regex
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+        self.prefix = _regex_literal_prefix(parsed, regex.flags)
+        self.first_chars = _regex_first_chars(parsed, regex.flags)
+        self.width = regex_max_width(regex)
+
+    def resume_index(self, raw_data, start_index):
+        """
+        @retval The first index a match could still start at once more data
+            arrives
+        """
+        if self.width is None:
+            return start_index
+        return len(raw_data) - self.width + 1
+
+
+class _SyncEntry(object):
+    """
+    A sync prefix and record framer registered with a TaggedSieve
+    """
+    def __init__(self, tag, prefix, framer):
+        self.tag = tag
+        self.prefix = prefix
+        self.framer = framer
+        self.first_chars = set([prefix[0]])
+
+    def match(self, raw_data, start):
+        """
+        @retval The end of the record at start, possibly past the end of the
+            data if it is not all here yet, None if there isn't one
+        """
+        if not raw_data.startswith(self.prefix, start):
+            return None
+        return self.framer(raw_data, start)
+
+    def resume_index(self, raw_data, start_index):
+        """
+        @retval The first index a sync prefix could still be completed at
+        """
+        return len(raw_data) - len(self.prefix) + 1
+
+
+class TaggedSieve(object):
+    """
+    A sieve that looks for any of several kinds of record in a single pass
+    over the data and tags each block it finds with the kind of record it is,
+    usually the particle class that handles it. Build one from a list of
+    (tag, pattern) pairs in priority order, where pattern is a compiled
+    regex (or a pattern string), or use a (tag, sync_prefix, framer) triple
+    for binary records that are framed by a sync word and a length.
+    framer(raw_data, start) returns the end index of the record starting at
+    start, an index past the end of raw_data if the record isn't all here
+    yet, or None if this wasn't a record after all.
+
+    The scanner only stops where the literal prefix (or failing that, a
+    first character) of some record turns up, and there only tries the
+    patterns that can start with that character. When more than one could
+    match at the same place the one registered first wins, and scanning
+    carries on after the end of the block, so the blocks found never
+    overlap. A regex whose first character can't be worked out is searched
+    for on its own and its matches are weighed against the others in the
+    same way.
+
+    Use it anywhere a sieve function is expected. It is resumable and the
+    chunker keeps the tags, see Chunker.get_next_data_with_tag().
+    """
+    resumable = True
+
+    def __init__(self, patterns):
+        """
+        @param patterns A list of (tag, pattern) or (tag, sync_prefix,
+            framer) tuples in priority order
+        """
+        self.entries = []
+        for pattern in patterns:
+            if len(pattern) == 3:
+                self.entries.append(_SyncEntry(*pattern))
+            else:
+                self.entries.append(_RegexEntry(*pattern))
+
+        # first character -> (priority, regex match, entry) for the entries
+        # that can start with it, in priority order. Keyed by both the
+        # character and its value so bytearrays can be scanned too.
+        self._dispatch = {}
+        self._unfiltered = []
+        for (priority, entry) in enumerate(self.entries):
+            # regexes are matched straight from the scan loop
+            regex_match = entry.regex.match if isinstance(entry, _RegexEntry) else None
+            if entry.first_chars is None:
+                self._unfiltered.append((priority, regex_match, entry))
+                continue
+            for char in entry.first_chars:
+                self._dispatch.setdefault(char, []).append((priority, regex_match, entry))
+                if len(char) == 1 and ord(char) < 256:
+                    self._dispatch[ord(char)] = self._dispatch[char]
+
+        # Search for the literal prefixes where there are any, the first
+        # characters otherwise, longest first
+        tokens = set()
+        for entry in self.entries:
+            if entry.first_chars is None:
+                continue
+            if entry.prefix:
+                tokens.add(entry.prefix)
+            else:
+                tokens.update(entry.first_chars)
+        if tokens:
+            tokens = sorted(tokens, key=len, reverse=True)
+            self._prefilter = re.compile('|'.join(re.escape(t) for t in tokens))
+        else:
+            self._prefilter = None
+
+    def scan(self, raw_data, start_index=0):
+        """
+        Find all of the tagged blocks starting at or after start_index.
+        @param raw_data The data to scan
+        @param start_index The index to start scanning from
+        @retval A tuple of ([(start, end, tag), ...], resume_index), see
+            resumable_sieve for the meaning of resume_index
+        """
+        return_list = []
+        data_len = len(raw_data)
+        resume_index = data_len
+
+        search = self._prefilter.search if self._prefilter is not None else None
+        dispatch = self._dispatch
+        unfiltered = self._unfiltered
+        # where each unfiltered regex next matches, past the end if it doesn't
+        unfiltered_starts = [-1] * len(unfiltered)
+
+        index = start_index
+        while index <= data_len:
+            match = search(raw_data, index) if search is not None else None
+            if match is not None:
+                start = match.start()
+                candidates = dispatch[raw_data[start]]
+            else:
+                start = data_len + 1
+                candidates = ()
+
+            if unfiltered:
+                for (i, (priority, regex_match, entry)) in enumerate(unfiltered):
+                    if unfiltered_starts[i] < index:
+                        found = entry.regex.search(raw_data, index)
+                        unfiltered_starts[i] = found.start() if found is not None else data_len + 1
+                first = min(unfiltered_starts)
+                if first < start:
+                    start = first
+                    candidates = ()
+                if first == start:
+                    candidates = sorted(list(candidates) +
+                                        [unfiltered[i] for (i, other) in enumerate(unfiltered_starts)
+                                         if other == start])
+
+            if start > data_len:
+                break
+            index = start + 1
+            for (priority, regex_match, entry) in candidates:
+                if regex_match is not None:
+                    found = regex_match(raw_data, start)
+                    end = found.end() if found is not None else None
+                else:
+                    end = entry.match(raw_data, start)
+                if end is None or end == start:
+                    continue
+                if end > data_len:
+                    # incomplete record, it may still turn up
+                    resume_index = min(resume_index, start)
+                    continue
+                return_list.append((start, end, entry.tag))
+                index = end
+                break
+
+        for entry in self.entries:
+            resume_index = min(resume_index,
+                               entry.resume_index(raw_data, start_index))
+
+        return (return_list, max(start_index, resume_index))
+
+    def __call__(self, raw_data, start_index=None):
+        """
+        Run as a sieve function.
+        @retval A list of (start, end, tag) tuples, or a tuple of that list
+            and the resume index if start_index is given
+        """
+        (return_list, resume_index) = self.scan(raw_data, start_index or 0)
+        if start_index is None:
+            return return_list
+        return (return_list, resume_index)
+
+
 class Chunker(object):
     """
     A great big buffer that ingests incoming data from an instrument, then
@@ -22,6 +391,13 @@ class Chunker(object):
     data. In the process it aggregates data fragments into whole chunks and
     breaks apart collections of data segments so they can be broken into
     individual blocks.
+
+    Incoming data is appended to a growable bytearray and consumed by moving
+    a read cursor forward, so pulling a chunk out never copies the rest of
+    the buffer. Chunk indices are held internally as absolute positions in
+    the stream in deques, which lets chunks be popped off the front without
+    rebasing every remaining entry. The buffer and chunk list attributes
+    still present everything relative to the current read cursor.
     """
     def __init__(self, data_sieve_fn):
         """
@@ -41,82 +417,230 @@ class Chunker(object):
             IN SEQUENTIAL ORDER and WITHOUT OVERLAP.
         """
         self.sieve = data_sieve_fn
-        
-        self.raw_chunk_list = []
-        self.data_chunk_list = []
-        self.nondata_chunk_list = []
-        
-        """ To be filled out by the subclass """
-        self.buffer = None
-        
+
+        # (start, end, timestamp) tuples in absolute stream positions, data
+        # chunks carry the tag from the sieve as a fourth item
+        self._raw_chunks = deque()
+        self._data_chunks = deque()
+        self._nondata_chunks = deque()
+
+        self._data = bytearray()
+        # absolute stream position of self._data[0]
+        self._base = 0
+        # absolute stream position of the read cursor, everything before
+        # it has been consumed
+        self._start = 0
+        # absolute stream position the next sieve pass can resume from
+        self._resume_index = 0
+
+    def _end(self):
+        """
+        @retval The absolute stream position one past the last byte received
+        """
+        return self._base + len(self._data)
+
+    def _make_chunk(self, start, end):
+        """
+        Copy a block out of the storage buffer. Subclasses override this to
+        hand out blocks in the type their drivers expect.
+        @param start absolute stream position of the first byte
+        @param end absolute stream position one past the last byte
+        @retval The block of data between start and end
+        """
+        return self._data[start - self._base:end - self._base]
+
+    def _to_relative(self, chunks):
+        """
+        @param chunks an iterable of absolute (start, end, timestamp) tuples
+        @retval A list of the same chunks relative to the read cursor
+        """
+        offset = self._start
+        return [(c[0] - offset, c[1] - offset, c[2]) for c in chunks]
+
+    def _to_absolute(self, chunks):
+        """
+        @param chunks an iterable of (start, end, timestamp) tuples relative
+            to the read cursor
+        @retval A deque of the same chunks in absolute stream positions
+        """
+        offset = self._start
+        return deque((s + offset, e + offset, t) for (s, e, t) in chunks)
+
+    def _get_sieve(self):
+        return self._sieve
+
+    def _set_sieve(self, sieve_fn):
+        if not is_resumable_sieve(sieve_fn):
+            sieve_fn = SieveAdapter(sieve_fn)
+        self._sieve = sieve_fn
+        self._resume_index = 0
+
+    sieve = property(_get_sieve, _set_sieve,
+                     doc="The sieve function, plain sieves are wrapped in "
+                         "a SieveAdapter")
+
+    def _get_buffer(self):
+        return self._make_chunk(self._start, self._end())
+
+    def _set_buffer(self, value):
+        self._data = bytearray(value)
+        self._base = self._start
+        self._resume_index = self._start
+
+    buffer = property(_get_buffer, _set_buffer,
+                      doc="The unconsumed contents of the buffer")
+
+    def _get_raw_chunk_list(self):
+        return self._to_relative(self._raw_chunks)
+
+    def _set_raw_chunk_list(self, value):
+        self._raw_chunks = self._to_absolute(value)
+
+    raw_chunk_list = property(_get_raw_chunk_list, _set_raw_chunk_list)
+
+    def _get_data_chunk_list(self):
+        return self._to_relative(self._data_chunks)
+
+    def _set_data_chunk_list(self, value):
+        self._data_chunks = deque(c + (None,) for c in self._to_absolute(value))
+
+    data_chunk_list = property(_get_data_chunk_list, _set_data_chunk_list)
+
+    def _get_nondata_chunk_list(self):
+        return self._to_relative(self._nondata_chunks)
+
+    def _set_nondata_chunk_list(self, value):
+        self._nondata_chunks = self._to_absolute(value)
+
+    nondata_chunk_list = property(_get_nondata_chunk_list,
+                                  _set_nondata_chunk_list)
+
     def add_chunk(self, raw_data, timestamp):
         """
         Adds a chunk of data to the end of the buffer, includes the new indices
-        in the raw_chunk_list. This base class method handles strings and lists.
-        Improve or subclass for more capabilities.
+        in the raw_chunk_list.
         
-        @param raw_data The bunch of raw data as a list (or something that can be
-            treated as a list...like a string)
+        @param raw_data The bunch of raw data as a string (or a list of byte
+            values for the binary chunker)
         @param timestamp The time (in NTP4 float format) that the data was
             collected at the port agent
         """
-        assert isinstance(self.buffer, str) or isinstance(self.buffer, list)
         assert isinstance(timestamp, float)
         # Append raw
-        start_index = len(self.buffer)
-        
-        if self.data_chunk_list == []:
-            last_data_index = 0
-        else:
-            last_data_index = self.data_chunk_list[-1][1] 
-        end_index = start_index + len(raw_data)
-        
-        if isinstance(self.buffer, str):
-            self.buffer += raw_data
+        start_index = self._end()
+        self._data.extend(raw_data)
+        self._raw_chunks.append((start_index, self._end(), timestamp))
+
+        # Only the region after the last data chunk can change
+        if self._data_chunks:
+            rescan_index = self._data_chunks[-1][1]
         else:
-            self.buffer.append(raw_data)
-            
-        self.raw_chunk_list.append((start_index, end_index, timestamp))
+            rescan_index = self._start
 
         # find data
-        result = self._generate_data_lists(timestamp,
-                                           start_index=last_data_index)
-        assert result != None
-        
-        # rebase onto existing buffer
-        for (s, e, t) in result['data_chunk_list']:
-            self.data_chunk_list.append((s, e, t))
-        
-            # remove first fragment part from non-data array if we completed a fragment
-            for (nds, nde, ndt) in self.nondata_chunk_list:
-                if (nds == s):
-                    self.nondata_chunk_list.remove((nds, nde, ndt))
-        
-        # splice non-data blocks in, combining with
-        # other blocks as needed
-        if result['non_data_chunk_list'] != []:
-            new_nondata_list = []
-            (first_new_s, first_new_e, first_new_t) = result['non_data_chunk_list'][0]
-            
-            if self.nondata_chunk_list == []:
-                self.nondata_chunk_list = result['non_data_chunk_list']
-                log.debug("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
-                      self.data_chunk_list, self.nondata_chunk_list)
-                return
-            for (s, e, t) in self.nondata_chunk_list:
+        (data_chunks, nondata_chunks) = self._sieve_from(rescan_index,
+                                                         timestamp,
+                                                         resume=True)
+
+        # Non-data chunks in the rescanned region are rebuilt from the new
+        # results, they all sit at the tail of the list.
+        old_tail = []
+        while self._nondata_chunks and self._nondata_chunks[-1][0] >= rescan_index:
+            old_tail.append(self._nondata_chunks.pop())
+        old_tail.reverse()
+
+        # drop fragments that have been completed into data chunks
+        data_starts = set([c[0] for c in data_chunks])
+        old_tail = [c for c in old_tail if c[0] not in data_starts]
+
+        self._data_chunks.extend(data_chunks)
+
+        # splice non-data blocks in, combining with the first
+        # existing block they touch so it keeps its original timestamp
+        if nondata_chunks:
+            (first_new_s, first_new_e, first_new_t) = nondata_chunks[0]
+            for (s, e, t) in old_tail:
                 if e >= first_new_s:
-                    new_nondata_list.append((s, first_new_e, t))
-                    result['non_data_chunk_list'].pop(0) # already used it
+                    self._nondata_chunks.append((s, first_new_e, t))
+                    nondata_chunks.pop(0) # already used it
                     break
-                if e < first_new_s:
-                    new_nondata_list.append((s, e, t))
-            # all done, merging, so add the rest of what is left
-            new_nondata_list.extend(result['non_data_chunk_list'])
-            
-            self.nondata_chunk_list = new_nondata_list
-            log.debug("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
-                      self.data_chunk_list, self.nondata_chunk_list)
-         
+                self._nondata_chunks.append((s, e, t))
+            self._nondata_chunks.extend(nondata_chunks)
+        else:
+            self._nondata_chunks.extend(old_tail)
+
+        log.trace("Added chunk, data_chunk_list: %s, nondata_chunk_list: %s",
+                  self._data_chunks, self._nondata_chunks)
+
+    def _sieve_from(self, start_index, timestamp, resume=False):
+        """
+        Run the sieve over the buffer from an absolute stream position to the
+        end of the received data.
+
+        @param start_index The absolute position to start sieving from
+        @param timestamp The timestamp to use for a non-data chunk covering
+            the whole region when nothing is found
+        @param resume If set, skip over the region settled by the previous
+            pass of the sieve and remember where the next pass can resume
+        @retval A tuple of (data_chunks, non_data_chunks), lists of
+            (start, end, timestamp) tuples in absolute stream positions with
+            the sieve's tag (or None) added to the data chunks
+        """
+        # the settled region is left out of the copy handed to the sieve
+        if resume:
+            scan_start = max(self._resume_index, start_index)
+        else:
+            scan_start = start_index
+        log.trace("Sieving from stream index %s, resuming at %s",
+                  start_index, scan_start)
+        (result, resume_index) = self._sieve(self._make_chunk(scan_start, self._end()),
+                                             start_index=0)
+        if resume:
+            self._resume_index = scan_start + resume_index
+        # assert no overlap!
+        if (self.overlaps(result)):
+            raise SampleException("Overlapping blocks in sieve list: %s" % result)
+        # sort to protect us from some sloppy sieve code
+        result.sort()
+
+        data_chunks = []
+        non_data_chunks = []
+
+        if result == []:
+            non_data_chunks.append((start_index, self._end(), timestamp))
+
+        previous_end = start_index
+        for item in result:
+            # rebase to the stream as we walk through
+            s = item[0] + scan_start
+            e = item[1] + scan_start
+            tag = item[2] if len(item) > 2 else None
+            assert(s >= previous_end)
+            data_chunks.append((s, e, self._timestamp_at(s), tag))
+            if (s > previous_end):
+                non_data_chunks.append((previous_end, s,
+                                        self._timestamp_at(previous_end)))
+            previous_end = e
+
+        return (data_chunks, non_data_chunks)
+
+    def _timestamp_at(self, index):
+        """
+        Find the timestamp of the raw chunk an absolute stream position falls
+        in. The raw chunks are searched from the newest end since sieved
+        blocks are almost always recent.
+
+        @param index An absolute stream position
+        @retval The timestamp of the raw chunk, None if there is no raw
+            chunk at that position
+        """
+        timestamp = None
+        for (raw_s, raw_e, raw_t) in reversed(self._raw_chunks):
+            if index >= raw_e:
+                break
+            timestamp = raw_t
+        return timestamp
+
     def _generate_data_lists(self, timestamp, start_index=0):
         """
         From some starting place in the raw data buffer, go through and
@@ -131,37 +655,10 @@ class Chunker(object):
             that include the full data chunk lists for this block of data.
             Indices are respect to the buffer, not the chunk
         """
-        log.debug("Generating data lists with start index %s", start_index)
-        return_list = {'data_chunk_list':[], 'non_data_chunk_list':[]}
-        result = self.sieve(self.buffer[start_index:])
-        # assert no overlap!
-        if (self.overlaps(result)):
-            raise SampleException("Overlapping blocks in sieve list: %s" % result)
-        # sort to protect us from some sloppy sieve code
-        result.sort()
-
-        # rebase to buffer coordinates
-        return_list['data_chunk_list'] = [(s+start_index, e+start_index) for (s, e) in result]
-        return_list['data_chunk_list'] = self.add_timestamps(return_list['data_chunk_list'])
-        # Look up the timestamps from the old list - could be made more efficient
-        
-        if result == []:
-            return_list['non_data_chunk_list'].append((start_index,
-                                                       len(self.buffer),
-                                                       timestamp))
-        previous_end = start_index
-        for (s, e) in result:
-            # rebase to buffer as long as we are walking through
-            s += start_index
-            e += start_index
-            assert(s >= previous_end)
-            if (s == previous_end):
-                previous_end = e
-            elif (s > previous_end):
-                return_list['non_data_chunk_list'].append((previous_end, s))
-                previous_end = e
-
-        return_list['non_data_chunk_list'] = self.add_timestamps(return_list['non_data_chunk_list'])
+        (data_chunks, non_data_chunks) = self._sieve_from(self._start + start_index,
+                                                          timestamp)
+        return_list = {'data_chunk_list': self._to_relative(data_chunks),
+                       'non_data_chunk_list': self._to_relative(non_data_chunks)}
         log.debug("Generated return list: %s", return_list)
         return return_list    
     
@@ -183,19 +680,15 @@ class Chunker(object):
             # simple case if it already has a timestamp
             if (len(item) == 3):
                 result_list.append(item)
-                break
-            elif (len(item) == 2):
-                (s, e) = (item[0], item[1])
-            else:
+                continue
+            elif (len(item) != 2):
                 raise SampleException("Invalid pair encountered!")
-                
-            for (raw_s, raw_e, raw_t) in self.raw_chunk_list:
-                if (s >= raw_e):
-                    continue
-                else:
-                    result_list.append((s, e, raw_t))
-                    break
-                    
+
+            (s, e) = item
+            timestamp = self._timestamp_at(s + self._start)
+            if timestamp is not None:
+                result_list.append((s, e, timestamp))
+
         log.trace("add_timestamp returning result_list: %s", result_list)
         return result_list
     
@@ -214,9 +707,7 @@ class Chunker(object):
         
         data_list.sort()
         for index in range(1,len(data_list)):
-            (s1, e1) = data_list[index-1]
-            (s2, e2) = data_list[index]
-            if (s2 < e1):
+            if (data_list[index][0] < data_list[index-1][1]):
                 return True
             
         return False
@@ -248,26 +739,54 @@ class Chunker(object):
             float format and data chunk is a section of buffer with indices
             between (start, end). If no data, returns (None, None, None, None)
         """
-        if self.data_chunk_list == []:
+        return self._get_next(self._data_chunks, clean)
+
+    def get_next_data_with_tag(self, clean=True):
+        """
+        Get the next chunk of data from the buffer along with the tag the
+        sieve gave it (see TaggedSieve). By default, it clears all that comes
+        before it.
+
+        @param clean If set to false, do not clear the buffer when fetching the
+            data, but simply return the data block and make no further changes.
+        @return A tuple of (timestamp, data_chunk, tag), the tag is None if
+            the sieve doesn't tag its blocks. If no data, returns
+            (None, None, None)
+        """
+        if not self._data_chunks:
+            return (None, None, None)
+        tag = self._data_chunks[0][3]
+        (time, result, start, end) = self._get_next(self._data_chunks, clean)
+        return (time, result, tag)
+
+    def _get_next(self, chunks, clean):
+        """
+        Get the next chunk from one of the chunk deques, optionally consuming
+        the buffer up to and including it.
+
+        @param chunks The deque of absolute chunk tuples to take from
+        @param clean Remove the buffer contents before and including the chunk
+        @retval A tuple of (timestamp, data_chunk, start_index, end_index) with
+            indices relative to the read cursor before any cleaning,
+            (None, None, None, None) if the deque is empty
+        """
+        if not chunks:
             return (None, None, None, None)
 
-        if clean:    
-            (next_start, next_end, timestamp) = self.data_chunk_list.pop(0)
+        if clean:
+            chunk = chunks.popleft()
         else:
-            (next_start, next_end, timestamp) = self.data_chunk_list[0]
-        
-        next_block = self.buffer[next_start:next_end]
-
-        if clean:    
-            self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
-            self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
-                                                         next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
-                
-        return (timestamp, next_block, next_start, next_end)
+            chunk = chunks[0]
+        (next_start, next_end, timestamp) = chunk[:3]
+
+        next_block = self._make_chunk(next_start, next_end)
+        result = (timestamp, next_block,
+                  next_start - self._start, next_end - self._start)
+
+        if clean:
+            self._discard(next_end)
+
+        return result
     
     def _clean_chunk_list(self, list, end_index):
         """
@@ -294,47 +813,72 @@ class Chunker(object):
                 if e > end_index:
                     return_list.append((0,e-end_index, time))
         return return_list
-    
-    def _clean_data_list(self, index):
+
+    @staticmethod
+    def _trim(chunks, end_index):
         """
-        Clean up the data list in place so that it, if a fragment is consumed
-        by a get_next_raw call, the data chunk is remove and added back to the
-        non-data list.
-        
-        @param index The index that things are being cleared up to
-        """
-        new_nondata_list = []
-
-        log.debug("Cleaning data chunk, data_chunk_list: %s, nondata_chunk_list: %s",
-                  self.data_chunk_list, self.nondata_chunk_list)
-
-        for (s, e, t) in self.data_chunk_list:
-            if (e <= index):
-                self.data_chunk_list.remove((s, e, t))
-                
-            if (e > index):
-                self.data_chunk_list.remove((s, e, t))
-                # add remaining to non data
-                for (nds, nde, ndt) in self.nondata_chunk_list:
-                    if (nde < s):
-                        new_nondata_list.append((nds, nde, ndt))
-                    elif (nde == s):
-                        new_nondata_list.append((nds, e, ndt))
-                    elif (nde > s):
-                        new_nondata_list.append((nds, nde, ndt))
-        
-        self.nondata_chunk_list = new_nondata_list
-    
+        Drop the chunks that end before an absolute position from the front of
+        a chunk deque and cut down one that straddles it.
+
+        @param chunks A deque of absolute (start, end, timestamp) tuples
+        @param end_index The absolute position being cleaned up to
+        """
+        while chunks and chunks[0][0] < end_index:
+            (s, e, t) = chunks[0]
+            if e > end_index:
+                chunks[0] = (end_index, e, t)
+                break
+            chunks.popleft()
+
+    def _discard(self, end_index):
+        """
+        Move the read cursor up to an absolute stream position and bring the
+        chunk deques in line with it. A data chunk that gets cut in half by
+        this can no longer be parsed, so what is left of it becomes non-data.
+
+        @param end_index The absolute position to clean up to
+        """
+        if end_index <= self._start:
+            return
+
+        self._start = end_index
+        self._trim(self._raw_chunks, end_index)
+        self._trim(self._nondata_chunks, end_index)
+
+        data_chunks = self._data_chunks
+        while data_chunks and data_chunks[0][1] <= end_index:
+            data_chunks.popleft()
+        if data_chunks and data_chunks[0][0] < end_index:
+            (s, e, t) = data_chunks.popleft()[:3]
+            if self._nondata_chunks and self._nondata_chunks[0][0] == e:
+                (nds, e, ndt) = self._nondata_chunks.popleft()
+            self._nondata_chunks.appendleft((end_index, e, t))
+            # what is left of it has to be sieved again
+            self._resume_index = end_index
+
+        self._compact()
+
+    def _compact(self):
+        """
+        Release consumed bytes from the front of the storage buffer. This is
+        free when everything has been consumed, otherwise it only happens
+        once the consumed region is large enough to be worth the move.
+        """
+        consumed = self._start - self._base
+        if consumed == len(self._data):
+            del self._data[:]
+        elif consumed >= COMPACT_THRESHOLD and consumed * 2 >= len(self._data):
+            del self._data[:consumed]
+        else:
+            return
+        self._base = self._start
+
     def _clean_buffer(self, end_index):
         """
-        Clean up the buffer only...usually followed by some list cleaning
+        Clean up the buffer and the chunk lists with it
         @param end_index the last index used...clean up to here
         """
-        # Clean up buffer
-        if isinstance(self.buffer, str):
-            self.buffer = self.buffer[end_index:]
-        else:
-            self.buffer[0:end_index] = []
+        self._discard(self._start + end_index)
         
     def get_next_non_data_with_index(self, clean=True):
         """
@@ -347,26 +891,7 @@ class Chunker(object):
             where timestamp is in NTP4 float format and data chunk is a 
             (start, end) tuple, (None, None) if no data
         """
-        if self.nondata_chunk_list == []:
-            return (None, None, None, None)
-
-        if clean:    
-            (next_start, next_end, next_time) = self.nondata_chunk_list.pop(0)
-        else:
-            (next_start, next_end, next_time) = self.nondata_chunk_list[0]
-        
-        next_block = self.buffer[next_start:next_end]
-
-        if clean:    
-            self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
-            self.data_chunk_list = self._clean_chunk_list(self.data_chunk_list,
-                                                         next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
-                        
-        return (next_time, next_block, next_start, next_end)
+        return self._get_next(self._nondata_chunks, clean)
 
     def get_next_non_data(self, clean=True):
         """
@@ -393,45 +918,21 @@ class Chunker(object):
             float format and data chunk is a (start, end) tuple,
             (None, None) if empty list
         """
-        if self.raw_chunk_list == []:
-            return (None, None)
-
-        if clean:    
-            (next_start, next_end, next_time) = self.raw_chunk_list.pop(0)
-        else:
-            (next_start, next_end, next_time) = self.raw_chunk_list[0]
-        
-        next_block = self.buffer[next_start:next_end]
-
-        if clean:
-            self._clean_buffer(next_end)
-            self.raw_chunk_list = self._clean_chunk_list(self.raw_chunk_list,
-                                                         next_end)
-            self._clean_data_list(next_end)
-            self.nondata_chunk_list = self._clean_chunk_list(self.nondata_chunk_list,
-                                                             next_end)
-
-        return (next_time, next_block)
+        (time, result, start, end) = self._get_next(self._raw_chunks, clean)
+        return (time, result)
 
     def clean_all_chunks(self):
         """
         Clean all data out of the non_data, raw, and data lists
         """
-        # clear out any non matching data.
-        (nd_timestamp, non_data) = self.get_next_non_data(clean=True)
-        while non_data is not None:
-            (nd_timestamp, non_data) = self.get_next_non_data(clean=True)
-        # clean out raw data
-        (nd_timestamp, raw_data) = self.get_next_raw(clean=True)
-        while raw_data is not None:
-            (nd_timestamp, raw_data) = self.get_next_raw(clean=True)
-        # clean out data
-        (nd_timestamp, data) = self.get_next_data(clean=True)
-        while data is not None:
-            (nd_timestamp, data) = self.get_next_data(clean=True)
+        self._discard(self._end())
+        self._raw_chunks.clear()
+        self._data_chunks.clear()
+        self._nondata_chunks.clear()
 
     @staticmethod
-    def regex_sieve_function(raw_data, regex_list=[]):
+    @resumable_sieve
+    def regex_sieve_function(raw_data, regex_list=[], start_index=None):
         """
         Simple method to take a list of regexes to use in a sieve and run the
         incoming data through them. Use this with functools.partial() to
@@ -441,18 +942,37 @@ class Chunker(object):
         @param raw_data The raw data to run through this regex sieve
         @param regex_list a list of pre-compiled regexes that will identify some
         flavor of a pattern in the raw data for matching.
-        @retval A list of (start, end) tuples for each match the regexs find
+        @param start_index If given, only look for matches starting at or after
+        this index and return where the next scan can resume (see
+        resumable_sieve). A regex can only be resumed past data that is too
+        long ago for it to still match, so patterns of unbounded width never
+        move the resume index forward.
+        @retval A list of (start, end) tuples for each match the regexs find,
+        or a tuple of (list, resume_index) if start_index is given
         @use
         """
         return_list = []
     
         sieve_matchers = regex_list
-        
+
+        if start_index is None:
+            for matcher in sieve_matchers:
+                for match in matcher.finditer(raw_data):
+                    return_list.append((match.start(), match.end()))
+            return return_list
+
+        resume_index = len(raw_data)
         for matcher in sieve_matchers:
-            for match in matcher.finditer(raw_data):
+            for match in matcher.finditer(raw_data, start_index):
                 return_list.append((match.start(), match.end()))
-    
-        return return_list
+
+            width = regex_max_width(matcher)
+            if width is None:
+                resume_index = start_index
+            else:
+                resume_index = min(resume_index, len(raw_data) - width + 1)
+
+        return (return_list, max(start_index, resume_index))
 
     
 class StringChunker(Chunker):
@@ -462,15 +982,20 @@ class StringChunker(Chunker):
     """
     def __init__(self, data_sieve_fn):
         Chunker.__init__(self, data_sieve_fn)
-        self.buffer = ""
-    
+
+    def _make_chunk(self, start, end):
+        """
+        Hand out blocks as strings, copied straight out of the storage buffer
+        """
+        return str(buffer(self._data, start - self._base, end - start))
+
     
 class BinaryChunker(Chunker):
     """
     A version of the chunker that handles a binary buffer and therefore
-    binary data blocks that fall out of it.
+    binary data blocks that fall out of it. Blocks are handed out (and passed
+    to the sieve) as bytearrays.
     """
     def __init__(self, data_sieve_fn):
         Chunker.__init__(self, data_sieve_fn)
-        self.buffer = []
     
\ No newline at end of file
@@ -24,9 +24,14 @@ except ImportError:
     import json
 
 from mi.core.common import BaseEnum
+from mi.core.ntp_time import Epoch, to_ntp
 from mi.core.exceptions import SampleException, ReadOnlyException, NotImplementedException, InstrumentParameterException
 from mi.core.log import get_logger ; log = get_logger()
 
+# ntplib.system_to_ntp_time() is just this offset added to a unix time, add
+# it inline for the driver timestamp every particle gets
+NTP_DELTA = ntplib.system_to_ntp_time(0)
+
 class CommonDataParticleType(BaseEnum):
     """
     This enum defines all the common particle types defined in the modules.  Currently there is only one, but by
@@ -68,8 +73,17 @@ class DataParticle(object):
     It is the intent that this class is subclassed as needed if an instrument must
     modify fields in the outgoing packet. The hope is to have most of the superclass
     code be called by the child class with just values overridden as needed.
+
+    Parsed values and the JSON string are built the first time they are
+    asked for and reused after that, so a particle that is generated once
+    to check for encoding errors and again to publish is only parsed and
+    serialized once. Setting the internal timestamp through
+    set_internal_timestamp() or set_value() discards them; a subclass that
+    changes contents directly after generating must call _invalidate().
     """
 
+    __slots__ = ('contents', 'raw_data', '_encoding_errors', '_values', '_json')
+
     # data particle type is intended to be defined in each derived data particle class.  This value should be unique
     # for all data particles.  Best practice is to access this variable using the accessor method:
     # data_particle_type()
@@ -88,12 +102,16 @@ class DataParticle(object):
         if new_sequence is not None and not isinstance(new_sequence, bool):
             raise TypeError("new_sequence is not a bool")
 
+        # Built with a literal rather than copied from a template dict: the
+        # copy gets a smaller hash table, and on python 2 that changes the
+        # key order, and so the JSON, of particles that add their own keys
+        # to contents.
         self.contents = {
             DataParticleKey.PKT_FORMAT_ID: DataParticleValue.JSON_DATA,
             DataParticleKey.PKT_VERSION: 1,
             DataParticleKey.PORT_TIMESTAMP: port_timestamp,
             DataParticleKey.INTERNAL_TIMESTAMP: internal_timestamp,
-            DataParticleKey.DRIVER_TIMESTAMP: ntplib.system_to_ntp_time(time.time()),
+            DataParticleKey.DRIVER_TIMESTAMP: time.time() + NTP_DELTA,
             DataParticleKey.PREFERRED_TIMESTAMP: preferred_timestamp,
             DataParticleKey.QUALITY_FLAG: quality_flag,
         }
@@ -102,6 +120,8 @@ class DataParticle(object):
             self.contents[DataParticleKey.NEW_SEQUENCE] = new_sequence
 
         self.raw_data = raw_data
+        self._values = None
+        self._json = None
 
     def __eq__(self, arg):
         """
@@ -131,6 +151,25 @@ class DataParticle(object):
         """
         return cls._data_particle_type
 
+    @classmethod
+    def create_batch(cls, raw_data, times, epoch=Epoch.UNIX, leap_seconds=0, **kwargs):
+        """
+        Build a particle for each record, with all the record times
+        converted to internal timestamps in one call.
+        @param raw_data Sequence of raw data, one per particle
+        @param times Matching sequence or numpy array of record times
+        @param epoch Epoch the times count from, see mi.core.ntp_time
+        @param leap_seconds Seconds the time scale is ahead of UTC
+        @param kwargs Passed on to each particle's constructor
+        @retval List of particles
+        @raise SampleException if there isn't a time for each record
+        """
+        if len(raw_data) != len(times):
+            raise SampleException("%d records but %d times" % (len(raw_data), len(times)))
+        timestamps = to_ntp(times, epoch, leap_seconds)
+        return [cls(data, internal_timestamp=timestamp, **kwargs)
+                for (data, timestamp) in zip(raw_data, timestamps)]
+
     def set_internal_timestamp(self, timestamp=None, unix_time=None):
         """
         Set the internal timestamp
@@ -149,6 +188,7 @@ class DataParticle(object):
         #    raise InstrumentParameterException("invalid timestamp")
 
         self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = float(timestamp)
+        self._invalidate()
 
     def set_value(self, id, value):
         """
@@ -160,6 +200,7 @@ class DataParticle(object):
         """
         if (id == DataParticleKey.INTERNAL_TIMESTAMP) and (self._check_timestamp(value)):
             self.contents[DataParticleKey.INTERNAL_TIMESTAMP] = value
+            self._invalidate()
         else:
             raise ReadOnlyException("Parameter %s not able to be set to %s after object creation!" %
                                     (id, value))
@@ -186,12 +227,21 @@ class DataParticle(object):
 
         return self._data_particle_type
 
+    def _invalidate(self):
+        """
+        Discard the parsed values and JSON so the next generate_dict() or
+        generate() builds them again from raw_data and contents.
+        """
+        self._values = None
+        self._json = None
+
     def generate_dict(self):
         """
         Generate a simple dictionary of sensor data and timestamps, without
         going to JSON. This is useful for the times when JSON is not needed to
         go across an interface. There are times when particles are used
-        internally to a component/process/module/etc.
+        internally to a component/process/module/etc. Each call returns a
+        new dict, the values list in it is shared between calls.
         @retval A python dictionary with the proper timestamps and data values
         @throws InstrumentDriverException if there is a problem wtih the inputs
         """
@@ -206,9 +256,12 @@ class DataParticle(object):
         if not self._check_preferred_timestamps():
             raise SampleException("Preferred timestamp not in particle!")
         
-        # build response structure
-        self._encoding_errors = []
-        values = self._build_parsed_values()
+        # build response structure, values are parsed once
+        values = self._values
+        if values is None:
+            self._encoding_errors = []
+            values = self._build_parsed_values()
+            self._values = values
         result = self._build_base_structure()
         result[DataParticleKey.STREAM_NAME] = self.data_particle_type()
         result[DataParticleKey.VALUES] = values
@@ -229,9 +282,12 @@ class DataParticle(object):
            and driver timestamp
         @throws InstrumentDriverException If there is a problem with the inputs
         """
-        result = self.generate_dict()
-        json_result = json.dumps(result, sort_keys=sorted)
-        return json_result
+        if sorted:
+            return json.dumps(self.generate_dict(), sort_keys=True)
+
+        if self._json is None:
+            self._json = json.dumps(self.generate_dict())
+        return self._json
         
     def _build_parsed_values(self):
         """
@@ -332,6 +388,8 @@ class RawDataParticle(DataParticle):
 
     It essentially is a translation of the port agent packet
     """
+    __slots__ = ()
+
     _data_particle_type = CommonDataParticleType.RAW
 
     def _build_parsed_values(self):
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.driver_launcher
+@file mi/core/instrument/driver_launcher.py
+@brief Fork server for ZMQ driver processes.
+
+ZmqDriverProcess.launch_process starts a new interpreter for every driver,
+which then imports pyon, the MI core and the driver from scratch before it
+writes its ports to files the launcher polls for. DriverLauncher instead
+starts one server interpreter that imports the common modules once and
+forks a driver process for each launch request. The forked process only
+imports the driver module itself and reports its ports back over a pipe.
+
+The launcher is opt in: ZmqDriverProcess.launch_process uses it when
+handed one and starts a new interpreter otherwise.
+
+To launch drivers from the python interpreter:
+from mi.core.instrument.driver_launcher import DriverLauncher
+from mi.core.instrument.zmq_driver_process import ZmqDriverProcess
+launcher = DriverLauncher()
+launcher.start()
+(process, cmd_port, evt_port) = ZmqDriverProcess.launch_process(
+    'mi.instrument.seabird.sbe37smb.ooicore.driver', 'SBE37Driver', launcher=launcher)
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import sys
+import json
+import time
+import errno
+import select
+import signal
+import threading
+from subprocess import Popen, PIPE
+
+from mi.core.exceptions import InstrumentException, InstrumentTimeoutException
+from mi.core.log import get_logger ; log = get_logger()
+
+# imported by the server before it forks any driver
+PRELOAD_MODULES = (
+    'zmq',
+    'mi.core.log',
+    'mi.core.exceptions',
+    'mi.core.common',
+    'mi.core.instrument.zmq_driver_process',
+    'mi.core.instrument.zmq_codec',
+    'mi.core.instrument.instrument_driver',
+    'mi.core.instrument.instrument_protocol',
+    'mi.core.instrument.instrument_fsm',
+    'mi.core.instrument.protocol_param_dict',
+    'mi.core.instrument.data_particle',
+    'mi.core.instrument.chunker',
+    'mi.core.instrument.port_agent_client',
+)
+
+# seconds to wait for a forked driver to report its ports
+LAUNCH_TIMEOUT = 60
+
+
+def serve(preload=PRELOAD_MODULES):
+    """
+    Fork server main loop, run in the server interpreter. Launch requests
+    are read as JSON lines from stdin and answered as JSON lines on what
+    was stdout, which is then pointed at stderr so nothing printed by a
+    driver can get into the replies. The server exits when stdin closes.
+    @param preload Modules to import before serving
+    """
+    requests = sys.stdin
+    replies = os.fdopen(os.dup(1), 'w', 0)
+    os.dup2(2, 1)
+
+    for module in preload:
+        try:
+            __import__(module)
+        except ImportError as e:
+            log.warn('Driver launcher could not preload %s: %s', module, e)
+
+    exited = {}
+    replies.write(json.dumps({'pid': os.getpid()}) + '\n')
+
+    while True:
+        line = requests.readline()
+        if not line:
+            break
+        _reap(exited)
+        try:
+            request = json.loads(line)
+            op = request.get('op')
+            if op == 'launch':
+                reply = _fork_driver(request, [requests.fileno(), replies.fileno()])
+            elif op == 'poll':
+                reply = {'returncode': exited.pop(request['pid'], None)}
+            else:
+                reply = {'error': 'Unknown driver launcher request %s' % op}
+        except Exception as e:
+            reply = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        replies.write(json.dumps(reply) + '\n')
+
+    log.info('Driver launcher exiting.')
+    os._exit(0)
+
+def _reap(exited):
+    """
+    Collect the exit status of any driver processes that have ended.
+    @param exited dict of pid to return code, updated
+    """
+    while True:
+        try:
+            (pid, status) = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            return
+        if not pid:
+            return
+        exited[pid] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+def _fork_driver(request, server_fds):
+    """
+    Fork a driver process and wait for it to report its ports.
+    @param request The launch request
+    @param server_fds Server file descriptors the driver must not keep
+    @retval Reply dict with pid, cmd_port and evt_port, or an error
+    """
+    timeout = request.get('timeout') or LAUNCH_TIMEOUT
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        _run_driver(request, write_fd, server_fds)
+
+    os.close(write_fd)
+    ports = {}
+    data = ''
+    deadline = time.time() + timeout
+    try:
+        while len(ports) < 2:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([read_fd], [], [], remaining)[0]:
+                return {'pid': pid, 'error': 'Driver process did not report its ports in %ss' % timeout}
+            chunk = os.read(read_fd, 4096)
+            if not chunk:
+                return {'pid': pid, 'error': 'Driver process exited before reporting its ports'}
+            data += chunk
+            while '\n' in data:
+                (line, data) = data.split('\n', 1)
+                (name, port) = line.split()
+                ports[name] = int(port)
+    finally:
+        os.close(read_fd)
+
+    return {'pid': pid, 'cmd_port': ports['cmd'], 'evt_port': ports['evt']}
+
+def _run_driver(request, port_fd, server_fds):
+    """
+    Body of a forked driver process, never returns.
+    """
+    try:
+        for fd in server_fds:
+            os.close(fd)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+        from mi.core.instrument.zmq_driver_process import ZmqDriverProcess
+        dp = ZmqDriverProcess(request['driver_module'], request['driver_class'],
+                              None, None, request.get('ppid'), port_pipe=port_fd)
+        dp.run()
+    except BaseException as e:
+        log.error('Forked driver process failed: %s', e)
+        os._exit(1)
+    os._exit(0)
+
+
+class ForkedDriverProcess(object):
+    """
+    Handle on a driver process forked by the launcher, with the parts of
+    the Popen interface driver process users rely on.
+    """
+
+    def __init__(self, launcher, pid):
+        self.launcher = launcher
+        self.pid = pid
+        self.returncode = None
+
+    def poll(self):
+        """
+        @retval The exit code if the process has ended, otherwise None
+        """
+        if self.returncode is None:
+            self.returncode = self.launcher.poll(self.pid)
+        return self.returncode
+
+    def wait(self, timeout=None):
+        """
+        Wait for the process to end.
+        @param timeout Seconds to wait, None waits forever
+        @retval The exit code
+        @raises InstrumentTimeoutException if the process is still running
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.time() > deadline:
+                raise InstrumentTimeoutException('Driver process %d still running' % self.pid)
+            time.sleep(.1)
+        return self.returncode
+
+    def send_signal(self, signum):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signum)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class DriverLauncher(object):
+    """
+    Client for a driver fork server. launch_process() returns the same
+    (process, cmd port, evt port) tuple as ZmqDriverProcess.launch_process,
+    with a ForkedDriverProcess in place of the Popen object. Requests are
+    serialized, the server handles one at a time.
+    """
+
+    def __init__(self, preload=PRELOAD_MODULES, python='bin/python'):
+        """
+        @param preload Modules for the server to import once
+        @param python Interpreter to run the server with
+        """
+        self.preload = tuple(preload)
+        self.python = python
+        self.server = None
+        self._lock = threading.Lock()
+
+    def start(self, timeout=LAUNCH_TIMEOUT):
+        """
+        Start the server and wait until it has imported the preload
+        modules.
+        """
+        cmd_str = 'from %s import serve; serve(%r)' % (__name__, self.preload)
+        self.server = Popen([self.python, '-c', cmd_str], stdin=PIPE, stdout=PIPE, close_fds=True)
+        reply = self._read_reply(timeout)
+        log.info('Driver launcher %d started.', reply['pid'])
+
+    def stop(self):
+        """
+        Stop the server. Drivers it launched keep running.
+        """
+        if self.server is not None:
+            self.server.stdin.close()
+            self.server.wait()
+            self.server.stdout.close()
+            self.server = None
+
+    def launch_process(self, driver_module, driver_class, ppid=None, timeout=LAUNCH_TIMEOUT):
+        """
+        Fork a ZmqDriverProcess for a driver.
+        @param driver_module The python module containing the driver code.
+        @param driver_class The python driver class.
+        @param ppid ID of the parent process, used to self destruct when
+        parent dies in test cases.
+        @param timeout Seconds to wait for the driver ports
+        @retval Tuple containing (ForkedDriverProcess, cmd port, evt port)
+        @raises InstrumentException if the driver process could not start
+        """
+        reply = self._request({'op': 'launch', 'driver_module': driver_module,
+                               'driver_class': driver_class, 'ppid': ppid,
+                               'timeout': timeout}, timeout + 5)
+        if 'error' in reply:
+            if 'pid' in reply:
+                ForkedDriverProcess(self, reply['pid']).kill()
+            raise InstrumentException('Could not launch %s.%s: %s' %
+                                      (driver_module, driver_class, reply['error']))
+        return (ForkedDriverProcess(self, reply['pid']), reply['cmd_port'], reply['evt_port'])
+
+    def poll(self, pid):
+        """
+        @retval Exit code of a launched driver process, None while it runs
+        """
+        return self._request({'op': 'poll', 'pid': pid})['returncode']
+
+    def _request(self, request, timeout=LAUNCH_TIMEOUT):
+        with self._lock:
+            if self.server is None:
+                raise InstrumentException('Driver launcher not started')
+            self.server.stdin.write(json.dumps(request) + '\n')
+            self.server.stdin.flush()
+            return self._read_reply(timeout)
+
+    def _read_reply(self, timeout):
+        if not select.select([self.server.stdout], [], [], timeout)[0]:
+            raise InstrumentTimeoutException('No reply from driver launcher')
+        line = self.server.stdout.readline()
+        if not line:
+            raise InstrumentException('Driver launcher exited')
+        return json.loads(line)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.event_queue
+@file mi/core/instrument/event_queue.py
+@brief Bounded queue for the events a driver process publishes. When the
+consumer falls behind the queue either blocks the driver, drops the oldest
+raw particles, or spills events to a local file that is read back in order
+once the consumer catches up.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import time
+import struct
+import tempfile
+import threading
+import cPickle as pickle
+from collections import deque
+
+from mi.core.common import BaseEnum
+from mi.core.exceptions import InstrumentParameterException
+from mi.core.instrument.instrument_driver import DriverAsyncEvent, stream_name
+from mi.core.instrument.data_particle import CommonDataParticleType
+from mi.core.log import get_logger ; log = get_logger()
+
+DEFAULT_MAX_EVENTS = 10000
+
+# warn once the queue is this full
+HIGH_WATER_FRACTION = .8
+
+RECORD_LENGTH = struct.Struct('>I')
+
+
+class EventQueuePolicy(BaseEnum):
+    """
+    What to do with a new event when the queue is full
+    """
+    # wait for the consumer, optionally giving up after block_timeout and
+    # dropping the oldest event
+    BLOCK = 'block'
+    # drop the oldest raw particle, or the oldest event if none are raw
+    DROP_RAW = 'drop_raw'
+    # append the event to the spill file
+    SPILL = 'spill'
+
+
+def is_raw(evt):
+    """
+    @param evt A driver event
+    @retval True for a raw particle SAMPLE or SAMPLE_BATCH event
+    """
+    if not isinstance(evt, dict):
+        return False
+    if evt.get('type') == DriverAsyncEvent.SAMPLE:
+        value = evt.get('value')
+        return isinstance(value, (basestring, dict)) and stream_name(value) == CommonDataParticleType.RAW
+    if evt.get('type') == DriverAsyncEvent.SAMPLE_BATCH:
+        return evt.get('stream_name') == CommonDataParticleType.RAW
+    return False
+
+
+class EventQueue(object):
+    """
+    Thread safe bounded FIFO with the parts of the deque interface the
+    driver process event thread uses: append, popleft, appendleft and len.
+    appendleft puts back an event that could not be sent and is always
+    accepted. Spilled events are kept in order behind the events in memory,
+    so once anything is spilled new events are spilled too until the spill
+    file has been read back.
+    """
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS, policy=EventQueuePolicy.DROP_RAW,
+                 spill_dir=None, block_timeout=None):
+        """
+        @param max_events Events held in memory
+        @param policy An EventQueuePolicy value
+        @param spill_dir Directory for the spill file, defaults to the
+        system temporary directory
+        @param block_timeout Seconds the BLOCK policy waits before dropping
+        the oldest event, None waits for as long as it takes
+        """
+        self._events = deque()
+        self._raw_count = 0
+        self._condition = threading.Condition()
+        self._spill_file = None
+        self._spill_name = None
+        self._spill_read = 0
+        self._spill_write = 0
+        self._spill_pending = 0
+        self._warned = False
+
+        self.max_depth = 0
+        self.dropped = 0
+        self.dropped_raw = 0
+        self.spilled_events = 0
+        self.spilled_bytes = 0
+        self.blocked_time = 0.0
+
+        self.max_events = None
+        self.policy = None
+        self.spill_dir = None
+        self.block_timeout = None
+        self.configure(max_events, policy, spill_dir, block_timeout)
+
+    def configure(self, max_events=None, policy=None, spill_dir=None, block_timeout=None):
+        """
+        Change the queue bounds and policy, arguments left None keep their
+        current values. Events already queued are kept.
+        """
+        if policy is not None and not EventQueuePolicy.has(policy):
+            raise InstrumentParameterException('Unknown event queue policy %s' % policy)
+        if max_events is not None and max_events < 1:
+            raise InstrumentParameterException('Event queue must hold at least one event')
+        with self._condition:
+            if max_events is not None:
+                self.max_events = max_events
+            if policy is not None:
+                self.policy = policy
+            if spill_dir is not None or self.spill_dir is None:
+                self.spill_dir = spill_dir or tempfile.gettempdir()
+            if block_timeout is not None:
+                self.block_timeout = block_timeout
+            self._condition.notify_all()
+
+    def __len__(self):
+        return len(self._events) + self._spill_pending
+
+    def append(self, evt):
+        """
+        Queue an event, applying the policy if the queue is full.
+        """
+        with self._condition:
+            if self._spill_pending:
+                self._spill(evt)
+                return
+
+            if len(self._events) >= self.max_events:
+                if self.policy == EventQueuePolicy.SPILL:
+                    self._spill(evt)
+                    return
+                if self.policy == EventQueuePolicy.BLOCK:
+                    self._wait_for_room()
+                if len(self._events) >= self.max_events:
+                    self._drop()
+
+            self._push(evt)
+            depth = len(self._events)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            if not self._warned and depth >= self.max_events * HIGH_WATER_FRACTION:
+                self._warned = True
+                log.warn('Driver event queue at %d of %d events, the consumer is falling behind',
+                         depth, self.max_events)
+
+    def appendleft(self, evt):
+        """
+        Put an event back at the head of the queue.
+        """
+        with self._condition:
+            self._events.appendleft(evt)
+            if is_raw(evt):
+                self._raw_count += 1
+
+    def popleft(self):
+        """
+        @retval The oldest event
+        @raises IndexError if the queue is empty
+        """
+        with self._condition:
+            if not self._events and self._spill_pending:
+                self._unspill()
+            evt = self._events.popleft()
+            if self._raw_count and is_raw(evt):
+                self._raw_count -= 1
+            if self._warned and len(self._events) < self.max_events / 2:
+                self._warned = False
+            self._condition.notify()
+            return evt
+
+    def metrics(self):
+        """
+        @retval dict of queue depth, high water mark, drops and spill
+        statistics
+        """
+        with self._condition:
+            return {'depth': len(self),
+                    'max_events': self.max_events,
+                    'max_depth': self.max_depth,
+                    'policy': self.policy,
+                    'dropped': self.dropped,
+                    'dropped_raw': self.dropped_raw,
+                    'spilled_events': self.spilled_events,
+                    'spilled_bytes': self.spilled_bytes,
+                    'spill_pending': self._spill_pending,
+                    'blocked_time': self.blocked_time}
+
+    def close(self):
+        """
+        Remove the spill file. Spilled events not yet read back are lost.
+        """
+        with self._condition:
+            self._close_spill()
+
+    def _push(self, evt):
+        self._events.append(evt)
+        if is_raw(evt):
+            self._raw_count += 1
+
+    def _wait_for_room(self):
+        start = time.time()
+        deadline = None if self.block_timeout is None else start + self.block_timeout
+        while len(self._events) >= self.max_events and self.policy == EventQueuePolicy.BLOCK:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self._condition.wait(remaining)
+        self.blocked_time += time.time() - start
+
+    def _drop(self):
+        """
+        Drop the oldest raw particle, or the oldest event if there are no
+        raw particles queued.
+        """
+        index = 0
+        if self._raw_count:
+            for (index, evt) in enumerate(self._events):
+                if is_raw(evt):
+                    break
+        evt = self._events[index]
+        del self._events[index]
+        if is_raw(evt):
+            self._raw_count -= 1
+            self.dropped_raw += 1
+        if not self.dropped:
+            log.warn('Driver event queue full, dropping events')
+        self.dropped += 1
+
+    def _spill(self, evt):
+        if self._spill_file is None:
+            (fd, self._spill_name) = tempfile.mkstemp(prefix='driver_events_%d_' % os.getpid(),
+                                                      suffix='.spill', dir=self.spill_dir)
+            self._spill_file = os.fdopen(fd, 'w+b')
+            log.warn('Driver event queue full, spilling events to %s', self._spill_name)
+        data = pickle.dumps(evt, 2)
+        self._spill_file.seek(self._spill_write)
+        self._spill_file.write(RECORD_LENGTH.pack(len(data)))
+        self._spill_file.write(data)
+        self._spill_write += RECORD_LENGTH.size + len(data)
+        self._spill_pending += 1
+        self.spilled_events += 1
+        self.spilled_bytes += RECORD_LENGTH.size + len(data)
+
+    def _unspill(self):
+        """
+        Read spilled events back into memory, up to half the queue size so
+        new events keep going to the spill file behind them.
+        """
+        self._spill_file.flush()
+        self._spill_file.seek(self._spill_read)
+        count = min(self._spill_pending, max(1, self.max_events / 2))
+        for i in xrange(count):
+            (length,) = RECORD_LENGTH.unpack(self._spill_file.read(RECORD_LENGTH.size))
+            self._push(pickle.loads(self._spill_file.read(length)))
+            self._spill_read += RECORD_LENGTH.size + length
+        self._spill_pending -= count
+        if not self._spill_pending:
+            # all read back, start the next spill at the front of the file
+            self._spill_file.truncate(0)
+            self._spill_read = 0
+            self._spill_write = 0
+
+    def _close_spill(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            os.remove(self._spill_name)
+            self._spill_file = None
+            self._spill_name = None
+        self._spill_read = 0
+        self._spill_write = 0
+        self._spill_pending = 0
@@ -11,10 +11,11 @@ with individual instruments in the system.
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import re
 import time
 import json
 
-from threading import Thread
+from threading import Thread, Condition
 
 from mi.core.common import BaseEnum
 from mi.core.exceptions import TestModeException
@@ -174,6 +175,7 @@ class DriverAsyncEvent(BaseEnum):
     STATE_CHANGE = 'DRIVER_ASYNC_EVENT_STATE_CHANGE'
     CONFIG_CHANGE = 'DRIVER_ASYNC_EVENT_CONFIG_CHANGE'
     SAMPLE = 'DRIVER_ASYNC_EVENT_SAMPLE'
+    SAMPLE_BATCH = 'DRIVER_ASYNC_EVENT_SAMPLE_BATCH'
     ERROR = 'DRIVER_ASYNC_EVENT_ERROR'
     RESULT = 'DRIVER_ASYNC_RESULT'
     DIRECT_ACCESS = 'DRIVER_ASYNC_EVENT_DIRECT_ACCESS'
@@ -186,6 +188,138 @@ class DriverParameter(BaseEnum):
     """
     ALL = 'DRIVER_PARAMETER_ALL'
 
+# Default SampleBatcher limits
+SAMPLE_BATCH_MAX_COUNT = 100
+SAMPLE_BATCH_MAX_BYTES = 1048576
+SAMPLE_BATCH_MAX_LATENCY = .25
+
+STREAM_NAME_REGEX = re.compile(r'"stream_name": "([^"]*)"')
+
+def stream_name(sample):
+    """
+    Find the stream a sample belongs to without decoding the whole sample.
+    @param sample A sample as sent in a SAMPLE event, a particle JSON string
+    or dict
+    @retval The stream name, None if there isn't one
+    """
+    if isinstance(sample, dict):
+        return sample.get('stream_name')
+    match = STREAM_NAME_REGEX.search(sample)
+    if match:
+        return match.group(1)
+    return None
+
+def event_samples(event):
+    """
+    @param event A driver event
+    @retval List of the samples carried by a SAMPLE or SAMPLE_BATCH event,
+    empty for any other event
+    """
+    if event['type'] == DriverAsyncEvent.SAMPLE:
+        return [event['value']]
+    if event['type'] == DriverAsyncEvent.SAMPLE_BATCH:
+        return event['value']
+    return []
+
+class SampleBatcher(object):
+    """
+    Collect samples per stream and send them as SAMPLE_BATCH events. A
+    stream's batch is sent once it holds max_count samples or max_bytes of
+    sample data, or max_latency seconds after its first sample was added,
+    whichever comes first. A batch event looks like a SAMPLE event with a
+    list of samples for the value and the stream name added:
+
+        {'type': DriverAsyncEvent.SAMPLE_BATCH,
+         'stream_name': 'ctdpf_parsed',
+         'value': [sample, sample, ...],
+         'time': time the first sample was added}
+
+    The latency limit is kept by a daemon thread that is started with the
+    batcher and ended by stop().
+    """
+
+    def __init__(self, send_event,
+                 max_count=SAMPLE_BATCH_MAX_COUNT,
+                 max_bytes=SAMPLE_BATCH_MAX_BYTES,
+                 max_latency=SAMPLE_BATCH_MAX_LATENCY):
+        """
+        @param send_event Callback the batch events are sent to
+        @param max_count Most samples in a batch
+        @param max_bytes Most bytes of sample data in a batch
+        @param max_latency Most seconds a sample waits in a batch
+        """
+        self._send_event = send_event
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+
+        # stream name -> [samples, byte count, time of first sample]
+        self._batches = {}
+        self._condition = Condition()
+        self._running = True
+        self._thread = Thread(target=self._run, name='SampleBatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, sample):
+        """
+        Add a sample to its stream's batch, sending the batch if it is full.
+        @param sample A particle JSON string or dict
+        """
+        stream = stream_name(sample)
+        with self._condition:
+            batch = self._batches.get(stream)
+            if batch is None:
+                batch = self._batches[stream] = [[], 0, time.time()]
+                self._condition.notify()
+            batch[0].append(sample)
+            if not isinstance(sample, dict):
+                batch[1] += len(sample)
+            if len(batch[0]) >= self.max_count or batch[1] >= self.max_bytes:
+                self._send(stream)
+
+    def flush(self):
+        """
+        Send every pending batch, oldest first.
+        """
+        with self._condition:
+            for stream in sorted(self._batches, key=lambda s: self._batches[s][2]):
+                self._send(stream)
+
+    def stop(self):
+        """
+        Send any pending batches and end the latency thread.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self.flush()
+
+    def _send(self, stream):
+        (samples, _, first) = self._batches.pop(stream)
+        self._send_event({
+            'type': DriverAsyncEvent.SAMPLE_BATCH,
+            'stream_name': stream,
+            'value': samples,
+            'time': first
+        })
+
+    def _run(self):
+        """
+        Send batches that have waited max_latency.
+        """
+        with self._condition:
+            while self._running:
+                now = time.time()
+                timeout = None
+                for stream in self._batches.keys():
+                    deadline = self._batches[stream][2] + self.max_latency
+                    if deadline <= now:
+                        self._send(stream)
+                    elif timeout is None or deadline - now < timeout:
+                        timeout = deadline - now
+                self._condition.wait(timeout)
+
 class InstrumentDriver(object):
     """
     Base class for instrument drivers.
@@ -200,6 +334,7 @@ class InstrumentDriver(object):
         LoggerManager()
         self._send_event = event_callback
         self._test_mode = False
+        self._sample_batcher = None
 
 
     #############################################################
@@ -214,6 +349,24 @@ class InstrumentDriver(object):
         """
         self._test_mode = True if mode else False
 
+    def set_sample_batching(self, max_count=SAMPLE_BATCH_MAX_COUNT,
+                            max_bytes=SAMPLE_BATCH_MAX_BYTES,
+                            max_latency=SAMPLE_BATCH_MAX_LATENCY):
+        """
+        Send samples in per stream SAMPLE_BATCH events rather than one SAMPLE
+        event each. See SampleBatcher for the limits. Call with max_count 1
+        or less to go back to SAMPLE events.
+        @param max_count Most samples in a batch
+        @param max_bytes Most bytes of sample data in a batch
+        @param max_latency Most seconds a sample is held back
+        """
+        if self._sample_batcher:
+            self._sample_batcher.stop()
+            self._sample_batcher = None
+
+        if max_count > 1:
+            self._sample_batcher = SampleBatcher(self._send_event, max_count, max_bytes, max_latency)
+
     def initialize(self, *args, **kwargs):
         """
         Initialize driver connection, bringing communications parameters
@@ -348,7 +501,9 @@ class InstrumentDriver(object):
 
     def _driver_event(self, type, val=None):
         """
-        Construct and send an asynchronous driver event.
+        Construct and send an asynchronous driver event. With sample
+        batching on, samples go to the batcher and any other event first
+        sends the pending batches.
         @param type a DriverAsyncEvent type specifier.
         @param val event value for sample and test result events.
         """
@@ -357,6 +512,10 @@ class InstrumentDriver(object):
             'value' : None,
             'time' : time.time()
         }
+        if self._sample_batcher and type != DriverAsyncEvent.SAMPLE:
+            # keep samples ahead of the events that followed them
+            self._sample_batcher.flush()
+
         if type == DriverAsyncEvent.STATE_CHANGE:
             state = self.get_resource_state()
             event['value'] = state
@@ -368,6 +527,9 @@ class InstrumentDriver(object):
             self._send_event(event)
         
         elif type == DriverAsyncEvent.SAMPLE:
+            if self._sample_batcher:
+                self._sample_batcher.add(val)
+                return
             event['value'] = val
             self._send_event(event)
             
@@ -451,11 +613,11 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.EXIT, self._handler_connected_exit)
         self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.DISCONNECT, self._handler_connected_disconnect)
         self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.CONNECTION_LOST, self._handler_connected_connection_lost)
-        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.DISCOVER, self._handler_connected_protocol_event)
-        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.GET, self._handler_connected_protocol_event)
-        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.SET, self._handler_connected_protocol_event)
-        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.EXECUTE, self._handler_connected_protocol_event)
-        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.FORCE_STATE, self._handler_connected_protocol_event)
+        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.DISCOVER, self._handler_connected_protocol_event, read_only=self._protocol_event_read_only)
+        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.GET, self._handler_connected_protocol_event, read_only=self._protocol_event_read_only)
+        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.SET, self._handler_connected_protocol_event, read_only=self._protocol_event_read_only)
+        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.EXECUTE, self._handler_connected_protocol_event, read_only=self._protocol_event_read_only)
+        self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.FORCE_STATE, self._handler_connected_protocol_event, read_only=self._protocol_event_read_only)
         self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.START_DIRECT, self._handler_connected_start_direct_event)
         self._connection_fsm.add_handler(DriverConnectionState.CONNECTED, DriverEvent.STOP_DIRECT, self._handler_connected_stop_direct_event)
         
@@ -945,6 +1107,8 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         next_state = None
         result = None
         
+        if self._protocol:
+            self._protocol.shutdown()
         log.info("_handler_connected_disconnect: invoking stop_comms().")
         self._connection.stop_comms()
         self._protocol = None
@@ -962,6 +1126,8 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         next_state = None
         result = None
         
+        if self._protocol:
+            self._protocol.shutdown()
         log.info("_handler_connected_connection_lost: invoking stop_comms().")
         self._connection.stop_comms()
         self._protocol = None
@@ -987,6 +1153,16 @@ class SingleConnectionInstrumentDriver(InstrumentDriver):
         result = self._protocol._protocol_fsm.on_event(event, *args, **kwargs)
         return (next_state, result)
 
+    def _protocol_event_read_only(self, event, *args, **kwargs):
+        """
+        A forwarded event only needs the connection FSM's read lock when
+        the protocol FSM will run it as read only under its own lock.
+        @param event The protocol event to be forwarded.
+        @retval True if the protocol handles the event read only.
+        """
+        fsm = getattr(self._protocol, '_protocol_fsm', None)
+        return isinstance(fsm, ThreadSafeFSM) and fsm.is_read_only(event, *args, **kwargs)
+
     def _handler_connected_start_direct_event(self, event, *args, **kwargs):
         """
         Stash the current config first, then forward a driver command event
@@ -10,13 +10,78 @@
 __author__ = 'Edward Hunter'
 __license__ = 'Apache 2.0'
 
-from threading import RLock
+from thread import get_ident
+from threading import Condition, Lock
 
 from mi.core.exceptions import InstrumentStateException
 
 from mi.core.log import get_logger,LoggerManager
 log = get_logger()
 
+class ReadWriteLock(object):
+    """
+    Reentrant lock that lets in any number of readers at once, or a single
+    writer. The writer may also take the read lock. Waiting writers hold
+    off new readers so a steady stream of reads can't starve them.
+    """
+
+    def __init__(self):
+        self._condition = Condition(Lock())
+        # thread ident : read lock depth
+        self._readers = {}
+        self._writer = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        me = get_ident()
+        with self._condition:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._writers_waiting:
+                self._condition.wait()
+            self._readers[me] = 1
+
+    def release_read(self):
+        me = get_ident()
+        with self._condition:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._condition.notify_all()
+
+    def acquire_write(self):
+        """
+        @raises InstrumentStateException if this thread holds the read
+        lock, waiting for the other readers could deadlock
+        """
+        me = get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._write_depth += 1
+                return
+            if me in self._readers:
+                raise InstrumentStateException('Write lock requested while holding the read lock.')
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = me
+            self._write_depth = 1
+
+    def release_write(self):
+        with self._condition:
+            self._write_depth -= 1
+            if not self._write_depth:
+                self._writer = None
+                self._condition.notify_all()
+
 class InstrumentFSM(object):
     """
     Simple state mahcine for driver and agent classes.
@@ -34,12 +99,21 @@ class InstrumentFSM(object):
 
         self.states = states
         self.events = events
+        # flat (state, event) : handler table
         self.state_handlers = {}
+        # (state, event) : True, or a callable taking the handler arguments
+        # that says whether the handler only reads
+        self.read_only_handlers = {}
         self.current_state = None
         self.previous_state = None
         self.enter_event = enter_event
         self.exit_event = exit_event
 
+        # BaseEnum.has() searches the class on each call, too slow for
+        # every event
+        self._states = frozenset(states.list())
+        self._events = frozenset(events.list())
+
     def get_current_state(self):
         """
         Return current state.
@@ -48,21 +122,29 @@ class InstrumentFSM(object):
 
         return self.current_state
 
-    def add_handler(self, state, event, handler):
+    def add_handler(self, state, event, handler, read_only=False):
         """
         Add an event handler.
         @param state the state to handler the event in.
         @param the event to handle.
+        @param read_only True if the handler doesn't change the state or
+        anything other events rely on, so a ThreadSafeFSM can run it
+        alongside other read only handlers. A callable taking the handler
+        arguments can decide per event.
         @retval True if successful, False otherwise.
         """
 
-        if not self.states.has(state):
+        if state not in self._states:
             return False
         
-        if not self.events.has(event):
+        if event not in self._events:
             return False
 
         self.state_handlers[(state,event)] = handler
+        if read_only:
+            self.read_only_handlers[(state,event)] = read_only
+        else:
+            self.read_only_handlers.pop((state,event), None)
         return True
         
     def start(self, state, *args, **kwargs):
@@ -76,7 +158,7 @@ class InstrumentFSM(object):
         @raises Any exception raised by the enter handler.
         """
 
-        if not self.states.has(state):
+        if state not in self._states:
             return False
                 
         self.current_state = state
@@ -85,6 +167,19 @@ class InstrumentFSM(object):
             handler(*args, **kwargs)
         return True
 
+    def is_read_only(self, event, *args, **kwargs):
+        """
+        @param event The event about to be handled.
+        @param args positional arguments to pass to the handler.
+        @param kwargs keyword arguments to pass to the handler.
+        @retval True if the current state handles the event with a read
+        only handler.
+        """
+        read_only = self.read_only_handlers.get((self.current_state, event))
+        if callable(read_only):
+            return bool(read_only(*args, **kwargs))
+        return bool(read_only)
+
     def on_event(self, event, *args, **kwargs):
         """
         Handle an event. Call the current state handler passing the event
@@ -97,24 +192,26 @@ class InstrumentFSM(object):
         @raises Any exception raised by the handlers.
         """
 
-        next_state = None
-        result = None
-
-        if self.events.has(event):
-            handler = self.state_handlers.get((self.current_state, event), None)
-            if handler:
-                (next_state, result) = handler(*args, **kwargs)
-            else:
-                raise InstrumentStateException('Command (%s) not handled in current state (%s).' % (event, self.current_state))
-        else:
-            raise InstrumentStateException(str(event) + " was not handled by InstrumentFSM.on_event()")
+        (next_state, result) = self._handler(event)(*args, **kwargs)
 
-        if self.states.has(next_state):
+        if next_state in self._states:
             self._on_transition(next_state, *args, **kwargs)
         else:
-            log.debug("No next state'" + repr(next_state) + "', remaining in current_state.")
+            log.debug("No next state '%r', remaining in current_state.", next_state)
                 
         return result
+
+    def _handler(self, event):
+        """
+        Look up the current state's handler for an event.
+        @raises InstrumentStateException if there isn't one.
+        """
+        handler = self.state_handlers.get((self.current_state, event), None)
+        if handler:
+            return handler
+        if event in self._events:
+            raise InstrumentStateException('Command (%s) not handled in current state (%s).' % (event, self.current_state))
+        raise InstrumentStateException(str(event) + " was not handled by InstrumentFSM.on_event()")
             
     def _on_transition(self, next_state, *args, **kwargs):
         """
@@ -159,7 +256,9 @@ class InstrumentFSM(object):
 class ThreadSafeFSM(InstrumentFSM):
     """
     A FSM class that provides thread locking in on_event to
-    prevent simultaneous thread reentry.
+    prevent simultaneous thread reentry. Events with read only handlers
+    share a read lock and run alongside each other; all other events are
+    serialized under the write lock.
     """
     
     def __init__(self, states, events, enter_event, exit_event):
@@ -167,26 +266,29 @@ class ThreadSafeFSM(InstrumentFSM):
         """
         super(ThreadSafeFSM, self).__init__(states, events, enter_event,
                                             exit_event)
-        self._lock = RLock()
+        self._lock = ReadWriteLock()
     
     def on_event(self, event, *args, **kwargs):
         """
+        @raises InstrumentStateException if a read only handler changes
+        state, or fires an event that isn't read only.
         """
         
-        self._lock.acquire(True)
-        ex = None
-        
+        if self.is_read_only(event, *args, **kwargs):
+            self._lock.acquire_read()
+            try:
+                # the state may have changed while waiting for the lock
+                if self.is_read_only(event, *args, **kwargs):
+                    (next_state, result) = self._handler(event)(*args, **kwargs)
+                    if next_state in self._states:
+                        raise InstrumentStateException('Read only handler for %s in %s changed state to %s.' %
+                                                       (event, self.current_state, next_state))
+                    return result
+            finally:
+                self._lock.release_read()
+
+        self._lock.acquire_write()
         try:
-            result = super(ThreadSafeFSM, self).on_event(event, *args, **kwargs)
-        
-        except Exception as ex:
-            pass
-        
+            return super(ThreadSafeFSM, self).on_event(event, *args, **kwargs)
         finally:
-            self._lock.release()
-        
-        if ex:
-            raise ex
-        
-        return result
-    
+            self._lock.release_write()
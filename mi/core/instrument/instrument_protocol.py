@@ -17,10 +17,11 @@ import re
 import time
 import json
 from functools import partial
+from collections import Mapping
 
 from mi.core.log import get_logger ; log = get_logger()
 
-from threading import Thread
+from threading import Thread, Condition, Timer
 
 from mi.core.instrument.protocol_param_dict import ParameterDictVisibility
 from mi.core.common import BaseEnum, InstErrorCode
@@ -38,6 +39,7 @@ from mi.core.instrument.instrument_driver import ResourceAgentEvent
 from mi.core.instrument.protocol_param_dict import ProtocolParameterDict
 from mi.core.instrument.protocol_cmd_dict import ProtocolCommandDict
 from mi.core.instrument.driver_dict import DriverDict
+from mi.core.instrument.paced_writer import PacedWriter
 from mi.core.exceptions import InstrumentTimeoutException
 from mi.core.exceptions import InstrumentProtocolException
 from mi.core.exceptions import InstrumentParameterException
@@ -59,11 +61,50 @@ class InitializationType(BaseEnum):
     STARTUP = 1,
     DIRECTACCESS = 2
 
+class PublishedSample(Mapping):
+    """
+    A published sample the way subscribers see it, decoded from the JSON
+    the particle generated (lists, unicode strings). The JSON is decoded
+    the first time the sample is looked into, so code that only checks
+    whether a sample was found doesn't pay for it.
+    """
+    def __init__(self, sample_json):
+        """
+        @param sample_json The JSON string published for the sample
+        """
+        self.json = sample_json
+        self._sample = None
+
+    def _decoded(self):
+        if self._sample is None:
+            self._sample = json.loads(self.json)
+        return self._sample
+
+    def __getitem__(self, key):
+        return self._decoded()[key]
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __len__(self):
+        return len(self._decoded())
+
+    def __nonzero__(self):
+        # a generated particle is never empty
+        return True
+
+    def __repr__(self):
+        return repr(self._decoded())
+
 class InstrumentProtocol(object):
     """
         
     Base instrument protocol class.
-    """    
+    """
+    # Chunk dispatch table, {tag: (particle_class, handler)}. Populated per
+    # instance with _register_particle.
+    _particle_dispatch = None
+
     def __init__(self, driver_event):
         """
         Base constructor.
@@ -243,24 +284,85 @@ class InstrumentProtocol(object):
                two different events are published: one to notify raw data and
                the other to notify parsed data.
 
-        @retval dict of dicts {'parsed': parsed_sample, 'raw': raw_sample} if
-                the line can be parsed for a sample. Otherwise, None.
+        @retval The sample as a PublishedSample if the line can be parsed for
+                a sample. Otherwise, None.
         @todo Figure out how the agent wants the results for a single poll
             and return them that way from here
         """
         sample = None
         if regex.match(line):
-        
-            particle = particle_class(line, port_timestamp=timestamp)
-            parsed_sample = particle.generate()
+            particle = self._build_particle(particle_class, line, timestamp)
+            sample = self._publish_particle(particle, publish)
 
-            if publish and self._driver_event:
-                self._driver_event(DriverAsyncEvent.SAMPLE, parsed_sample)
-    
-            sample = json.loads(parsed_sample)
+        return sample
+
+    def _register_particle(self, tag, particle_class, handler=None):
+        """
+        Add an entry to the chunk dispatch table. Chunks the chunker returns
+        with this tag are turned straight into particle_class without
+        re-matching the chunk against every sample regex in _got_chunk.
+
+        @param tag The tag the sieve attaches to matching chunks, e.g. the
+            tag of a TaggedSieve entry or sync prefix
+        @param particle_class The DataParticle class built from the chunk
+        @param handler Optional callable invoked with the PublishedSample
+            after the particle has been published
+        """
+        if self._particle_dispatch is None:
+            self._particle_dispatch = {}
+        self._particle_dispatch[tag] = (particle_class, handler)
+
+    def _build_particle(self, particle_class, chunk, timestamp):
+        """
+        Construct a particle for a chunk. Override to pass extra arguments
+        such as a quality flag to the particle constructor.
+        @param particle_class The DataParticle class to build
+        @param chunk The raw chunk
+        @param timestamp port agent timestamp to include with the particle
+        @retval A particle_class instance
+        """
+        return particle_class(chunk, port_timestamp=timestamp)
+
+    def _publish_particle(self, particle, publish=True):
+        """
+        Generate the sample for a particle and optionally publish it. The
+        particle parses its values once and caches the JSON it publishes.
+        @param particle The DataParticle to generate
+        @param publish boolean to publish the sample (default True)
+        @retval A PublishedSample, decoded from the published JSON only if
+            it is used
+        """
+        parsed_sample = particle.generate()
+
+        if publish and self._driver_event:
+            self._driver_event(DriverAsyncEvent.SAMPLE, parsed_sample)
+
+        return PublishedSample(parsed_sample)
+
+    def _dispatch_chunk(self, chunk, timestamp, tag):
+        """
+        Build and publish the particle registered for a chunk tag, then run
+        the registered handler, if any.
+        @param chunk The raw chunk
+        @param timestamp port agent timestamp of the chunk
+        @param tag The chunk tag, must be in the dispatch table
+        @retval The PublishedSample
+        """
+        (particle_class, handler) = self._particle_dispatch[tag]
+        particle = self._build_particle(particle_class, chunk, timestamp)
+        sample = self._publish_particle(particle)
+        if handler:
+            handler(sample)
 
         return sample
 
+    def shutdown(self):
+        """
+        Release what the protocol holds once the driver drops it, when the
+        connection is closed or lost.
+        """
+        pass
+
     def get_current_state(self):
         """
         Return current state of the protocol FSM.
@@ -815,6 +917,17 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         # Short buffer to look for prompts from device in command-response
         # mode.
         self._promptbuf = ''
+
+        # Signaled by add_to_buffer, with a count of all bytes ever added so
+        # a waiter knows how much of the buffer is new.
+        self._buffer_condition = Condition()
+        self._buffer_count = 0
+
+        # Compiled prompt matchers by prompt list.
+        self._prompt_matchers = {}
+
+        # Writer for commands sent with a write delay, created on first use.
+        self._paced_writer = None
         
         # Lines of data awaiting further processing.
         self._datalines = []
@@ -842,6 +955,53 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         return prompts
 
+    def _prompt_matcher(self, prompt_list):
+        """
+        @param prompt_list Prompts to look for
+        @retval (compiled regex matching any of the prompts, longest prompt
+        length)
+        """
+        key = tuple(prompt_list)
+        matcher = self._prompt_matchers.get(key)
+        if matcher is None:
+            matcher = (re.compile('|'.join(re.escape(item) for item in prompt_list)),
+                       max(len(item) for item in prompt_list))
+            self._prompt_matchers[key] = matcher
+        return matcher
+
+    def _buffers_changed(self):
+        """
+        Wake anything waiting for a response. add_to_buffer does this, call
+        it after changing the buffers any other way.
+        """
+        with self._buffer_condition:
+            self._buffer_condition.notify_all()
+
+    def _start_deadline_timer(self, deadline):
+        """
+        Start a timer that wakes response waiters at a deadline, so they can
+        wait for data without a timeout. Cancel it once the wait is over.
+        @param deadline time.time() value to wake waiters at
+        @retval The started Timer
+        """
+        timer = Timer(max(0, deadline - time.time()), self._buffers_changed)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _wait_for_data(self, count, deadline):
+        """
+        Wait until the buffers change or the deadline passes. Call with
+        _buffer_condition held and a deadline timer running, the wait
+        itself has no timeout.
+        @param count _buffer_count when the buffers were last examined
+        @param deadline time.time() value to stop waiting at
+        @retval True if data was added, False if the wait ended without it
+        """
+        if time.time() < deadline and self._buffer_count == count:
+            self._buffer_condition.wait()
+        return self._buffer_count != count
+
     def _get_response(self, timeout=10, expected_prompt=None, response_regex=None):
         """
         Get a response from the instrument, but be a bit loose with what we
@@ -889,22 +1049,47 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         log.debug('_get_response: timeout=%s, prompt_list=%s, expected_prompt=%s, response_regex=%r, promptbuf=%s',
                   timeout, prompt_list, expected_prompt, pattern, self._promptbuf)
-        while True:
-            if response_regex:
-                match = response_regex.search(self._linebuf)
-                if match:
-                    return match.groups()
-            else:
-                for item in prompt_list:
-                    index = self._promptbuf.find(item)
-                    if index >= 0:
-                        result = self._promptbuf[0:index+len(item)]
-                        return item, result
-
-            time.sleep(.1)
 
-            if time.time() > starttime + timeout:
-                raise InstrumentTimeoutException("in InstrumentProtocol._get_response()")
+        if not response_regex:
+            (matcher, overlap) = self._prompt_matcher(prompt_list)
+        deadline = starttime + timeout
+        new_data = None     # bytes added since the last look, None for all
+        timer = self._start_deadline_timer(deadline)
+        try:
+            with self._buffer_condition:
+                while True:
+                    count = self._buffer_count
+                    if response_regex:
+                        match = response_regex.search(self._linebuf)
+                        if match:
+                            return match.groups()
+                    else:
+                        # only look at what was added, plus enough before it to
+                        # catch a prompt split between two reads
+                        if new_data is None:
+                            found = matcher.search(self._promptbuf)
+                        else:
+                            found = new_data and matcher.search(self._promptbuf, max(0,
+                                        len(self._promptbuf) - new_data - overlap + 1))
+                        if found:
+                            # prompts are tried in list order as they always
+                            # have been, the matcher just says when to try
+                            for item in prompt_list:
+                                index = self._promptbuf.find(item)
+                                if index >= 0:
+                                    result = self._promptbuf[0:index+len(item)]
+                                    return item, result
+
+                    if time.time() > deadline:
+                        raise InstrumentTimeoutException("in InstrumentProtocol._get_response()")
+
+                    if self._wait_for_data(count, deadline):
+                        new_data = self._buffer_count - count
+                    else:
+                        # the buffers may have been changed some other way
+                        new_data = None
+        finally:
+            timer.cancel()
 
     def _get_raw_response(self, timeout=10, expected_prompt=None):
         """
@@ -928,15 +1113,22 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
             else:
                 prompt_list = expected_prompt
 
-        while True:
-            for item in prompt_list:
-                if self._promptbuf.rstrip(strip_chars).endswith(item.rstrip(strip_chars)):
-                    return (item, self._linebuf)
-                else:
-                    time.sleep(.1)
+        deadline = starttime + timeout
+        timer = self._start_deadline_timer(deadline)
+        try:
+            with self._buffer_condition:
+                while True:
+                    count = self._buffer_count
+                    for item in prompt_list:
+                        if self._promptbuf.rstrip(strip_chars).endswith(item.rstrip(strip_chars)):
+                            return (item, self._linebuf)
 
-            if time.time() > starttime + timeout:
-                raise InstrumentTimeoutException("in InstrumentProtocol._get_raw_response()")
+                    if time.time() > deadline:
+                        raise InstrumentTimeoutException("in InstrumentProtocol._get_raw_response()")
+
+                    self._wait_for_data(count, deadline)
+        finally:
+            timer.cancel()
 
     def _do_cmd_resp(self, cmd, *args, **kwargs):
         """
@@ -946,6 +1138,9 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         @param write_delay kwarg for the amount of delay in seconds to pause
         between each character. If none supplied, the DEFAULT_WRITE_DELAY
         value will be used.
+        @param write_group kwarg for the number of characters sent at a time
+        when write_delay is set, pausing write_group * write_delay after
+        each group. Defaults to 1.
         @param timeout optional wakeup and command timeout via kwargs.
         @param expected_prompt kwarg offering a specific prompt to look for
         other than the ones in the protocol class itself.
@@ -967,6 +1162,7 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         expected_prompt = kwargs.get('expected_prompt', None)
         response_regex = kwargs.get('response_regex', None)
         write_delay = kwargs.get('write_delay', DEFAULT_WRITE_DELAY)
+        write_group = kwargs.get('write_group', 1)
 
         if response_regex and not isinstance(response_regex, RE_PATTERN):
             raise InstrumentProtocolException('Response regex is not a compiled pattern!')
@@ -992,23 +1188,21 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         log.debug('_do_cmd_resp: %s, timeout=%s, write_delay=%s, expected_prompt=%s, response_regex=%s',
                         repr(cmd_line), timeout, write_delay, expected_prompt, response_regex)
 
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        paced = self._queue_write(cmd_line, write_delay, write_group)
 
-        # Wait for the prompt, prepare result and return, timeout exception
+        # Wait for the prompt, prepare result and return, timeout exception.
+        # A paced command is still going out, the response can't be
+        # complete before it is.
         if response_regex:
             prompt = ""
-            result_tuple = self._get_response(timeout,
+            result_tuple = self._get_response(timeout + paced.duration(),
                                               response_regex=response_regex,
                                               expected_prompt=expected_prompt)
             result = "".join(result_tuple)
         else:
-            (prompt, result) = self._get_response(timeout,
+            (prompt, result) = self._get_response(timeout + paced.duration(),
                                                   expected_prompt=expected_prompt)
+        paced.wait()
 
         resp_handler = self._response_handlers.get((self.get_current_state(), cmd), None) or \
             self._response_handlers.get(cmd, None)
@@ -1026,12 +1220,17 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         @param cmd The command to execute.
         @param args positional arguments to pass to the build handler.
         @param timeout=timeout optional wakeup timeout.
+        @param write_delay=write_delay optional seconds per character.
+        @param write_group=write_group optional characters per paced send.
+        @retval PacedWrite, wait() on it to know a paced command has been
+        sent.
         @raises InstrumentTimeoutException if the response did not occur in time.
         @raises InstrumentProtocolException if command could not be built.        
         """
 
         timeout = kwargs.get('timeout', DEFAULT_CMD_TIMEOUT)
         write_delay = kwargs.get('write_delay', DEFAULT_WRITE_DELAY)
+        write_group = kwargs.get('write_group', 1)
         
         build_handler = self._build_handlers.get(cmd, None)
         if not build_handler:
@@ -1049,13 +1248,33 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
         # Send command.
         log.debug('_do_cmd_no_resp: %s, timeout=%s' % (repr(cmd_line), timeout))
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        return self._queue_write(cmd_line, write_delay, write_group)
     
+    def _queue_write(self, data, write_delay=0, group=1):
+        """
+        Queue data for the instrument, sent by the paced writer thread at
+        write_delay seconds per character, after anything queued before
+        it. Without a delay and with nothing queued the data is sent at
+        once.
+        @param data String to send
+        @param write_delay Seconds per character
+        @param group Characters per send, for instruments that can take a
+        few characters at once
+        @retval PacedWrite, wait() on it to know the data has been sent
+        """
+        if self._paced_writer is None:
+            self._paced_writer = PacedWriter(lambda chunk: self._connection.send(chunk))
+        return self._paced_writer.write(data, write_delay, group)
+
+    def shutdown(self):
+        """
+        Stop the paced writer, writes not yet sent fail.
+        """
+        if self._paced_writer is not None:
+            self._paced_writer.stop()
+            self._paced_writer = None
+        InstrumentProtocol.shutdown(self)
+
     def _do_cmd_direct(self, cmd):
         """
         Issue an untranslated command to the instrument. No response is handled 
@@ -1077,15 +1296,16 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         Append line and prompt buffers.
 
         Also add data to the chunker and when received call got_chunk
-        to publish results.
+        to publish results. Chunks whose tag is in the dispatch table are
+        published directly instead.
         """
 
         data_length = port_agent_packet.get_data_length()
         data = port_agent_packet.get_data()
         timestamp = port_agent_packet.get_timestamp()
 
-        log.debug("Got Data: %r" % data)
-        log.debug("Add Port Agent Timestamp: %s" % timestamp)
+        log.debug("Got Data: %r", data)
+        log.debug("Add Port Agent Timestamp: %s", timestamp)
 
         if data_length > 0:
             if self.get_current_state() == DriverProtocolState.DIRECT_ACCESS:
@@ -1093,11 +1313,15 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
 
             self.add_to_buffer(data)
 
+            dispatch = self._particle_dispatch
             self._chunker.add_chunk(data, timestamp)
-            (timestamp, chunk) = self._chunker.get_next_data()
+            (timestamp, chunk, tag) = self._chunker.get_next_data_with_tag()
             while(chunk):
-                self._got_chunk(chunk, timestamp)
-                (timestamp, chunk) = self._chunker.get_next_data()
+                if dispatch and tag in dispatch:
+                    self._dispatch_chunk(chunk, timestamp, tag)
+                else:
+                    self._got_chunk(chunk, timestamp)
+                (timestamp, chunk, tag) = self._chunker.get_next_data_with_tag()
 
     ########################################################################
     # Incoming raw data callback.
@@ -1126,20 +1350,25 @@ class CommandResponseInstrumentProtocol(InstrumentProtocol):
         buffers implemented as lifo ring buffer
         @param data: bytes to add to the buffer
         '''
-        # Update the line and prompt buffers.
-        self._linebuf += data
-        self._promptbuf += data
-        self._last_data_timestamp = time.time()
-
-        # If our buffer exceeds the max allowable size then drop the leading
-        # characters on the floor.
-        if(len(self._linebuf) > self._max_buffer_size()):
-            self._linebuf = self._linebuf[self._max_buffer_size()*-1:]
-
-        # If our buffer exceeds the max allowable size then drop the leading
-        # characters on the floor.
-        if(len(self._promptbuf) > self._max_buffer_size()):
-            self._promptbuf = self._linebuf[self._max_buffer_size()*-1:]
+        with self._buffer_condition:
+            # Update the line and prompt buffers.
+            self._linebuf += data
+            self._promptbuf += data
+            self._last_data_timestamp = time.time()
+
+            # If our buffer exceeds the max allowable size then drop the leading
+            # characters on the floor.
+            if(len(self._linebuf) > self._max_buffer_size()):
+                self._linebuf = self._linebuf[self._max_buffer_size()*-1:]
+
+            # If our buffer exceeds the max allowable size then drop the leading
+            # characters on the floor.
+            if(len(self._promptbuf) > self._max_buffer_size()):
+                self._promptbuf = self._linebuf[self._max_buffer_size()*-1:]
+
+            # Wake anyone waiting for a response.
+            self._buffer_count += len(data)
+            self._buffer_condition.notify_all()
 
         log.debug("LINE BUF: %s", self._linebuf)
         log.debug("PROMPT BUF: %s", self._promptbuf)
@@ -1391,7 +1620,8 @@ class MenuInstrumentProtocol(CommandResponseInstrumentProtocol):
         
         return CommandResponseInstrumentProtocol._get_response(self,
                     timeout=timeout,
-                    expected_prompt=expected_prompt)
+                    expected_prompt=expected_prompt,
+                    response_regex=kwargs.get('response_regex', None))
                  
     def _navigate(self, menu, **kwargs):
         """
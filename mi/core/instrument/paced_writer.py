@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.paced_writer
+@file mi/core/instrument/paced_writer.py
+@brief Paced output to slow instruments. Writes are queued and sent by a
+writer thread a character, or a small group of characters, at a time at
+the rate the instrument can take, so the caller is free to do other work
+and only waits for a write when it needs to.
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import threading
+from collections import deque
+
+from mi.core.exceptions import InstrumentTimeoutException
+from mi.core.log import get_logger ; log = get_logger()
+
+
+class PacedWrite(object):
+    """
+    A queued write, done once its last character has been sent.
+    """
+
+    def __init__(self, data, delay, group):
+        """
+        @param data String to send
+        @param delay Seconds per character
+        @param group Characters per send, all of them without a delay
+        """
+        self.data = data
+        self.delay = delay
+        self.group = max(1, group if delay else len(data))
+        self.sent = 0
+        self.exception = None
+        self._done = threading.Event()
+
+    def duration(self):
+        """
+        @retval Seconds the write takes once it starts
+        """
+        return len(self.data) * self.delay
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the write to be sent.
+        @param timeout Seconds to wait, None waits until it is sent
+        @raises InstrumentTimeoutException if it isn't sent in time
+        @raises The exception sending failed with
+        """
+        if not self._done.wait(timeout):
+            raise InstrumentTimeoutException('Paced write not sent in %s seconds' % timeout)
+        if self.exception is not None:
+            raise self.exception
+
+    def _finish(self, exception=None):
+        self.exception = exception
+        self._done.set()
+
+
+class PacedWriter(object):
+    """
+    Sends queued writes in order through a send callable, pacing each one
+    at its own rate. The pace carries over from one write to the next, so
+    back to back writes are spaced the same as the characters within one.
+    A write without a delay and with nothing queued ahead of it is sent at
+    once from the caller's thread. The writer thread is started by the
+    first paced write and runs until stop().
+    """
+
+    def __init__(self, send):
+        """
+        @param send Callable taking a string to send
+        """
+        self._send = send
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        # earliest time the next characters may go out
+        self._next_send = 0
+
+    def write(self, data, delay, group=1):
+        """
+        Queue data to be sent at one character per delay seconds.
+        @param data String to send
+        @param delay Seconds per character
+        @param group Characters to send at a time, the pause after each
+        group is group * delay
+        @retval PacedWrite to wait on
+        @raises The exception sending failed with, for a write sent at once
+        """
+        paced = PacedWrite(data, delay, group)
+        with self._condition:
+            if self._stopped:
+                paced._finish(InstrumentTimeoutException('Paced writer stopped'))
+                return paced
+            if delay == 0 and not self._queue:
+                # keep the pause after the last paced characters
+                now = time.time()
+                if self._next_send > now:
+                    time.sleep(self._next_send - now)
+                try:
+                    self._send(data)
+                except Exception as e:
+                    paced._finish(e)
+                    raise
+                paced.sent = len(data)
+                paced._finish()
+                return paced
+            self._queue.append(paced)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='paced writer')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+        return paced
+
+    def pending(self):
+        """
+        @retval Writes queued or in progress
+        """
+        return len(self._queue)
+
+    def stop(self):
+        """
+        Stop the writer thread. Writes not yet sent fail.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    abandoned = list(self._queue)
+                    self._queue.clear()
+                    break
+                paced = self._queue[0]
+            try:
+                self._send_paced(paced)
+            except Exception as e:
+                log.error('Paced write failed: %s', e)
+                paced._finish(e)
+            else:
+                paced._finish()
+            with self._condition:
+                self._queue.popleft()
+
+        for paced in abandoned:
+            paced._finish(InstrumentTimeoutException('Paced writer stopped'))
+
+    def _send_paced(self, paced):
+        """
+        Send one write, sleeping until each group is due. A group is due
+        an interval after the previous one went out, so a late wakeup or a
+        slow send never leaves groups closer together than the interval.
+        """
+        data = paced.data
+        interval = paced.delay * paced.group
+        for start in xrange(0, len(data), paced.group):
+            if self._stopped:
+                raise InstrumentTimeoutException('Paced writer stopped')
+            now = time.time()
+            if self._next_send > now:
+                time.sleep(self._next_send - now)
+                now = time.time()
+            self._send(data[start:start + paced.group])
+            paced.sent = min(len(data), start + paced.group)
+            self._next_send = now + interval
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.particle_ring
+@file mi/core/instrument/particle_ring.py
+@brief Shared memory ring of encoded driver events, for a driver process
+and a client on the same host.
+
+The ring is a memory mapped file, on tmpfs where /dev/shm exists, with a
+64 byte header followed by the data area. The header holds a magic string,
+the data area capacity and two byte counters: head, advanced by the
+single writer, and tail, advanced by the single reader. The counters only
+grow; a counter modulo the capacity is its position in the data area.
+Each record is a 4 byte big endian length followed by the encoded event.
+A record never wraps: when it doesn't fit before the end of the data area
+the writer pads to the end, with a PAD length if there is room for one,
+and starts the record at the front.
+
+The writer stores a record before publishing the new head and the reader
+reads a record before publishing the new tail, so each side only ever
+sees complete records. That relies on stores to the shared mapping being
+seen in order by the other process, which holds on the x86 hosts the
+drivers run on.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import mmap
+import struct
+import tempfile
+
+from mi.core.exceptions import InstrumentException
+
+MAGIC = 'MIRING01'
+HEADER = struct.Struct('>8sQ')
+COUNTER = struct.Struct('>Q')
+HEAD_OFFSET = 16
+TAIL_OFFSET = 24
+DATA_OFFSET = 64
+LENGTH = struct.Struct('>I')
+PAD = 0xffffffff
+
+DEFAULT_CAPACITY = 16 * 1024 * 1024
+
+# sent on the event socket after events are written to the ring
+NOTIFY = '\x00ring'
+
+SHM_DIR = '/dev/shm'
+
+
+class ParticleRing(object):
+    """
+    One end of a shared memory ring. The driver process creates the ring
+    and writes, the client opens it by path and reads.
+    """
+
+    def __init__(self, path, capacity=None, mapped=None):
+        self.path = path
+        self.capacity = capacity
+        self._map = mapped
+
+    @classmethod
+    def create(cls, capacity=DEFAULT_CAPACITY, directory=None):
+        """
+        Create a ring file and map it.
+        @param capacity Size of the data area in bytes
+        @param directory Where to create the file, defaults to /dev/shm if
+        it exists, otherwise the system temporary directory
+        @retval The writer end of the ring
+        """
+        if directory is None:
+            directory = SHM_DIR if os.access(SHM_DIR, os.W_OK) else tempfile.gettempdir()
+        (fd, path) = tempfile.mkstemp(prefix='mi_ring_%d_' % os.getpid(), dir=directory)
+        try:
+            os.ftruncate(fd, DATA_OFFSET + capacity)
+            mapped = mmap.mmap(fd, DATA_OFFSET + capacity)
+        except Exception:
+            os.close(fd)
+            os.remove(path)
+            raise
+        os.close(fd)
+        HEADER.pack_into(mapped, 0, MAGIC, capacity)
+        COUNTER.pack_into(mapped, HEAD_OFFSET, 0)
+        COUNTER.pack_into(mapped, TAIL_OFFSET, 0)
+        return cls(path, capacity, mapped)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Map an existing ring file.
+        @param path Path of the ring file
+        @retval The reader end of the ring
+        @raises InstrumentException if the file isn't a ring
+        """
+        fd = os.open(path, os.O_RDWR)
+        try:
+            mapped = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+        (magic, capacity) = HEADER.unpack_from(mapped, 0)
+        if magic != MAGIC or len(mapped) != DATA_OFFSET + capacity:
+            mapped.close()
+            raise InstrumentException('%s is not a particle ring' % path)
+        return cls(path, capacity, mapped)
+
+    def close(self, remove=False):
+        """
+        Unmap the ring.
+        @param remove Also remove the ring file, done by the writer
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _head(self):
+        return COUNTER.unpack_from(self._map, HEAD_OFFSET)[0]
+
+    def _tail(self):
+        return COUNTER.unpack_from(self._map, TAIL_OFFSET)[0]
+
+    def __len__(self):
+        """
+        @retval Bytes in use, including record lengths and padding
+        """
+        return self._head() - self._tail()
+
+    def fits(self, data):
+        """
+        @retval True if a record of this size can ever be written
+        """
+        return LENGTH.size + len(data) <= self.capacity / 2
+
+    def write(self, data):
+        """
+        Append a record.
+        @param data Encoded event
+        @retval False if there is no room for the record right now
+        """
+        need = LENGTH.size + len(data)
+        head = self._head()
+        free = self.capacity - (head - self._tail())
+        position = head % self.capacity
+        pad = self.capacity - position
+        if pad >= need:
+            pad = 0
+        if free < pad + need:
+            return False
+
+        if pad:
+            if pad >= LENGTH.size:
+                LENGTH.pack_into(self._map, DATA_OFFSET + position, PAD)
+            head += pad
+            position = 0
+        start = DATA_OFFSET + position
+        LENGTH.pack_into(self._map, start, len(data))
+        self._map[start + LENGTH.size:start + need] = data
+        COUNTER.pack_into(self._map, HEAD_OFFSET, head + need)
+        return True
+
+    def read(self, limit=None):
+        """
+        Take the records written so far.
+        @param limit Most records to take, None for all
+        @retval List of encoded events, oldest first
+        """
+        records = []
+        head = self._head()
+        tail = self._tail()
+        while tail < head and (limit is None or len(records) < limit):
+            position = tail % self.capacity
+            remaining = self.capacity - position
+            if remaining < LENGTH.size:
+                tail += remaining
+                continue
+            start = DATA_OFFSET + position
+            (length,) = LENGTH.unpack_from(self._map, start)
+            if length == PAD:
+                tail += remaining
+                continue
+            records.append(self._map[start + LENGTH.size:start + LENGTH.size + length])
+            tail += LENGTH.size + length
+        COUNTER.pack_into(self._map, TAIL_OFFSET, tail)
+        return records
@@ -11,7 +11,10 @@ and logging.
 __author__ = 'David Everett'
 __license__ = 'Apache 2.0'
 
+import os
+import fcntl
 import socket
+import select
 import errno
 import threading
 import time
@@ -58,11 +61,42 @@ MIN_RETRY_WINDOW = 2 # 2 seconds
 
 MAX_SEND_ATTEMPTS = 15              # Max number of times we can get EAGAIN
 
+READ_BLOCK_SIZE = 65536             # Size of the listener's receive buffer
+LISTENER_POLL_TIMEOUT = 0.2         # Seconds to block waiting for data before checking for shutdown
+
 
 class SocketClosed(Exception): pass
 
 
-class PortAgentPacket():
+def _xor_fold(value, width):
+    """
+    XOR the bytes of an integer together by repeatedly folding its upper
+    half onto its lower half, so the work is done on whole integers rather
+    than one byte at a time.
+    @param value Non-negative integer
+    @param width Number of bytes in value
+    @retval The XOR of all bytes in value
+    """
+    bits = 8
+    while bits < width * 8:
+        bits <<= 1
+    while bits > 8:
+        bits >>= 1
+        value = (value >> bits) ^ (value & ((1 << bits) - 1))
+    return value
+
+def xor_checksum(data):
+    """
+    Compute the XOR of every byte of a string or buffer.
+    @param data str, bytearray, buffer or memoryview
+    @retval The XOR of all bytes in data, 0 if data is empty
+    """
+    if not len(data):
+        return 0
+    return _xor_fold(int(binascii.hexlify(data), 16), len(data))
+
+
+class PortAgentPacket(object):
     """
     An object that encapsulates the details packets that are sent to and
     received from the port agent.
@@ -82,38 +116,41 @@ class PortAgentPacket():
     PICKLED_DATA_FROM_INSTRUMENT = 8
     PICKLED_DATA_FROM_DRIVER = 9
 
+    # B = unsigned char size 1 bytes
+    # H = unsigned short size 2 bytes
+    # I = unsigned int size 4 bytes
+    HEADER_FORMAT = struct.Struct('>BBBBHHII')
+
+    # header bits left once the checksum bytes are masked out
+    HEADER_CHECKSUM_MASK = ((1 << (HEADER_SIZE * 8)) - 1) ^ \
+                           (0xffff << ((HEADER_SIZE - OFFSET_P_CHECKSUM_HIGH - 1) * 8))
+
+    __slots__ = ('_header', '_data', '_type', '_length', '_port_agent_timestamp',
+                 '_recv_checksum', '_checksum', '_isValid')
+
     def __init__(self, packetType = None):
-        self.__header = None
-        self.__data = None
-        self.__type = packetType
-        self.__length = None
-        self.__port_agent_timestamp = None
-        self.__recv_checksum  = None
-        self.__checksum = None
-        self.__isValid = False
+        self._header = None
+        self._data = None
+        self._type = packetType
+        self._length = None
+        self._port_agent_timestamp = None
+        self._recv_checksum  = None
+        self._checksum = None
+        self._isValid = False
 
     def unpack_header(self, header):
-        self.__header = header
-        #@TODO may want to switch from big endian to network order '!' instead of '>' note network order is big endian.
-        # B = unsigned char size 1 bytes
-        # H = unsigned short size 2 bytes
-        # L = unsigned long size 4 bytes
-        # d = float size8 bytes
-        variable_tuple = struct.unpack_from('>BBBBHHII', header)
-        # change offset to index.
-        self.__type = variable_tuple[TYPE_INDEX]
-        self.__length = int(variable_tuple[LENGTH_INDEX]) - HEADER_SIZE
-        self.__recv_checksum  = int(variable_tuple[CHECKSUM_INDEX])
-        upper = variable_tuple[TIMESTAMP_UPPER_INDEX]
-        lower = variable_tuple[TIMESTAMP_LOWER_INDEX]
-        self.__port_agent_timestamp = float("%s.%s" % (upper, lower))
-        #log.trace("port_timestamp: %f", self.__port_agent_timestamp)
+        self._header = header
+        (_, _, _, self._type, length, self._recv_checksum, upper, lower) = \
+            self.HEADER_FORMAT.unpack_from(header)
+        self._length = length - HEADER_SIZE
+        # NTP timestamp: 32 bit seconds and 32 bit binary fraction
+        self._port_agent_timestamp = upper + lower / 4294967296.0
 
     def pack_header(self):
         """
         Given a type and length, pack a header to be sent to the port agent.
         """
-        if self.__data == None:
+        if self._data == None:
             log.error('pack_header: no data!')
             """
             TODO: throw an exception here?
@@ -122,15 +159,15 @@ class PortAgentPacket():
             """
             Set the packet type if it was not passed in as parameter
             """
-            if self.__type == None:
-                self.__type = self.DATA_FROM_DRIVER
-            self.set_data_length(len(self.__data))
+            if self._type == None:
+                self._type = self.DATA_FROM_DRIVER
+            self.set_data_length(len(self._data))
             self.set_timestamp()
 
 
-            variable_tuple = (0xa3, 0x9d, 0x7a, self.__type, 
-                              self.__length + HEADER_SIZE, 0x0000, 
-                              self.__port_agent_timestamp)
+            variable_tuple = (0xa3, 0x9d, 0x7a, self._type, 
+                              self._length + HEADER_SIZE, 0x0000, 
+                              self._port_agent_timestamp)
 
             # B = unsigned char size 1 bytes
             # H = unsigned short size 2 bytes
@@ -140,8 +177,8 @@ class PortAgentPacket():
             size = struct.calcsize(format)
             temp_header = ctypes.create_string_buffer(size)
             struct.pack_into(format, temp_header, 0, *variable_tuple)
-            self.__header = temp_header.raw
-            #print "here it is: ", binascii.hexlify(self.__header)
+            self._header = temp_header.raw
+            #print "here it is: ", binascii.hexlify(self._header)
             
             """
             do the checksum last, since the checksum needs to include the
@@ -150,50 +187,45 @@ class PortAgentPacket():
             do not include a header (as I mistakenly believed when I wrote
             this)
             """
-            self.__checksum = self.calculate_checksum()
-            self.__recv_checksum  = self.__checksum
+            self._checksum = self.calculate_checksum()
+            self._recv_checksum  = self._checksum
 
             """
             This was causing a problem, and since it is not used for our tests,
             commented out; if we need it we'll have to fix
             """
-            #self.__header[OFFSET_P_CHECKSUM_HIGH] = self.__checksum & 0x00ff
-            #self.__header[OFFSET_P_CHECKSUM_LOW] = (self.__checksum & 0xff00) >> 8
+            #self._header[OFFSET_P_CHECKSUM_HIGH] = self._checksum & 0x00ff
+            #self._header[OFFSET_P_CHECKSUM_LOW] = (self._checksum & 0xff00) >> 8
 
 
     def attach_data(self, data):
-        self.__data = data
+        self._data = data
 
     def calculate_checksum(self):
-        checksum = 0
-        for i in range(HEADER_SIZE):
-            if i < OFFSET_P_CHECKSUM_LOW or i > OFFSET_P_CHECKSUM_HIGH:
-                checksum ^= struct.unpack_from('B', str(self.__header[i]))[0]
-                
-        for i in range(self.__length):
-            checksum ^= struct.unpack_from('B', str(self.__data[i]))[0]
-            
-        return checksum
-            
+        """
+        XOR of the header, less its checksum bytes, and the payload.
+        """
+        header = int(binascii.hexlify(self._header[:HEADER_SIZE]), 16)
+        checksum = _xor_fold(header & self.HEADER_CHECKSUM_MASK, HEADER_SIZE)
+
+        data = self._data
+        if self._length != len(data):
+            data = data[:self._length]
+
+        return checksum ^ xor_checksum(data)
                                 
     def verify_checksum(self):
-        checksum = 0
-        for i in range(HEADER_SIZE):
-            if i < OFFSET_P_CHECKSUM_LOW or i > OFFSET_P_CHECKSUM_HIGH:
-                checksum ^= struct.unpack_from('B', self.__header[i])[0]
-                
-        for i in range(self.__length):
-            checksum ^= struct.unpack_from('B', self.__data[i])[0]
-            
-        if checksum == self.__recv_checksum:
-            self.__isValid = True
+        checksum = self.calculate_checksum()
+
+        if checksum == self._recv_checksum:
+            self._isValid = True
         else:
-            self.__isValid = False
+            self._isValid = False
             
         #log.debug('checksum: %i.' %(checksum))
 
     def get_header(self):
-        return self.__header
+        return self._header
 
     
     def set_header(self, header):
@@ -201,48 +233,48 @@ class PortAgentPacket():
         This method is used for testing only; we want to test the checksum so
         this is one of the hoops we jump through to do that.
         """
-        self.__header = header
+        self._header = header
 
     def get_data(self):
-        return self.__data
+        return self._data
 
     def get_timestamp(self):
-        return self.__port_agent_timestamp
+        return self._port_agent_timestamp
 
     def attach_timestamp(self, timestamp):
-        self.__port_agent_timestamp = timestamp
+        self._port_agent_timestamp = timestamp
 
     def set_timestamp(self):
         self.attach_timestamp(time.time())
 
     def get_data_length(self):
-        return self.__length
+        return self._length
 
     def set_data_length(self, length):
-        self.__length = length
+        self._length = length
 
     def get_header_type(self):
-        return self.__type
+        return self._type
 
     def get_header_checksum(self):
-        return self.__checksum
+        return self._checksum
 
     def get_header_recv_checksum (self):
-        return self.__recv_checksum
+        return self._recv_checksum
 
     def get_as_dict(self):
         """
         Return a dictionary representation of a port agent packet
         """
         return {
-            'type': self.__type,
-            'length': self.__length,
-            'checksum': self.__checksum,
-            'raw': self.__data
+            'type': self._type,
+            'length': self._length,
+            'checksum': self._checksum,
+            'raw': self._data
         }
 
     def is_valid(self):
-        return self.__isValid
+        return self._isValid
                     
 
 class PortAgentClient(object):
@@ -257,11 +289,14 @@ class PortAgentClient(object):
     HEARTBEAT_INTERVAL_COMMAND = "heartbeat_interval "
     BREAK_COMMAND = "break "
     
-    def __init__(self, host, port, cmd_port, delim=None):
+    def __init__(self, host, port, cmd_port, delim=None, hub=None):
         """
         PortAgentClient constructor.
+        @param hub Optional PortAgentHub to service this connection from a
+        shared I/O thread rather than a listener thread of its own.
         """
         self.host = host
+        self.hub = hub
         self.port = port
         self.cmd_port = cmd_port
         self.sock = None
@@ -310,7 +345,8 @@ class PortAgentClient(object):
                                                 self.callback_raw,
                                                 self.listener_callback_error,
                                                 self.callback_error,
-                                                self.user_callback_error)
+                                                self.user_callback_error,
+                                                self.hub)
                 self.listener_thread.start()
 
             ###
@@ -577,6 +613,98 @@ class PortAgentClient(object):
         else:
             log.debug('port_agent_client listen thread: recovery succeeded.')
 
+class PacketReader(object):
+    """
+    Frames port agent packets out of the data socket. Data is read in large
+    blocks into a reusable buffer and every complete packet in the buffer is
+    handed out as a view into it, so a burst of small packets costs a single
+    recv rather than two per packet.
+    """
+
+    def __init__(self, sock, block_size=READ_BLOCK_SIZE):
+        """
+        @param sock The non-blocking socket to read from.
+        @param block_size Initial size of the receive buffer; it grows if a
+        single packet does not fit.
+        """
+        self.sock = sock
+        self._block_size = block_size
+        self._buffer = bytearray(block_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0     # first unconsumed byte
+        self._end = 0       # end of received data
+
+    def fill(self):
+        """
+        Read whatever the socket has available into the free end of the
+        buffer.
+        @retval The number of bytes read; 0 if the read would block.
+        @raise SocketClosed if the port agent closed the connection.
+        """
+        self._make_room()
+        try:
+            count = self.sock.recv_into(self._view[self._end:])
+        except socket.error as e:
+            if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                return 0
+            raise
+
+        if count <= 0:
+            raise SocketClosed()
+
+        self._end += count
+        return count
+
+    def packets(self):
+        """
+        Generator yielding every complete packet in the buffer as a
+        memoryview over header and payload. The views are only valid until
+        the next call to fill, callers must copy anything they keep.
+        @raise InstrumentConnectionException if a header carries a length
+        shorter than the header itself; that header is consumed first.
+        """
+        buf = self._buffer
+        while self._end - self._start >= HEADER_SIZE:
+            start = self._start
+            (length,) = struct.unpack_from('>H', buf, start + 4)
+            if length < HEADER_SIZE:
+                self._start = start + HEADER_SIZE
+                raise InstrumentConnectionException('Invalid port agent packet length: %d' % length)
+            if self._end - start < length:
+                break
+            self._start = start + length
+            yield self._view[start:start + length]
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _make_room(self):
+        """
+        Make sure there is a reasonable amount of free space at the end of
+        the buffer: move a trailing partial packet to the front, and grow the
+        buffer when the partial packet is larger than the buffer.
+        """
+        free = len(self._buffer) - self._end
+        if free >= self._block_size // 2:
+            return
+
+        pending = self._end - self._start
+        if pending + self._block_size // 2 > len(self._buffer):
+            # the view pins the old buffer, so allocate a larger one
+            size = len(self._buffer)
+            while pending + self._block_size // 2 > size:
+                size *= 2
+            buf = bytearray(size)
+            buf[:pending] = self._view[self._start:self._end]
+            self._buffer = buf
+            self._view = memoryview(buf)
+        else:
+            self._buffer[:pending] = self._view[self._start:self._end]
+
+        self._start = 0
+        self._end = pending
+
+
 class Listener(threading.Thread):
 
     MAX_HEARTBEAT_INTERVAL = 20 # Max, for range checking parameter
@@ -594,7 +722,8 @@ class Listener(threading.Thread):
                  callback_data = None, callback_raw = None,
                  default_callback_error = None,
                  local_callback_error = None,
-                 user_callback_error = None):
+                 user_callback_error = None,
+                 hub = None):
         """
         Listener thread constructor.
         @param sock The socket to listen on.
@@ -609,9 +738,14 @@ class Listener(threading.Thread):
         @param default_callback_data A callback to handle non-network exceptions
         @param local_callback_data The local callback when error encountered.
         @param user_callback_data The user callback on error_encountered.
+        @param hub Optional PortAgentHub; when given the listener is serviced
+        by the hub's I/O thread instead of running a thread of its own.
         """
         threading.Thread.__init__(self)
         self.sock = sock
+        self.hub = hub
+        self.heartbeat_deadline = None
+        self._stopped = threading.Event()
         self.recovery_attempt = recovery_attempt
         self._done = False
         self.linebuf = ''
@@ -724,19 +858,58 @@ class Listener(threading.Thread):
         I don't like this; we need to implement a tread timer that 
         stays up and can be reset and started many times.
         """
+        if self.hub:
+            # the hub checks the deadline from its own loop
+            self.heartbeat_deadline = time.time() + self.heartbeat
+            return
+
         if self.heartbeat_timer:
             self.heartbeat_timer.cancel()
 
         self.heartbeat_timer = threading.Timer(self.heartbeat, 
                                             self.heartbeat_timeout)
         self.heartbeat_timer.start()
-        
+
+    def start(self):
+        """
+        Start listening: register with the hub if there is one, otherwise
+        start the listener thread.
+        """
+        if self.hub:
+            self.thread_name = self.name
+            if self.heartbeat:
+                self.start_heartbeat_timer()
+            self.hub.register(self)
+        else:
+            threading.Thread.start(self)
+
+    def join(self, timeout=None):
+        """
+        Wait for the listener to stop. Called from one of its callbacks on
+        the hub thread this returns straight away; the hub drops the
+        listener once the callback returns.
+        """
+        if self.hub:
+            if threading.current_thread() is not self.hub:
+                self._stopped.wait(timeout)
+        else:
+            threading.Thread.join(self, timeout)
+
+    def is_alive(self):
+        if self.hub:
+            return not self._stopped.is_set()
+        return threading.Thread.is_alive(self)
+
+    isAlive = is_alive
+
     def done(self):
         """
         Signal to the listener thread to end its processing loop and
         conclude.
         """
         self._done = True
+        if self.hub:
+            self.hub.unregister(self)
 
     def handle_packet(self, paPacket):
         packet_type = paPacket.get_header_type()
@@ -773,10 +946,9 @@ class Listener(threading.Thread):
 
     def run(self):
         """
-        Listener thread processing loop. Block on receive from port agent.
-        Receive HEADER_SIZE bytes to receive the entire header.  From that,
-        get the length of the whole packet (including header); compute the
-        length of the remaining data and read that.  
+        Listener thread processing loop. Block in poll until the port agent
+        socket is readable, read everything available in one block and hand
+        each complete packet in it to handle_packet.
         """
         self.thread_name = str(threading.current_thread().name)
         log.info('PortAgentClient listener thread: %s started.', self.thread_name)
@@ -784,100 +956,112 @@ class Listener(threading.Thread):
         if self.heartbeat:
             self.start_heartbeat_timer()
 
+        reader = PacketReader(self.sock)
+        wait_readable = self._readable_waiter()
+
+        backlog = False
         while not self._done:
-            try:
-                log.debug('RX NEW PACKET')
-                header = bytearray(HEADER_SIZE)
-                headerview = memoryview(header)
-                bytes_left = HEADER_SIZE
-                while bytes_left and not self._done:
-                    try:
-                        bytesrx = self.sock.recv_into(headerview[HEADER_SIZE - bytes_left:], bytes_left)
-                        log.debug('RX HEADER BYTES %d LEFT %d SOCK %r' % (
-                                                    bytesrx, bytes_left, self.sock,))
-                        if bytesrx <= 0:
-                            raise SocketClosed()
-                        bytes_left -= bytesrx
-                    except socket.error as e:
-                        if e.errno == errno.EWOULDBLOCK:
-                            time.sleep(.1)
-                        else:
-                            raise
-
-                """
-                Only do this if we've received the whole header, otherwise (ex. during shutdown)
-                we can have a completely invalid header, resulting in negative count exceptions.
-                """
-                if (bytes_left == 0):
-                    paPacket = PortAgentPacket()
-                    paPacket.unpack_header(str(header))
-                    data_size = paPacket.get_data_length()
-                    bytes_left = data_size
-                    data = bytearray(data_size)
-                    dataview = memoryview(data)
-                    log.debug('Expecting DATA BYTES %d' % data_size)
-                    
-                while bytes_left and not self._done:
-                    try:
-                        bytesrx = self.sock.recv_into(dataview[data_size - bytes_left:], bytes_left)
-                        log.debug('RX DATA BYTES %d LEFT %d SOCK %r' % (
-                                                    bytesrx, bytes_left, self.sock,))
-                        if bytesrx <= 0:
-                            raise SocketClosed()
-                        bytes_left -= bytesrx
-                    except socket.error as e:
-                        if e.errno == errno.EWOULDBLOCK:
-                            time.sleep(.1)
-                        else:
-                            raise
-
-                if not self._done:
-                    """
-                    Should have complete port agent packet.
-                    """
-                    paPacket.attach_data(str(data))
-                    log.debug("HANDLE PACKET")
-                    self.handle_packet(paPacket)
-
-            except SocketClosed:
-                errorString = 'Listener thread: %s SocketClosed exception from port_agent socket' \
-                    % (self.thread_name) 
-                log.error(errorString)
-                self._invoke_error_callback(self.recovery_attempt, errorString)
-                """
-                This next statement causes the thread to exit.  This 
-                thread is done regardless of which condition exists 
-                above; it is the job of the callbacks to restart the
-                thread
-                """
-                self._done = True
-
-            except socket.error as e:
-                errorString = 'Listener thread: %s Socket error while receiving from port agent: %r' \
-                 % (self.thread_name, e)
-                log.error(errorString)
-                self._invoke_error_callback(self.recovery_attempt, errorString)
-                """
-                This next statement causes the thread to exit.  This 
-                thread is done regardless of which condition exists 
-                above; it is the job of the callbacks to restart the
-                thread
-                """
-                self._done = True
-
-            except Exception as e:
-                self.default_callback_error(e)
+            fill = not backlog and wait_readable(LISTENER_POLL_TIMEOUT)
+            if self._done:
+                break
+            backlog = self._service(reader, fill)
 
         log.info('Port_agent_client thread done listening; going away.')
 
+    def _service(self, reader, fill):
+        """
+        Optionally read from the socket, then hand every complete packet in
+        the reader to handle_packet. Socket errors invoke the error
+        callbacks and end the listener.
+        @param reader The PacketReader for this listener's socket.
+        @param fill True to read from the socket first.
+        @retval True if complete packets may be left in the reader, e.g.
+        because a callback raised.
+        """
+        try:
+            if fill:
+                bytesrx = reader.fill()
+                log.debug('RX BYTES %d SOCK %r', bytesrx, self.sock)
+
+            for frame in reader.packets():
+                if self._done:
+                    break
+                paPacket = PortAgentPacket()
+                paPacket.unpack_header(frame[:HEADER_SIZE].tobytes())
+                paPacket.attach_data(frame[HEADER_SIZE:].tobytes())
+                self.handle_packet(paPacket)
+
+        except SocketClosed:
+            errorString = 'Listener thread: %s SocketClosed exception from port_agent socket' \
+                % (self.thread_name) 
+            log.error(errorString)
+            self._invoke_error_callback(self.recovery_attempt, errorString)
+            """
+            This next statement causes the thread to exit.  This 
+            thread is done regardless of which condition exists 
+            above; it is the job of the callbacks to restart the
+            thread
+            """
+            self._done = True
+
+        except (socket.error, select.error) as e:
+            errorString = 'Listener thread: %s Socket error while receiving from port agent: %r' \
+             % (self.thread_name, e)
+            log.error(errorString)
+            self._invoke_error_callback(self.recovery_attempt, errorString)
+            """
+            This next statement causes the thread to exit.  This 
+            thread is done regardless of which condition exists 
+            above; it is the job of the callbacks to restart the
+            thread
+            """
+            self._done = True
+
+        except Exception as e:
+            self.default_callback_error(e)
+            return True
+
+        return False
+
+    def _readable_waiter(self):
+        """
+        Build a function that blocks until the socket is readable or the
+        timeout expires. Uses poll where the platform has it, select
+        otherwise.
+        @retval function(timeout) returning True if the socket is readable.
+        """
+        sock = self.sock
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(sock, select.POLLIN | select.POLLPRI)
+
+            def wait_readable(timeout):
+                return bool(poller.poll(timeout * 1000))
+        else:
+            def wait_readable(timeout):
+                return bool(select.select([sock], [], [], timeout)[0])
+
+        return wait_readable
+
     def _invoke_error_callback(self, recovery_attempt, error_string = "No error string passed."):
         """
         Invoke either the user_error_callback or the local_error_callback, depending upon the
         recovery_attempt value.  If the local_error_callback is invoked, and its return_code
         indicates that it failed, invoke the user_error_callback. 
+        On the hub thread the callbacks run on a thread of their own, as
+        recovery reconnects and may sleep between attempts.
         @param recovery_attempt: the number of this recovery attempt.
         @param error_string: error description.
         """
+        if self.hub and threading.current_thread() is self.hub:
+            recovery = threading.Thread(target=self._recover, args=(error_string,),
+                                        name='%s recovery' % self.thread_name)
+            recovery.daemon = True
+            recovery.start()
+        else:
+            self._recover(error_string)
+
+    def _recover(self, error_string):
         if self.recovery_attempt < MAX_RECOVERY_ATTEMPTS:
             log.debug('port_agent_client listen thread calling local_callback_error.')
             recovery = self.local_callback_error(error_string)
@@ -889,3 +1073,236 @@ class Listener(threading.Thread):
         else:
             log.debug('port_agent_client listen thread calling user_callback_error.')
             self.user_callback_error(error_string)
+
+
+class PortAgentHub(threading.Thread):
+    """
+    Services many port agent data connections, and their heartbeats, from a
+    single I/O thread instead of one Listener thread plus one heartbeat
+    timer thread per connection. Listeners constructed with a hub register
+    with it when started; the hub waits for any of their sockets to become
+    readable (epoll, or poll where epoll is not available) and calls
+    the listener's packet and error handling from its own thread.
+
+    Callbacks for every connection on a hub run on the hub thread, so a
+    callback that blocks delays the others. Error callbacks, and with them
+    connection recovery, run on a thread of their own.
+    """
+    TICK = 1.0          # Longest time to block in poll
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """
+        The process-wide hub, created and started on first use.
+        """
+        with cls._instance_lock:
+            if cls._instance is None or not cls._instance.is_alive():
+                cls._instance = cls()
+                cls._instance.start()
+            return cls._instance
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='PortAgentHub')
+        self.daemon = True
+        self._done = False
+        self._lock = threading.Lock()
+        self._pending = []          # (listener, register) changes for the loop
+        self._connections = {}      # fd -> (listener, reader)
+        self._backlog = set()       # fds that may still hold complete packets
+
+        self._poller = _Poller()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        fcntl.fcntl(self._wakeup_r, fcntl.F_SETFL, os.O_NONBLOCK)
+        fcntl.fcntl(self._wakeup_w, fcntl.F_SETFL, os.O_NONBLOCK)
+        self._poller.register(self._wakeup_r)
+
+    def register(self, listener):
+        """
+        Start servicing a listener's socket.
+        """
+        self._change(listener, True)
+
+    def unregister(self, listener):
+        """
+        Stop servicing a listener. Its join returns once the hub has dropped
+        it.
+        """
+        self._change(listener, False)
+
+    def get_listeners(self):
+        """
+        @retval The listeners currently serviced by the hub.
+        """
+        return [listener for (listener, reader) in self._connections.values()]
+
+    def stop(self):
+        """
+        Stop the hub thread and release all of its listeners.
+        """
+        self._done = True
+        self._wakeup()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def run(self):
+        log.info('PortAgentHub started.')
+
+        while not self._done:
+            try:
+                self._apply_changes()
+                ready = self._poller.poll(self._next_timeout())
+            except (select.error, IOError, OSError) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in ready:
+                if fd == self._wakeup_r:
+                    self._drain_wakeup()
+                elif fd in self._connections:
+                    self._service(fd, True)
+
+            for fd in list(self._backlog):
+                self._service(fd, False)
+
+            self._check_heartbeats()
+
+        for fd in self._connections.keys():
+            self._drop(fd)
+        with self._lock:
+            for (listener, register) in self._pending:
+                listener._stopped.set()
+            self._pending = []
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        log.info('PortAgentHub done.')
+
+    def _change(self, listener, register):
+        with self._lock:
+            self._pending.append((listener, register))
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self._wakeup_w, 'x')
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EBADF):
+                raise
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _apply_changes(self):
+        """
+        Apply queued registrations in order. A socket closed during error
+        recovery may hand its descriptor to the replacement socket, so an
+        existing entry for the same descriptor is dropped first.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        for (listener, register) in pending:
+            if register:
+                if listener._done:
+                    listener._stopped.set()
+                    continue
+                fd = listener.sock.fileno()
+                if fd in self._connections:
+                    self._drop(fd)
+                self._connections[fd] = (listener, PacketReader(listener.sock))
+                self._poller.register(fd)
+                log.debug('PortAgentHub registered %s fd %d', listener.thread_name, fd)
+            else:
+                for (fd, (other, reader)) in self._connections.items():
+                    if other is listener:
+                        self._drop(fd)
+                        break
+                else:
+                    listener._stopped.set()
+
+    def _drop(self, fd):
+        (listener, reader) = self._connections.pop(fd)
+        self._backlog.discard(fd)
+        self._poller.unregister(fd)
+        listener._stopped.set()
+
+    def _service(self, fd, fill):
+        (listener, reader) = self._connections[fd]
+        backlog = not listener._done and listener._service(reader, fill)
+        if backlog:
+            self._backlog.add(fd)
+        else:
+            self._backlog.discard(fd)
+
+        # error recovery may already have replaced this connection
+        if listener._done and self._connections.get(fd, (None,))[0] is listener:
+            self._drop(fd)
+
+    def _next_timeout(self):
+        if self._backlog:
+            return 0
+        timeout = self.TICK
+        now = time.time()
+        for (listener, reader) in self._connections.itervalues():
+            if listener.heartbeat_deadline is not None:
+                timeout = min(timeout, listener.heartbeat_deadline - now)
+        return max(timeout, 0)
+
+    def _check_heartbeats(self):
+        now = time.time()
+        for (listener, reader) in self._connections.values():
+            deadline = listener.heartbeat_deadline
+            if deadline is not None and deadline <= now and not listener._done:
+                listener.heartbeat_deadline = None
+                try:
+                    listener.heartbeat_timeout()
+                except Exception as e:
+                    listener.default_callback_error(e)
+
+
+class _Poller(object):
+    """
+    Readiness poller for file descriptors over epoll, or poll where epoll
+    is not available.
+    """
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._impl = select.epoll()
+            self._mask = select.EPOLLIN | select.EPOLLPRI
+            self._scale = 1
+        else:
+            self._impl = select.poll()
+            self._mask = select.POLLIN | select.POLLPRI
+            self._scale = 1000
+
+    def register(self, fd):
+        try:
+            self._impl.register(fd, self._mask)
+        except IOError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            self._impl.modify(fd, self._mask)
+
+    def unregister(self, fd):
+        """
+        Forget a descriptor. Closed descriptors are silently ignored.
+        """
+        try:
+            self._impl.unregister(fd)
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+
+    def poll(self, timeout):
+        """
+        @param timeout Seconds to wait
+        @retval List of readable (or errored) descriptors
+        """
+        return [fd for (fd, event) in self._impl.poll(timeout * self._scale)]
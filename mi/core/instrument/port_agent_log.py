@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.port_agent_log
+@file mi/core/instrument/port_agent_log.py
+@brief Indexed reader for port agent data logs. The log is memory mapped,
+an index of (offset, timestamp, packet type) is built once and kept in a
+sidecar file, and packets can be read or replayed into a driver protocol
+from any point in time.
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import mmap
+import time
+import array
+import struct
+import bisect
+
+from mi.core.log import get_logger ; log = get_logger()
+from mi.core.instrument.port_agent_client import PortAgentPacket, HEADER_SIZE
+
+SYNC = '\xa3\x9d\x7a'
+INDEX_SUFFIX = '.idx'
+
+# magic, version, offset itemsize, indexed length of the log, packet count
+INDEX_HEADER = struct.Struct('<8sIIQQ')
+INDEX_MAGIC = 'PALOGIDX'
+INDEX_VERSION = 1
+
+# packet types handed to both the data and raw callbacks on replay, the
+# same split Listener.handle_packet makes for live data
+DATA_PACKET_TYPES = (PortAgentPacket.DATA_FROM_INSTRUMENT,
+                     PortAgentPacket.PICKLED_DATA_FROM_INSTRUMENT)
+MAX_PACKET_TYPE = PortAgentPacket.PICKLED_DATA_FROM_DRIVER
+
+
+def _verify_packet(buf, offset, length):
+    """
+    @retval True if the packet at offset passes its checksum
+    """
+    packet = PortAgentPacket()
+    packet.unpack_header(buf[offset:offset + HEADER_SIZE])
+    packet.attach_data(buf[offset + HEADER_SIZE:offset + length])
+    packet.verify_checksum()
+    return packet.is_valid()
+
+
+def _next_packet(buf, offset, end):
+    """
+    Find the next whole packet before end that passes its checksum.
+    @retval Offset of the packet, or -1 if there is none
+    """
+    unpack_from = PortAgentPacket.HEADER_FORMAT.unpack_from
+    offset = buf.find(SYNC, offset, end)
+    while 0 <= offset and offset + HEADER_SIZE <= end:
+        (_, _, _, packet_type, length, _, _, _) = unpack_from(buf, offset)
+        if (HEADER_SIZE <= length and offset + length <= end and 0 < packet_type <= MAX_PACKET_TYPE
+                and _verify_packet(buf, offset, length)):
+            return offset
+        offset = buf.find(SYNC, offset + 1, end)
+    return -1
+
+
+def scan_packets(buf, offset=0, end=None):
+    """
+    Find the port agent packets in a buffer. Bytes that are not part of a
+    packet are skipped by searching for the next sync sequence.
+    @param buf str, mmap or other buffer holding log data
+    @param offset Where to start scanning
+    @param end Where to stop scanning, defaults to the end of buf
+    @retval Generator of (offset, timestamp, packet_type, length) tuples,
+    length includes the header.
+    """
+    if end is None:
+        end = len(buf)
+    unpack_from = PortAgentPacket.HEADER_FORMAT.unpack_from
+    resynced = False
+
+    while offset + HEADER_SIZE <= end:
+        if buf[offset:offset + len(SYNC)] != SYNC:
+            offset = buf.find(SYNC, offset + 1, end)
+            if offset < 0:
+                return
+            resynced = True
+            continue
+
+        (_, _, _, packet_type, length, _, upper, lower) = unpack_from(buf, offset)
+        if length < HEADER_SIZE or not 0 < packet_type <= MAX_PACKET_TYPE:
+            # a sync sequence inside payload or a damaged packet, resync
+            offset += 1
+            resynced = True
+            continue
+        if offset + length > end:
+            # either the log ends with a partial packet, or this is a false
+            # sync or a damaged length with whole packets after it
+            offset = _next_packet(buf, offset + 1, end)
+            if offset < 0:
+                return
+            resynced = True
+            continue
+
+        if resynced:
+            # after skipping junk only trust a packet with a good checksum
+            if not _verify_packet(buf, offset, length):
+                offset += 1
+                continue
+            resynced = False
+
+        yield (offset, upper + lower / 4294967296.0, packet_type, length)
+        offset += length
+
+
+class PortAgentLogReader(object):
+    """
+    Random access reader for a port agent log file.
+
+    The index is three parallel arrays: packet offsets, port agent
+    timestamps and packet types. It is stored next to the log with an
+    INDEX_SUFFIX and reused as long as the log has not shrunk; when the log
+    has grown (a log that is still being written) only the new data is
+    scanned.
+
+    Time based seeks use a binary search over the timestamps, so they
+    assume the log is in time order, which is how the port agent writes it.
+    """
+
+    def __init__(self, filename, index_filename=None, persist_index=True):
+        """
+        @param filename Path of the port agent log
+        @param index_filename Path of the sidecar index, defaults to the
+        log path plus INDEX_SUFFIX
+        @param persist_index Save the index after building or extending it
+        """
+        self.filename = filename
+        self.index_filename = index_filename or filename + INDEX_SUFFIX
+        self.persist_index = persist_index
+
+        self._file = open(filename, 'rb')
+        self._map = None
+        self._size = 0
+
+        self.offsets = array.array('L')
+        self.timestamps = array.array('d')
+        self.types = array.array('B')
+        self._indexed = 0       # log length covered by the index
+
+        if not self._load_index():
+            self._reset_index()
+        self.refresh()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def refresh(self):
+        """
+        Map the whole log file and index any packets added since the index
+        was last built.
+        @retval The number of packets added to the index
+        """
+        size = os.fstat(self._file.fileno()).st_size
+        if size < self._indexed:
+            log.warn("Port agent log %s shrank, rebuilding index", self.filename)
+            self._reset_index()
+
+        if size != self._size:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            if size:
+                self._map = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+            self._size = size
+
+        if self._map is None or self._indexed >= size:
+            return 0
+
+        count = len(self.offsets)
+        resume = self._indexed
+        for (offset, timestamp, packet_type, length) in scan_packets(self._map, self._indexed, size):
+            self.offsets.append(offset)
+            self.timestamps.append(timestamp)
+            self.types.append(packet_type)
+            resume = offset + length
+
+        # leave a trailing partial packet, or the start of its sync
+        # sequence, to be indexed once it is complete
+        tail = self._map.find(SYNC, resume, size)
+        self._indexed = max(resume, size - len(SYNC) + 1) if tail < 0 else tail
+
+        added = len(self.offsets) - count
+        if added and self.persist_index:
+            self._save_index()
+        log.debug("Indexed %d packets in %s", added, self.filename)
+        return added
+
+    def find_time(self, timestamp):
+        """
+        @param timestamp NTP timestamp
+        @retval Index of the first packet at or after timestamp
+        """
+        return bisect.bisect_left(self.timestamps, timestamp)
+
+    def get_packet(self, index, verify=False):
+        """
+        @param index Position in the index
+        @param verify Compute and verify the packet checksum
+        @retval A PortAgentPacket
+        """
+        offset = self.offsets[index]
+        packet = PortAgentPacket()
+        packet.unpack_header(self._map[offset:offset + HEADER_SIZE])
+        start = offset + HEADER_SIZE
+        packet.attach_data(self._map[start:start + packet.get_data_length()])
+        if verify:
+            packet.verify_checksum()
+        return packet
+
+    def packets(self, start_time=None, end_time=None, types=None, verify=False):
+        """
+        Generator of the packets in a time range.
+        @param start_time NTP timestamp of the first packet, defaults to the
+        start of the log
+        @param end_time NTP timestamp to stop before, defaults to the end of
+        the log
+        @param types Packet types to include, defaults to all
+        @param verify Compute and verify packet checksums
+        """
+        first = 0 if start_time is None else self.find_time(start_time)
+        last = len(self.offsets) if end_time is None else self.find_time(end_time)
+        if types is not None:
+            types = frozenset(types)
+
+        for index in xrange(first, last):
+            if types is None or self.types[index] in types:
+                yield self.get_packet(index, verify)
+
+    def replay(self, got_data, got_raw=None, start_time=None, end_time=None, rate=None, verify=True):
+        """
+        Feed logged packets to driver callbacks, typically a protocol's
+        got_data and got_raw. Instrument data goes to both callbacks and
+        everything else but heartbeats to got_raw only, as it would from a
+        live PortAgentClient.
+        @param got_data Callback for instrument data packets
+        @param got_raw Optional callback for raw packets
+        @param start_time NTP timestamp to start at
+        @param end_time NTP timestamp to stop before
+        @param rate None to replay as fast as possible, otherwise a
+        multiple of real time, e.g. 10 to replay ten times faster than the
+        data was logged
+        @param verify Verify packet checksums as the live client does
+        @retval The number of packets replayed
+        """
+        types = None
+        if got_raw is None:
+            types = DATA_PACKET_TYPES
+
+        count = 0
+        first_timestamp = None
+        started = time.time()
+        for packet in self.packets(start_time, end_time, types, verify):
+            packet_type = packet.get_header_type()
+            if packet_type == PortAgentPacket.HEARTBEAT:
+                continue
+
+            if rate:
+                timestamp = packet.get_timestamp()
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                delay = started + (timestamp - first_timestamp) / rate - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if got_raw is not None:
+                got_raw(packet)
+            if packet_type in DATA_PACKET_TYPES:
+                got_data(packet)
+            count += 1
+
+        return count
+
+    def _reset_index(self):
+        self.offsets = array.array('L')
+        self.timestamps = array.array('d')
+        self.types = array.array('B')
+        self._indexed = 0
+
+    def _load_index(self):
+        """
+        Load the sidecar index if there is a usable one.
+        @retval True if the index was loaded
+        """
+        try:
+            with open(self.index_filename, 'rb') as index_file:
+                (magic, version, itemsize, indexed, count) = \
+                    INDEX_HEADER.unpack(index_file.read(INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or version != INDEX_VERSION or itemsize != self.offsets.itemsize:
+                    return False
+                if indexed > os.fstat(self._file.fileno()).st_size:
+                    return False
+                self.offsets.fromfile(index_file, count)
+                self.timestamps.fromfile(index_file, count)
+                self.types.fromfile(index_file, count)
+        except (IOError, EOFError, struct.error) as e:
+            log.debug("No usable index for %s: %s", self.filename, e)
+            self._reset_index()
+            return False
+
+        # the log may have been replaced by a different one of equal or
+        # larger size, make sure the last indexed packet is still there
+        if count:
+            self._file.seek(self.offsets[-1])
+            if self._file.read(len(SYNC)) != SYNC:
+                self._reset_index()
+                return False
+
+        self._indexed = indexed
+        return True
+
+    def _save_index(self):
+        temp_filename = self.index_filename + '.tmp'
+        try:
+            with open(temp_filename, 'wb') as index_file:
+                index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.offsets.itemsize,
+                                                   self._indexed, len(self.offsets)))
+                self.offsets.tofile(index_file)
+                self.timestamps.tofile(index_file)
+                self.types.tofile(index_file)
+            os.rename(temp_filename, self.index_filename)
+        except (IOError, OSError) as e:
+            log.warn("Failed to save port agent log index %s: %s", self.index_filename, e)
@@ -12,6 +12,9 @@ __author__ = 'Edward Hunter'
 __license__ = 'Apache 2.0'
 
 import re
+import string
+import sre_parse
+import sre_constants
 import ntplib
 import time
 import yaml
@@ -27,6 +30,15 @@ from mi.core.log import get_logger ; log = get_logger()
 EGG_PATH = "resource"
 DEFAULT_FILENAME = "strings.yml"
 
+# Characters of a literal used to look it up in a ParameterIndex
+INDEX_KEY_LENGTH = 3
+
+# The case folding the re module does for str patterns without LOCALE or
+# UNICODE, independent of the process locale unlike str.lower()
+_ASCII_LOWER = string.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+NO_PARAMETERS = frozenset()
+
 class ParameterDictType(BaseEnum):
     BOOL = "bool"
     INT = "int"
@@ -384,16 +396,114 @@ class FunctionParameter(Parameter):
         else:
             return False
 
+def _required_literal(parameter):
+    """
+    Find the longest run of literal text that every match of a regex
+    parameter has to contain, so inputs without it can skip the search.
+    @param parameter A Parameter object
+    @retval (literal, folded) where folded is True if the regex ignores
+    ASCII case and the literal is lower case, or None if the parameter
+    has to be tried on every input
+    """
+    if not isinstance(parameter, RegexParameter) or 'update' in parameter.__dict__ or \
+       type(parameter).update.im_func is not RegexParameter.update.im_func:
+        return None
+
+    regex = parameter.regex
+    if not isinstance(regex.pattern, str):
+        return None
+    folded = bool(regex.flags & re.IGNORECASE)
+    if folded and regex.flags & (re.LOCALE | re.UNICODE):
+        return None
+
+    runs = [[]]
+    def walk(subpattern):
+        for (op, av) in subpattern:
+            if op == sre_constants.LITERAL:
+                runs[-1].append(chr(av))
+            elif op == sre_constants.SUBPATTERN:
+                # a plain group is matched in line with its surroundings
+                walk(av[1])
+            else:
+                runs.append([])
+    walk(sre_parse.parse(regex.pattern, regex.flags))
+
+    literal = max((''.join(run) for run in runs), key=len)
+    if len(literal) < INDEX_KEY_LENGTH:
+        return None
+    if folded:
+        if any(ord(c) > 127 for c in literal):
+            return None
+        literal = literal.translate(_ASCII_LOWER)
+    return (literal, folded)
+
+class ParameterIndex(object):
+    """
+    Dispatch index for matching input against a set of parameters. Each
+    regex parameter is filed under the literal text its regex requires,
+    keyed by the first few characters, so a line is only searched by the
+    parameters whose literal it contains. The keys are found with a single
+    regex scan of the line. Parameters without a usable literal are not
+    indexed and are always tried.
+    """
+    def __init__(self, params):
+        """
+        @param params Dict of name : Parameter the index is built for
+        """
+        self.params = dict(params)
+        self._names = set()
+        # case sensitive and case folded literals, key -> literal -> names
+        literals = ({}, {})
+        for (name, val) in self.params.iteritems():
+            required = _required_literal(val)
+            if required is None:
+                continue
+            (literal, folded) = required
+            self._names.add(name)
+            literals[folded].setdefault(literal[:INDEX_KEY_LENGTH], {}).setdefault(literal, []).append(name)
+
+        # keys are all the same length, so at most one matches at each
+        # position and a lookahead finds every occurrence
+        self._tables = []
+        for (folded, table) in enumerate(literals):
+            if table:
+                keys = '|'.join(re.escape(key) for key in table)
+                self._tables.append((folded, re.compile('(?=(%s))' % keys), table))
+
+    def __len__(self):
+        return len(self._names)
+
+    def skipped(self, input):
+        """
+        @param input The string about to be matched
+        @retval Set of the names of parameters that can't match it
+        """
+        found = set()
+        for (folded, key_regex, table) in self._tables:
+            text = input.translate(_ASCII_LOWER) if folded else input
+            for key in set(key_regex.findall(text)):
+                for (literal, names) in table[key].iteritems():
+                    if literal in text:
+                        found.update(names)
+        return self._names.difference(found)
+
 class ProtocolParameterDict(InstrumentDict):
     """
     Protocol parameter dictionary. Manages, matches and formats device
-    parameters.
+    parameters. Input is only searched by the parameters a ParameterIndex
+    says could match it; the index is built by the first update after
+    the parameters change.
     """
+    # Dictionaries with fewer parameters search every one, the index
+    # doesn't pay for itself
+    INDEX_MIN_PARAMETERS = 8
+
     def __init__(self):
         """
         Constructor.        
         """
         self._param_dict = {}
+        self._index = None
         
     def add(self,
             name,
@@ -494,7 +604,20 @@ class ProtocolParameterDict(InstrumentDict):
             raise InstrumentParameterException(
                 "Invalid Parameter added! Attempting to add: %s" % parameter)
         self._param_dict[parameter.name] = parameter
-        
+
+    def _skipped(self, input):
+        """
+        Look up the parameters that can't match an input. The index is
+        rebuilt whenever the parameters have changed since it was built.
+        @param input The input about to be matched
+        @retval Set of parameter names not to try
+        """
+        if not isinstance(input, str) or len(self._param_dict) < self.INDEX_MIN_PARAMETERS:
+            return NO_PARAMETERS
+        if self._index is None or self._index.params != self._param_dict:
+            self._index = ParameterIndex(self._param_dict)
+        return self._index.skipped(input)
+
     def get(self, name, timestamp=None):
         """
         Get a parameter value from the dictionary.
@@ -673,9 +796,12 @@ class ProtocolParameterDict(InstrumentDict):
         """
         hit_count = 0
         multi_mode = False
+        skipped = self._skipped(input)
         for (name, val) in self._param_dict.iteritems():
             if multi_mode == True and val.description.multi_match == False:
                 continue
+            if name in skipped:
+                continue
             if val.update(input):
                 hit_count =hit_count +1
                 if False == val.description.multi_match:
@@ -694,7 +820,10 @@ class ProtocolParameterDict(InstrumentDict):
         @retval A dict with the names and values that were updated
         """
         result = {}
+        skipped = self._skipped(input)
         for (name, val) in self._param_dict.iteritems():
+            if name in skipped:
+                continue
             update_result = val.update(input)
             if update_result:
                 result[name] = update_result 
@@ -726,9 +855,12 @@ class ProtocolParameterDict(InstrumentDict):
         else:
             raise InstrumentParameterException("invalid target_params, must be name or list")
 
+        skipped = self._skipped(input)
         for name in params:
-            log.trace("update param dict name: %s", name)
             val = self._param_dict[name]
+            if name in skipped:
+                continue
+            log.trace("update param dict name: %s", name)
             if val.update(input):
                 found = True
         return found
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.slow_driver
+@file mi/core/instrument/test/slow_driver.py
+@brief Driver with a slow command, launched in a driver process by the
+ZMQ driver process tests.
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+
+from mi.core.instrument.instrument_driver import InstrumentDriver
+
+
+class SlowDriver(InstrumentDriver):
+    """
+    InstrumentDriver whose execute_resource stands in for slow instrument
+    I/O.
+    """
+
+    def execute_resource(self, delay=1.0):
+        """
+        @param delay Seconds to take
+        """
+        time.sleep(delay)
+        return 'execute_resource'
@@ -20,6 +20,11 @@ from ooi.logging import log
 
 from mi.core.exceptions import SampleException
 from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import BinaryChunker
+from mi.core.instrument.chunker import SieveAdapter
+from mi.core.instrument.chunker import TaggedSieve
+from mi.core.instrument.chunker import resumable_sieve
+from mi.core.instrument.chunker import is_resumable_sieve
 
 @attr('UNIT', group='mi')
 class UnitTestStringChunker(MiUnitTestCase):
@@ -42,14 +47,15 @@ class UnitTestStringChunker(MiUnitTestCase):
     TIMESTAMP_1 = 3569168821.102485
     TIMESTAMP_2 = 3569168822.202485
     TIMESTAMP_3 = 3569168823.302485
+
+    PATTERN = r'SATPAR(?P<sernum>\d{4}),(?P<timer>\d{1,7}.\d\d),(?P<counts>\d{10}),(?P<checksum>\d{1,3})'
     
     @staticmethod
     def sieve_function(raw_data):
         """ The method that splits samples
         """
         return_list = []
-        pattern = r'SATPAR(?P<sernum>\d{4}),(?P<timer>\d{1,7}.\d\d),(?P<counts>\d{10}),(?P<checksum>\d{1,3})'
-        regex = re.compile(pattern)
+        regex = re.compile(UnitTestStringChunker.PATTERN)
         
         for match in regex.finditer(raw_data):
             return_list.append((match.start(), match.end()))        
@@ -99,6 +105,148 @@ class UnitTestStringChunker(MiUnitTestCase):
         self.assertEquals([(0,31), (33, 64)],
                           self._chunker.regex_sieve_function(self.MULTI_SAMPLE_1, [regex]))
 
+
+    def test_resumable_regex_sieve(self):
+        """
+        Run the regex sieve with a start index and check where it says the
+        next scan can resume from.
+        """
+        regex = re.compile(self.PATTERN)
+        self.assertTrue(is_resumable_sieve(StringChunker.regex_sieve_function))
+
+        data = self.MULTI_SAMPLE_1 + "\r\n" + self.FRAGMENT_1
+        (result, resume) = StringChunker.regex_sieve_function(data, [regex],
+                                                              start_index=0)
+        self.assertEquals(result, [(0,31), (33, 64)])
+        # the longest possible match could still start after here
+        self.assertEquals(resume, len(data) - 36 + 1)
+
+        (result, resume) = StringChunker.regex_sieve_function(data, [regex],
+                                                              start_index=33)
+        self.assertEquals(result, [(33, 64)])
+
+        # unbounded patterns can't be resumed past the start index
+        regex = re.compile(r'SATPAR.*?\r\n')
+        (result, resume) = StringChunker.regex_sieve_function(data, [regex],
+                                                              start_index=5)
+        self.assertEquals(resume, 5)
+
+    def test_sieve_adapter(self):
+        """
+        Plain sieves get wrapped so the chunker can treat every sieve the same
+        """
+        self.assertFalse(is_resumable_sieve(UnitTestStringChunker.sieve_function))
+        self.assertIsInstance(self._chunker.sieve, SieveAdapter)
+        self.assertEquals(self._chunker.sieve(self.SAMPLE_1), [(0,31)])
+        self.assertEquals(self._chunker.sieve(self.SAMPLE_1, start_index=0),
+                          ([(0,31)], 0))
+
+    def test_resumable_sieve_scan_cost(self):
+        """
+        Feed a long run of non-data through a resumable sieve and verify each
+        packet is only scanned, and only copied out for the sieve, from near
+        where the last scan left off instead of from the start of the buffer.
+        """
+        regex = re.compile(self.PATTERN)
+        scanned = []
+
+        @resumable_sieve
+        def counting_sieve(raw_data, start_index=None):
+            scanned.append(len(raw_data))
+            return StringChunker.regex_sieve_function(raw_data, [regex],
+                                                      start_index)
+
+        self._chunker = StringChunker(counting_sieve)
+        for index in range(1000):
+            self._chunker.add_chunk("S>DS\r\n", self.TIMESTAMP_1)
+            self.assertEquals(self._chunker.get_next_data(), (None, None))
+
+        self.assertTrue(max(scanned) <= 36 + len("S>DS\r\n"))
+
+        self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_2)
+        self._chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_3)
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_2, self.FRAGMENT_SAMPLE))
+
+
+    def test_tagged_sieve(self):
+        """
+        Scan for several kinds of record in one pass and check each one comes
+        back tagged with the pattern that found it.
+        """
+        sieve = TaggedSieve([('par', re.compile(self.PATTERN)),
+                             ('prompt', re.compile(r'S>')),
+                             ('digits', re.compile(r'\d{3}'))])
+
+        data = "%s\r\nS>123%s" % (self.SAMPLE_1, self.SAMPLE_2)
+        self.assertEquals(sieve(data), [(0, 31, 'par'),
+                                        (33, 35, 'prompt'),
+                                        (35, 38, 'digits'),
+                                        (38, 69, 'par')])
+
+        # the first pattern registered wins, the second doesn't overlap it
+        sieve = TaggedSieve([('sample', re.compile(r'SATPAR\d{4}')),
+                             ('short', re.compile(r'SATPAR'))])
+        self.assertEquals(sieve("SATPAR0229 SATPAR"),
+                          [(0, 10, 'sample'), (11, 17, 'short')])
+
+        # a pattern with no fixed first character still gets found
+        sieve = TaggedSieve([('par', re.compile(self.PATTERN)),
+                             ('any', re.compile(r'.?Bar'))])
+        self.assertEquals(sorted(sieve("Bar" + self.SAMPLE_1)),
+                          [(0, 3, 'any'), (3, 34, 'par')])
+
+        # and doesn't overlap the other blocks, whichever comes first
+        sieve = TaggedSieve([('par', re.compile(self.PATTERN)),
+                             ('any', re.compile(r'.?\d{3}'))])
+        self.assertEquals(sieve("x12" + self.SAMPLE_1 + "x123"),
+                          [(3, 34, 'par'), (34, 38, 'any')])
+        sieve = TaggedSieve([('id', re.compile(r'S?ATPAR\d{4}')),
+                             ('par', re.compile(self.PATTERN))])
+        self.assertEquals(sieve(self.SAMPLE_1), [(0, 10, 'id')])
+        sieve = TaggedSieve([('par', re.compile(self.PATTERN)),
+                             ('id', re.compile(r'S?ATPAR\d{4}'))])
+        self.assertEquals(sieve(self.SAMPLE_1), [(0, 31, 'par')])
+        self.assertEquals(TaggedSieve([('empty', re.compile(r'x*'))])("ab"), [])
+
+    def test_tagged_sieve_sync_prefix(self):
+        """
+        Frame binary records from a sync prefix and a length byte
+        """
+        def framer(raw_data, start):
+            return start + 3 + ord(raw_data[start + 2])
+
+        sieve = TaggedSieve([('rec', '\x7f\x7f', framer)])
+        data = "xx\x7f\x7f\x02abyy\x7f\x7f\x05abc"
+        (result, resume) = sieve.scan(data)
+        self.assertEquals(result, [(2, 7, 'rec')])
+        # the last record isn't all here yet
+        self.assertEquals(resume, 9)
+
+    def test_tagged_chunks(self):
+        """
+        The chunker hangs on to the tag of each data block
+        """
+        sieve = TaggedSieve([('par', re.compile(self.PATTERN)),
+                             ('prompt', re.compile(r'S>'))])
+        self._chunker = StringChunker(sieve)
+        self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.FRAGMENT_2 + "S>", self.TIMESTAMP_2)
+
+        self.assertEquals(self._chunker.get_next_data_with_tag(clean=False),
+                          (self.TIMESTAMP_1, self.FRAGMENT_SAMPLE, 'par'))
+        self.assertEquals(self._chunker.get_next_data_with_tag(),
+                          (self.TIMESTAMP_1, self.FRAGMENT_SAMPLE, 'par'))
+        self.assertEquals(self._chunker.get_next_data_with_tag(),
+                          (self.TIMESTAMP_2, "S>", 'prompt'))
+        self.assertEquals(self._chunker.get_next_data_with_tag(),
+                          (None, None, None))
+
+        # untagged sieves give no tag
+        self._chunker = StringChunker(UnitTestStringChunker.sieve_function)
+        self._chunker.add_chunk(self.SAMPLE_1, self.TIMESTAMP_1)
+        self.assertEquals(self._chunker.get_next_data_with_tag(),
+                          (self.TIMESTAMP_1, self.SAMPLE_1, None))
         
     def test_generate_data_lists(self):
         sample_string = "Foo%sBar%sBat" % (self.SAMPLE_1, self.SAMPLE_2)
@@ -331,52 +479,113 @@ class UnitTestStringChunker(MiUnitTestCase):
         self.assertRaises(SampleException,
                           self._chunker.add_chunk, "foobar", self.TIMESTAMP_1)
 
-@unittest.skip("Write this when a binary chunker is needed")
 @attr('UNIT', group='mi')
 class UnitTestBinaryChunker(MiUnitTestCase):
     """
     Test the basic functionality of the chunker system via unit tests
     """
-    SAMPLE_1 = []
-    SAMPLE_2 = []
-    SAMPLE_3 = []
-    
-    FRAGMENT_1 = []
-    FRAGMENT_2 = []
-    
-    MULTI_SAMPLE_1 = []
-    
+    # Sync word, length byte, then payload
+    SAMPLE_1 = bytearray([0x7f, 0x7f, 0x03, 0x01, 0x02, 0x03])
+    SAMPLE_2 = bytearray([0x7f, 0x7f, 0x02, 0x0a, 0x0b])
+    SAMPLE_3 = bytearray([0x7f, 0x7f, 0x01, 0xff])
+
+    FRAGMENT_1 = SAMPLE_1[:4]
+    FRAGMENT_2 = SAMPLE_1[4:]
+
+    MULTI_SAMPLE_1 = SAMPLE_1 + SAMPLE_2
+
+    TIMESTAMP_1 = 3569168821.102485
+    TIMESTAMP_2 = 3569168822.202485
+    TIMESTAMP_3 = 3569168823.302485
+
+    @staticmethod
+    def sieve_function(raw_data):
+        """ Find complete sync word delimited records """
+        return_list = []
+        index = 0
+        while index + 3 <= len(raw_data):
+            if raw_data[index] == 0x7f and raw_data[index+1] == 0x7f:
+                end = index + 3 + raw_data[index+2]
+                if end > len(raw_data):
+                    break
+                return_list.append((index, end))
+                index = end
+            else:
+                index += 1
+        return return_list
+
+    def setUp(self):
+        """ Setup a chunker for use in tests """
+        self._chunker = BinaryChunker(UnitTestBinaryChunker.sieve_function)
+
     def test_add_get_simple(self):
         """
         Add a simple string of data to the buffer, get the next chunk out
         """
-        pass
+        self._chunker.add_chunk(self.SAMPLE_1, self.TIMESTAMP_1)
+        (time, result) = self._chunker.get_next_data()
+        self.assertEquals(time, self.TIMESTAMP_1)
+        self.assertEquals(result, self.SAMPLE_1)
+        self.assertIsInstance(result, bytearray)
+
+        (time, result) = self._chunker.get_next_data()
+        self.assertEquals(time, None)
+        self.assertEquals(result, None)
     
     def test_add_get_many_simple(self):
         """
         Add a few simple strings of data to the buffer, get the chunks out
         """
-        # Add a sample,
-        # Add a sample
-        # Add another sample
-        # get some samples out,
-        # assert they were correct and in the right order
-        pass
+        self._chunker.add_chunk(self.SAMPLE_1, self.TIMESTAMP_1)
+        self._chunker.add_chunk(self.SAMPLE_2, self.TIMESTAMP_2)
+        self._chunker.add_chunk(self.SAMPLE_3, self.TIMESTAMP_3)
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_1, self.SAMPLE_1))
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_2, self.SAMPLE_2))
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_3, self.SAMPLE_3))
+        self.assertEquals(self._chunker.get_next_data(), (None, None))
     
     def test_add_get_fragment(self):
         """
         Add some fragments of a string, then verify that value is stitched together
         """
-        # Add a part of a sample
-        # confirm you cant get anything out
-        # add the rest of the sample
-        # confirm that the rest comes out
-        pass
+        self._chunker.add_chunk(self.FRAGMENT_1, self.TIMESTAMP_1)
+        self.assertEquals(self._chunker.get_next_data(), (None, None))
+        self.assertEquals(len(self._chunker.nondata_chunk_list), 1)
+
+        self._chunker.add_chunk(self.FRAGMENT_2, self.TIMESTAMP_2)
+        self.assertEquals(len(self._chunker.nondata_chunk_list), 0)
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_1, self.SAMPLE_1))
     
     def test_add_multiple_in_one(self):
         """
         Test multiple data bits input in a single sample. They will ultimately
         need to be split apart.
         """
-        pass
-    
+        self._chunker.add_chunk(self.MULTI_SAMPLE_1, self.TIMESTAMP_1)
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_1, self.SAMPLE_1))
+        self.assertEquals(self._chunker.get_next_data(),
+                          (self.TIMESTAMP_1, self.SAMPLE_2))
+        self.assertEquals(self._chunker.get_next_data(), (None, None))
+
+    def test_large_backlog(self):
+        """
+        Drain a backlog big enough to force the storage buffer to compact
+        part way through and make sure indices stay consistent.
+        """
+        count = 40000
+        data = self.SAMPLE_1 * count
+        for index in range(0, len(data), 1000):
+            self._chunker.add_chunk(data[index:index+1000], self.TIMESTAMP_1)
+
+        for index in range(count):
+            (time, result, start, end) = self._chunker.get_next_data_with_index()
+            self.assertEquals(result, self.SAMPLE_1)
+            self.assertEquals((start, end), (0, len(self.SAMPLE_1)))
+
+        self.assertEquals(self._chunker.get_next_data(), (None, None))
+        self.assertEquals(len(self._chunker.buffer), 0)
@@ -24,6 +24,7 @@ from mi.core.exceptions import SampleException, ReadOnlyException, NotImplemente
 from mi.core.instrument.data_particle import DataParticle, DataParticleKey, DataParticleValue
 from mi.core.instrument.data_particle import RawDataParticle, CommonDataParticleType
 from mi.core.instrument.port_agent_client import PortAgentPacket
+from mi.core.ntp_time import Epoch
 
 TEST_PARTICLE_VERSION = 1
 TEST_PARTICLE_TYPE = 'test_particle_foo'
@@ -55,6 +56,32 @@ class TestUnitDataParticle(MiUnitTestCase):
                        DataParticleKey.VALUE: "305.16"}]
             return result
 
+    class CountingDataParticle(TestDataParticle):
+        """
+        Test particle that counts how often its values are parsed
+        """
+        parse_count = 0
+
+        def _build_parsed_values(self):
+            self.parse_count += 1
+            return super(TestUnitDataParticle.CountingDataParticle, self)._build_parsed_values()
+
+    class RecordDataParticle(DataParticle):
+        """
+        Stands in for an instrument particle in the benchmark: a record of
+        comma separated scalars followed by ';' separated arrays of ints
+        """
+        _data_particle_type = TEST_PARTICLE_TYPE
+
+        def _build_parsed_values(self):
+            fields = self.raw_data.split(';')
+            result = [self._encode_value('value_%d' % i, value, float)
+                      for (i, value) in enumerate(fields[0].split(','))]
+            for (i, array) in enumerate(fields[1:]):
+                result.append(self._encode_value('array_%d' % i, array.split(','),
+                                                 lambda values: [int(v) for v in values]))
+            return result
+
     class BadDataParticle(DataParticle):
          """
          Define a data particle that doesn't initialize _data_particle_type.
@@ -247,6 +274,23 @@ class TestUnitDataParticle(MiUnitTestCase):
 
         self.assertRaises(InstrumentParameterException, test_particle.set_internal_timestamp)
 
+    def test_create_batch(self):
+        """
+        Test building particles for a batch of records
+        """
+        particles = self.TestDataParticle.create_batch(['a', 'b'], [0, 1.5], Epoch.SBE,
+                                                       preferred_timestamp=DataParticleKey.INTERNAL_TIMESTAMP)
+        self.assertEqual([p.raw_data for p in particles], ['a', 'b'])
+        self.assertEqual([p.get_value(DataParticleKey.INTERNAL_TIMESTAMP) for p in particles],
+                         [3155673600.0, 3155673601.5])
+        self.assertEqual(particles[1].get_value(DataParticleKey.PREFERRED_TIMESTAMP),
+                         DataParticleKey.INTERNAL_TIMESTAMP)
+
+        now = time.time()
+        particle = self.TestDataParticle.create_batch(['a'], [now])[0]
+        self.assertEqual(particle.get_value(DataParticleKey.INTERNAL_TIMESTAMP), ntplib.system_to_ntp_time(now))
+        self.assertRaises(SampleException, self.TestDataParticle.create_batch, ['a', 'b'], [now])
+
     def test_get_set_value(self):
         """
         Test setting values after creation
@@ -283,3 +327,53 @@ class TestUnitDataParticle(MiUnitTestCase):
 
         with self.assertRaises(NotImplementedException):
             particle.data_particle_type()
+
+    def test_generate_cached(self):
+        """
+        Values are parsed and serialized once, until the internal timestamp
+        changes
+        """
+        particle = self.CountingDataParticle(self.sample_raw_data,
+                                             port_timestamp=self.sample_port_timestamp)
+        first = particle.generate()
+        self.assertIs(particle.generate(), first)
+        self.assertEqual(json.loads(first), particle.generate_dict())
+        self.assertIsNot(particle.generate_dict(), particle.generate_dict())
+        self.assertEqual(particle.generate(sorted=True), json.dumps(json.loads(first), sort_keys=True))
+        self.assertEqual(particle.parse_count, 1)
+
+        particle.set_internal_timestamp(self.sample_internal_timestamp)
+        second = particle.generate()
+        self.assertEqual(json.loads(second)[DataParticleKey.INTERNAL_TIMESTAMP], self.sample_internal_timestamp)
+        self.assertEqual(particle.parse_count, 2)
+
+        particle.set_value(DataParticleKey.INTERNAL_TIMESTAMP, self.sample_internal_timestamp + 1)
+        self.assertIsNot(particle.generate(), second)
+        self.assertEqual(particle.parse_count, 3)
+
+        # a raw particle is created for every port agent packet, it is
+        # fully slotted
+        self.assertFalse(hasattr(self.raw_test_particle, '__dict__'))
+
+    def test_generate_rate(self):
+        """
+        Benchmark building and generating particles the size of a CTD
+        sample (10 values) and of an absorption spectrum (4 arrays of 80
+        values). Each particle is generated the way a sample is handled:
+        once to check for encoding errors, then as a dict and as JSON to
+        publish.
+        """
+        scalars = ','.join('%d.%04d' % (i, i * 37) for i in range(10))
+        arrays = ';'.join(','.join(str(i * 80 + j) for j in range(80)) for i in range(4))
+        for (name, raw_data, count) in [('10 value', scalars, 5000),
+                                        ('array', scalars + ';' + arrays, 500)]:
+            start = time.time()
+            for i in xrange(count):
+                particle = self.RecordDataParticle(raw_data, port_timestamp=self.sample_port_timestamp)
+                particle.generate()
+                self.assertEqual(particle.get_encoding_errors(), [])
+                particle.generate_dict()
+                particle.generate()
+            elapsed = time.time() - start
+            log.info("Generated %d %s particles in %.3fs: %d particles/s",
+                     count, name, elapsed, count / elapsed)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_driver_launcher
+@file mi/core/instrument/test/test_driver_launcher.py
+@brief Test cases for the driver process fork server
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import time
+import logging
+
+import zmq
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+
+from mi.core.exceptions import InstrumentException
+from mi.core.instrument.zmq_driver_process import ZmqDriverProcess
+from mi.core.instrument.driver_launcher import DriverLauncher
+
+mi_logger = logging.getLogger('mi_logger')
+
+DRIVER_MODULE = 'mi.core.instrument.instrument_driver'
+DRIVER_CLASS = 'InstrumentDriver'
+
+
+@attr('UNIT', group='mi')
+class TestUnitDriverLauncher(MiUnitTest):
+
+    def setUp(self):
+        self.launcher = DriverLauncher()
+        self.launcher.start()
+        self.addCleanup(self.launcher.stop)
+        self.context = zmq.Context()
+        self.addCleanup(self.context.term)
+
+    def _ping(self, cmd_port):
+        sock = self.context.socket(zmq.REQ)
+        sock.connect('tcp://localhost:%i' % cmd_port)
+        try:
+            sock.send_pyobj({'cmd': 'driver_ping', 'args': ('ping',), 'kwargs': {}})
+            self.assertTrue(sock.poll(30000), 'no reply to driver_ping')
+            self.assertEqual(sock.recv_pyobj(), 'driver_ping: ping')
+            sock.send_pyobj({'cmd': 'stop_driver_process', 'args': (), 'kwargs': {}})
+            self.assertTrue(sock.poll(30000), 'no reply to stop_driver_process')
+            sock.recv_pyobj()
+        finally:
+            sock.close(linger=0)
+
+    def _time_to_first_ping(self, launch, count):
+        """
+        Launch count drivers, ping each one and stop them.
+        @retval Seconds from the first launch to the last ping
+        """
+        start = time.time()
+        launched = [launch(DRIVER_MODULE, DRIVER_CLASS, ppid=os.getpid()) for i in range(count)]
+        for (process, cmd_port, evt_port) in launched:
+            self._ping(cmd_port)
+        elapsed = time.time() - start
+        for (process, cmd_port, evt_port) in launched:
+            process.wait()
+        return elapsed
+
+    def test_launch(self):
+        (process, cmd_port, evt_port) = ZmqDriverProcess.launch_process(DRIVER_MODULE, DRIVER_CLASS,
+                                                                        ppid=os.getpid(),
+                                                                        launcher=self.launcher)
+        self.assertNotEqual(cmd_port, evt_port)
+        self.assertIsNone(process.poll())
+        self._ping(cmd_port)
+        self.assertEqual(process.wait(30), 0)
+
+    def test_launch_failure(self):
+        self.assertRaises(InstrumentException, self.launcher.launch_process,
+                          'mi.no_such_module', DRIVER_CLASS, timeout=10)
+
+    def test_time_to_first_ping(self):
+        """
+        Time to bring up 50 drivers and ping each one, launched as new
+        interpreters and forked by the launcher.
+        """
+        count = 50
+        spawned = self._time_to_first_ping(ZmqDriverProcess.launch_process, count)
+        forked = self._time_to_first_ping(self.launcher.launch_process, count)
+        mi_logger.info("Time to first ping for %d drivers: %.2fs spawned, %.2fs forked",
+                       count, spawned, forked)
+        self.assertLess(forked, spawned)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_event_queue
+@file mi/core/instrument/test/test_event_queue.py
+@brief Test cases for the bounded driver process event queue
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+
+from mi.core.exceptions import InstrumentParameterException
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.event_queue import EventQueue, EventQueuePolicy, is_raw
+
+
+def sample(stream, i):
+    return {'type': DriverAsyncEvent.SAMPLE,
+            'value': '{"stream_name": "%s", "values": [%d]}' % (stream, i),
+            'time': time.time()}
+
+def drain(queue):
+    events = []
+    while queue:
+        events.append(queue.popleft())
+    return events
+
+
+@attr('UNIT', group='mi')
+class TestUnitEventQueue(MiUnitTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_is_raw(self):
+        self.assertTrue(is_raw(sample('raw', 0)))
+        self.assertFalse(is_raw(sample('ctdpf_parsed', 0)))
+        self.assertTrue(is_raw({'type': DriverAsyncEvent.SAMPLE_BATCH, 'stream_name': 'raw', 'value': []}))
+        self.assertFalse(is_raw({'type': DriverAsyncEvent.STATE_CHANGE, 'value': 'raw'}))
+        self.assertFalse(is_raw('event'))
+
+    def test_drop_raw(self):
+        queue = EventQueue(max_events=10)
+        for i in range(10):
+            queue.append(sample('raw' if i % 2 else 'parsed', i))
+        for i in range(10, 14):
+            queue.append(sample('parsed', i))
+
+        # the four oldest raw particles went first
+        events = drain(queue)
+        self.assertEqual([e['value'] for e in events],
+                         [sample('parsed', i)['value'] for i in (0, 2, 4, 6, 8)] +
+                         [sample('raw', 9)['value']] +
+                         [sample('parsed', i)['value'] for i in (10, 11, 12, 13)])
+        self.assertEqual(queue.metrics()['dropped_raw'], 4)
+
+        # with no raw particles left the oldest event goes
+        for i in range(12):
+            queue.append(i)
+        self.assertEqual(drain(queue), range(2, 12))
+        metrics = queue.metrics()
+        self.assertEqual(metrics['dropped'], 6)
+        self.assertEqual(metrics['max_depth'], 10)
+        self.assertEqual(metrics['depth'], 0)
+
+    def test_spill(self):
+        queue = EventQueue(max_events=10, policy=EventQueuePolicy.SPILL, spill_dir=self.directory)
+        for i in range(25):
+            queue.append(i)
+        self.assertEqual(len(queue), 25)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+        metrics = queue.metrics()
+        self.assertEqual(metrics['spilled_events'], 15)
+        self.assertEqual(metrics['spill_pending'], 15)
+        self.assertGreater(metrics['spilled_bytes'], 0)
+
+        # events keep their order while the spill is read back
+        events = [queue.popleft() for i in range(12)]
+        for i in range(25, 30):
+            queue.append(i)
+        events += drain(queue)
+        self.assertEqual(events, range(30))
+        self.assertEqual(queue.metrics()['dropped'], 0)
+
+        queue.close()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_block(self):
+        queue = EventQueue(max_events=5, policy=EventQueuePolicy.BLOCK)
+        events = []
+
+        def consume():
+            while len(events) < 20:
+                time.sleep(.005)
+                if queue:
+                    events.append(queue.popleft())
+        consumer = threading.Thread(target=consume)
+        consumer.start()
+        for i in range(20):
+            queue.append(i)
+        consumer.join(5)
+
+        self.assertEqual(events, range(20))
+        self.assertEqual(queue.metrics()['dropped'], 0)
+        self.assertGreater(queue.metrics()['blocked_time'], 0)
+
+        # without a consumer the producer gives up after the timeout
+        queue.configure(block_timeout=.05)
+        for i in range(6):
+            queue.append(i)
+        self.assertEqual(drain(queue), range(1, 6))
+        self.assertEqual(queue.metrics()['dropped'], 1)
+
+    def test_configure(self):
+        queue = EventQueue()
+        self.assertRaises(InstrumentParameterException, queue.configure, policy='explode')
+        self.assertRaises(InstrumentParameterException, queue.configure, max_events=0)
+        queue.configure(max_events=3, policy=EventQueuePolicy.DROP_RAW)
+        for i in range(4):
+            queue.append(i)
+        self.assertEqual(drain(queue), [1, 2, 3])
@@ -28,6 +28,8 @@ from mi.core.instrument.instrument_driver import DriverEvent
 from mi.core.instrument.instrument_driver import SingleConnectionInstrumentDriver
 from mi.core.instrument.instrument_driver import DriverParameter
 from mi.core.instrument.instrument_driver import ConfigMetadataKey
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.instrument_driver import event_samples
 from mi.core.instrument.instrument_protocol import InstrumentProtocol
 from mi.core.instrument.driver_dict import DriverDictKey
 
@@ -241,6 +243,64 @@ class TestUnitInstrumentDriver(MiUnitTestCase):
 
     ##### Integration tests for startup config in the SBE37 integration suite
 
+    def _sample(self, stream, i):
+        return json.dumps({'stream_name': stream, 'values': [{'value_id': 'i', 'value': i}]})
 
+    def test_sample_batching(self):
+        """
+        Samples are batched per stream and sent when a batch is full, when
+        another event is sent and when the latency limit passes
+        """
+        events = []
+        driver = SingleConnectionInstrumentDriver(events.append)
+        driver.set_sample_batching(max_count=3, max_latency=.2)
+        self.addCleanup(driver.set_sample_batching, max_count=0)
+        del events[:]
+
+        for i in range(4):
+            driver._driver_event(DriverAsyncEvent.SAMPLE, self._sample('ctd', i))
+        driver._driver_event(DriverAsyncEvent.SAMPLE, self._sample('raw', 0))
+
+        # a full batch goes at once
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['type'], DriverAsyncEvent.SAMPLE_BATCH)
+        self.assertEqual(events[0]['stream_name'], 'ctd')
+        self.assertEqual(event_samples(events[0]), [self._sample('ctd', i) for i in range(3)])
+
+        # other events flush the pending batches first
+        driver._driver_event(DriverAsyncEvent.ERROR, 'error')
+        self.assertEqual([(e['type'], e.get('stream_name')) for e in events[1:]],
+                         [(DriverAsyncEvent.SAMPLE_BATCH, 'ctd'),
+                          (DriverAsyncEvent.SAMPLE_BATCH, 'raw'),
+                          (DriverAsyncEvent.ERROR, None)])
+        self.assertEqual(event_samples(events[1]), [self._sample('ctd', 3)])
+        self.assertEqual(event_samples(events[3]), [])
 
+        # a lone sample waits out the latency limit
+        driver._driver_event(DriverAsyncEvent.SAMPLE, self._sample('ctd', 4))
+        self.assertEqual(len(events), 4)
+        time.sleep(.4)
+        self.assertEqual(len(events), 5)
+        self.assertEqual(event_samples(events[4]), [self._sample('ctd', 4)])
+
+        # and back to single sample events
+        driver.set_sample_batching(max_count=1)
+        driver._driver_event(DriverAsyncEvent.SAMPLE, self._sample('ctd', 5))
+        self.assertEqual(events[5]['type'], DriverAsyncEvent.SAMPLE)
+        self.assertEqual(event_samples(events[5]), [self._sample('ctd', 5)])
+
+    def test_sample_batch_bytes(self):
+        """
+        A batch is sent once it holds max_bytes of samples
+        """
+        events = []
+        driver = SingleConnectionInstrumentDriver(events.append)
+        sample = self._sample('adcp', 'x' * 100)
+        driver.set_sample_batching(max_bytes=len(sample) * 2)
+        del events[:]
 
+        for i in range(5):
+            driver._driver_event(DriverAsyncEvent.SAMPLE, sample)
+        self.assertEqual([len(event_samples(e)) for e in events], [2, 2])
+        driver.set_sample_batching(max_count=0)
+        self.assertEqual([len(event_samples(e)) for e in events], [2, 2, 1])
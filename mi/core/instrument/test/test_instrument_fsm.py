@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_instrument_fsm
+@file mi/core/instrument/test/test_instrument_fsm.py
+@brief Test cases for the instrument state machines and their locking
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import threading
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+from mi.core.log import get_logger ; log = get_logger()
+
+from mi.core.common import BaseEnum
+from mi.core.exceptions import InstrumentStateException
+from mi.core.instrument.instrument_fsm import InstrumentFSM, ThreadSafeFSM, ReadWriteLock
+
+
+class State(BaseEnum):
+    COMMAND = 'STATE_COMMAND'
+    AUTOSAMPLE = 'STATE_AUTOSAMPLE'
+
+class Event(BaseEnum):
+    ENTER = 'EVENT_ENTER'
+    EXIT = 'EVENT_EXIT'
+    GET = 'EVENT_GET'
+    SAMPLE = 'EVENT_SAMPLE'
+    START = 'EVENT_START'
+    STOP = 'EVENT_STOP'
+
+
+class AutosampleProtocol(object):
+    """
+    Just enough of a protocol to run an autosample session: samples are
+    handled as state changing events, GET reads the last one.
+    """
+
+    def __init__(self, get_read_only):
+        self.samples = 0
+        self.fsm = ThreadSafeFSM(State, Event, Event.ENTER, Event.EXIT)
+        self.fsm.add_handler(State.COMMAND, Event.START, self._handler_start)
+        self.fsm.add_handler(State.AUTOSAMPLE, Event.STOP, self._handler_stop)
+        self.fsm.add_handler(State.AUTOSAMPLE, Event.SAMPLE, self._handler_sample)
+        for state in State.list():
+            self.fsm.add_handler(state, Event.GET, self._handler_get, read_only=get_read_only)
+        self.fsm.start(State.COMMAND)
+
+    def _handler_start(self):
+        return (State.AUTOSAMPLE, None)
+
+    def _handler_stop(self):
+        return (State.COMMAND, None)
+
+    def _handler_sample(self):
+        time.sleep(.001)
+        self.samples += 1
+        return (None, None)
+
+    def _handler_get(self):
+        # stands in for looking up and formatting parameters
+        time.sleep(.002)
+        return (None, self.samples)
+
+
+@attr('UNIT', group='mi')
+class TestUnitInstrumentFSM(MiUnitTest):
+
+    def test_read_write_lock(self):
+        lock = ReadWriteLock()
+        events = []
+
+        def hold(acquire, release, name):
+            acquire()
+            events.append(name + ' in')
+            time.sleep(.05)
+            events.append(name + ' out')
+            release()
+
+        # readers share the lock, the writer waits for both
+        threads = [threading.Thread(target=hold, args=(lock.acquire_read, lock.release_read, 'r1')),
+                   threading.Thread(target=hold, args=(lock.acquire_read, lock.release_read, 'r2'))]
+        for thread in threads:
+            thread.start()
+        time.sleep(.01)
+        hold(lock.acquire_write, lock.release_write, 'w')
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(events[:2]), ['r1 in', 'r2 in'])
+        self.assertEqual(events[-2:], ['w in', 'w out'])
+
+        # the writer can reenter and read, a reader can't upgrade
+        lock.acquire_write()
+        lock.acquire_write()
+        lock.acquire_read()
+        lock.release_read()
+        lock.release_write()
+        lock.release_write()
+        lock.acquire_read()
+        self.assertRaises(InstrumentStateException, lock.acquire_write)
+        lock.release_read()
+        lock.acquire_write()
+        lock.release_write()
+
+    def test_read_only_handlers(self):
+        protocol = AutosampleProtocol(get_read_only=True)
+        fsm = protocol.fsm
+        self.assertTrue(fsm.is_read_only(Event.GET))
+        self.assertFalse(fsm.is_read_only(Event.START))
+        self.assertEqual(fsm.on_event(Event.GET), 0)
+        fsm.on_event(Event.START)
+        fsm.on_event(Event.SAMPLE)
+        self.assertEqual(fsm.on_event(Event.GET), 1)
+
+        # read only handlers can't change state or fire other events
+        fsm.add_handler(State.AUTOSAMPLE, Event.STOP, lambda : (State.COMMAND, None), read_only=True)
+        self.assertRaises(InstrumentStateException, fsm.on_event, Event.STOP)
+        self.assertEqual(fsm.get_current_state(), State.AUTOSAMPLE)
+        fsm.add_handler(State.AUTOSAMPLE, Event.STOP, lambda : (None, fsm.on_event(Event.SAMPLE)), read_only=True)
+        self.assertRaises(InstrumentStateException, fsm.on_event, Event.STOP)
+
+        # decided per event
+        fsm.add_handler(State.AUTOSAMPLE, Event.STOP, protocol._handler_stop, read_only=lambda *args : bool(args))
+        self.assertTrue(fsm.is_read_only(Event.STOP, 'x'))
+        self.assertFalse(fsm.is_read_only(Event.STOP))
+        fsm.on_event(Event.STOP)
+        self.assertEqual(fsm.get_current_state(), State.COMMAND)
+
+        self.assertRaises(InstrumentStateException, fsm.on_event, Event.SAMPLE)
+        self.assertRaises(InstrumentStateException, fsm.on_event, 'EVENT_BOGUS')
+        self.assertFalse(fsm.add_handler(State.COMMAND, 'EVENT_BOGUS', protocol._handler_get))
+        self.assertFalse(fsm.start('STATE_BOGUS'))
+
+    def test_event_overhead(self):
+        count = 20000
+        for fsm_class in (InstrumentFSM, ThreadSafeFSM):
+            fsm = fsm_class(State, Event, Event.ENTER, Event.EXIT)
+            fsm.add_handler(State.COMMAND, Event.GET, lambda : (None, None))
+            fsm.start(State.COMMAND)
+            start = time.time()
+            for i in xrange(count):
+                fsm.on_event(Event.GET)
+            log.info("%s: %.2f us per event", fsm_class.__name__, (time.time() - start) * 1e6 / count)
+
+    def test_contention(self):
+        """
+        Clients polling GET while an autosample session streams samples
+        through the FSM, with GET serialized and with it read only.
+        """
+        clients = 8
+        gets = 25
+        elapsed = []
+
+        for get_read_only in (False, True):
+            protocol = AutosampleProtocol(get_read_only)
+            protocol.fsm.on_event(Event.START)
+            running = [True]
+            latencies = []
+
+            def autosample():
+                while running[0]:
+                    protocol.fsm.on_event(Event.SAMPLE)
+                    time.sleep(.005)
+
+            def client():
+                for i in range(gets):
+                    start = time.time()
+                    protocol.fsm.on_event(Event.GET)
+                    latencies.append(time.time() - start)
+
+            sampler = threading.Thread(target=autosample)
+            sampler.start()
+            threads = [threading.Thread(target=client) for i in range(clients)]
+            start = time.time()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed.append(time.time() - start)
+            running[0] = False
+            sampler.join()
+            protocol.fsm.on_event(Event.STOP)
+
+            self.assertEqual(len(latencies), clients * gets)
+            self.assertGreater(protocol.samples, 0)
+            log.info("GET %s: %d GETs in %.3fs, mean latency %.1f ms, max %.1f ms, %d samples",
+                     'read only' if get_read_only else 'serialized', len(latencies), elapsed[-1],
+                     sum(latencies) * 1000 / len(latencies), max(latencies) * 1000, protocol.samples)
+
+        self.assertLess(elapsed[1], elapsed[0] / 2)
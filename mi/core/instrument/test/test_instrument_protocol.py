@@ -11,6 +11,7 @@ __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
 import re
+import json
 import time
 import ntplib
 import datetime
@@ -19,6 +20,10 @@ from nose.plugins.attrib import attr
 from mi.core.log import get_logger ; log = get_logger()
 from mi.core.instrument.instrument_fsm import ThreadSafeFSM
 from mi.core.instrument.instrument_driver import DriverParameter
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.instrument_driver import DriverProtocolState
+from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import TaggedSieve
 from mi.core.instrument.instrument_protocol import InstrumentProtocol
 from mi.core.instrument.instrument_protocol import MenuInstrumentProtocol
 from mi.core.instrument.instrument_protocol import CommandResponseInstrumentProtocol
@@ -36,6 +41,7 @@ from mi.core.driver_scheduler import TriggerType
 
 from mi.core.unit_test import MiUnitTestCase
 import unittest
+from threading import Thread
 from mi.core.exceptions import InstrumentTimeoutException
 from mi.core.exceptions import InstrumentProtocolException
 from mi.core.exceptions import InstrumentParameterException
@@ -114,6 +120,44 @@ class TestUnitInstrumentProtocol(MiUnitTestCase):
         # Test the format of the result in the individual driver tests. Here,
         # just tests that the result is there.
 
+    def test_chunk_dispatch(self):
+        """
+        Verify tagged chunks are published through the dispatch table and
+        untagged chunks still go to _got_chunk
+        """
+        sample_line = "SATPAR0229,10.01,2206748544,234\r\n"
+        samples = []
+        events = []
+
+        def callback(event, value=None):
+            events.append((event, value))
+
+        self.protocol = CommandResponseInstrumentProtocol([], '\r\n', callback)
+        self.protocol.get_current_state = Mock(return_value=DriverProtocolState.COMMAND)
+        self.protocol._got_chunk = Mock()
+        self.protocol._chunker = StringChunker(TaggedSieve([
+            ('par', SAMPLE_REGEX),
+            ('other', re.compile(r'OTHER\r\n')),
+        ]))
+        self.protocol._register_particle('par', SatlanticPARDataParticle, samples.append)
+
+        packet = Mock()
+        packet.get_data.return_value = sample_line + 'OTHER\r\n'
+        packet.get_data_length.return_value = len(packet.get_data.return_value)
+        packet.get_timestamp.return_value = ntplib.system_to_ntp_time(time.time())
+        self.protocol.got_data(packet)
+
+        self.assertEqual(len(samples), 1)
+        self.assertEqual([event for (event, value) in events], [DriverAsyncEvent.SAMPLE])
+        # the JSON is only decoded once the sample is looked into
+        self.assertTrue(samples[0])
+        self.assertIsNone(samples[0]._sample)
+        self.assertEqual(samples[0]['stream_name'], SatlanticPARDataParticle(None, None).data_particle_type())
+        # the sample is what subscribers get from the JSON
+        self.assertEqual(samples[0], json.loads(events[0][1]))
+        self.assertIsInstance(samples[0]['stream_name'], unicode)
+        self.protocol._got_chunk.assert_called_once_with('OTHER\r\n', packet.get_timestamp.return_value)
+
     def test_get_param_list(self):
         """
         verify get_param_list returns correct parameter lists.
@@ -608,6 +652,51 @@ class TestUnitCommandInstrumentProtocol(MiUnitTestCase):
                           self.protocol._do_cmd_resp,
                           self.TestEvent.TEST, expected_prompt=">", response_regex=regex1)
 
+    def test_response_latency(self):
+        """
+        Responses arriving on another thread are seen as soon as they are
+        added to the buffer, including a prompt split across two reads.
+        """
+        def respond(*chunks):
+            def send():
+                for chunk in chunks:
+                    time.sleep(.005)
+                    self.protocol.add_to_buffer(chunk)
+            Thread(target=send).start()
+
+        count = 20
+        start = time.time()
+        for i in range(count):
+            self.protocol._promptbuf = ''
+            respond('value=%d\n-' % i, '->')
+            self.assertEqual(self.protocol._get_response(5, expected_prompt='-->'),
+                             ('-->', 'value=%d\n-->' % i))
+        elapsed = time.time() - start
+        log.info("%d responses in %.3fs", count, elapsed)
+        # waking every 100ms would take at least a second
+        self.assertLess(elapsed, count * .05)
+
+        self.protocol._linebuf = ''
+        respond('ts=', '12.5\n')
+        self.assertEqual(self.protocol._get_response(5, response_regex=re.compile(r'ts=(\d+\.\d+)\n')),
+                         ('12.5',))
+
+        # a buffer changed without add_to_buffer is seen once waiters are told
+        def change():
+            time.sleep(.01)
+            self.protocol._promptbuf = 'x >'
+            self.protocol._buffers_changed()
+        self.protocol._promptbuf = ''
+        Thread(target=change).start()
+        start = time.time()
+        self.assertEqual(self.protocol._get_response(5), ('>', 'x >'))
+        self.assertLess(time.time() - start, .1)
+
+        # the deadline ends the wait without any data
+        start = time.time()
+        self.assertRaises(InstrumentTimeoutException, self.protocol._get_response, .2, expected_prompt='-->')
+        self.assertLess(time.time() - start, .3)
+
 
 @attr('UNIT', group='mi')
 class TestUnitMenuInstrumentProtocol(MiUnitTestCase):
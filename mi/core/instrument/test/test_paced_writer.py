@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_paced_writer
+@file mi/core/instrument/test/test_paced_writer.py
+@brief Test cases for the paced instrument writer
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+
+from mock import Mock
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+
+from mi.core.exceptions import InstrumentTimeoutException, InstrumentConnectionException
+from mi.core.instrument.paced_writer import PacedWriter
+from mi.core.instrument.instrument_protocol import CommandResponseInstrumentProtocol
+
+
+@attr('UNIT', group='mi')
+class TestUnitPacedWriter(MiUnitTest):
+
+    def setUp(self):
+        self.sent = []
+        self.writer = PacedWriter(self._send)
+        self.addCleanup(self.writer.stop)
+
+    def _send(self, data):
+        self.sent.append((time.time(), data))
+
+    def test_pacing(self):
+        start = time.time()
+        paced = self.writer.write('abcdefghij', .01)
+        # queued, the caller isn't held up
+        self.assertLess(time.time() - start, .01)
+        paced.wait(5)
+
+        self.assertEqual([data for (t, data) in self.sent], list('abcdefghij'))
+        gaps = [b[0] - a[0] for (a, b) in zip(self.sent, self.sent[1:])]
+        self.assertGreaterEqual(min(gaps), .009)
+        # the pace doesn't drift with the time spent sending
+        self.assertLess(self.sent[-1][0] - self.sent[0][0], .12)
+
+    def test_groups_and_order(self):
+        first = self.writer.write('1234567', .01, group=3)
+        second = self.writer.write('ab', .001)
+        second.wait(5)
+        self.assertTrue(first.done())
+        self.assertEqual([data for (t, data) in self.sent], ['123', '456', '7', 'a', 'b'])
+        # the next write waits out the pause after the last group
+        self.assertGreaterEqual(self.sent[3][0] - self.sent[2][0], .029)
+
+    def test_wait(self):
+        paced = self.writer.write('x' * 20, .05)
+        self.assertRaises(InstrumentTimeoutException, paced.wait, .1)
+        self.writer.stop()
+        self.assertRaises(InstrumentTimeoutException, paced.wait, 5)
+        self.assertLess(paced.sent, 20)
+        self.assertRaises(InstrumentTimeoutException, self.writer.write('y', 0).wait, 5)
+
+    def test_send_error(self):
+        writer = PacedWriter(Mock(side_effect=InstrumentConnectionException('gone')))
+        self.addCleanup(writer.stop)
+        self.assertRaises(InstrumentConnectionException, writer.write('abc', .001).wait, 5)
+        # a failed write doesn't stop the ones behind it
+        writer._send = self._send
+        writer.write('ok', .001).wait(5)
+        self.assertEqual([data for (t, data) in self.sent], ['o', 'k'])
+
+    def test_unpaced(self):
+        """
+        Unpaced writes go out at once unless paced ones are queued.
+        """
+        self.assertTrue(self.writer.write('now', 0).done())
+        self.assertEqual(self.writer._thread, None)
+        queued = self.writer.write('ab', .02)
+        after = self.writer.write('cd', 0)
+        self.assertFalse(after.done())
+        after.wait(5)
+        self.assertTrue(queued.done())
+        self.assertEqual([data for (t, data) in self.sent], ['now', 'a', 'b', 'cd'])
+        # sent from the caller's thread, but still after the pause
+        self.assertGreaterEqual(self.sent[3][0] - self.sent[2][0], .019)
+        self.writer.write('e', .05).wait(5)
+        self.writer.write('f', 0)
+        self.assertGreaterEqual(self.sent[5][0] - self.sent[4][0], .049)
+
+        writer = PacedWriter(Mock(side_effect=InstrumentConnectionException('gone')))
+        self.assertRaises(InstrumentConnectionException, writer.write, 'abc', 0)
+
+    def test_protocol(self):
+        """
+        Commands with a write delay go through the protocol's paced
+        writer, in order with commands sent without one, and the protocol
+        waits for the response while the command goes out.
+        """
+        protocol = CommandResponseInstrumentProtocol(['>'], '\r\n', Mock())
+        protocol._connection = Mock()
+        protocol._connection.send = self._send
+        protocol._wakeup = Mock()
+        protocol._protocol_fsm = Mock()
+        protocol._add_build_handler('set', lambda cmd, val: 'set=%s\r' % val)
+
+        def response(timeout, **kwargs):
+            responses.append(timeout)
+            return ('>', '')
+        responses = []
+        protocol._get_response = response
+
+        protocol._do_cmd_resp('set', 1, write_delay=.01, write_group=3, timeout=10)
+        self.assertEqual([data for (t, data) in self.sent], ['set', '=1\r'])
+        # the response timeout allows for sending the command
+        self.assertAlmostEqual(responses[0], 10.06)
+
+        queued = protocol._queue_write('ts\r', .02)
+        protocol._do_cmd_no_resp('set', 2).wait(5)
+        self.assertTrue(queued.done())
+        self.assertEqual(''.join(data for (t, data) in self.sent), 'set=1\rts\rset=2\r')
+
+        # the writer is stopped when the driver drops the protocol
+        queued = protocol._queue_write('x' * 100, .05)
+        protocol.shutdown()
+        self.assertRaises(InstrumentTimeoutException, queued.wait, 5)
+        self.assertEqual(protocol._paced_writer, None)
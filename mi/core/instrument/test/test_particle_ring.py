@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_particle_ring
+@file mi/core/instrument/test/test_particle_ring.py
+@brief Test cases for the shared memory particle ring
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import time
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+from mi.core.log import get_logger ; log = get_logger()
+
+from mi.core.exceptions import InstrumentException
+from mi.core.instrument.particle_ring import ParticleRing
+
+
+@attr('UNIT', group='mi')
+class TestUnitParticleRing(MiUnitTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_write_read(self):
+        writer = ParticleRing.create(1024, self.directory)
+        reader = ParticleRing.open(writer.path)
+        self.assertEqual(reader.capacity, 1024)
+
+        self.assertEqual(reader.read(), [])
+        for i in range(10):
+            self.assertTrue(writer.write('record %d' % i))
+        self.assertEqual(reader.read(limit=3), ['record 0', 'record 1', 'record 2'])
+        self.assertEqual(reader.read(), ['record %d' % i for i in range(3, 10)])
+        self.assertEqual(len(writer), 0)
+
+        reader.close()
+        writer.close(remove=True)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_wrap(self):
+        """
+        Records that don't fit before the end of the ring start at the
+        front, and a full ring refuses writes until it is read.
+        """
+        writer = ParticleRing.create(100, self.directory)
+        reader = ParticleRing.open(writer.path)
+        self.assertFalse(writer.fits('x' * 50))
+
+        written = []
+        read = []
+        for i in range(200):
+            data = chr(ord('a') + i % 26) * (i % 30)
+            if not writer.write(data):
+                read += reader.read()
+                self.assertTrue(writer.write(data))
+            written.append(data)
+        read += reader.read()
+        self.assertEqual(read, written)
+
+        # records of 40 and 44 bytes leave 16 free, one more won't fit
+        writer = ParticleRing.create(100, self.directory)
+        reader = ParticleRing.open(writer.path)
+        self.assertTrue(writer.write('x' * 36))
+        self.assertTrue(writer.write('y' * 40))
+        self.assertFalse(writer.write('z' * 36))
+        self.assertEqual(reader.read(), ['x' * 36, 'y' * 40])
+
+    def test_not_a_ring(self):
+        path = os.path.join(self.directory, 'junk')
+        with open(path, 'wb') as junk:
+            junk.write('x' * 200)
+        self.assertRaises(InstrumentException, ParticleRing.open, path)
+
+    def test_processes(self):
+        """
+        A forked writer and this process reading, with the rate logged.
+        """
+        count = 100000
+        record = 'x' * 200
+        writer = ParticleRing.create(1024 * 1024, self.directory)
+        reader = ParticleRing.open(writer.path)
+
+        start = time.time()
+        pid = os.fork()
+        if pid == 0:
+            for i in xrange(count):
+                while not writer.write(record):
+                    time.sleep(.0001)
+            os._exit(0)
+
+        received = 0
+        while received < count:
+            records = reader.read()
+            if not records:
+                time.sleep(.0001)
+            self.assertTrue(all(r == record for r in records))
+            received += len(records)
+        elapsed = time.time() - start
+        os.waitpid(pid, 0)
+        log.info("Particle ring: %d records/s between processes", count / elapsed)
+        writer.close(remove=True)
@@ -16,6 +16,8 @@ import gevent
 
 import logging
 import unittest
+import socket
+import threading
 import re
 import time
 import datetime
@@ -40,6 +42,8 @@ from mi.idk.unit_test import InstrumentDriverIntegrationTestCase
 
 from mi.core.instrument.port_agent_client import PortAgentClient, PortAgentPacket, Listener
 from mi.core.instrument.port_agent_client import HEADER_SIZE
+from mi.core.instrument.port_agent_client import PacketReader, SocketClosed, xor_checksum
+from mi.core.instrument.port_agent_client import PortAgentHub
 from mi.core.instrument.instrument_driver import DriverConnectionState
 from mi.core.instrument.instrument_driver import DriverProtocolState
 
@@ -420,6 +424,263 @@ class PAClientTestPortAgentPacket(MiUnitTest):
         #self.assertEqual(got_timestamp, 1105890970.110589)
         self.assertEqual(self.pap.get_header_recv_checksum(), 3729) 
 
+@attr('UNIT', group='mi')
+class PAClientTestPacketReader(MiUnitTest):
+    def setUp(self):
+        self.rx, self.tx = socket.socketpair()
+        self.rx.setblocking(0)
+
+    def tearDown(self):
+        self.rx.close()
+        self.tx.close()
+
+    def _packet(self, data, packet_type=PortAgentPacket.DATA_FROM_INSTRUMENT):
+        header = PortAgentPacket.HEADER_FORMAT.pack(0xa3, 0x9d, 0x7a, packet_type,
+                                                    len(data) + HEADER_SIZE, 0, 1, 2)
+        checksum = xor_checksum(header + data)
+        return PortAgentPacket.HEADER_FORMAT.pack(0xa3, 0x9d, 0x7a, packet_type,
+                                                  len(data) + HEADER_SIZE, checksum, 1, 2) + data
+
+    def _read(self, reader):
+        """
+        Fill the reader until it has at least one packet and return them all
+        """
+        frames = []
+        while not frames:
+            self.assertGreater(reader.fill(), 0)
+            frames = [frame.tobytes() for frame in reader.packets()]
+        return frames
+
+    def test_burst(self):
+        """
+        Several packets arriving together are split out of a single read
+        """
+        reader = PacketReader(self.rx)
+        packets = [self._packet('sample %d\r\n' % i) for i in range(20)]
+        self.tx.sendall(''.join(packets))
+        time.sleep(.1)
+
+        self.assertEqual(reader.fill(), len(''.join(packets)))
+        self.assertEqual([frame.tobytes() for frame in reader.packets()], packets)
+        self.assertEqual(reader.fill(), 0)
+
+    def test_partial_packet(self):
+        """
+        A packet split across reads is only returned once it is complete
+        """
+        reader = PacketReader(self.rx)
+        packet = self._packet('partial packet')
+        self.tx.sendall(packet[:HEADER_SIZE + 3])
+        time.sleep(.1)
+        reader.fill()
+        self.assertEqual(list(reader.packets()), [])
+
+        self.tx.sendall(packet[HEADER_SIZE + 3:] + packet)
+        self.assertEqual(self._read(reader), [packet, packet])
+
+    def test_large_packet(self):
+        """
+        The buffer grows to hold a packet larger than the block size
+        """
+        reader = PacketReader(self.rx, block_size=64)
+        small = self._packet('small')
+        large = self._packet('x' * 1000)
+        self.tx.sendall(small + large + small)
+
+        frames = []
+        while len(frames) < 3:
+            frames += self._read(reader)
+        self.assertEqual(frames, [small, large, small])
+
+    def test_bad_length(self):
+        reader = PacketReader(self.rx)
+        packet = self._packet('data')
+        self.tx.sendall(packet[:4] + struct.pack('>H', 2) + packet[6:])
+        time.sleep(.1)
+        reader.fill()
+        with self.assertRaises(InstrumentConnectionException):
+            list(reader.packets())
+
+    def test_socket_closed(self):
+        reader = PacketReader(self.rx)
+        self.tx.close()
+        time.sleep(.1)
+        with self.assertRaises(SocketClosed):
+            reader.fill()
+
+    def test_decode_rate(self):
+        """
+        Benchmark decoding and checksumming packets streamed from the port
+        agent simulator.
+        """
+        count = 20000
+        packets = [self._packet('SATPAR0229,10.01,2206748544,%03d\r\n' % i) for i in range(100)]
+
+        server = TCPSimulatorServer()
+        sock = socket.create_connection(('localhost', server.port))
+        sock.setblocking(0)
+        reader = PacketReader(sock)
+
+        server.send(''.join(packets) * (count / len(packets)))
+        start = time.time()
+        decoded = 0
+        while decoded < count:
+            if not reader.fill():
+                time.sleep(.001)
+            for frame in reader.packets():
+                packet = PortAgentPacket()
+                packet.unpack_header(frame[:HEADER_SIZE].tobytes())
+                packet.attach_data(frame[HEADER_SIZE:].tobytes())
+                packet.verify_checksum()
+                self.assertTrue(packet.is_valid())
+                decoded += 1
+        elapsed = time.time() - start
+
+        sock.close()
+        server.close()
+        log.info("Decoded %d packets in %.3fs: %d packets/s", decoded, elapsed, decoded / elapsed)
+
+
+@attr('UNIT', group='mi')
+class PAClientTestPortAgentHub(MiUnitTest):
+    """
+    Several port agent connections serviced by a single hub thread
+    """
+    def setUp(self):
+        self.hub = PortAgentHub()
+        self.hub.start()
+        self.received = {}
+        self.errors = []
+        self.addCleanup(self.hub.stop)
+
+    def _packet(self, data, packet_type=PortAgentPacket.DATA_FROM_INSTRUMENT):
+        header = PortAgentPacket.HEADER_FORMAT.pack(0xa3, 0x9d, 0x7a, packet_type,
+                                                    len(data) + HEADER_SIZE, 0, 1, 2)
+        return header + data
+
+    def _connect(self, name):
+        server = TCPSimulatorServer()
+        self.addCleanup(server.close)
+        client = PortAgentClient('localhost', server.port, None, hub=self.hub)
+        self.received[name] = []
+        client.init_comms(lambda packet: self.received[name].append(packet.get_data()),
+                          lambda packet: None,
+                          self.errors.append,
+                          self.errors.append)
+        return server, client
+
+    def _wait_for(self, condition, timeout=5):
+        end = time.time() + timeout
+        while not condition() and time.time() < end:
+            time.sleep(.01)
+        self.assertTrue(condition())
+
+    def test_many_connections(self):
+        thread_count = threading.active_count()
+        connections = dict((name, self._connect(name)) for name in ('a', 'b', 'c', 'd'))
+        self.assertEqual(threading.active_count(), thread_count)
+        self._wait_for(lambda: len(self.hub.get_listeners()) == 4)
+
+        for i in range(50):
+            for name, (server, client) in connections.items():
+                server.send(self._packet('%s %d\r\n' % (name, i)))
+
+        for name in connections:
+            expected = ['%s %d\r\n' % (name, i) for i in range(50)]
+            self._wait_for(lambda: len(self.received[name]) == len(expected))
+            self.assertEqual(self.received[name], expected)
+
+        for (server, client) in connections.values():
+            client.stop_comms()
+        self.assertEqual(self.hub.get_listeners(), [])
+        self.assertEqual(self.errors, [])
+
+    def test_heartbeat_timeout(self):
+        rx, tx = socket.socketpair()
+        self.addCleanup(rx.close)
+        self.addCleanup(tx.close)
+        rx.setblocking(0)
+
+        errors = []
+        listener = Listener(rx, 1, heartbeat=1, max_missed_heartbeats=2,
+                            user_callback_error=errors.append, hub=self.hub)
+        listener.heartbeat = .1
+        listener.start()
+
+        # heartbeats keep the listener happy
+        for i in range(5):
+            tx.sendall(self._packet('', PortAgentPacket.HEARTBEAT))
+            time.sleep(.05)
+        self.assertEqual(errors, [])
+
+        self._wait_for(lambda: errors)
+        self.assertTrue(listener.is_alive())
+        listener.done()
+        listener.join()
+        self.assertFalse(listener.is_alive())
+
+    def test_connection_recovery(self):
+        """
+        A dropped connection is re-established and the replacement listener
+        is serviced by the same hub
+        """
+        server, client = self._connect('a')
+        listener = client.listener_thread
+        self._wait_for(lambda: self.hub.get_listeners() == [listener])
+
+        server.close()
+        self._wait_for(lambda: client.listener_thread is not listener)
+        self._wait_for(lambda: self.hub.get_listeners() == [client.listener_thread])
+        self.assertFalse(listener.is_alive())
+        self.assertEqual(self.errors, [])
+        client.stop_comms()
+
+    def test_slow_recovery(self):
+        """
+        Reconnecting one connection doesn't hold up the others on the hub
+        """
+        server_a, client_a = self._connect('a')
+        server_b, client_b = self._connect('b')
+        self._wait_for(lambda: len(self.hub.get_listeners()) == 2)
+
+        recovering = []
+        init_comms = client_a._init_comms
+        def slow_init_comms():
+            recovering.append(threading.current_thread())
+            time.sleep(1)
+            return init_comms()
+        client_a._init_comms = slow_init_comms
+
+        server_a.close()
+        self._wait_for(lambda: recovering)
+        self.assertIsNot(recovering[0], self.hub)
+        server_b.send(self._packet('b 0\r\n'))
+        self._wait_for(lambda: self.received['b'], timeout=.5)
+
+        self._wait_for(lambda: len(self.hub.get_listeners()) == 2)
+        self.assertEqual(self.errors, [])
+        client_a.stop_comms()
+        client_b.stop_comms()
+
+    def test_stop_from_callback(self):
+        """
+        A connection can be stopped from its own callback on the hub thread
+        """
+        server = TCPSimulatorServer()
+        self.addCleanup(server.close)
+        client = PortAgentClient('localhost', server.port, None, hub=self.hub)
+        stopped = []
+        def got_data(packet):
+            client.stop_comms()
+            stopped.append(packet.get_data())
+        client.init_comms(got_data, lambda packet: None, self.errors.append, self.errors.append)
+
+        server.send(self._packet('stop\r\n'))
+        self._wait_for(lambda: stopped)
+        self._wait_for(lambda: self.hub.get_listeners() == [])
+        self.assertEqual(self.errors, [])
+
+
 @attr('INT', group='mi')
 class PAClientIntTestCase(InstrumentDriverTestCase):
     def initialize(cls, *args, **kwargs):
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_port_agent_log
+@file mi/core/instrument/test/test_port_agent_log.py
+@brief Test cases for the indexed port agent log reader
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import time
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+
+from mi.core.instrument.port_agent_client import PortAgentPacket, HEADER_SIZE, xor_checksum
+from mi.core.instrument.port_agent_log import PortAgentLogReader, scan_packets, INDEX_SUFFIX
+
+NTP_START = 3600000000
+
+@attr('UNIT', group='mi')
+class TestUnitPortAgentLog(MiUnitTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'port_agent_4001.20140101.data')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _packet(self, data, timestamp, packet_type=PortAgentPacket.DATA_FROM_INSTRUMENT):
+        upper = int(timestamp)
+        lower = int((timestamp - upper) * 4294967296)
+        header = PortAgentPacket.HEADER_FORMAT.pack(0xa3, 0x9d, 0x7a, packet_type,
+                                                    len(data) + HEADER_SIZE, 0, upper, lower)
+        return PortAgentPacket.HEADER_FORMAT.pack(0xa3, 0x9d, 0x7a, packet_type, len(data) + HEADER_SIZE,
+                                                  xor_checksum(header + data), upper, lower) + data
+
+    def _write_log(self, count=100, step=1.0):
+        """
+        Write a log of count instrument samples, each followed by a driver
+        echo, with a heartbeat and some junk mixed in.
+        """
+        records = []
+        for i in range(count):
+            timestamp = NTP_START + i * step
+            records.append(self._packet('sample %d\r\n' % i, timestamp))
+            records.append(self._packet('echo %d' % i, timestamp + step / 2,
+                                        PortAgentPacket.DATA_FROM_DRIVER))
+            if i == count / 2:
+                records.append(self._packet('', timestamp + step / 2, PortAgentPacket.HEARTBEAT))
+                records.append('junk \xa3\x9d\x7a junk')
+        with open(self.filename, 'wb') as log_file:
+            log_file.write(''.join(records))
+
+    def test_index(self):
+        self._write_log()
+        reader = PortAgentLogReader(self.filename)
+
+        self.assertEqual(len(reader), 201)
+        self.assertTrue(os.path.exists(self.filename + INDEX_SUFFIX))
+        self.assertEqual(reader.types.count(PortAgentPacket.DATA_FROM_INSTRUMENT), 100)
+        self.assertEqual(reader.timestamps[0], NTP_START)
+        self.assertEqual(list(reader.timestamps), sorted(reader.timestamps))
+
+        packet = reader.get_packet(2, verify=True)
+        self.assertEqual(packet.get_data(), 'sample 1\r\n')
+        self.assertEqual(packet.get_timestamp(), NTP_START + 1)
+        self.assertTrue(packet.is_valid())
+
+        # a second reader uses the saved index
+        second = PortAgentLogReader(self.filename)
+        self.assertEqual(second.offsets, reader.offsets)
+        self.assertEqual(second.timestamps, reader.timestamps)
+        self.assertEqual(second.refresh(), 0)
+        reader.close()
+        second.close()
+
+    def test_stale_index(self):
+        """
+        An index for a different log is discarded
+        """
+        self._write_log()
+        PortAgentLogReader(self.filename).close()
+
+        with open(self.filename, 'wb') as log_file:
+            log_file.write('x' * 10000 + self._packet('new', NTP_START))
+        reader = PortAgentLogReader(self.filename)
+        self.assertEqual(len(reader), 1)
+        self.assertEqual(reader.get_packet(0).get_data(), 'new')
+
+    def test_growing_log(self):
+        first = self._packet('first\r\n', NTP_START)
+        second = self._packet('second\r\n', NTP_START + 1)
+        with open(self.filename, 'wb') as log_file:
+            log_file.write(first + second[:HEADER_SIZE + 2])
+
+        reader = PortAgentLogReader(self.filename)
+        self.assertEqual(len(reader), 1)
+
+        with open(self.filename, 'ab') as log_file:
+            log_file.write(second[HEADER_SIZE + 2:] + second[:2])
+        self.assertEqual(reader.refresh(), 1)
+        self.assertEqual(reader.get_packet(1).get_data(), 'second\r\n')
+
+        with open(self.filename, 'ab') as log_file:
+            log_file.write(second[2:])
+        self.assertEqual(reader.refresh(), 1)
+        self.assertEqual(len(reader), 3)
+
+        # a fresh reader picks up where the saved index left off
+        self.assertEqual(len(PortAgentLogReader(self.filename)), 3)
+
+    def test_time_range(self):
+        self._write_log()
+        reader = PortAgentLogReader(self.filename, persist_index=False)
+
+        packets = list(reader.packets(NTP_START + 10, NTP_START + 20,
+                                      types=[PortAgentPacket.DATA_FROM_INSTRUMENT]))
+        self.assertEqual([p.get_data() for p in packets], ['sample %d\r\n' % i for i in range(10, 20)])
+        self.assertEqual(list(reader.packets(NTP_START + 1000)), [])
+        self.assertFalse(os.path.exists(self.filename + INDEX_SUFFIX))
+
+    def test_replay(self):
+        self._write_log()
+        reader = PortAgentLogReader(self.filename)
+        data = []
+        raw = []
+
+        count = reader.replay(data.append, raw.append)
+        self.assertEqual(count, 200)
+        self.assertEqual(len(data), 100)
+        self.assertEqual(len(raw), 200)
+        self.assertEqual(data[-1].get_data(), 'sample 99\r\n')
+        self.assertTrue(data[0].is_valid())
+
+        # without a raw callback only instrument data is read
+        data = []
+        self.assertEqual(reader.replay(data.append, start_time=NTP_START + 90), 10)
+        self.assertEqual(data[0].get_data(), 'sample 90\r\n')
+
+    def test_replay_rate(self):
+        """
+        10 samples a second apart replayed at 50 times real time take 0.18s
+        """
+        self._write_log(count=10)
+        reader = PortAgentLogReader(self.filename)
+        start = time.time()
+        self.assertEqual(reader.replay(lambda packet: None, rate=50), 10)
+        self.assertGreaterEqual(time.time() - start, .17)
+
+    def test_scan_buffer(self):
+        buf = 'junk' + self._packet('one', NTP_START) + self._packet('two', NTP_START + 1)[:-1]
+        self.assertEqual([(offset, packet_type) for (offset, ts, packet_type, length) in scan_packets(buf)],
+                         [(4, PortAgentPacket.DATA_FROM_INSTRUMENT)])
+
+    def test_false_sync_length(self):
+        """
+        A false sync or damaged length running past the end of the log does
+        not hide the packets after it.
+        """
+        packets = [self._packet('sample %d\r\n' % i, NTP_START + i) for i in range(20)]
+        false_sync = '\xa3\x9d\x7a\x01\xff\xff' + 'x' * 10
+        damaged = packets[10][:4] + '\xff\xff' + packets[10][6:]
+        buf = ''.join(packets[:5]) + 'junk' + false_sync + ''.join(packets[5:10]) + damaged + ''.join(packets[11:])
+        self.assertEqual(len(list(scan_packets(buf))), 19)
+
+        with open(self.filename, 'wb') as log_file:
+            log_file.write(buf + packets[0][:HEADER_SIZE + 2])
+        reader = PortAgentLogReader(self.filename)
+        self.assertEqual(len(reader), 19)
+        self.assertEqual(reader.get_packet(18, verify=True).get_data(), 'sample 19\r\n')
+        with open(self.filename, 'ab') as log_file:
+            log_file.write(packets[0][HEADER_SIZE + 2:] + packets[1])
+        self.assertEqual(reader.refresh(), 2)
@@ -10,8 +10,10 @@
 __author__ = 'Steve Foley'
 __license__ = 'Apache 2.0'
 
+import sys
 import json
 import re
+import time
 
 from ooi.logging import log
 from nose.plugins.attrib import attr
@@ -23,6 +25,7 @@ from mi.core.instrument.protocol_param_dict import ParameterDictVisibility
 from mi.core.instrument.protocol_param_dict import ParameterDictType
 from mi.core.instrument.protocol_param_dict import ParameterDictKey
 from mi.core.instrument.protocol_param_dict import Parameter, FunctionParameter, RegexParameter
+from mi.core.instrument.protocol_param_dict import _required_literal
 
 @attr('UNIT', group='mi')
 class TestUnitProtocolParameterDict(TestUnitStringsDict):
@@ -619,6 +622,111 @@ bar=200, baz=300
                           regex_flags="bad flag",
                           value=12)
             
+    def test_required_literal(self):
+        def literal(pattern, flags=0):
+            return _required_literal(RegexParameter("x", pattern, None, str, regex_flags=flags))
+
+        self.assertEqual(literal(r'.*foo=(\d+).*'), ('foo=', False))
+        self.assertEqual(literal(r'(do not )?output salinity'), ('output salinity', False))
+        self.assertEqual(literal(r'CI = (\d+) \-+ Instrument ID'), (' Instrument ID', False))
+        self.assertEqual(literal(r'Serial (No)\.', re.IGNORECASE), ('serial no.', True))
+        self.assertEqual(literal(r'serial  no', re.VERBOSE), ('serialno', False))
+        self.assertEqual(literal(r'(foo|bar)=(\d+)'), None)
+        self.assertEqual(literal(r'S[eE]r'), None)
+        self.assertEqual(literal(r'Ser', re.IGNORECASE | re.UNICODE), None)
+        self.assertEqual(literal(u'Serial'), None)
+        self.assertEqual(_required_literal(FunctionParameter("x", str, str)), None)
+
+    def test_indexed_update(self):
+        """
+        Results from the indexed dictionary match trying every parameter,
+        including for parameters changed after the index was built.
+        """
+        def build():
+            param_dict = ProtocolParameterDict()
+            for name in ('foo', 'bar', 'baz', 'bat', 'qux', 'qut'):
+                param_dict.add(name, r'%s=(\d+)' % name,
+                               lambda match : int(match.group(1)), str,
+                               multi_match=(name in ('bar', 'qux')))
+            param_dict.add('dup', r'foo=(\d+)', lambda match : int(match.group(1)), str)
+            param_dict.add('folded', r'FOLD=(\d+)', lambda match : int(match.group(1)), str,
+                           regex_flags=re.IGNORECASE)
+            param_dict.add('any', r'(\d+)', lambda match : int(match.group(1)), str)
+            param_dict.add_parameter(FunctionParameter('len', len, str))
+            return param_dict
+
+        indexed = build()
+        unindexed = build()
+        unindexed.INDEX_MIN_PARAMETERS = sys.maxint
+        inputs = ['foo=1', 'bar=2, qux=3', 'Fold=4 baz=5', 'nothing here', '',
+                  'x' * 40 + 'qut=6', 'bat=7\nfoo=8\nfold=9\n']
+        for input in inputs:
+            self.assertEqual(indexed.update(input), unindexed.update(input))
+            self.assertEqual(indexed.update(input, target_params=['foo', 'folded']),
+                             unindexed.update(input, target_params=['foo', 'folded']))
+            self.assertEqual(indexed.update_many(input), unindexed.update_many(input))
+            self.assertEqual(indexed.multi_match_update(input), unindexed.multi_match_update(input))
+            self.assertEqual(indexed.get_all(), unindexed.get_all())
+        self.assertEqual(indexed.get('folded'), 9)
+        self.assertEqual(len(indexed._index), 8)
+
+        # changes made behind the dictionary's back are still matched
+        for param_dict in (indexed, unindexed):
+            param_dict._param_dict['foo'] = RegexParameter('foo', r'oof=(\d+)',
+                                                           lambda match : int(match.group(1)), str)
+            param_dict._param_dict['new'] = RegexParameter('new', r'new=(\d+)',
+                                                           lambda match : int(match.group(1)), str)
+            param_dict.update('oof=10 new=11')
+        self.assertEqual(indexed.get_all(), unindexed.get_all())
+        self.assertEqual(indexed.get('foo'), 10)
+        self.assertEqual(indexed.get('new'), 11)
+
+        # adding a parameter rebuilds the index
+        indexed.add('late', r'late=(\d+)', lambda match : int(match.group(1)), str)
+        self.assertTrue(indexed.update('late=12'))
+        self.assertEqual(indexed.get('late'), 12)
+        self.assertTrue('late' in indexed._index._names)
+
+    def test_index_benchmark(self):
+        """
+        Refresh parameters from dumps captured from several drivers, line
+        by line as the drivers do, with and without the index.
+        """
+        from mock import Mock
+        from mi.instrument.teledyne.driver import TeledynePrompt
+        from mi.instrument.teledyne.workhorse_monitor_75_khz.rsn.driver import Protocol as WorkhorseProtocol
+        from mi.instrument.teledyne.workhorse_monitor_75_khz.test.test_data import get_params_output
+        from mi.instrument.seabird.sbe37smb.ooicore.driver import SBE37Protocol, SBE37Prompt
+        from mi.instrument.seabird.sbe37smb.ooicore.test.sample_data import SAMPLE_DS, SAMPLE_DC
+        from mi.instrument.wetlabs.fluorometer.flort_d.driver import Protocol as FlortProtocol, Prompt as FlortPrompt
+        from mi.instrument.wetlabs.fluorometer.flort_d.test.sample_data import SAMPLE_MNU_RESPONSE
+
+        drivers = [(WorkhorseProtocol, TeledynePrompt, get_params_output),
+                   (SBE37Protocol, SBE37Prompt, SAMPLE_DS + SAMPLE_DC),
+                   (FlortProtocol, FlortPrompt, SAMPLE_MNU_RESPONSE)]
+        repeat = 20
+
+        for (protocol_class, prompts, dump) in drivers:
+            lines = dump.split('\r\n')
+            param_dicts = []
+            elapsed = []
+            for index_min in (sys.maxint, ProtocolParameterDict.INDEX_MIN_PARAMETERS):
+                param_dict = protocol_class(prompts, '\r\n', Mock())._param_dict
+                param_dict.INDEX_MIN_PARAMETERS = index_min
+                start = time.time()
+                for i in range(repeat):
+                    results = [param_dict.update(line) for line in lines]
+                elapsed.append(time.time() - start)
+                param_dicts.append((param_dict, results))
+
+            ((unindexed, unindexed_results), (indexed, indexed_results)) = param_dicts
+            self.assertEqual(indexed_results, unindexed_results)
+            self.assertEqual(indexed.get_all(), unindexed.get_all())
+            self.assertLess(elapsed[1], elapsed[0])
+            log.info("%s: %d parameters, %d lines, %.3f ms per dump unindexed, %.3f ms indexed",
+                     protocol_class.__name__, len(indexed._param_dict), len(lines),
+                     elapsed[0] * 1000 / repeat, elapsed[1] * 1000 / repeat)
+
     def test_format_current(self):
         self.param_dict.add("test_format", r'.*foo=(\d+).*',
                              lambda match : int(match.group(1)),
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.test.test_zmq_codec
+@file mi/core/instrument/test/test_zmq_codec.py
+@brief Test cases for the driver process ZMQ message codecs
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import unittest
+import cPickle as pickle
+from collections import OrderedDict
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+from mi.core.log import get_logger ; log = get_logger()
+
+from mi.core.exceptions import InstrumentProtocolException, InstrumentCommandException, InstrumentTimeoutException
+from mi.core.instrument import zmq_codec
+from mi.core.instrument.zmq_codec import TaggedCodec, PickleCodec, MsgpackCodec
+from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.data_particle import RawDataParticle
+from mi.core.instrument.port_agent_client import PortAgentPacket
+
+from mi.instrument.teledyne.particles import ADCP_PD0_PARSED_DataParticle
+from mi.instrument.teledyne.workhorse_monitor_75_khz.test.test_data import RSN_SAMPLE_RAW_DATA
+
+
+@attr('UNIT', group='mi')
+class TestUnitZmqCodec(MiUnitTest):
+
+    def setUp(self):
+        self.tagged = zmq_codec.get_codec(TaggedCodec.name)
+        self.pickle = zmq_codec.get_codec(PickleCodec.name)
+
+    def _adcp_events(self):
+        """
+        The events an ADCP driver sends for each ensemble: the raw port
+        agent packet and the parsed PD0 particle.
+        """
+        packet = PortAgentPacket()
+        packet.attach_data(RSN_SAMPLE_RAW_DATA)
+        packet.pack_header()
+        raw = RawDataParticle(packet.get_as_dict(), port_timestamp=3600000000.0)
+        parsed = ADCP_PD0_PARSED_DataParticle(RSN_SAMPLE_RAW_DATA, port_timestamp=3600000000.0)
+        return [{'type': DriverAsyncEvent.SAMPLE, 'value': raw.generate(), 'time': time.time()},
+                {'type': DriverAsyncEvent.SAMPLE, 'value': parsed.generate(), 'time': time.time()}]
+
+    def test_round_trip(self):
+        message = {'cmd': 'execute_resource',
+                   'args': ('DRIVER_EVENT_ACQUIRE_SAMPLE', None, True, False),
+                   'kwargs': {u'timeout': 10.5, 'count': -3, 'big': 2 ** 80, 'neg': -2 ** 70},
+                   'list': [1, [2, ['three']], {'four': (4.0,)}],
+                   'binary': '\x00\xff\xa7\x80'}
+        data = self.tagged.encode(message)
+        self.assertEqual(data[0], zmq_codec.TAGGED_MAGIC)
+        decoded = zmq_codec.decode(data)
+        self.assertEqual(decoded, message)
+        self.assertIsInstance(decoded['args'], tuple)
+        self.assertEqual([key for key in decoded['kwargs'] if isinstance(key, unicode)], [u'timeout'])
+
+        for value in [None, True, False, 0, '', u'\xb0C', [], {}, ()]:
+            self.assertEqual(zmq_codec.decode(self.tagged.encode(value)), value)
+
+    @unittest.skipIf(zmq_codec.msgpack is None, 'msgpack not installed')
+    def test_msgpack_round_trip(self):
+        """
+        Tuples, exception triples among them, come back as tuples.
+        """
+        codec = zmq_codec.get_codec(MsgpackCodec.name)
+        message = {'cmd': 'execute_resource',
+                   'args': ('DRIVER_EVENT_ACQUIRE_SAMPLE', None, (1, [2.5, ()])),
+                   'kwargs': OrderedDict([(u'timeout', 10)]),
+                   'list': [1, 'two', u'\xb0C'],
+                   'reply': InstrumentTimeoutException('late').get_triple()}
+        decoded = zmq_codec.decode(codec.encode(message))
+        self.assertEqual(decoded, message)
+        self.assertIsInstance(decoded['args'], tuple)
+        self.assertIsInstance(decoded['args'][2][1][1], tuple)
+        self.assertIsInstance(decoded['list'], list)
+        self.assertIsInstance(decoded['reply'], tuple)
+        self.assertIsInstance(decoded['list'][1], str)
+        self.assertIsInstance(decoded['list'][2], unicode)
+
+        # anything else goes pickled
+        data = zmq_codec.encode(codec, {'value': InstrumentCommandException('bad')})
+        self.assertIs(zmq_codec.codec_of(data), self.pickle)
+
+    def test_pickle_compatible(self):
+        """
+        Messages from send_pyobj are recognized and decoded
+        """
+        message = {'type': DriverAsyncEvent.ERROR, 'value': InstrumentCommandException('bad')}
+        data = pickle.dumps(message, -1)
+        self.assertIs(zmq_codec.codec_of(data), self.pickle)
+        self.assertIsInstance(zmq_codec.decode(data)['value'], InstrumentCommandException)
+
+        # the tagged codec can't carry an exception, it goes pickled
+        data = zmq_codec.encode(self.tagged, message)
+        self.assertIs(zmq_codec.codec_of(data), self.pickle)
+
+    def test_bad_messages(self):
+        self.assertRaises(InstrumentProtocolException, zmq_codec.decode, 'junk')
+        self.assertRaises(InstrumentProtocolException, zmq_codec.get_codec, 'xml')
+
+        data = self.tagged.encode({'value': 'x' * 100})
+        for bad in [data[:-1], data + 'N', data[:1] + 'Q' + data[2:]]:
+            self.assertRaises(InstrumentProtocolException, zmq_codec.decode, bad)
+
+    def test_choose_codec(self):
+        self.assertEqual(zmq_codec.choose_codec(['xml', 'tagged', 'pickle']), 'tagged')
+        self.assertEqual(zmq_codec.choose_codec(['xml']), 'pickle')
+        self.assertIn(zmq_codec.choose_codec(zmq_codec.DEFAULT_CODECS), zmq_codec.CODECS)
+        # pickle is faster than the tagged codec
+        self.assertEqual(zmq_codec.choose_codec([n for n in zmq_codec.DEFAULT_CODECS if n != 'msgpack']),
+                         'pickle')
+
+    def test_event_rate(self):
+        """
+        Benchmark encoding and decoding the event stream of an ADCP
+        session with each codec.
+        """
+        count = 5000
+        events = self._adcp_events()
+        for codec in zmq_codec.CODECS.values():
+            start = time.time()
+            for i in xrange(count / len(events)):
+                for event in events:
+                    self.assertEqual(codec.decode(codec.encode(event))['type'], DriverAsyncEvent.SAMPLE)
+            elapsed = time.time() - start
+            log.info("%s codec: %d events/s, %d bytes per ensemble", codec.name, count / elapsed,
+                     sum(len(codec.encode(event)) for event in events))
@@ -12,14 +12,19 @@ __license__ = 'Apache 2.0'
 
 from gevent import monkey; monkey.patch_all()
 
+import os
 import time
+import thread
 import unittest
 import logging
 
+import zmq
+
 from nose.plugins.attrib import attr
 
 from pyon.util.unit_test import PyonTestCase
 
+from mi.core.exceptions import InstrumentTimeoutException
 from mi.core.instrument.zmq_driver_client import ZmqDriverClient
 from mi.core.instrument.zmq_driver_process import ZmqDriverProcess
 import mi.core.mi_logger
@@ -106,3 +111,173 @@ class TestZmqDriverProcess(MiTestCase):
         """
         
         pass 
+
+    def test_latency(self):
+        """
+        Benchmark command round trips and event delivery against a driver
+        process. The client side uses plain blocking sockets so only the
+        driver process is measured.
+        """
+        (process, cmd_port, evt_port) = ZmqDriverProcess.launch_process(
+            'mi.core.instrument.instrument_driver', 'InstrumentDriver', ppid=os.getpid())
+
+        context = zmq.Context()
+        cmd_sock = context.socket(zmq.REQ)
+        cmd_sock.connect('tcp://localhost:%i' % cmd_port)
+        evt_sock = context.socket(zmq.SUB)
+        evt_sock.connect('tcp://localhost:%i' % evt_port)
+        evt_sock.setsockopt(zmq.SUBSCRIBE, '')
+
+        def command(cmd, *args, **kwargs):
+            cmd_sock.send_pyobj({'cmd': cmd, 'args': args, 'kwargs': kwargs})
+            self.assertTrue(cmd_sock.poll(5000), 'no reply to %s' % cmd)
+            return cmd_sock.recv_pyobj()
+
+        try:
+            # wait for the event subscription to be connected
+            while True:
+                command('test_events', events=['sync'])
+                if evt_sock.poll(100):
+                    while evt_sock.poll(100):
+                        evt_sock.recv_pyobj()
+                    break
+
+            count = 200
+            start = time.time()
+            for i in range(count):
+                self.assertTrue(command('process_echo').startswith('ping'))
+            round_trip = (time.time() - start) / count
+
+            delays = []
+            for i in range(count):
+                sent = time.time()
+                self.assertEqual(command('test_events', events=[i]), 'test_events')
+                self.assertTrue(evt_sock.poll(5000), 'event %d not delivered' % i)
+                self.assertEqual(evt_sock.recv_pyobj(), i)
+                delays.append(time.time() - sent)
+            delivery = sum(delays) / count
+
+            mi_logger.info("Command round trip %.3fms, event delivery %.3fms (max %.3fms)",
+                     round_trip * 1000, delivery * 1000, max(delays) * 1000)
+            # the old loops slept up to 100ms on each side
+            self.assertLess(round_trip, .05)
+            self.assertLess(delivery, .05)
+
+            self.assertEqual(command('stop_driver_process'), 'stop_driver_process')
+        finally:
+            cmd_sock.close(linger=0)
+            evt_sock.close(linger=0)
+            context.term()
+            process.wait()
+
+    def test_pipelined(self):
+        """
+        Read-only commands are answered while a slow command runs, and
+        each command has its own timeout.
+        """
+        (process, cmd_port, evt_port) = ZmqDriverProcess.launch_process(
+            'mi.core.instrument.test.slow_driver', 'SlowDriver', ppid=os.getpid())
+        driver_client = ZmqDriverClient('localhost', cmd_port, evt_port)
+        driver_client.start_messaging()
+        try:
+            self.assertTrue(driver_client.pipelined)
+
+            start = time.time()
+            slow = driver_client.send_command('execute_resource', kwargs={'delay': 2})
+            pings = [driver_client.send_command('driver_ping', ('ping %d' % i,), timeout=5)
+                     for i in range(50)]
+            for (i, ping) in enumerate(pings):
+                self.assertEqual(ping.result(), 'driver_ping: ping %d' % i)
+            self.assertLess(time.time() - start, 1)
+            self.assertFalse(slow.done())
+
+            replies = []
+            driver_client.send_command('get_resource_state', callback=replies.append).result(5)
+            self.assertEqual(len(replies), 1)
+
+            self.assertEqual(slow.result(10), 'execute_resource')
+
+            late = driver_client.send_command('execute_resource', kwargs={'delay': 1}, timeout=.1)
+            self.assertIsInstance(late.exception(5), InstrumentTimeoutException)
+            # the late reply is dropped, not taken for the next command
+            self.assertEqual(driver_client.cmd_dvr('execute_resource', delay=0), 'execute_resource')
+
+            driver_client.done()
+        finally:
+            process.wait()
+
+    def test_timeout_not_pipelined(self):
+        """
+        A command to a driver process that answers one request at a time
+        can time out, here because the driver process restarted, without
+        holding up the commands after it.
+        """
+        context = zmq.Context()
+        socks = [context.socket(zmq.REP)]
+        cmd_port = socks[0].bind_to_random_port('tcp://127.0.0.1')
+        running = [True]
+
+        def older_driver_process():
+            # replies in order, without negotiating; restarts instead of
+            # replying to restart
+            while running[0]:
+                if not socks[0].poll(0):
+                    time.sleep(.01)
+                    continue
+                msg = socks[0].recv_pyobj()
+                if msg['cmd'] == 'restart':
+                    socks[0].close(linger=0)
+                    socks[0] = context.socket(zmq.REP)
+                    while True:
+                        try:
+                            socks[0].bind('tcp://127.0.0.1:%i' % cmd_port)
+                            break
+                        except zmq.ZMQError:
+                            # the old socket closes in the background
+                            time.sleep(.05)
+                else:
+                    socks[0].send_pyobj(msg['cmd'])
+        thread.start_new_thread(older_driver_process, ())
+
+        driver_client = ZmqDriverClient('localhost', cmd_port, cmd_port + 1)
+        driver_client.start_messaging()
+        try:
+            self.assertFalse(driver_client.pipelined)
+            lost = driver_client.send_command('restart', timeout=.5)
+            self.assertIsInstance(lost.exception(5), InstrumentTimeoutException)
+            self.assertEqual(driver_client.send_command('driver_ping').result(5), 'driver_ping')
+            self.assertEqual(driver_client.send_command('get_resource_state').result(5), 'get_resource_state')
+        finally:
+            driver_client.stop_messaging()
+            running[0] = False
+            time.sleep(.1)
+            socks[0].close(linger=0)
+            context.term()
+
+    def test_ring_fallback(self):
+        """
+        A client that stops reading a shared memory ring leaves the driver
+        process publishing on the socket for the next client.
+        """
+        (process, cmd_port, evt_port) = ZmqDriverProcess.launch_process(
+            'mi.core.instrument.instrument_driver', 'InstrumentDriver', ppid=os.getpid())
+        try:
+            for shared_memory in (True, False, True):
+                events = []
+                driver_client = ZmqDriverClient('localhost', cmd_port, evt_port,
+                                                shared_memory=shared_memory)
+                driver_client.start_messaging(events.append)
+                self.assertEqual(driver_client.ring is not None, shared_memory)
+                driver_client.cmd_dvr('test_events', events=['event %d' % i for i in range(10)])
+                deadline = time.time() + 5
+                while len(events) < 10 and time.time() < deadline:
+                    time.sleep(.1)
+                self.assertEqual(events, ['event %d' % i for i in range(10)])
+                driver_client.stop_messaging()
+                # the driver process sees the subscriber go
+                time.sleep(.5)
+        finally:
+            driver_client = ZmqDriverClient('localhost', cmd_port, evt_port)
+            driver_client.start_messaging()
+            driver_client.done()
+            process.wait()
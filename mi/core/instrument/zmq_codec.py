@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.instrument.zmq_codec
+@file mi/core/instrument/zmq_codec.py
+@brief Message codecs for the driver process ZMQ transport.
+
+Every encoded message starts with a byte that identifies its codec, so a
+receiver can decode whatever it is sent: pickle protocol 2, as written by
+send_pyobj, starts with PICKLE_MAGIC, the others with their own magic byte.
+Clients that predate the codecs only ever send and expect pickle, newer
+clients negotiate the codec the driver process publishes events with.
+
+The msgpack codec is only available when the msgpack module is installed;
+it is C accelerated, about as fast as cPickle, and preferred because it
+can't run code when decoding. Neither can the tagged codec, but it is pure
+python and about three times slower than cPickle. It is offered after
+pickle, so without msgpack events stay pickled unless a client asks for
+the tagged codec first.
+"""
+
+__license__ = 'Apache 2.0'
+
+import struct
+import cPickle as pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from mi.core.exceptions import InstrumentProtocolException, NotImplementedException
+
+PICKLE_MAGIC = '\x80'
+TAGGED_MAGIC = '\xa7'
+MSGPACK_MAGIC = '\xa8'
+
+# msgpack extension type tuples are packed as
+MSGPACK_TUPLE = 1
+
+# command that negotiates the event codec, always sent with pickle so a
+# driver process that doesn't know it can still answer
+NEGOTIATE_CODEC = 'negotiate_codec'
+
+INT = struct.Struct('>q')
+FLOAT = struct.Struct('>d')
+LENGTH = struct.Struct('>I')
+
+STR_HEADER = lambda length, pack=struct.Struct('>I').pack: 's' + pack(length)
+DICT_HEADER = lambda length, pack=struct.Struct('>I').pack: 'm' + pack(length)
+FLOAT_VALUE = lambda value, pack=FLOAT.pack: 'd' + pack(value)
+
+MIN_INT = -2 ** 63
+MAX_INT = 2 ** 63 - 1
+
+
+class Codec(object):
+    """
+    Base class for message codecs.
+    """
+    name = None
+    magic = None
+
+    def encode(self, obj):
+        """
+        @param obj Message to encode
+        @retval Encoded message string
+        @raises TypeError if the message can't be encoded
+        """
+        raise NotImplementedException()
+
+    def decode(self, data):
+        """
+        @param data Encoded message string
+        @retval The message
+        """
+        raise NotImplementedException()
+
+
+class PickleCodec(Codec):
+    """
+    Pickle protocol 2, compatible with send_pyobj/recv_pyobj. Can carry
+    any picklable object but decoding runs arbitrary code, only use it
+    between trusted processes.
+    """
+    name = 'pickle'
+    magic = PICKLE_MAGIC
+
+    def encode(self, obj):
+        return pickle.dumps(obj, 2)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class TaggedCodec(Codec):
+    """
+    Schema free binary encoding of None, bools, ints, longs, floats, str,
+    unicode, lists, tuples and dicts. Each value is a one byte tag followed
+    by its data, with big endian lengths and numbers. Decoding never
+    creates anything but those types.
+    """
+    name = 'tagged'
+    magic = TAGGED_MAGIC
+
+    def __init__(self):
+        self._encoders = {
+            type(None): self._encode_none,
+            bool: self._encode_bool,
+            int: self._encode_int,
+            long: self._encode_int,
+            float: self._encode_float,
+            str: self._encode_str,
+            unicode: self._encode_unicode,
+            list: self._encode_list,
+            tuple: self._encode_tuple,
+            dict: self._encode_dict,
+        }
+        self._decoders = {
+            'N': self._decode_none,
+            'T': self._decode_true,
+            'F': self._decode_false,
+            'i': self._decode_int,
+            'L': self._decode_long,
+            'd': self._decode_float,
+            's': self._decode_str,
+            'u': self._decode_unicode,
+            'l': self._decode_list,
+            't': self._decode_tuple,
+            'm': self._decode_dict,
+        }
+
+    def encode(self, obj):
+        parts = [TAGGED_MAGIC]
+        self._encode(obj, parts.append)
+        return ''.join(parts)
+
+    def decode(self, data):
+        if data[:1] != TAGGED_MAGIC:
+            raise InstrumentProtocolException('Not a tagged message')
+        try:
+            (obj, offset) = self._decode(data, 1)
+        except (KeyError, IndexError, ValueError, TypeError, struct.error):
+            raise InstrumentProtocolException('Malformed tagged message')
+        if offset != len(data):
+            raise InstrumentProtocolException('Trailing data in tagged message')
+        return obj
+
+    def _encode(self, obj, write):
+        encoder = self._encoders.get(type(obj))
+        if encoder is None:
+            raise TypeError('%s can not be encoded by the tagged codec' % type(obj).__name__)
+        encoder(obj, write)
+
+    def _encode_none(self, obj, write):
+        write('N')
+
+    def _encode_bool(self, obj, write):
+        write('T' if obj else 'F')
+
+    def _encode_int(self, obj, write):
+        if MIN_INT <= obj <= MAX_INT:
+            write('i')
+            write(INT.pack(obj))
+        else:
+            digits = str(obj)
+            write('L')
+            write(LENGTH.pack(len(digits)))
+            write(digits)
+
+    def _encode_float(self, obj, write):
+        write('d')
+        write(FLOAT.pack(obj))
+
+    def _encode_str(self, obj, write):
+        write(STR_HEADER(len(obj)))
+        write(obj)
+
+    def _encode_unicode(self, obj, write):
+        obj = obj.encode('utf-8')
+        write('u')
+        write(LENGTH.pack(len(obj)))
+        write(obj)
+
+    def _encode_list(self, obj, write, tag='l'):
+        write(tag)
+        write(LENGTH.pack(len(obj)))
+        encode = self._encode
+        for item in obj:
+            encode(item, write)
+
+    def _encode_tuple(self, obj, write):
+        self._encode_list(obj, write, 't')
+
+    def _encode_dict(self, obj, write):
+        write(DICT_HEADER(len(obj)))
+        encode = self._encode
+        # str keys and str and float values inline, they are most of what
+        # driver events hold
+        for (key, value) in obj.iteritems():
+            if type(key) is str:
+                write(STR_HEADER(len(key)))
+                write(key)
+            else:
+                encode(key, write)
+            value_type = type(value)
+            if value_type is str:
+                write(STR_HEADER(len(value)))
+                write(value)
+            elif value_type is float:
+                write(FLOAT_VALUE(value))
+            else:
+                encode(value, write)
+
+    def _decode(self, data, offset):
+        return self._decoders[data[offset]](data, offset + 1)
+
+    def _decode_none(self, data, offset):
+        return (None, offset)
+
+    def _decode_true(self, data, offset):
+        return (True, offset)
+
+    def _decode_false(self, data, offset):
+        return (False, offset)
+
+    def _decode_int(self, data, offset):
+        return (INT.unpack_from(data, offset)[0], offset + INT.size)
+
+    def _decode_long(self, data, offset):
+        (digits, offset) = self._decode_str(data, offset)
+        return (long(digits), offset)
+
+    def _decode_float(self, data, offset):
+        return (FLOAT.unpack_from(data, offset)[0], offset + FLOAT.size)
+
+    def _decode_str(self, data, offset):
+        (length,) = LENGTH.unpack_from(data, offset)
+        start = offset + LENGTH.size
+        end = start + length
+        if end > len(data):
+            raise IndexError()
+        return (data[start:end], end)
+
+    def _decode_unicode(self, data, offset):
+        (value, offset) = self._decode_str(data, offset)
+        return (value.decode('utf-8'), offset)
+
+    def _decode_list(self, data, offset):
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        decode = self._decode
+        result = []
+        for i in xrange(length):
+            (item, offset) = decode(data, offset)
+            result.append(item)
+        return (result, offset)
+
+    def _decode_tuple(self, data, offset):
+        (result, offset) = self._decode_list(data, offset)
+        return (tuple(result), offset)
+
+    def _decode_dict(self, data, offset):
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        decode = self._decode
+        decode_str = self._decode_str
+        result = {}
+        for i in xrange(length):
+            if data[offset] == 's':
+                (key, offset) = decode_str(data, offset + 1)
+            else:
+                (key, offset) = decode(data, offset)
+            if data[offset] == 's':
+                (result[key], offset) = decode_str(data, offset + 1)
+            else:
+                (result[key], offset) = decode(data, offset)
+        return (result, offset)
+
+
+class MsgpackCodec(Codec):
+    """
+    msgpack, with str kept apart from unicode. Tuples are packed as an
+    extension type so they decode as tuples, as they do with pickle;
+    exception triples in particular.
+    """
+    name = 'msgpack'
+    magic = MSGPACK_MAGIC
+
+    def encode(self, obj):
+        return MSGPACK_MAGIC + self._pack(obj)
+
+    def decode(self, data):
+        try:
+            return self._unpack(data[1:])
+        except Exception as e:
+            raise InstrumentProtocolException('Malformed msgpack message: %s' % e)
+
+    def _pack(self, obj):
+        # strict types hands tuples, and subclasses of the other types,
+        # to _default instead of packing them as their base type
+        return msgpack.packb(obj, use_bin_type=True, strict_types=True, default=self._default)
+
+    def _unpack(self, data):
+        return msgpack.unpackb(data, raw=False, ext_hook=self._ext_hook)
+
+    def _default(self, obj):
+        if isinstance(obj, tuple):
+            return msgpack.ExtType(MSGPACK_TUPLE, self._pack(list(obj)))
+        for base in (int, long, float, str, unicode, list, dict):
+            if isinstance(obj, base):
+                return base(obj)
+        raise TypeError('msgpack codec can not encode %s' % type(obj).__name__)
+
+    def _ext_hook(self, code, data):
+        if code == MSGPACK_TUPLE:
+            return tuple(self._unpack(data))
+        raise InstrumentProtocolException('Unknown msgpack extension type %d' % code)
+
+
+CODECS = {}
+for codec in (TaggedCodec(), PickleCodec()):
+    CODECS[codec.name] = codec
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+del codec
+
+# codecs in order of preference, the tagged codec is slower than pickle
+DEFAULT_CODECS = (MsgpackCodec.name, PickleCodec.name, TaggedCodec.name)
+
+_BY_MAGIC = dict((codec.magic, codec) for codec in CODECS.values())
+
+
+def get_codec(name):
+    """
+    @param name Codec name
+    @retval The codec
+    @raises InstrumentProtocolException for an unknown codec
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        raise InstrumentProtocolException('Unknown codec %s' % name)
+    return codec
+
+def codec_of(data):
+    """
+    @param data An encoded message
+    @retval The codec the message was encoded with
+    @raises InstrumentProtocolException if it isn't a known encoding
+    """
+    codec = _BY_MAGIC.get(data[:1])
+    if codec is None:
+        raise InstrumentProtocolException('Unknown message encoding')
+    return codec
+
+def decode(data):
+    """
+    Decode a message with whichever codec encoded it.
+    """
+    return codec_of(data).decode(data)
+
+def encode(codec, obj):
+    """
+    Encode a message, falling back to pickle for messages the codec can't
+    carry, e.g. an exception object in an event.
+    @param codec The preferred codec
+    @param obj The message
+    @retval Encoded message string
+    """
+    try:
+        return codec.encode(obj)
+    except (TypeError, ValueError, OverflowError):
+        if codec.name == PickleCodec.name:
+            raise
+        return CODECS[PickleCodec.name].encode(obj)
+
+def choose_codec(offered):
+    """
+    Pick the first codec of those offered that is available here.
+    @param offered Codec names in order of preference
+    @retval The chosen codec name
+    """
+    for name in offered:
+        if name in CODECS:
+            return name
+    return PickleCodec.name
@@ -20,6 +20,9 @@ c = zdc.ZmqDriverClient('localhost', 5556, 5557)
 import thread
 import logging
 import time
+import itertools
+import threading
+from collections import deque
 
 # We import "regular" zmq, not the patched version because
 # we handle the nonblocking sockets directly as they need to work
@@ -27,21 +30,129 @@ import time
 import zmq
 
 from mi.core.instrument.driver_client import DriverClient
+from mi.core.instrument import zmq_codec
+from mi.core.instrument import particle_ring
+from mi.core.exceptions import InstrumentTimeoutException, InstrumentConnectionException
 from mi.core.log import get_logger ; log = get_logger()
 
- 
+# hosts a shared memory ring can be used with
+LOCAL_HOSTS = ('localhost', '127.0.0.1')
+
+# seconds to wait for the driver process to detach a ring
+RING_DETACH_TIMEOUT = 5
+
+# bounds of the command socket poll interval while replies are outstanding
+MIN_POLL_INTERVAL = .001
+MAX_POLL_INTERVAL = .1
+
+
+class CommandFuture(object):
+    """
+    The pending result of a driver command sent with
+    ZmqDriverClient.send_command.
+    """
+
+    def __init__(self, request_id, cmd, timeout=None):
+        """
+        @param request_id Id the request is tagged with
+        @param cmd The driver command identifier
+        @param timeout Seconds to wait for the reply, None waits forever
+        """
+        self.request_id = request_id
+        self.cmd = cmd
+        self.deadline = None if timeout is None else time.time() + timeout
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._reply = None
+        self._exception = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the command reply.
+        @param timeout Seconds to wait, None waits for the command timeout
+        @retval The driver reply
+        @raises The exception the driver replied with,
+        InstrumentTimeoutException if there was no reply in time
+        """
+        if not self._done.wait(timeout):
+            raise InstrumentTimeoutException('No reply to %s in %s seconds' % (self.cmd, timeout))
+        if self._exception is not None:
+            raise self._exception
+        return self._reply
+
+    def exception(self, timeout=None):
+        """
+        @retval The exception the command failed with, or None
+        """
+        try:
+            self.result(timeout)
+        except Exception as e:
+            return e
+        return None
+
+    def add_done_callback(self, callback):
+        """
+        Call callback(future) once the command is done, right away if it
+        already is. Callbacks run on the client command thread and should
+        not block.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, reply=None, exception=None):
+        with self._lock:
+            if self._done.is_set():
+                return
+            if exception is None and isinstance(reply, Exception):
+                exception = reply
+            self._reply = reply
+            self._exception = exception
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                log.error('Driver command callback failed: %s', e)
+
+
+
 class ZmqDriverClient(DriverClient):
     """
     A class for communicating with a ZMQ-based driver process using python
     thread for catching asynchronous driver events.
+
+    Commands go out on a DEALER socket owned by a command thread. Against a
+    driver process that negotiates pipelining every request is tagged with
+    an id and any number may be in flight, replies are matched by id. An
+    older driver process gets one request at a time, as from a REQ socket.
+
+    With shared_memory set and the driver process on this host, events
+    are read from a shared memory ring and the event socket only carries
+    notifications. If the ring can't be set up events come over the
+    socket as usual.
     """
     
-    def __init__(self, host, cmd_port, event_port):
+    def __init__(self, host, cmd_port, event_port, codecs=zmq_codec.DEFAULT_CODECS,
+                 shared_memory=False):
         """
         Initialize members.
         @param host Host string address of the driver process.
         @param cmd_port Port number for the driver process command port.
         @param event_port Port number for the driver process event port.
+        @param codecs Names of the codecs to offer the driver process, in
+        order of preference. Pickle is used with driver processes that
+        can't negotiate.
+        @param shared_memory Read events from a shared memory ring when
+        the driver process is on this host.
         """
         DriverClient.__init__(self)
         self.host = host
@@ -53,6 +164,17 @@ class ZmqDriverClient(DriverClient):
         self.zmq_cmd_socket = None
         self.event_thread = None
         self.stop_event_thread = True
+        self.codecs = codecs
+        self.codec = zmq_codec.get_codec(zmq_codec.PickleCodec.name)
+        self.pipelined = False
+        self.shared_memory = shared_memory
+        self.ring = None
+        self.cmd_thread = None
+        self.stop_cmd_thread = True
+        self._request_ids = itertools.count(1)
+        self._outgoing = deque()
+        self._wakeup = threading.Event()
+        self._cmd_thread_done = threading.Event()
         
     def start_messaging(self, evt_callback=None):
         """
@@ -62,11 +184,14 @@ class ZmqDriverClient(DriverClient):
         process independently of command request-reply.
         """
         self.zmq_context = zmq.Context()
-        self.zmq_cmd_socket = self.zmq_context.socket(zmq.REQ)
-        self.zmq_cmd_socket.connect(self.cmd_host_string)
-        log.info('Driver client cmd socket connected to %s.' %
-                       self.cmd_host_string)        
+        self._connect_cmd_socket()
         self.evt_callback = evt_callback
+        self.pipelined = False
+        self.stop_cmd_thread = False
+        self._cmd_thread_done.clear()
+        self.cmd_thread = thread.start_new_thread(self._run_commands, ())
+        self._negotiate_codec()
+        self._attach_ring()
         
         def recv_evt_messages(driver_client):
             """
@@ -81,11 +206,22 @@ class ZmqDriverClient(DriverClient):
             log.info('Driver client event thread connected to %s.' %
                   driver_client.event_host_string)
 
+            ring = driver_client.ring
             driver_client.stop_event_thread = False
             #last_time = time.time()
             while not driver_client.stop_event_thread:
+                # the ring is read on every pass, a notification that
+                # was sent before the subscription is lost
+                if ring is not None:
+                    for data in ring.read():
+                        evt = zmq_codec.decode(data)
+                        if driver_client.evt_callback:
+                            driver_client.evt_callback(evt)
                 try:
-                    evt = sock.recv_pyobj(flags=zmq.NOBLOCK)
+                    data = sock.recv(flags=zmq.NOBLOCK)
+                    if data == particle_ring.NOTIFY:
+                        continue
+                    evt = zmq_codec.decode(data)
                     log.debug('got event: %s' % str(evt))
                     if driver_client.evt_callback:
                         driver_client.evt_callback(evt)
@@ -97,18 +233,165 @@ class ZmqDriverClient(DriverClient):
                 #    last_time = cur_time
             sock.close()
             context.term()
+            if ring is not None:
+                ring.close()
+                driver_client.ring = None
             log.info('Client event socket closed.')
         self.event_thread = thread.start_new_thread(recv_evt_messages, (self,))
         log.info('Driver client messaging started.')
         
+    def _negotiate_codec(self):
+        """
+        Agree on the codec for commands and events with the driver
+        process. The negotiation itself is pickled, a driver process that
+        doesn't know it replies with an error and pickle stays in use.
+        """
+        self.codec = zmq_codec.get_codec(zmq_codec.PickleCodec.name)
+        reply = self.cmd_dvr(zmq_codec.NEGOTIATE_CODEC, list(self.codecs))
+        if isinstance(reply, dict):
+            self.pipelined = bool(reply.get('pipelined'))
+            reply = reply.get('codec')
+        if isinstance(reply, basestring) and reply in zmq_codec.CODECS:
+            self.codec = zmq_codec.get_codec(reply)
+        log.info('Driver client using the %s codec%s.', self.codec.name,
+                 ', pipelined' if self.pipelined else '')
+
+    def _attach_ring(self):
+        """
+        Ask a driver process on this host to publish events through a
+        shared memory ring and map it. Events stay on the socket if the
+        driver process is remote, doesn't support rings or the ring can't
+        be mapped; a ring another client left attached is then detached.
+        """
+        self.ring = None
+        if not self.pipelined:
+            # an older driver process only has the socket
+            return
+        if not self.shared_memory or self.host not in LOCAL_HOSTS:
+            self._detach_ring()
+            return
+        try:
+            reply = self.cmd_dvr('attach_ring')
+            self.ring = particle_ring.ParticleRing.open(reply['path'])
+        except Exception as e:
+            log.warn('Driver client using the event socket, no particle ring: %s', e)
+            self._detach_ring()
+            return
+        log.info('Driver client reading events from %s.', self.ring.path)
+
+    def _detach_ring(self):
+        """
+        Have the driver process publish events on the socket again.
+        """
+        try:
+            self.send_command('detach_ring', timeout=RING_DETACH_TIMEOUT).result()
+        except Exception as e:
+            log.debug('Driver client could not detach the particle ring: %s', e)
+
+    def _connect_cmd_socket(self):
+        """
+        Open the command socket and connect it to the driver process.
+        """
+        self.zmq_cmd_socket = self.zmq_context.socket(zmq.DEALER)
+        self.zmq_cmd_socket.setsockopt(zmq.LINGER, 0)
+        self.zmq_cmd_socket.connect(self.cmd_host_string)
+        log.info('Driver client cmd socket connected to %s.' %
+                       self.cmd_host_string)        
+        return self.zmq_cmd_socket
+
+    def _run_commands(self):
+        """
+        Command thread, the only user of the command socket. Sends queued
+        requests, matches replies to their futures and expires those past
+        their timeout. The socket is polled without blocking so the loop
+        also works in a gevent process. An older driver process replies in
+        the order it was asked, so when a request to one times out the
+        socket is replaced and the late reply goes nowhere.
+        """
+        sock = self.zmq_cmd_socket
+        pending = {}            # request id -> future, pipelined requests
+        in_flight = deque()     # futures awaiting a reply, in order sent
+        interval = MIN_POLL_INTERVAL
+
+        try:
+            while not self.stop_cmd_thread:
+                busy = False
+
+                # an older driver process answers one request at a time
+                while self._outgoing and (self.pipelined or not in_flight):
+                    (future, data) = self._outgoing.popleft()
+                    if future.done():
+                        continue
+                    if self.pipelined:
+                        sock.send_multipart(['', future.request_id, data])
+                        pending[future.request_id] = future
+                    else:
+                        sock.send_multipart(['', data])
+                        in_flight.append(future)
+                    busy = True
+
+                while True:
+                    try:
+                        frames = sock.recv_multipart(flags=zmq.NOBLOCK)
+                    except zmq.ZMQError:
+                        break
+                    busy = True
+                    if len(frames) == 3:
+                        future = pending.pop(frames[1], None)
+                    elif in_flight:
+                        future = in_flight.popleft()
+                    else:
+                        future = None
+                    if future is None:
+                        log.debug('Ignoring late or unexpected driver reply.')
+                        continue
+                    try:
+                        future._set(zmq_codec.decode(frames[-1]))
+                    except Exception as e:
+                        future._set(exception=e)
+
+                now = time.time()
+                for future in pending.values() + list(in_flight):
+                    if future.deadline is not None and future.deadline <= now and not future.done():
+                        future._set(exception=InstrumentTimeoutException(
+                            'No reply to %s from driver process' % future.cmd))
+                        pending.pop(future.request_id, None)
+                if in_flight and in_flight[0].done():
+                    in_flight.clear()
+                    sock.close()
+                    sock = self._connect_cmd_socket()
+                    busy = True
+
+                if busy:
+                    interval = MIN_POLL_INTERVAL
+                elif pending or in_flight:
+                    time.sleep(interval)
+                    interval = min(interval * 2, MAX_POLL_INTERVAL)
+                else:
+                    self._wakeup.wait(1)
+                    self._wakeup.clear()
+        finally:
+            error = InstrumentConnectionException('Driver client messaging stopped')
+            for future in pending.values() + list(in_flight) + [f for (f, d) in self._outgoing]:
+                future._set(exception=error)
+            self._outgoing.clear()
+            self._cmd_thread_done.set()
+
     def stop_messaging(self):
         """
         Close messaging resources for the driver process client. Close
         ZMQ command socket and terminate command context. Set flag to
         cause event thread to close event socket and context and terminate.
-        Await event thread completion and return.
+        Await event thread completion and return. A ring in use is
+        detached first so the driver process holds events for the next
+        client.
         """
-        
+        if self.ring is not None:
+            self._detach_ring()
+        self.stop_cmd_thread = True
+        self._wakeup.set()
+        self._cmd_thread_done.wait(5)
+        self.cmd_thread = None
         self.zmq_cmd_socket.close()
         self.zmq_cmd_socket = None
         self.zmq_context.term()
@@ -119,50 +402,39 @@ class ZmqDriverClient(DriverClient):
         self.evt_callback = None
         log.info('Driver client messaging closed.')        
     
+    def send_command(self, cmd, args=(), kwargs=None, timeout=None, callback=None):
+        """
+        Send a driver command without waiting for the reply.
+        @param cmd The driver command identifier.
+        @param args Positional arguments of the command.
+        @param kwargs Keyword arguments of the command.
+        @param timeout Seconds to wait for the reply, None waits forever.
+        @param callback Optional callback(future) called with the reply.
+        @retval CommandFuture for the reply.
+        """
+        msg = {'cmd':cmd,'args':tuple(args),'kwargs':kwargs or {}}
+        future = CommandFuture(str(self._request_ids.next()), cmd, timeout)
+        if callback:
+            future.add_done_callback(callback)
+        if self.stop_cmd_thread:
+            future._set(exception=InstrumentConnectionException('Driver client messaging not started'))
+            return future
+
+        log.debug('Sending command %s.' % str(msg))
+        self._outgoing.append((future, zmq_codec.encode(self.codec, msg)))
+        self._wakeup.set()
+        return future
+
     def cmd_dvr(self, cmd, *args, **kwargs):
         """
-        Command a driver by request-reply messaging. Package command
-        message and send on blocking command socket. Block on same socket
-        to receive the reply. Return the driver reply.
+        Command a driver by request-reply messaging and wait for the
+        reply.
         @param cmd The driver command identifier.
         @param args Positional arguments of the command.
         @param kwargs Keyword arguments of the command.
         @retval Command result.
+        @raises The exception the driver replied with.
         """
-        # Package command dictionary.
-        msg = {'cmd':cmd,'args':args,'kwargs':kwargs}
-        
-        log.debug('Sending command %s.' % str(msg))
-        while True:
-            try:
-                # Attempt command send. Retry if necessary.
-                self.zmq_cmd_socket.send_pyobj(msg)
-                if msg == 'stop_driver_process':
-                    return 'driver stopping'
-
-                # Command sent, break out and wait for reply.
-                break    
-
-            except zmq.ZMQError:
-                # Socket not ready to accept send. Sleep and retry later.
-                time.sleep(.5)
-            
-        log.debug('Awaiting reply.')
-        while True:
-            try:
-                # Attempt reply recv. Retry if necessary.
-                reply = self.zmq_cmd_socket.recv_pyobj(flags=zmq.NOBLOCK)
-                # Reply recieved, break and return.
-                break
-
-            except zmq.ZMQError:
-                # Socket not ready with the reply. Sleep and retry later.
-                time.sleep(.5)
-                
+        reply = self.send_command(cmd, args, kwargs).result()
         log.debug('Reply: %s.' % str(reply))
-        
-        if isinstance(reply, Exception):
-            raise reply
-        else:
-            return reply
-    
+        return reply
@@ -17,13 +17,16 @@ p = zdp.ZmqDriverProcess.launch_process(5556, 5557, 'ion.services.mi.drivers.sbe
 
 """
 
-from threading import Thread
+from threading import Thread, Condition
+from collections import deque
 from subprocess import Popen
 import os
 import time
 import logging
 import sys
 import uuid
+import fcntl
+import errno
 
 import zmq
 
@@ -31,9 +34,26 @@ from ooi.exception import ApplicationException
 from mi.core.exceptions import InstrumentException, UnexpectedError
 
 import mi.core.instrument.driver_process as driver_process
+from mi.core.instrument import zmq_codec
+from mi.core.instrument.event_queue import EventQueue
+from mi.core.instrument import particle_ring
 from mi.core.log import get_logger
 log = get_logger()
 
+# Commands that only read driver state. They run on their own worker thread
+# so they are answered while other commands wait on the instrument.
+READ_ONLY_COMMANDS = ('driver_ping', 'get_resource_state', 'get_resource',
+                      'get_resource_capabilities', 'get_init_params',
+                      'get_cached_config', 'get_config_metadata')
+
+# Commands answered by the command thread itself
+INLINE_COMMANDS = ('stop_driver_process', 'process_echo', 'test_events',
+                   zmq_codec.NEGOTIATE_CODEC, 'get_event_queue_metrics',
+                   'configure_event_queue', 'attach_ring', 'detach_ring')
+
+# milliseconds between attempts to write to a full shared memory ring
+RING_RETRY_INTERVAL = 10
+
 def _encode_exception(reply):
     if isinstance(reply, InstrumentException):
         # InstrumentExceptions have corresponding IonException error code built-in
@@ -43,16 +63,88 @@ def _encode_exception(reply):
         ex = UnexpectedError("%s('%s')" % (reply.__class__.__name__, reply.message))
         return ex.get_triple()
 
+def _make_pipe():
+    """
+    @retval (read fd, write fd) of a pipe with both ends nonblocking
+    """
+    pipe = os.pipe()
+    for fd in pipe:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    return pipe
+
+def _signal_pipe(fd):
+    """
+    Write a wakeup byte, a full pipe already wakes the reader.
+    """
+    try:
+        os.write(fd, 'x')
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            raise
+
+def _drain_pipe(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            raise
+
+class _CommandWorker(Thread):
+    """
+    Runs driver commands one at a time and hands the replies back to the
+    command thread, which owns the socket.
+    """
+    def __init__(self, zmq_driver_process, name):
+        Thread.__init__(self, name=name)
+        self.daemon = True
+        self._process = zmq_driver_process
+        self._queue = deque()
+        self._condition = Condition()
+        self._stopped = False
+
+    def submit(self, envelope, codec, msg):
+        with self._condition:
+            self._queue.append((envelope, codec, msg))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                (envelope, codec, msg) = self._queue.popleft()
+            reply = self._process.cmd_driver(msg)
+            self._process.queue_reply(envelope, codec, reply)
+
 class ZmqDriverProcess(driver_process.DriverProcess):
     """
     A OS-level driver process that communicates with ZMQ sockets.
     Command-REP and event-PUB sockets monitor and react to comms
     needs in separate threads, which can be signaled to end
-    by setting boolean flags stop_cmd_thread and stop_evt_thread.
+    with stop_messaging(). Events are queued on a deque and the event
+    thread is woken through a pipe when the first one arrives.
+
+    The command socket is a ROUTER. REQ clients get one reply per request
+    as before. DEALER clients tag each request with an id, which is
+    echoed in the reply, and may keep many requests in flight. Read-only
+    commands run on their own worker so a slow command doesn't hold them
+    up, all other driver commands run in order on the command worker.
+
+    Events wait in a bounded EventQueue, see configure_event_queue and
+    get_event_queue_metrics.
     """
     
     @classmethod
-    def launch_process(cls, driver_module, driver_class, workdir='/tmp/', ppid=None):
+    def launch_process(cls, driver_module, driver_class, workdir='/tmp/', ppid=None,
+                       launcher=None):
         """
         Class method constructor to launch ZmqDriverProcess as a
         separate OS process. Creates command string for this
@@ -62,9 +154,13 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         @param workdir The work directory when temporary port files are written.
         @param ppid ID of the parent process, used to self destruct when
         parent dies in test cases.
+        @param launcher Optional started DriverLauncher to fork the process
+        from instead of starting a new interpreter.
         @retval Tuple containing (Popen object for the process, cmd port,
             evt_port)
         """
+        if launcher is not None:
+            return launcher.launch_process(driver_module, driver_class, ppid=ppid)
         
         # Construct the command string.
         tag = str(uuid.uuid4())
@@ -101,7 +197,8 @@ class ZmqDriverProcess(driver_process.DriverProcess):
 
         return (dvr_proc, dvr_cmd_port, dvr_evt_port)
         
-    def __init__(self, driver_module, driver_class, cmd_port_fname, evt_port_fname, ppid):
+    def __init__(self, driver_module, driver_class, cmd_port_fname, evt_port_fname, ppid,
+                 port_pipe=None):
         """
         Zmq driver process constructor.
         @param driver_module The python module containing the driver code.
@@ -110,93 +207,209 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         @param evt_port_fname Filename for temp evt port file.
         @param ppid ID of the parent process, used to self destruct when
         parent dies in test cases.        
+        @param port_pipe File descriptor to report the ports on instead of
+        the port files, as 'cmd <port>' and 'evt <port>' lines.
         """
         driver_process.DriverProcess.__init__(self, driver_module, driver_class, ppid)
         self.cmd_port = None
         self.cmd_port_fname = cmd_port_fname
         self.evt_port = None
         self.evt_port_fname = evt_port_fname
+        self.port_pipe = port_pipe
+        self.events = EventQueue()
+        self.ring = None
+        self._detached_rings = []
         self.cmd_host_string = 'tcp://*'
         self.event_host_string ='tcp://*'
         self.evt_thread = None
         self.stop_evt_thread = True
         self.cmd_thread = None
         self.stop_cmd_thread = True
+        self._event_pipe = _make_pipe()
+        self._event_signaled = False
+        self._stop_pipe = _make_pipe()
+        self._reply_pipe = _make_pipe()
+        self._replies = deque()
+        self._command_worker = None
+        self._read_worker = None
+        # events go out pickled until a client negotiates another codec
+        self.event_codec = zmq_codec.get_codec(zmq_codec.PickleCodec.name)
         
     def start_messaging(self):
         """
         Initialize and start messaging resources for the driver, blocking
         until messaging terminates. This ZMQ implementation starts and
-        joins command and event threads, managing nonblocking send/recv calls
-        on REP and PUB sockets, respectively. Terminate loops and close
-        sockets when stop flag is set in driver process.
+        joins command and event threads, each blocking in a zmq.Poller on
+        its socket and a wakeup pipe. Commands are answered as soon as they
+        arrive and events are published as soon as they are queued.
+        Terminate loops and close sockets when stop flag is set in driver
+        process.
         """
         def recv_cmd_msg(zmq_driver_process):
             """
-            Await commands on a ZMQ REP socket, forwaring them to the
-            driver for processing and returning the result.
+            Await commands on a ZMQ ROUTER socket, forwaring them to the
+            driver workers for processing and returning the results.
             """
             context = zmq.Context()
-            sock = context.socket(zmq.REP)
+            sock = context.socket(zmq.ROUTER)
             zmq_driver_process.cmd_port = sock.bind_to_random_port(zmq_driver_process.cmd_host_string)
             log.info('Driver process cmd socket bound to %i' %
                            zmq_driver_process.cmd_port)
-            file(zmq_driver_process.cmd_port_fname,'w+').write(str(zmq_driver_process.cmd_port)+'\n')
+            zmq_driver_process.report_port('cmd', zmq_driver_process.cmd_port, zmq_driver_process.cmd_port_fname)
+
+            reply_pipe = zmq_driver_process._reply_pipe[0]
+            replies = zmq_driver_process._replies
+            poller = zmq.Poller()
+            poller.register(sock, zmq.POLLIN)
+            poller.register(reply_pipe, zmq.POLLIN)
+            poller.register(zmq_driver_process._stop_pipe[0], zmq.POLLIN)
+
+            zmq_driver_process._command_worker = _CommandWorker(zmq_driver_process, 'command worker')
+            zmq_driver_process._read_worker = _CommandWorker(zmq_driver_process, 'read worker')
+            zmq_driver_process._command_worker.start()
+            zmq_driver_process._read_worker.start()
 
             zmq_driver_process.stop_cmd_thread = False
             while not zmq_driver_process.stop_cmd_thread:
+                ready = dict(poller.poll())
+
+                if ready.get(reply_pipe):
+                    _drain_pipe(reply_pipe)
+                while replies:
+                    (envelope, data) = replies.popleft()
+                    sock.send_multipart(envelope + [data])
+
+                if ready.get(sock) != zmq.POLLIN:
+                    continue
+                # [identity, ''] from a REQ client,
+                # [identity, '', request id] from a DEALER client
+                frames = sock.recv_multipart()
+                (envelope, data) = (frames[:-1], frames[-1])
+                # reply with the codec the command came in
                 try:
-                    msg = sock.recv_pyobj(flags=zmq.NOBLOCK)
-                    #log.trace('Processing message %s', msg)
-                    reply = zmq_driver_process.cmd_driver(msg)
-                    # if operation raised exception, encode as triple
-                    if isinstance(reply, Exception):
-                        reply = _encode_exception(reply)
-                    # send, send, and resend
-                    while True:
-                        try:
-                            sock.send_pyobj(reply, flags=zmq.NOBLOCK)
-                            break
-                        except zmq.ZMQError:
-                            time.sleep(.1)
-                            if zmq_driver_process.stop_cmd_thread:
-                                break
-                except zmq.ZMQError:
-                    time.sleep(.1)
-                
-            sock.close()
+                    codec = zmq_codec.codec_of(data)
+                    msg = codec.decode(data)
+                    cmd = msg.get('cmd', None)
+                except Exception as e:
+                    log.error('Failed to decode driver command: %s', e)
+                    zmq_driver_process.queue_reply(envelope, zmq_codec.get_codec(zmq_codec.PickleCodec.name), e)
+                    continue
+
+                #log.trace('Processing message %s', msg)
+                if cmd in INLINE_COMMANDS:
+                    zmq_driver_process.queue_reply(envelope, codec, zmq_driver_process.cmd_driver(msg))
+                elif cmd in READ_ONLY_COMMANDS:
+                    zmq_driver_process._read_worker.submit(envelope, codec, msg)
+                else:
+                    zmq_driver_process._command_worker.submit(envelope, codec, msg)
+
+            # answer what is already done, a stop_driver_process reply
+            # in particular
+            while replies:
+                (envelope, data) = replies.popleft()
+                sock.send_multipart(envelope + [data])
+            zmq_driver_process._command_worker.stop()
+            zmq_driver_process._read_worker.stop()
+            sock.close(linger=1000)
             context.term()
             log.info('Driver process cmd socket closed.')
 
         def send_evt_msg(zmq_driver_process):
             """
             Await events on the driver process event queue and publish them
-            on a ZMQ PUB socket to the driver process client.
+            on a ZMQ XPUB socket to the driver process client. Where libzmq
+            supports XPUB_NODROP a full socket pushes back into the event
+            queue instead of dropping, and events are held in the queue
+            while a client that had subscribed is reconnecting. While a
+            client has a shared memory ring attached events are written to
+            the ring and the socket only carries a notification. The ring
+            is detached when the last subscriber goes, so events wait in
+            the queue for the next client whichever way it reads them.
             """
             context = zmq.Context()
-            sock = context.socket(zmq.PUB)
+            sock = context.socket(zmq.XPUB)
+            if hasattr(zmq, 'XPUB_NODROP'):
+                sock.setsockopt(zmq.XPUB_NODROP, 1)
             zmq_driver_process.evt_port = sock.bind_to_random_port(zmq_driver_process.event_host_string)
             log.info('Driver process event socket bound to %i', zmq_driver_process.evt_port)
-            file(zmq_driver_process.evt_port_fname,'w+').write(str(zmq_driver_process.evt_port)+'\n')
+            zmq_driver_process.report_port('evt', zmq_driver_process.evt_port, zmq_driver_process.evt_port_fname)
+
+            wakeup = zmq_driver_process._event_pipe[0]
+            poller = zmq.Poller()
+            poller.register(sock, zmq.POLLIN)
+            poller.register(wakeup, zmq.POLLIN)
+            poller.register(zmq_driver_process._stop_pipe[0], zmq.POLLIN)
+            events = zmq_driver_process.events
+            # with a single topic XPUB reports the first subscription and
+            # the last unsubscription
+            subscribed = False
+            had_subscriber = False
+            blocked = False
 
             zmq_driver_process.stop_evt_thread = False
             while not zmq_driver_process.stop_evt_thread:
-                try:
-                    evt = zmq_driver_process.events.pop(0)
+                # clear the signal before draining the queue so an event
+                # queued while draining signals again
+                _drain_pipe(wakeup)
+                zmq_driver_process._event_signaled = False
+                while True:
+                    try:
+                        msg = sock.recv(flags=zmq.NOBLOCK)
+                    except zmq.ZMQError:
+                        break
+                    subscribed = msg[:1] == '\x01'
+                    had_subscriber = had_subscriber or subscribed
+                    log.info('Driver process event client %s', 'subscribed' if subscribed else 'gone')
+                    if not subscribed and zmq_driver_process.ring is not None:
+                        zmq_driver_process.detach_ring()
+
+                # rings are closed here, the only thread writing to them
+                while zmq_driver_process._detached_rings:
+                    zmq_driver_process._detached_rings.pop().close(remove=True)
+                ring = zmq_driver_process.ring
+
+                blocked = False
+                ring_full = False
+                notify = False
+                held = had_subscriber and not subscribed and ring is None
+                while events and not held:
+                    evt = events.popleft()
                     #log.trace('Event thread sending event %s',evt)
-                    while evt:
-                        try:
-                            if isinstance(evt, Exception):
-                                evt = _encode_exception(evt)
-                            sock.send_pyobj(evt, flags=zmq.NOBLOCK)
-                            evt = None
-                            log.trace('Event sent!')
-                        except zmq.ZMQError:
-                            time.sleep(.1)
-                            if zmq_driver_process.stop_evt_thread:
-                                break
-                except IndexError:
-                    time.sleep(.1)
+                    if isinstance(evt, Exception):
+                        evt = _encode_exception(evt)
+                    data = zmq_codec.encode(zmq_driver_process.event_codec, evt)
+                    # an event too big for the ring goes on the socket once
+                    # the ring is empty, so the client sees events in order
+                    if ring is not None and (ring.fits(data) or len(ring)):
+                        if ring.fits(data) and ring.write(data):
+                            notify = True
+                            continue
+                        events.appendleft(evt)
+                        ring_full = True
+                        break
+                    try:
+                        sock.send(data, flags=zmq.NOBLOCK)
+                    except zmq.ZMQError as e:
+                        if e.errno != zmq.EAGAIN:
+                            raise
+                        # the subscriber is behind, keep the event queued
+                        events.appendleft(evt)
+                        blocked = True
+                        break
+                    log.trace('Event sent!')
+
+                if notify or ring_full:
+                    try:
+                        sock.send(particle_ring.NOTIFY, flags=zmq.NOBLOCK)
+                    except zmq.ZMQError:
+                        pass
+
+                poller.modify(sock, zmq.POLLIN | zmq.POLLOUT if blocked else zmq.POLLIN)
+                if ring_full:
+                    # nothing signals room in the ring, look again shortly
+                    poller.poll(RING_RETRY_INTERVAL)
+                elif blocked or held or not events:
+                    poller.poll()
 
             sock.close()
             context.term()
@@ -207,21 +420,133 @@ class ZmqDriverProcess(driver_process.DriverProcess):
         self.cmd_thread.start()        
         self.evt_thread.start()
         self.messaging_started = True
+
+    def report_port(self, name, port, fname):
+        """
+        Tell the launcher which port a socket is bound to.
+        @param name 'cmd' or 'evt'
+        @param port The bound port
+        @param fname Port file to write when there is no port pipe
+        """
+        if self.port_pipe is not None:
+            # a line this short is written to the pipe atomically
+            os.write(self.port_pipe, '%s %i\n' % (name, port))
+        else:
+            file(fname,'w+').write(str(port)+'\n')
+
+    def queue_reply(self, envelope, codec, reply):
+        """
+        Queue a command reply for the command thread to send, can be
+        called from any thread.
+        @param envelope The routing frames of the command
+        @param codec The codec the command was encoded with
+        @param reply The command result
+        """
+        # if operation raised exception, encode as triple
+        if isinstance(reply, Exception):
+            reply = _encode_exception(reply)
+        self._replies.append((envelope, zmq_codec.encode(codec, reply)))
+        _signal_pipe(self._reply_pipe[1])
+
+    def cmd_driver(self, msg):
+        """
+        Handle codec negotiation and the event queue commands, pass
+        everything else to the driver.
+        """
+        cmd = msg.get('cmd', None)
+        if cmd == zmq_codec.NEGOTIATE_CODEC:
+            return self.negotiate_codec(*msg.get('args', ()))
+        if cmd == 'get_event_queue_metrics':
+            return self.events.metrics()
+        if cmd == 'attach_ring':
+            return self.attach_ring(*msg.get('args', ()), **msg.get('kwargs', {}))
+        if cmd == 'detach_ring':
+            return self.detach_ring()
+        if cmd == 'configure_event_queue':
+            try:
+                self.events.configure(*msg.get('args', ()), **msg.get('kwargs', {}))
+            except Exception as e:
+                return e
+            return self.events.metrics()
+        return driver_process.DriverProcess.cmd_driver(self, msg)
+
+    def negotiate_codec(self, codecs):
+        """
+        Choose the codec events are published with. The event socket is
+        shared by all subscribers, so the last client to negotiate decides.
+        @param codecs Codec names the client can decode, in order of
+        preference
+        @retval dict with the chosen codec name and whether requests may be
+        tagged with ids and pipelined
+        """
+        name = zmq_codec.choose_codec(codecs)
+        self.event_codec = zmq_codec.get_codec(name)
+        log.info('Driver process publishing events with the %s codec', name)
+        return {'codec': name, 'pipelined': True}
+
+    def attach_ring(self, capacity=particle_ring.DEFAULT_CAPACITY):
+        """
+        Publish events through a shared memory ring, for a client on the
+        same host. The ring stays attached until detach_ring or until the
+        last client unsubscribes from the event socket.
+        @param capacity Ring size in bytes
+        @retval dict with the ring path and capacity, or the exception if
+        a ring could not be created
+        """
+        if self.ring is None:
+            try:
+                self.ring = particle_ring.ParticleRing.create(capacity)
+            except Exception as e:
+                log.warn('Driver process could not create a particle ring: %s', e)
+                return e
+            log.info('Driver process publishing events through %s', self.ring.path)
+            _signal_pipe(self._event_pipe[1])
+        return {'path': self.ring.path, 'capacity': self.ring.capacity}
+
+    def detach_ring(self):
+        """
+        Go back to publishing events on the socket. Events in the ring
+        that were not read are lost.
+        """
+        if self.ring is not None:
+            self._detached_rings.append(self.ring)
+            self.ring = None
+            _signal_pipe(self._event_pipe[1])
+        return 'detach_ring'
+
+    def send_event(self, evt):
+        """
+        Queue an event and wake the event thread to publish it.
+        """
+        self.events.append(evt)
+        if not self._event_signaled:
+            self._event_signaled = True
+            _signal_pipe(self._event_pipe[1])
     
     def stop_messaging(self):
         """
         Close messaging resource for the driver. Set flags to cause
-        command and event threads to close sockets and conclude.
+        command and event threads to close sockets and conclude, and wake
+        them through the stop pipe, which is never drained.
         """
         self.stop_cmd_thread = True
         self.stop_evt_thread = True
         self.messaging_started = False
+        _signal_pipe(self._stop_pipe[1])
     
     def shutdown(self):
         """
         Shutdown function prior to process exit.
         """
         driver_process.DriverProcess.shutdown(self)
+        self.events.close()
+        # the event thread may still be writing to the ring
+        if self.evt_thread is not None:
+            self.evt_thread.join(1)
+        for ring in self._detached_rings + [self.ring]:
+            if ring is not None:
+                ring.close(remove=True)
+        self.ring = None
 
     
     
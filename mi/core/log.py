@@ -28,8 +28,9 @@ import logging
 import os
 import sys
 import yaml
+import weakref
 import pkg_resources
-from types import FunctionType
+from types import FunctionType, ModuleType
 from functools import wraps
 
 from mi.core.common import Singleton
@@ -77,21 +78,123 @@ class LoggerManager(Singleton):
             if debug:
                 print >> sys.stderr, str(os.getpid()) + ' supplemented logging from ' + LOGGING_CONTAINER_OVERRIDE
 
+        refresh_method_tracing()
+
+
+# ooi.logging's TRACE level, used if the name hasn't been registered
+TRACE = 5
+
+# class : _MethodTracing for each class built by a logging metaclass
+_traced_classes = weakref.WeakKeyDictionary()
+
+
+def _level_number(log_level):
+    level = logging.getLevelName(log_level.upper())
+    if isinstance(level, int):
+        return level
+    return TRACE if log_level == 'trace' else logging.NOTSET
+
+
+def _trace_wrapper(func, func_name, logger, log_level):
+    emit = getattr(logger, log_level)
+
+    @wraps(func)
+    def inner(*args, **kwargs):
+        emit('entered %s | args: %r | kwargs: %r', func_name, args, kwargs)
+        r = func(*args, **kwargs)
+        emit('exiting %s | returning %r', func_name, r)
+        return r
+    return inner
+
+
+class _MethodTracing(object):
+    """
+    The methods of one traced class, kept unwrapped so tracing can be
+    switched by swapping the class attributes.
+    """
+
+    def __init__(self, cls, logger, log_level, methods):
+        self.logger = logger
+        self.log_level = log_level
+        self.level = _level_number(log_level)
+        self.methods = methods
+        # True or False if switched explicitly, None to follow the logger
+        self.forced = None
+        self.enabled = False
+        self.apply(cls)
+
+    def apply(self, cls):
+        enabled = self.forced
+        if enabled is None:
+            enabled = self.logger.isEnabledFor(self.level)
+        if enabled == self.enabled:
+            return
+        for (name, func) in self.methods.iteritems():
+            if enabled:
+                func = _trace_wrapper(func, '%s.%s' % (cls.__name__, name), self.logger, self.log_level)
+            setattr(cls, name, func)
+        self.enabled = enabled
+
 
 def get_logging_metaclass(log_level='trace'):
+    """
+    Metaclass that logs entry to and exit from every method defined in
+    the class. Whether the methods are wrapped is decided when the class
+    is created, from the level of its module's logger, and again by
+    set_method_tracing(); with tracing off they are called directly.
+    @param log_level Name of the logger method to log with
+    """
     class LoggingMetaClass(type):
         def __new__(mcs, class_name, bases, class_dict):
-            wrapper = log_method(class_name=class_name, log_level=log_level)
-            new_class_dict = {}
-            for attributeName, attribute in class_dict.items():
-                if type(attribute) == FunctionType:
-                    attribute = wrapper(attribute)
-                new_class_dict[attributeName] = attribute
-            return type.__new__(mcs, class_name, bases, new_class_dict)
+            cls = type.__new__(mcs, class_name, bases, class_dict)
+            methods = dict((name, attribute) for (name, attribute) in class_dict.items()
+                           if type(attribute) == FunctionType)
+            logger = logging.getLogger(class_dict.get('__module__', 'UNKNOWN_MODULE_NAME'))
+            _traced_classes[cls] = _MethodTracing(cls, logger, log_level, methods)
+            return cls
     return LoggingMetaClass
 
 
+def set_method_tracing(target=None, enabled=None):
+    """
+    Switch method tracing at runtime for classes built by a logging
+    metaclass.
+    @param target A class, a module or module name covering the traced
+    classes defined in it and its sub modules, or None for all of them
+    @param enabled True to trace, False not to, None to follow the level
+    of each class's logger again
+    @retval The number of traced classes matched
+    """
+    if isinstance(target, ModuleType):
+        target = target.__name__
+    count = 0
+    for (cls, tracing) in _traced_classes.items():
+        if isinstance(target, basestring):
+            if cls.__module__ != target and not cls.__module__.startswith(target + '.'):
+                continue
+        elif target is not None and cls is not target:
+            continue
+        tracing.forced = enabled
+        tracing.apply(cls)
+        count += 1
+    return count
+
+
+def refresh_method_tracing():
+    """
+    Re-check the logger levels of traced classes that haven't been
+    switched explicitly, after the logging configuration changes.
+    """
+    for (cls, tracing) in _traced_classes.items():
+        tracing.apply(cls)
+
+
 def log_method(class_name=None, log_level='trace'):
+    """
+    Decorator logging entry to and exit from a function. Whether to wrap
+    is decided when the function is decorated: if the calling module's
+    logger isn't enabled for log_level the function is returned as is.
+    """
     name = "UNKNOWN_MODULE_NAME"
     stack = inspect.stack()
     # step through the stack until we leave mi.core.log
@@ -104,18 +207,13 @@ def log_method(class_name=None, log_level='trace'):
     logger = logging.getLogger(name)
 
     def wrapper(func):
+        if not logger.isEnabledFor(_level_number(log_level)):
+            return func
         if class_name is not None:
             func_name = '%s.%s' % (class_name, func.__name__)
         else:
             func_name = func.__name__
-
-        @wraps(func)
-        def inner(*args, **kwargs):
-            getattr(logger, log_level)('entered %s | args: %r | kwargs: %r', func_name, args, kwargs)
-            r = func(*args, **kwargs)
-            getattr(logger, log_level)('exiting %s | returning %r', func_name, r)
-            return r
-        return inner
+        return _trace_wrapper(func, func_name, logger, log_level)
 
     return wrapper
 
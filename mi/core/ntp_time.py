@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.ntp_time
+@file mi/core/ntp_time.py
+@brief Bulk conversion of instrument times to NTP.
+
+Parsers that build many particles at once convert all their record times
+in one call here, instead of calling ntplib once per record. Times count
+seconds from one of the instrument epochs in Epoch and are converted to
+NTP64 floats, or to NTP64 packed into 64 bit integers, 32 bits of seconds
+and 32 of fraction.
+
+Large batches are converted with numpy when it is installed. The pure
+python conversion does the same float operations in the same order, so
+both give identical results, and the same as ntplib.system_to_ntp_time
+does for unix times.
+"""
+
+__license__ = 'Apache 2.0'
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from mi.core.common import BaseEnum
+
+
+class Epoch(BaseEnum):
+    UNIX = 'unix'          # 1970-01-01
+    MAC = 'mac'            # 1904-01-01, SAMI and other Mac based loggers
+    SBE = 'sbe'            # 2000-01-01, Sea-Bird
+    GPS = 'gps'            # 1980-01-06, GPS time, see the leap_seconds parameter
+    NTP = 'ntp'            # 1900-01-01
+
+# seconds from the NTP epoch to each epoch
+EPOCH_OFFSETS = {
+    Epoch.UNIX: 2208988800,
+    Epoch.MAC: 126144000,
+    Epoch.SBE: 3155673600,
+    Epoch.GPS: 2524953600,
+    Epoch.NTP: 0,
+}
+
+# batches smaller than this aren't worth the numpy array round trip
+NUMPY_MIN_VALUES = 64
+
+FRACTION = 4294967296.0
+FRACTION_MASK = 0xFFFFFFFF
+
+
+def _offset(epoch, leap_seconds):
+    try:
+        return float(EPOCH_OFFSETS[epoch] - leap_seconds)
+    except KeyError:
+        raise ValueError("Unknown epoch '%s'" % epoch)
+
+def _use_numpy(values):
+    return numpy is not None and (isinstance(values, numpy.ndarray) or len(values) >= NUMPY_MIN_VALUES)
+
+def to_ntp(values, epoch=Epoch.UNIX, leap_seconds=0):
+    """
+    Convert times to NTP64 floats.
+    @param values Sequence or numpy array of seconds since the epoch
+    @param epoch Epoch the values count from
+    @param leap_seconds Seconds the time scale is ahead of UTC, for GPS
+    times the GPS-UTC offset when they were taken (16 in 2013)
+    @retval List of NTP timestamps
+    @raises ValueError for an unknown epoch
+    """
+    offset = _offset(epoch, leap_seconds)
+    if _use_numpy(values):
+        return (numpy.asarray(values, dtype=numpy.float64) + offset).tolist()
+    return [float(value) + offset for value in values]
+
+def from_ntp(timestamps, epoch=Epoch.UNIX, leap_seconds=0):
+    """
+    Convert NTP64 floats to seconds since the epoch.
+    @param timestamps Sequence or numpy array of NTP timestamps
+    @param epoch Epoch to count from
+    @param leap_seconds Seconds the time scale is ahead of UTC
+    @retval List of seconds since the epoch
+    @raises ValueError for an unknown epoch
+    """
+    offset = _offset(epoch, leap_seconds)
+    if _use_numpy(timestamps):
+        return (numpy.asarray(timestamps, dtype=numpy.float64) - offset).tolist()
+    return [float(timestamp) - offset for timestamp in timestamps]
+
+def to_ntp_packed(values, epoch=Epoch.UNIX, leap_seconds=0):
+    """
+    Convert times to NTP64 packed in integers, seconds in the upper 32
+    bits and the fraction of a second in the lower 32, as ntplib's
+    _to_int and _to_frac split them.
+    @param values Sequence or numpy array of seconds since the epoch
+    @param epoch Epoch the values count from
+    @param leap_seconds Seconds the time scale is ahead of UTC
+    @retval List of packed NTP timestamps
+    @raises ValueError for an unknown epoch
+    """
+    offset = _offset(epoch, leap_seconds)
+    if _use_numpy(values):
+        timestamps = numpy.asarray(values, dtype=numpy.float64) + offset
+        seconds = numpy.floor(timestamps)
+        fractions = numpy.floor((timestamps - seconds) * FRACTION)
+        return ((seconds.astype(numpy.uint64) << numpy.uint64(32)) | fractions.astype(numpy.uint64)).tolist()
+
+    result = []
+    for value in values:
+        timestamp = float(value) + offset
+        seconds = int(timestamp)
+        result.append(seconds << 32 | int((timestamp - seconds) * FRACTION))
+    return result
+
+def packed_to_ntp(packed):
+    """
+    Convert packed NTP64 integers to NTP64 floats.
+    @param packed Sequence or numpy array of packed NTP timestamps
+    @retval List of NTP timestamps
+    """
+    if _use_numpy(packed):
+        packed = numpy.asarray(packed, dtype=numpy.uint64)
+        return ((packed >> numpy.uint64(32)).astype(numpy.float64) +
+                (packed & numpy.uint64(FRACTION_MASK)).astype(numpy.float64) / FRACTION).tolist()
+    return [(value >> 32) + (value & FRACTION_MASK) / FRACTION for value in packed]
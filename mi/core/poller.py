@@ -1,13 +1,46 @@
 """
 polling utilities -- general polling for condition, polling for file to appear in a directory
+
+on linux DirectoryPoller is told about new files by inotify instead of globbing the directory
+every interval, so new files are found straight away and an idle poller doesn't use any CPU.
 """
 import os
 import glob
-from threading import Thread
+import select
+import fnmatch
+from threading import Thread, Lock
 from gevent.event import Event
 from ooi.logging import log
 from Queue import Queue
 
+from mi.core import inotify
+
+# file systems where inotify doesn't hear about changes made by other hosts
+NETWORK_FILE_SYSTEMS = frozenset(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs', 'ncpfs', 'coda',
+                                  '9p', 'fuse.sshfs', 'glusterfs', 'fuse.glusterfs', 'lustre', 'gpfs', 'ceph'])
+
+def file_system_type(path, mounts='/proc/mounts'):
+    """
+    @param path path to look up
+    @param mounts mount table to look it up in
+    @retval type of the file system the path is on, or None if not known
+    """
+    path = os.path.realpath(path)
+    found = (None, None)
+    try:
+        with open(mounts) as table:
+            for line in table:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+                    if found[0] is None or len(mount_point) > len(found[0]):
+                        found = (mount_point, fields[2])
+    except IOError:
+        pass
+    return found[1]
+
 class ConditionPoller(Thread):
     """
     generic polling mechanism: every interval seconds, check if condition returns a true value. if so, pass the value to callback
@@ -31,9 +64,12 @@ class ConditionPoller(Thread):
         try:
             while not self._shutdown_now.is_set():
                 self._check_condition()
-                self._shutdown_now.wait(self.polling_interval)
+                self._wait()
         except:
             log.error('thread failed', exc_info=True)
+    def _wait(self):
+        """ wait until the condition should be checked again, or shutdown """
+        self._shutdown_now.wait(self.polling_interval)
     def _check_condition(self):
         try:
             value = self._condition()
@@ -51,14 +87,144 @@ class DirectoryPoller(ConditionPoller):
     """
     poll for new files added to a directory that match a wildcard pattern.
     expects files to be added only, and added in ASCII order.
+
+    where it can, the poller watches the directory with inotify and only globs it once at the
+    start and again if events are lost or files are removed. it polls every interval instead
+    where inotify isn't available, the directory is on a network file system, or the directory
+    or wildcard span more than one directory. if the directory is removed or moved away the
+    watch ends; the poller watches the directory again if it is back, or else polls every
+    interval until it is.
     """
-    def __init__(self, directory, wildcard, callback, exception_callback=None, interval=1):
+    # events that bring a file into the directory
+    NEW_FILE_EVENTS = inotify.IN_CREATE | inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO
+    # events that take one out, checked with a full scan
+    REMOVED_FILE_EVENTS = inotify.IN_DELETE | inotify.IN_MOVED_FROM
+    # events that mean the directory itself has gone
+    WATCH_ENDED_EVENTS = inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_IGNORED
+
+    def __init__(self, directory, wildcard, callback, exception_callback=None, interval=1, use_inotify=True):
         self._directory = directory
+        self._wildcard = wildcard
         self._path = directory + '/' + wildcard
         self._last_filename = None
+        self._inotify = None
+        self._new_names = set()
+        self._scan = True
+        # set when the watch has ended and the directory is to be watched again once it is back
+        self._rewatch = False
+        # shutdown() writes to the pipe to wake _wait()
+        self._wake_read = self._wake_write = None
+        self._wake_lock = Lock()
         super(DirectoryPoller,self).__init__(self._check_for_files, callback, exception_callback, interval)
+        if use_inotify:
+            self._watch()
+
+    def _watch(self):
+        """
+        watch the directory with inotify if it will tell us about new files
+        @retval True if the directory is being watched
+        """
+        if glob.has_magic(self._directory) or '/' in self._wildcard or not os.path.isdir(self._directory):
+            return False
+        fs_type = file_system_type(self._directory)
+        if fs_type in NETWORK_FILE_SYSTEMS:
+            log.debug('polling %s, inotify does not work on %s', self._directory, fs_type)
+            return False
+        try:
+            watcher = inotify.Inotify()
+        except inotify.InotifyUnavailable as e:
+            log.debug('polling %s: %s', self._directory, e)
+            return False
+        try:
+            watcher.add_watch(self._directory, self.NEW_FILE_EVENTS | self.REMOVED_FILE_EVENTS |
+                                               inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF | inotify.IN_ONLYDIR)
+        except (inotify.InotifyUnavailable, OSError) as e:
+            log.debug('polling %s: %s', self._directory, e)
+            watcher.close()
+            return False
+        with self._wake_lock:
+            self._inotify = watcher
+            (self._wake_read, self._wake_write) = os.pipe()
+        log.debug('watching %s with inotify', self._directory)
+        return True
+
+    def _unwatch(self):
+        """ stop watching the directory with inotify """
+        with self._wake_lock:
+            if self._inotify:
+                self._inotify.close()
+                os.close(self._wake_read)
+                os.close(self._wake_write)
+                self._inotify = None
+                self._wake_read = self._wake_write = None
+
+    def shutdown(self):
+        super(DirectoryPoller,self).shutdown()
+        with self._wake_lock:
+            if self._wake_write is not None:
+                os.write(self._wake_write, 'x')
+
+    def run(self):
+        try:
+            super(DirectoryPoller,self).run()
+        finally:
+            self._unwatch()
+
+    def _wait(self):
+        if not self._inotify:
+            super(DirectoryPoller,self)._wait()
+            if self._rewatch and not self._shutdown_now.is_set() and self._watch():
+                # files may have come while it wasn't watched
+                self._rewatch = False
+                self._scan = True
+            return
+        (readable, writable, errors) = select.select([self._inotify.fd, self._wake_read], [], [])
+        if self._inotify.fd not in readable:
+            return
+        watch_ended = False
+        for event in self._inotify.read_events():
+            if event.mask & (inotify.IN_Q_OVERFLOW | self.WATCH_ENDED_EVENTS):
+                self._scan = True
+                if event.mask & self.WATCH_ENDED_EVENTS:
+                    watch_ended = True
+            elif self._matches(event.name):
+                if event.mask & self.REMOVED_FILE_EVENTS:
+                    self._scan = True
+                else:
+                    self._new_names.add(event.name)
+        if watch_ended:
+            log.debug('watch on %s ended', self._directory)
+            self._unwatch()
+            if not self._watch():
+                # gone for now: look again after an interval, as polling would
+                self._rewatch = True
+                self._wait()
+
+    def _matches(self, name):
+        # glob leaves out hidden files unless the wildcard asks for them
+        if name.startswith('.') and not self._wildcard.startswith('.'):
+            return False
+        return fnmatch.fnmatch(name, self._wildcard)
 
     def _check_for_files(self):
+        if not self._inotify or self._scan:
+            self._scan = False
+            self._new_names.clear()
+            return self._scan_for_files()
+
+        # the names glob would have given for the new files
+        directory = os.path.split(self._path)[0]
+        filenames = sorted(os.path.join(directory, name) for name in self._new_names)
+        self._new_names.clear()
+        if self._last_filename:
+            filenames = [filename for filename in filenames if filename > self._last_filename]
+        if not filenames:
+            return None
+        self._last_filename = filenames[-1]
+        log.trace('found files: %r', filenames)
+        return filenames
+
+    def _scan_for_files(self):
         if not os.path.isdir(self._directory):
             raise ValueError('%s is not a directory' % self._directory)
 
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_log
+@file mi/core/test/test_log.py
+@brief Test cases for method tracing in mi.core.log
+"""
+
+__license__ = 'Apache 2.0'
+
+import sys
+import time
+import logging
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+
+from mi.core.log import get_logging_metaclass, log_method, set_method_tracing, refresh_method_tracing
+from mi.core.log import _traced_classes
+
+logger = logging.getLogger(__name__)
+
+
+class Named(object):
+    def __repr__(self):
+        return '<traced>'
+
+
+class Traced(Named):
+    __metaclass__ = get_logging_metaclass(log_level='debug')
+
+    def double(self, value):
+        return value * 2
+
+    @staticmethod
+    def triple(value):
+        return value * 3
+
+
+class TracedChild(Traced):
+    def half(self, value):
+        return value / 2
+
+
+class Handler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+@attr('UNIT', group='mi')
+class TestUnitMethodTracing(MiUnitTest):
+
+    def setUp(self):
+        self.handler = Handler()
+        logger.addHandler(self.handler)
+        self.addCleanup(logger.removeHandler, self.handler)
+        self.level = logger.level
+        self.addCleanup(self.restore)
+        logger.setLevel(logging.WARNING)
+        set_method_tracing(sys.modules[__name__], None)
+
+    def restore(self):
+        logger.setLevel(self.level)
+        set_method_tracing(sys.modules[__name__], None)
+
+    def assertWrapped(self, cls, name, wrapped):
+        original = _traced_classes[cls].methods[name]
+        self.assertEqual(cls.__dict__[name] is not original, wrapped)
+
+    def test_disabled(self):
+        # nothing logged and nothing in the way
+        self.assertWrapped(Traced, 'double', False)
+        self.assertWrapped(TracedChild, 'half', False)
+        self.assertEqual(Traced().double(2), 4)
+        self.assertEqual(Traced.triple(2), 6)
+        self.assertEqual(self.handler.messages, [])
+
+    def test_switch(self):
+        # changing the level alone doesn't wrap anything
+        logger.setLevel(logging.DEBUG)
+        self.assertWrapped(Traced, 'double', False)
+        self.assertEqual(set_method_tracing(Traced, True), 1)
+        self.assertWrapped(Traced, 'double', True)
+        self.assertWrapped(TracedChild, 'half', False)
+        self.assertEqual(TracedChild().double(2), 4)
+        self.assertEqual(self.handler.messages,
+                         ["entered Traced.double | args: (<traced>, 2) | kwargs: {}",
+                          "exiting Traced.double | returning 4"])
+
+        # by module, sub modules included
+        del self.handler.messages[:]
+        self.assertEqual(set_method_tracing('mi.core', True), len([c for c in _traced_classes.keys()
+                                                                  if c.__module__.startswith('mi.core.')]))
+        self.assertWrapped(TracedChild, 'half', True)
+        set_method_tracing(__name__, False)
+        self.assertWrapped(Traced, 'double', False)
+        self.assertWrapped(TracedChild, 'half', False)
+        TracedChild().half(4)
+        self.assertEqual(self.handler.messages, [])
+
+        # following the logger level again
+        logger.setLevel(logging.WARNING)
+        set_method_tracing(__name__)
+        self.assertWrapped(Traced, 'double', False)
+        logger.setLevel(logging.DEBUG)
+        refresh_method_tracing()
+        self.assertWrapped(Traced, 'double', True)
+        self.assertWrapped(TracedChild, 'half', True)
+        TracedChild().half(4)
+        self.assertEqual(len(self.handler.messages), 2)
+
+    def test_log_method(self):
+        def plain(value):
+            return value
+        self.assertTrue(log_method(log_level='debug')(plain) is plain)
+        logger.setLevel(logging.DEBUG)
+        wrapped = log_method(log_level='debug')(plain)
+        self.assertFalse(wrapped is plain)
+        self.assertEqual(wrapped(1), 1)
+        self.assertEqual(self.handler.messages,
+                         ['entered plain | args: (1,) | kwargs: {}', 'exiting plain | returning 1'])
+
+    def test_overhead(self):
+        count = 100000
+        traced = Traced()
+        timings = []
+        for enabled in (False, True):
+            # enabled with the logger off is what every call used to cost
+            set_method_tracing(Traced, enabled)
+            start = time.time()
+            for i in xrange(count):
+                traced.double(i)
+            timings.append((time.time() - start) * 1e6 / count)
+        logger.info("Method call: %.2f us untraced, %.2f us wrapped with tracing off", *timings)
+        self.assertLess(timings[0], timings[1])
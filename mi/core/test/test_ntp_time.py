@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_ntp_time
+@file mi/core/test/test_ntp_time.py
+@brief Test cases for the bulk NTP time conversions
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import random
+import datetime
+import unittest
+
+import ntplib
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+from mi.core.log import get_logger ; log = get_logger()
+
+import mi.core.ntp_time
+from mi.core.ntp_time import Epoch, EPOCH_OFFSETS, to_ntp, from_ntp, to_ntp_packed, packed_to_ntp
+
+
+@attr('UNIT', group='mi')
+class TestUnitNtpTime(MiUnitTest):
+
+    def setUp(self):
+        generator = random.Random(1)
+        self.unix_times = [generator.uniform(1.3e9, 1.5e9) for i in range(1000)] + [0, 1, 1388534400]
+
+    def without_numpy(self):
+        self.addCleanup(setattr, mi.core.ntp_time, 'numpy', mi.core.ntp_time.numpy)
+        mi.core.ntp_time.numpy = None
+
+    def test_epochs(self):
+        ntp_epoch = datetime.datetime(1900, 1, 1)
+        for (epoch, start) in ((Epoch.UNIX, datetime.datetime(1970, 1, 1)),
+                               (Epoch.MAC, datetime.datetime(1904, 1, 1)),
+                               (Epoch.SBE, datetime.datetime(2000, 1, 1)),
+                               (Epoch.GPS, datetime.datetime(1980, 1, 6)),
+                               (Epoch.NTP, ntp_epoch)):
+            delta = start - ntp_epoch
+            self.assertEqual(EPOCH_OFFSETS[epoch], delta.days * 86400)
+            self.assertEqual(to_ntp([0, 1.5], epoch), [delta.days * 86400.0, delta.days * 86400 + 1.5])
+
+        self.assertEqual(to_ntp([100], Epoch.GPS, leap_seconds=16), [2524953684.0])
+        self.assertEqual(from_ntp(to_ntp([100], Epoch.SBE), Epoch.SBE), [100.0])
+        self.assertRaises(ValueError, to_ntp, [0], 'julian')
+
+    def test_ntplib(self):
+        """
+        The same as ntplib for unix times, with and without numpy.
+        """
+        expected = [float(ntplib.system_to_ntp_time(t)) for t in self.unix_times]
+        packed = [ntplib._to_int(t) << 32 | ntplib._to_frac(t) for t in expected]
+        self.assertEqual(to_ntp(self.unix_times), expected)
+        self.assertEqual(to_ntp_packed(self.unix_times), packed)
+        self.assertEqual(packed_to_ntp(packed), [ntplib._to_time(p >> 32, p & 0xFFFFFFFF) for p in packed])
+
+        self.without_numpy()
+        self.assertEqual(to_ntp(self.unix_times), expected)
+        self.assertEqual(to_ntp_packed(self.unix_times), packed)
+        self.assertEqual(from_ntp(expected), [t - 2208988800.0 for t in expected])
+
+    @unittest.skipIf(mi.core.ntp_time.numpy is None, 'numpy not installed')
+    def test_numpy(self):
+        """
+        numpy arrays in, and numpy and python giving identical results.
+        """
+        numpy = mi.core.ntp_time.numpy
+        array = numpy.array(self.unix_times)
+        results = [to_ntp(array, Epoch.MAC), to_ntp_packed(array, Epoch.SBE), from_ntp(array, Epoch.GPS, 16)]
+        packed = numpy.array(results[1], dtype=numpy.uint64)
+        results.append(packed_to_ntp(packed))
+        self.without_numpy()
+        self.assertEqual(results, [to_ntp(self.unix_times, Epoch.MAC), to_ntp_packed(self.unix_times, Epoch.SBE),
+                                   from_ntp(self.unix_times, Epoch.GPS, 16), packed_to_ntp(results[1])])
+
+    def test_rate(self):
+        times = self.unix_times * 100
+        start = time.time()
+        expected = [ntplib.system_to_ntp_time(t) for t in times]
+        one_at_a_time = time.time() - start
+        start = time.time()
+        self.assertEqual(to_ntp(times), expected)
+        log.info("NTP conversion of %d times: %.1f ms one at a time, %.1f ms bulk (numpy %s)", len(times),
+                 one_at_a_time * 1000, (time.time() - start) * 1000, mi.core.ntp_time.numpy is not None)
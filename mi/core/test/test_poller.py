@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_poller
+@file mi/core/test/test_poller.py
+@brief Test cases for the directory poller
+"""
+
+__license__ = 'Apache 2.0'
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from Queue import Queue
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+from mi.core.log import get_logger ; log = get_logger()
+
+from mi.core import inotify
+from mi.core.poller import DirectoryPoller, file_system_type
+
+try:
+    inotify.Inotify().close()
+    HAVE_INOTIFY = True
+except inotify.InotifyUnavailable:
+    HAVE_INOTIFY = False
+
+
+@attr('UNIT', group='mi')
+class TestUnitDirectoryPoller(MiUnitTest):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.found = Queue()
+        self.errors = Queue()
+
+    def start_poller(self, wildcard='*.DAT', interval=.1, use_inotify=True):
+        poller = DirectoryPoller(self.directory, wildcard, self.on_files, self.errors.put, interval, use_inotify)
+        poller.start()
+        self.addCleanup(poller.join, 2)
+        self.addCleanup(poller.shutdown)
+        return poller
+
+    def on_files(self, filenames):
+        now = time.time()
+        for filename in filenames:
+            self.found.put((filename, now))
+
+    def write(self, name):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        return path
+
+    def get_found(self, count, timeout=2):
+        return [self.found.get(timeout=timeout)[0] for i in range(count)]
+
+    def check_new_files(self, poller):
+        self.write('A001.DAT')
+        self.write('A002.DAT')
+        self.assertEqual(self.get_found(2), [os.path.join(self.directory, 'A001.DAT'),
+                                             os.path.join(self.directory, 'A002.DAT')])
+        # moved in, not matching, hidden, and older than the last file seen
+        self.write('.A003.DAT')
+        self.write('A004.TXT')
+        self.write('A000.DAT')
+        os.rename(self.write('A005.tmp'), os.path.join(self.directory, 'A005.DAT'))
+        self.assertEqual(self.get_found(1), [os.path.join(self.directory, 'A005.DAT')])
+        time.sleep(.3)
+        self.assertTrue(self.found.empty())
+
+        # removing the last file stops the poller as it always has
+        os.remove(os.path.join(self.directory, 'A005.DAT'))
+        self.assertIsInstance(self.errors.get(timeout=2), ValueError)
+        poller.join(2)
+        self.assertFalse(poller.is_alive())
+
+    @unittest.skipUnless(HAVE_INOTIFY, 'no inotify')
+    def test_inotify(self):
+        self.write('A000.DAT')
+        poller = self.start_poller(interval=3600)
+        self.assertTrue(poller._inotify)
+        self.assertEqual(self.get_found(1), [os.path.join(self.directory, 'A000.DAT')])
+        os.remove(os.path.join(self.directory, 'A000.DAT'))
+        self.assertIsInstance(self.errors.get(timeout=2), ValueError)
+
+        self.errors = Queue()
+        self.check_new_files(self.start_poller(interval=3600))
+
+    @unittest.skipUnless(HAVE_INOTIFY, 'no inotify')
+    def test_directory_replaced(self):
+        """
+        When the directory is removed the watch ends; a directory made in its place
+        is watched again, and one made after an interval is found by polling.
+        """
+        poller = self.start_poller(interval=.5)
+        time.sleep(.2)
+        os.rmdir(self.directory)
+        os.mkdir(self.directory)
+        self.write('A001.DAT')
+        self.assertEqual(self.get_found(1), [os.path.join(self.directory, 'A001.DAT')])
+        self.assertTrue(poller._inotify)
+
+        os.rename(self.directory, self.directory + '.old')
+        self.addCleanup(shutil.rmtree, self.directory + '.old')
+        time.sleep(.2)
+        os.mkdir(self.directory)
+        shutil.copy(os.path.join(self.directory + '.old', 'A001.DAT'), self.directory)
+        self.write('A002.DAT')
+        self.assertEqual(self.get_found(1), [os.path.join(self.directory, 'A002.DAT')])
+        time.sleep(.7)
+        self.assertTrue(poller._inotify)
+        self.write('A003.DAT')
+        self.assertEqual(self.get_found(1, timeout=.3), [os.path.join(self.directory, 'A003.DAT')])
+        self.assertTrue(self.errors.empty())
+
+    def test_polling(self):
+        poller = self.start_poller(use_inotify=False)
+        self.assertFalse(poller._inotify)
+        self.check_new_files(poller)
+
+    def test_fallback(self):
+        """
+        Directories inotify can't watch are polled.
+        """
+        self.assertFalse(DirectoryPoller(self.directory + '/*', '*.DAT', None)._inotify)
+        self.assertFalse(DirectoryPoller(self.directory, '*/*.DAT', None)._inotify)
+        self.assertFalse(DirectoryPoller(self.directory + '/missing', '*.DAT', None)._inotify)
+
+        mounts = os.path.join(self.directory, 'mounts')
+        with open(mounts, 'w') as f:
+            f.write('/dev/sda1 / ext4 rw 0 0\n'
+                    'server:/export /mnt/data nfs4 rw 0 0\n'
+                    'server:/export2 /mnt/data\\040two cifs rw 0 0\n')
+        self.assertEqual(file_system_type('/mnt/data/instrument', mounts), 'nfs4')
+        self.assertEqual(file_system_type('/mnt/data', mounts), 'nfs4')
+        self.assertEqual(file_system_type('/mnt/data two/x', mounts), 'cifs')
+        self.assertEqual(file_system_type('/mnt/database', mounts), 'ext4')
+
+        shutdown = DirectoryPoller(self.directory, '*.DAT', None)
+        shutdown.start()
+        shutdown.shutdown()
+        shutdown.join(2)
+        self.assertFalse(shutdown.is_alive())
+
+    @unittest.skipUnless(HAVE_INOTIFY, 'no inotify')
+    def test_large_directory(self):
+        """
+        Detection latency and idle CPU watching a directory of 50000 files,
+        polling every half second against inotify.
+        """
+        for i in range(50000):
+            open(os.path.join(self.directory, 'A%06d.DAT' % i), 'w').close()
+
+        results = {}
+        for use_inotify in (False, True):
+            self.found = Queue()
+            poller = self.start_poller(interval=.5, use_inotify=use_inotify)
+            files = len(os.listdir(self.directory))
+            self.assertEqual(len(self.get_found(files, timeout=10)), files)
+
+            start = os.times()
+            time.sleep(2)
+            end = os.times()
+            idle_cpu = (end[0] - start[0]) + (end[1] - start[1])
+
+            latencies = []
+            for i in range(5):
+                time.sleep(.13)
+                created = time.time()
+                self.write('B%d%06d.DAT' % (use_inotify, i))
+                latencies.append(self.found.get(timeout=5)[1] - created)
+            poller.shutdown()
+            poller.join(2)
+            results[use_inotify] = (idle_cpu, sum(latencies) / len(latencies))
+
+        log.info("DirectoryPoller with 50000 files: polling %.3fs CPU idle for 2s, %.1f ms mean latency; "
+                 "inotify %.3fs CPU idle, %.1f ms mean latency",
+                 results[False][0], results[False][1] * 1000, results[True][0], results[True][1] * 1000)
+        self.assertLess(results[True][0], results[False][0])
+        self.assertLess(results[True][1], results[False][1])
+        self.assertLess(results[True][1], .1)
@@ -15,7 +15,9 @@ from mi.core.time import *
 import unittest
 from mi.core.unit_test import MiUnitTest
 import datetime
+import calendar
 import time as system_time
+import mi.core.time
 from mi.idk.exceptions import InvalidParameters
 
 @attr('UNIT', group='mi')
@@ -65,3 +67,110 @@ class TestTime(MiUnitTest):
             now = datetime.datetime.utcnow()
             self.assertLess(now.microsecond, 100)
             system_time.sleep(0.1)
+
+
+# Timestamps from the driver and parser tests, with the time they stand for
+TIMESTAMP_CORPUS = [
+    ('2013-02-05T19:11:43Z', 'iso8601', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('2013-02-05T19:11:43.123Z', 'iso8601', datetime.datetime(2013, 2, 5, 19, 11, 43, 123000)),
+    ('2013-02-05T19:11:43.1234567', 'iso8601', datetime.datetime(2013, 2, 5, 19, 11, 43, 123456)),
+    ('2013-02-05 19:11:43', 'iso8601', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('2013-02-05', 'iso8601', datetime.datetime(2013, 2, 5)),
+    ('20130205T191143Z', 'iso8601_basic', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('20130205 191143', 'iso8601_basic', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('2013/05/29 00:25:36', 'year_first', datetime.datetime(2013, 5, 29, 0, 25, 36)),
+    ('2013/05/29 00:25:36.120', 'year_first', datetime.datetime(2013, 5, 29, 0, 25, 36, 120000)),
+    ('07/16/2013  09:33:06', 'year_last', datetime.datetime(2013, 7, 16, 9, 33, 6)),
+    ('16/07/2013 09:33:06', 'year_last', datetime.datetime(2013, 7, 16, 9, 33, 6)),
+    ('07/16/13\t09:33:06', 'short_year_last', datetime.datetime(2013, 7, 16, 9, 33, 6)),
+    ('05 Feb 2013 19:11:43', 'day_month_name', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('5-FEB-2013 19:11:43', 'day_month_name', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('Feb 05 2013 19:11:43', 'month_name_day', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+    ('Tue Feb  5 19:11:43 2013', 'ctime', datetime.datetime(2013, 2, 5, 19, 11, 43)),
+]
+
+
+@attr('UNIT', group='mi')
+class TestTimestampParser(MiUnitTest):
+    """
+    Test the format specific timestamp parsers
+    """
+
+    def expected(self, dt):
+        return ntplib.system_to_ntp_time(calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6)
+
+    def test_corpus(self):
+        """
+        Each layout is detected and parsed to the same time as the
+        datetime it stands for.
+        """
+        for (datestr, layout, dt) in TIMESTAMP_CORPUS:
+            parser = TimestampParser()
+            self.assertAlmostEqual(parser.to_ntp(datestr), self.expected(dt), places=6, msg=datestr)
+            self.assertEqual(parser.format, layout, datestr)
+
+    def test_matches_dateutil(self):
+        """
+        The fast parsers give exactly what dateutil does.
+        """
+        for (datestr, layout, dt) in TIMESTAMP_CORPUS:
+            for dayfirst in (False, True):
+                self.assertEqual(TimestampParser(dayfirst).to_ntp(datestr),
+                                 mi.core.time._dateutil_to_ntp(datestr, dayfirst), datestr)
+
+    def test_cached_format(self):
+        parser = TimestampParser()
+        first = parser.to_ntp('05 Feb 2013 19:11:43')
+        self.assertEqual(parser.to_ntp('05 Feb 2013 19:11:44'), first + 1)
+        self.assertEqual(parser.to_ntp('06 Feb 2013 19:11:43'), first + 86400)
+        # a new layout is detected again
+        self.assertEqual(parser.to_ntp('2013-02-05T19:11:45Z'), first + 2)
+        self.assertEqual(parser.format, 'iso8601')
+
+        # each call site keeps its own parser
+        self.assertEqual(timestamp_to_ntp('2013/02/05 19:11:43'), first)
+        self.assertEqual(timestamp_to_ntp('05 Feb 2013 19:11:43'), first)
+        formats = [p.format for (key, p) in mi.core.time._call_site_parsers.items()
+                   if key[0] is self.test_cached_format.im_func.func_code]
+        self.assertEqual(sorted(formats), ['day_month_name', 'year_first'])
+
+    def test_day_order(self):
+        self.assertEqual(TimestampParser().to_ntp('05/02/2013 00:00:00'),
+                         self.expected(datetime.datetime(2013, 5, 2)))
+        self.assertEqual(TimestampParser(dayfirst=True).to_ntp('05/02/2013 00:00:00'),
+                         self.expected(datetime.datetime(2013, 2, 5)))
+        self.assertEqual(TimestampParser(dayfirst=True).to_ntp('2013-05-02'),
+                         self.expected(datetime.datetime(2013, 2, 5)))
+
+    def test_fallback(self):
+        """
+        Values that aren't valid in the detected layout go to dateutil.
+        """
+        calls = []
+        def dateutil_to_ntp(datestr, dayfirst=False):
+            calls.append(datestr)
+            raise ValueError('unknown string format')
+        original = mi.core.time._dateutil_to_ntp
+        mi.core.time._dateutil_to_ntp = dateutil_to_ntp
+        self.addCleanup(setattr, mi.core.time, '_dateutil_to_ntp', original)
+
+        parser = TimestampParser()
+        parser.to_ntp('2013-02-05T19:11:43Z')
+        for datestr in ('2013-02-30T19:11:43Z', '2013-02-05T24:11:43Z', '05 Fbr 2013 19:11:43',
+                        'Bob Feb 05 19:11:43 2013', '2013-02-05T19:11:43+0100', 'not a date'):
+            self.assertRaises(ValueError, parser.to_ntp, datestr)
+        self.assertEqual(len(calls), 6)
+
+        self.assertRaises(ValueError, string_to_ntp_date_time, '2013-02-30T19:11:43Z')
+        self.assertRaises(ValueError, string_to_ntp_date_time, '05 Feb 2013 19:11:43')
+        self.assertRaises(IOError, string_to_ntp_date_time, 1)
+        self.assertEqual(string_to_ntp_date_time('2013-02-05T19:11:43.5'),
+                         self.expected(datetime.datetime(2013, 2, 5, 19, 11, 43, 500000)))
+
+    def test_speed(self):
+        count = 20000
+        timestamps = ['05 Feb 2013 %02d:%02d:%02d' % (i / 3600 % 24, i / 60 % 60, i % 60) for i in xrange(count)]
+        start = system_time.time()
+        for datestr in timestamps:
+            timestamp_to_ntp(datestr)
+        log.info("Timestamp parsing: %.2f us per value", (system_time.time() - start) * 1e6 / count)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.test.test_timer_wheel
+@file mi/core/test/test_timer_wheel.py
+@brief Test cases for the timer wheel scheduler
+"""
+
+__license__ = 'Apache 2.0'
+
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+
+from nose.plugins.attrib import attr
+from mi.core.unit_test import MiUnitTest
+from mi.core.log import get_logger ; log = get_logger()
+
+from mi.core.timer_wheel import Timer, TimerWheel, TimerService, TimerWheelScheduler
+from mi.core.driver_scheduler import DriverScheduler, DriverSchedulerConfigKey, TriggerType
+
+
+@attr('UNIT', group='mi')
+class TestUnitTimerWheel(MiUnitTest):
+
+    def test_wheel(self):
+        """
+        Timers fire at the advance that passes their deadline, whatever
+        level or the overflow they start in.
+        """
+        generator = random.Random(1)
+        # small enough that timers cascade through every level and overflow
+        wheel = TimerWheel(levels=3, slot_bits=2)
+        timers = [Timer(generator.randint(0, 200), None) for i in range(500)]
+        for timer in timers:
+            wheel.add(timer)
+        removed = timers[::7]
+        for timer in removed:
+            wheel.remove(timer)
+        self.assertEqual(len(wheel), len(timers) - len(removed))
+
+        fired = []
+        target = 0
+        while len(wheel):
+            target += generator.randint(0, 9)
+            due = wheel.advance(target)
+            self.assertTrue(all(timer.deadline <= target for timer in due))
+            self.assertEqual([timer.deadline for timer in due], sorted(timer.deadline for timer in due))
+            self.assertTrue(all(timer.slot is None for timer in due))
+            # anything left isn't due yet
+            fired += due
+            self.assertEqual(len(fired) + len(wheel), len(timers) - len(removed))
+        self.assertEqual(sorted(fired), sorted(set(timers) - set(removed)))
+
+        # late timers fire at the next advance
+        late = Timer(0, None)
+        wheel.add(late)
+        self.assertEqual(wheel.advance(wheel.now), [late])
+
+    def test_next_tick(self):
+        wheel = TimerWheel()
+        self.assertEqual(wheel.next_tick(), None)
+        wheel.add(Timer(10, None))
+        self.assertEqual(wheel.next_tick(), 10)
+        # far ahead, only the levels it moves down through wake the wheel
+        wheel = TimerWheel()
+        wheel.add(Timer(100000, None))
+        ticks = []
+        while len(wheel):
+            ticks.append(wheel.next_tick())
+            wheel.advance(ticks[-1])
+        self.assertEqual(ticks, [98304, 99968, 100000])
+
+    def test_service(self):
+        """
+        Timers due together fire in one wakeup, and nothing wakes the
+        thread while it waits.
+        """
+        service = TimerService(tick=.05)
+        self.addCleanup(service.stop)
+        fired = []
+        start = time.time()
+        for i in range(200):
+            service.schedule(start + .2 + i * .0001, lambda: fired.append(time.time()))
+        time.sleep(.4)
+        self.assertEqual(len(fired), 200)
+        self.assertGreaterEqual(min(fired), start + .2)
+        self.assertLessEqual(service.wakeups, 2)
+
+        # the idle thread wakes to pick up a new timer, then sleeps until it is due
+        timer = service.schedule(time.time() + 3600, lambda: fired.append(None))
+        time.sleep(.05)
+        wakeups = service.wakeups
+        time.sleep(.3)
+        self.assertEqual(service.wakeups, wakeups)
+        service.cancel(timer)
+        self.assertEqual(len(service), 0)
+
+        # an earlier timer wakes it
+        service.schedule(time.time() + 3600, lambda: fired.append(None))
+        event = threading.Event()
+        service.schedule(time.time() + .05, event.set)
+        event.wait(1)
+        self.assertTrue(event.is_set())
+
+    def test_scheduler(self):
+        service = TimerService(tick=.01)
+        self.addCleanup(service.stop)
+        scheduler = TimerWheelScheduler(service)
+        runs = []
+        callback = lambda name: runs.append(name)
+
+        date_job = scheduler.add_date_job(callback, datetime.now() + timedelta(seconds=.1), ['date'])
+        scheduler.add_interval_job(callback, seconds=.1, args=['interval'])
+        polled = scheduler.add_polled_job(callback, 'polled', scheduler.interval(seconds=.2),
+                                          scheduler.interval(seconds=.3), args=['polled'])
+        self.assertEqual(len(service), 0)
+        self.assertRaises(LookupError, scheduler.run_polled_job, 'polled')
+        scheduler.start()
+        self.assertEqual(len(scheduler.get_jobs()), 3)
+
+        time.sleep(.35)
+        self.assertEqual(runs.count('date'), 1)
+        self.assertNotIn(date_job, scheduler.get_jobs())
+        self.assertIn(runs.count('interval'), (2, 3))
+        self.assertEqual(runs.count('polled'), 1)
+
+        # polled runs are limited by the minimum interval and put the
+        # automatic run back
+        self.assertFalse(scheduler.run_polled_job('polled'))
+        time.sleep(.2)
+        self.assertTrue(scheduler.run_polled_job('polled'))
+        time.sleep(.05)
+        self.assertEqual(runs.count('polled'), 2)
+        self.assertEqual(polled.runs, 2)
+        self.assertRaises(ValueError, scheduler.add_polled_job, callback, 'polled', scheduler.interval(seconds=1))
+
+        scheduler.unschedule_func(callback)
+        self.assertRaises(KeyError, scheduler.unschedule_func, callback)
+        self.assertEqual(len(service), 0)
+
+    def test_driver_scheduler(self):
+        """
+        Driver schedulers share the process timer thread but not their
+        job names.
+        """
+        runs = []
+        schedulers = [DriverScheduler(), DriverScheduler()]
+        for (i, scheduler) in enumerate(schedulers):
+            scheduler.add_config({
+                'acquire_status': {
+                    DriverSchedulerConfigKey.TRIGGER: {
+                        DriverSchedulerConfigKey.TRIGGER_TYPE: TriggerType.POLLED_INTERVAL,
+                        DriverSchedulerConfigKey.MINIMAL_INTERVAL: {DriverSchedulerConfigKey.SECONDS: 1},
+                    },
+                    DriverSchedulerConfigKey.CALLBACK: lambda i=i: runs.append(i)
+                }
+            })
+        self.assertTrue(schedulers[1].run_job('acquire_status'))
+        self.assertFalse(schedulers[1].run_job('acquire_status'))
+        self.assertTrue(schedulers[0].run_job('acquire_status'))
+        time.sleep(.2)
+        self.assertEqual(sorted(runs), [0, 1])
+        self.assertTrue(schedulers[0]._scheduler._service is schedulers[1]._scheduler._service)
+
+    def test_many_jobs(self):
+        """
+        Wakeups and threads with hundreds of interval jobs.
+        """
+        service = TimerService()
+        self.addCleanup(service.stop)
+        scheduler = TimerWheelScheduler(service)
+        runs = [0]
+        def callback():
+            runs[0] += 1
+        threads = threading.active_count()
+        for i in range(500):
+            scheduler.add_interval_job(callback, seconds=.5 + (i % 10) * .1)
+        scheduler.start()
+        time.sleep(2)
+        new_threads = threading.active_count() - threads
+        scheduler.shutdown()
+        log.info("Timer wheel: %d interval jobs ran %d times in 2s with %d wakeups and %d new threads",
+                 500, runs[0], service.wakeups, new_threads)
+        self.assertGreater(runs[0], 700)
+        self.assertLess(service.wakeups, 100)
+        # the timer thread and the scheduler's worker
+        self.assertEqual(new_threads, 2)
+
+    def test_slow_job(self):
+        """
+        A job that blocks holds up the other jobs of its scheduler but not
+        those of other schedulers on the same service.
+        """
+        service = TimerService(tick=.01)
+        self.addCleanup(service.stop)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        (slow, fast) = (TimerWheelScheduler(service), TimerWheelScheduler(service))
+        self.addCleanup(slow.shutdown)
+        self.addCleanup(fast.shutdown)
+        runs = []
+        slow.add_polled_job(lambda: release.wait(5), 'blocked', slow.interval(seconds=.01))
+        slow.add_interval_job(runs.append, seconds=.05, args=['slow'])
+        fast.add_interval_job(runs.append, seconds=.05, args=['fast'])
+        slow.start()
+        fast.start()
+
+        self.assertTrue(slow.run_polled_job('blocked'))
+        time.sleep(.3)
+        self.assertGreaterEqual(runs.count('fast'), 4)
+        self.assertEqual(runs.count('slow'), 0)
+
+        # the slow scheduler catches up once the job returns
+        release.set()
+        time.sleep(.15)
+        self.assertGreaterEqual(runs.count('slow'), 1)
+
+    def test_cron_job(self):
+        """
+        Cron jobs fire at the times the cron trigger gives.
+        """
+        service = TimerService(tick=.01)
+        self.addCleanup(service.stop)
+        scheduler = TimerWheelScheduler(service)
+        self.addCleanup(scheduler.shutdown)
+        runs = []
+        job = scheduler.add_cron_job(lambda: runs.append(datetime.now()), second='*')
+        scheduler.start()
+        first = job.next_run_time
+        self.assertEqual(first.microsecond, 0)
+        self.assertLessEqual(first - datetime.now(), timedelta(seconds=1))
+
+        time.sleep(2.5)
+        self.assertIn(len(runs), (2, 3))
+        for when in runs:
+            # each run is just after a whole second
+            self.assertLess(when.microsecond, 200000)
+        self.assertGreater(job.next_run_time, runs[-1])
+
+        # a cron time that never comes round isn't added
+        self.assertRaises(ValueError, scheduler.add_cron_job, runs.append, year='2000')
@@ -15,6 +15,8 @@ __license__ = 'Apache 2.0'
 
 from mi.core.log import get_logger ; log = get_logger()
 
+import sys
+import calendar
 import datetime
 import ntplib
 import time
@@ -24,6 +26,45 @@ from dateutil import parser
 DATE_PATTERN = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z?$'
 DATE_MATCHER = re.compile(DATE_PATTERN)
 
+# Field patterns shared by the timestamp layouts
+_TIME = r'(?P<hour>\d{1,2}):(?P<minute>\d{1,2}):(?P<second>\d{1,2})(?:\.(?P<fraction>\d+))?'
+_MONTH_NAME = r'(?P<month_name>[A-Za-z]{3,9})'
+
+# Timestamp layouts the instruments and data loggers emit, tried in order
+# on the first value a TimestampParser sees. Numeric day and month fields
+# that could be either way round are named first and second_field and resolved
+# the way dateutil does.
+TIMESTAMP_FORMATS = [
+    # 2013-02-05T19:11:43.123Z, 2013-02-05 19:11:43
+    ('iso8601', r'(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})(?:[T ]' + _TIME + r')?(?P<utc>Z)?'),
+    # 20130205T191143Z, 20130205 191143
+    ('iso8601_basic', r'(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})[T ]'
+                      r'(?P<hour>\d{2})(?P<minute>\d{2})(?P<second>\d{2})(?P<utc>Z)?'),
+    # 2013/05/29 00:25:36.123, BOTPT and DCL logs
+    ('year_first', r'(?P<year>\d{4})/(?P<month>\d{1,2})/(?P<day>\d{1,2})\s+' + _TIME),
+    # 07/16/2013 09:33:06 or 16/07/2013 09:33:06
+    ('year_last', r'(?P<first>\d{1,2})/(?P<second_field>\d{1,2})/(?P<year>\d{4})\s+' + _TIME),
+    # 07/16/13 09:33:06, FLORT
+    ('short_year_last', r'(?P<first>\d{1,2})/(?P<second_field>\d{1,2})/(?P<short_year>\d{2})\s+' + _TIME),
+    # 05 Feb 2013 19:11:43, SBE
+    ('day_month_name', r'(?P<day>\d{1,2})[ -]' + _MONTH_NAME + r'[ -](?P<year>\d{4})\s+' + _TIME),
+    # Feb 05 2013 19:11:43
+    ('month_name_day', _MONTH_NAME + r'\s+(?P<day>\d{1,2}),?\s+(?P<year>\d{4})\s+' + _TIME),
+    # Tue Feb 05 19:11:43 2013
+    ('ctime', r'(?P<weekday>[A-Za-z]{3,9})\s+' + _MONTH_NAME + r'\s+(?P<day>\d{1,2})\s+' + _TIME +
+              r'\s+(?P<year>\d{4})'),
+]
+
+_MONTHS = {}
+for (number, names) in enumerate([('jan', 'january'), ('feb', 'february'), ('mar', 'march'),
+                                  ('apr', 'april'), ('may',), ('jun', 'june'), ('jul', 'july'),
+                                  ('aug', 'august'), ('sep', 'sept', 'september'),
+                                  ('oct', 'october'), ('nov', 'november'), ('dec', 'december')]):
+    for name in names:
+        _MONTHS[name] = number + 1
+_WEEKDAYS = frozenset(['mon', 'monday', 'tue', 'tuesday', 'wed', 'wednesday', 'thu', 'thursday',
+                       'fri', 'friday', 'sat', 'saturday', 'sun', 'sunday'])
+
 def get_timestamp_delayed(format):
     '''
     Return a formatted date string of the current utc time,
@@ -71,6 +112,163 @@ def get_timestamp(format):
 
     return time.strftime(format, time.gmtime())
 
+def _seconds_to_ntp(seconds, microseconds):
+    """
+    Convert UTC seconds since 1970 to NTP time with the same floating point
+    steps as the float(dt.strftime("%s.%f")) - time.timezone idiom. The
+    results are identical to the bit where the idiom was right: local time
+    on UTC, or dates outside daylight saving time. In daylight saving time
+    strftime("%s") applies the DST offset and time.timezone doesn't, so the
+    idiom came out an hour early; this gives the UTC time.
+    """
+    local_sec = ((seconds + time.timezone) * 1000000 + microseconds) / 1e6
+    return ntplib.system_to_ntp_time(local_sec - time.timezone)
+
+def _dateutil_to_ntp(datestr, dayfirst=False):
+    """
+    Parse any timestamp dateutil understands. Values without a time zone
+    are taken to be UTC.
+    @raises ValueError if dateutil can't parse it
+    """
+    dt = parser.parse(datestr, dayfirst=dayfirst)
+    if dt.tzinfo is not None:
+        dt = (dt - dt.utcoffset()).replace(tzinfo=None)
+    return _seconds_to_ntp(calendar.timegm(dt.timetuple()), dt.microsecond)
+
+def _convert_year(year):
+    """
+    Put a two digit year in the century dateutil would.
+    """
+    this_year = time.localtime().tm_year
+    year += this_year // 100 * 100
+    if year >= this_year + 50:
+        year -= 100
+    elif year <= this_year - 50:
+        year += 100
+    return year
+
+
+class TimestampParser(object):
+    """
+    Converts timestamp strings to NTP time. The layout is found from
+    TIMESTAMP_FORMATS on the first value and reused for the ones after it,
+    which normally come from the same instrument in the same layout. The
+    start of the last calendar day seen is cached, so most values only
+    need their time of day worked out. Anything the layouts don't cover,
+    or that doesn't make a valid date, goes to dateutil, as do time zones
+    other than Z.
+    """
+
+    def __init__(self, dayfirst=False):
+        """
+        @param dayfirst True if numeric dates like 05/02/2013 put the day
+        first, as for dateutil.parser.parse
+        """
+        self.dayfirst = dayfirst
+        self.format = None
+        self._matcher = None
+        # ((year, month, day), seconds since 1970 at its start)
+        self._day = (None, None)
+
+    def to_ntp(self, datestr):
+        """
+        @param datestr Timestamp string, UTC unless it says otherwise
+        @retval NTP time
+        @raises ValueError if the string can't be parsed
+        """
+        matcher = self._matcher
+        match = matcher.match(datestr) if matcher is not None else None
+        if match is None:
+            match = self._detect(datestr)
+        if match is not None:
+            ntp = self._match_to_ntp(match)
+            if ntp is not None:
+                return ntp
+        return _dateutil_to_ntp(datestr, self.dayfirst)
+
+    def _detect(self, datestr):
+        for (name, matcher) in _FORMAT_MATCHERS:
+            match = matcher.match(datestr)
+            if match:
+                self.format = name
+                self._matcher = matcher
+                return match
+        return None
+
+    def _match_to_ntp(self, match):
+        """
+        @retval NTP time, or None if the fields aren't a valid date
+        """
+        fields = match.groupdict()
+        if fields.get('weekday') is not None and fields['weekday'].lower() not in _WEEKDAYS:
+            return None
+
+        if fields.get('month_name') is not None:
+            month = _MONTHS.get(fields['month_name'].lower())
+            if month is None:
+                return None
+            day = int(fields['day'])
+        elif fields.get('first') is not None:
+            (first, second) = (int(fields['first']), int(fields['second_field']))
+            if first > 12 or (self.dayfirst and second <= 12):
+                (day, month) = (first, second)
+            else:
+                (month, day) = (first, second)
+        else:
+            (month, day) = (int(fields['month']), int(fields['day']))
+            if self.dayfirst and day <= 12:
+                (month, day) = (day, month)
+
+        if fields.get('short_year') is not None:
+            year = _convert_year(int(fields['short_year']))
+        else:
+            year = int(fields['year'])
+
+        key = (year, month, day)
+        (cached_key, midnight) = self._day
+        if key != cached_key:
+            try:
+                datetime.date(year, month, day)
+            except ValueError:
+                return None
+            midnight = calendar.timegm((year, month, day, 0, 0, 0))
+            self._day = (key, midnight)
+
+        if fields['hour'] is None:
+            return _seconds_to_ntp(midnight, 0)
+        (hour, minute, second) = (int(fields['hour']), int(fields['minute']), int(fields['second']))
+        if hour > 23 or minute > 59 or second > 59:
+            return None
+        fraction = fields.get('fraction')
+        microseconds = int(fraction[:6].ljust(6, '0')) if fraction else 0
+        return _seconds_to_ntp(midnight + hour * 3600 + minute * 60 + second, microseconds)
+
+
+_FORMAT_MATCHERS = [(name, re.compile(r'\s*' + pattern + r'\s*$')) for (name, pattern) in TIMESTAMP_FORMATS]
+
+# (code, line, dayfirst) : TimestampParser for each place timestamp_to_ntp is called from
+_call_site_parsers = {}
+
+# ISO8601 parser behind string_to_ntp_date_time
+_iso_parser = TimestampParser()
+
+def timestamp_to_ntp(datestr, dayfirst=False):
+    """
+    Convert a timestamp string in any layout dateutil can read to NTP
+    time. Each line calling this gets its own TimestampParser, so the
+    layout is worked out once per call site.
+    @param datestr Timestamp string, UTC unless it says otherwise
+    @param dayfirst True if numeric dates put the day first
+    @retval NTP time
+    @raises ValueError if the string can't be parsed
+    """
+    caller = sys._getframe(1)
+    key = (caller.f_code, caller.f_lineno, dayfirst)
+    timestamp_parser = _call_site_parsers.get(key)
+    if timestamp_parser is None:
+        timestamp_parser = _call_site_parsers.setdefault(key, TimestampParser(dayfirst))
+    return timestamp_parser.to_ntp(datestr)
+
 def string_to_ntp_date_time(datestr):
         """
         Extract an ntp date from a ISO8601 formatted date string.
@@ -86,22 +284,12 @@ def string_to_ntp_date_time(datestr):
 
         try:
             # This assumes input date string are in UTC (=GMT)
-            if datestr[-1:] != 'Z':
-                datestr += 'Z'
-
-            # the parsed date time represents a GMT time, but strftime
-            # does not take timezone into account, so these are seconds from the
-            # local start of 1970
-            local_sec = float(parser.parse(datestr).strftime("%s.%f"))
-            # remove the local time zone to convert to gmt (seconds since gmt jan 1 1970)
-            gmt_sec = local_sec - time.timezone
-            # convert to ntp (seconds since gmt jan 1 1900)
-            timestamp = ntplib.system_to_ntp_time(gmt_sec)
+            timestamp = _iso_parser.to_ntp(datestr)
 
         except ValueError as e:
             raise ValueError('Value %s could not be formatted to a date. %s' % (str(datestr), e))
 
-        log.debug("converting time string '%s', unix_ts: %s ntp: %s", datestr, gmt_sec, timestamp)
+        log.debug("converting time string '%s', ntp: %s", datestr, timestamp)
 
         return timestamp
 
@@ -0,0 +1,610 @@
+#!/usr/bin/env python
+
+"""
+@package mi.core.timer_wheel
+@file mi/core/timer_wheel.py
+@brief Timer wheel scheduler shared by all the jobs in a driver process.
+
+Every TimerWheelScheduler puts its jobs on one TimerService, by default
+the process wide one, and that service runs all the jobs on a single
+thread. Timers are kept in a hierarchical timing wheel, so adding and
+cancelling one costs the same however many there are. The thread sleeps
+until the next tick that has timers due. All the timers due in that tick
+then fire in a single wakeup, instead of each job waking its own
+scheduler thread and handing the work to a thread pool.
+
+Job firing times come from the same triggers PolledScheduler uses, so
+date, interval, cron and polled interval jobs fire when they did before.
+The timer thread only decides which jobs are due. Each scheduler runs
+its jobs one at a time on a worker thread of its own, so a job that
+blocks, e.g. a driver command waiting for its response, holds up the
+other jobs of that driver only.
+
+Usage is the same as for PolledScheduler:
+
+scheduler = TimerWheelScheduler()
+scheduler.start()
+job = scheduler.add_interval_job(some_callback, seconds=3)
+job = scheduler.add_polled_job(some_callback, 'test_job', min_interval, max_interval)
+scheduler.run_polled_job('test_job')
+"""
+
+from __future__ import absolute_import
+
+__license__ = 'Apache 2.0'
+
+import os
+import math
+import time
+import Queue
+import select
+import threading
+from functools import partial
+from datetime import datetime, timedelta
+
+from apscheduler.triggers import SimpleTrigger, IntervalTrigger, CronTrigger
+
+from mi.core.log import get_logger; log = get_logger()
+
+from mi.core.scheduler import PolledScheduler, PolledIntervalTrigger
+
+# seconds per tick, timers due in the same tick fire together
+DEFAULT_TICK = 0.05
+
+
+class Timer(object):
+    """
+    A callback due at a tick of a TimerWheel.
+    """
+    __slots__ = ('deadline', 'callback', 'slot')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        # (level, list) the timer is in, None once fired or removed
+        self.slot = None
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timing wheel. Level 0 has a slot per tick, each level
+    above it a slot per turn of the level below. Timers are put in the
+    lowest level their deadline is within range of and moved down a
+    level each time the level below comes round to their slot. Timers
+    beyond the top level wait in an overflow list until the top level
+    turns over. Times are integer ticks; the wheel doesn't know how long
+    a tick is.
+    """
+
+    def __init__(self, levels=4, slot_bits=6):
+        """
+        @param levels Number of levels
+        @param slot_bits Each level has 2**slot_bits slots
+        """
+        self.levels = levels
+        self._bits = slot_bits
+        self._mask = (1 << slot_bits) - 1
+        self._slots = [[[] for i in xrange(1 << slot_bits)] for level in xrange(levels)]
+        self._counts = [0] * levels
+        self._overflow = []
+        # the first tick not yet fired
+        self.now = 0
+
+    def __len__(self):
+        return sum(self._counts) + len(self._overflow)
+
+    def add(self, timer):
+        """
+        Add a timer. One already due fires at the next advance.
+        """
+        if timer.deadline < self.now:
+            timer.deadline = self.now
+        delta = timer.deadline - self.now
+        for level in xrange(self.levels):
+            if delta < 1 << (self._bits * (level + 1)):
+                slot = self._slots[level][(timer.deadline >> (self._bits * level)) & self._mask]
+                slot.append(timer)
+                self._counts[level] += 1
+                timer.slot = (level, slot)
+                return
+        self._overflow.append(timer)
+        timer.slot = (None, self._overflow)
+
+    def remove(self, timer):
+        """
+        Remove a timer that hasn't fired.
+        """
+        (level, slot) = timer.slot
+        slot.remove(timer)
+        if level is not None:
+            self._counts[level] -= 1
+        timer.slot = None
+
+    def advance(self, target):
+        """
+        Move the wheel on past the target tick.
+        @param target Tick to fire timers up to and including
+        @retval List of timers due, in deadline order
+        """
+        due = []
+        while self.now <= target:
+            slot = self._slots[0][self.now & self._mask]
+            if slot:
+                self._counts[0] -= len(slot)
+                for timer in slot:
+                    timer.slot = None
+                due.extend(slot)
+                del slot[:]
+            # ticks without anything to fire or cascade are skipped
+            following = self.next_tick()
+            if following is None or following > target + 1:
+                following = target + 1
+            self.now = following
+            self._cascade()
+        return due
+
+    def next_tick(self):
+        """
+        @retval The next tick with timers due or to move down a level, or
+        None if the wheel is empty
+        """
+        bits = self._bits
+        mask = self._mask
+        ticks = []
+        if self._counts[0]:
+            slots = self._slots[0]
+            for step in xrange(1 << bits):
+                if slots[(self.now + step) & mask]:
+                    ticks.append(self.now + step)
+                    break
+        for level in xrange(1, self.levels):
+            if self._counts[level]:
+                shift = bits * level
+                current = self.now >> shift
+                slots = self._slots[level]
+                # the current slot was emptied when the level below entered
+                # it, what is there now is for the next time round
+                for step in xrange(1, (1 << bits) + 1):
+                    if slots[(current + step) & mask]:
+                        ticks.append((current + step) << shift)
+                        break
+        if self._overflow:
+            shift = bits * self.levels
+            ticks.append(((self.now >> shift) + 1) << shift)
+        return min(ticks) if ticks else None
+
+    def _cascade(self):
+        """
+        Move the timers in the slots the current tick enters down a level,
+        highest level first so they can move down more than one.
+        """
+        now = self.now
+        top = self._bits * self.levels
+        if self._overflow and not now & ((1 << top) - 1):
+            overflow = self._overflow
+            self._overflow = []
+            for timer in overflow:
+                self.add(timer)
+        for level in xrange(self.levels - 1, 0, -1):
+            shift = self._bits * level
+            if now & ((1 << shift) - 1):
+                continue
+            slot = self._slots[level][(now >> shift) & self._mask]
+            if slot:
+                timers = list(slot)
+                del slot[:]
+                self._counts[level] -= len(timers)
+                for timer in timers:
+                    self.add(timer)
+
+
+class TimerService(object):
+    """
+    Runs the callbacks of timers on a TimerWheel from one thread. The
+    thread waits in select on a pipe, which is written to when a timer is
+    added ahead of the one it is waiting for: Condition.wait with a
+    timeout polls on python 2, select really sleeps.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, tick=DEFAULT_TICK):
+        """
+        @param tick Seconds per tick
+        """
+        self.tick = tick
+        # times the thread has woken from waiting
+        self.wakeups = 0
+        self._origin = time.time()
+        self._wheel = TimerWheel()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        # tick the thread is waiting for, None while it waits for a timer
+        # to be added, -1 while it isn't waiting
+        self._waiting_for = -1
+        self._woken = False
+        (self._wake_read, self._wake_write) = os.pipe()
+
+    @classmethod
+    def shared(cls):
+        """
+        @retval The process wide TimerService
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def __len__(self):
+        return len(self._wheel)
+
+    def schedule(self, when, callback):
+        """
+        @param when Time to call back at, in seconds since the epoch
+        @param callback Callable taking no arguments
+        @retval Timer to cancel it with
+        """
+        timer = Timer(int(math.ceil((when - self._origin) / self.tick)), callback)
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError('Timer service stopped')
+            self._wheel.add(timer)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='timer wheel')
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._waiting_for is None or 0 <= timer.deadline < self._waiting_for:
+                self._wake()
+        return timer
+
+    def cancel(self, timer):
+        """
+        Cancel a timer, nothing happens if it has already fired.
+        """
+        with self._lock:
+            if timer.slot is not None:
+                self._wheel.remove(timer)
+
+    def stop(self):
+        """
+        Stop the thread, timers not yet fired are dropped.
+        """
+        with self._lock:
+            self._stopped = True
+            self._wake()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _wake(self):
+        if not self._woken:
+            self._woken = True
+            os.write(self._wake_write, 'x')
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    break
+                due = self._wheel.advance(int((time.time() - self._origin) / self.tick))
+                if due:
+                    self._waiting_for = -1
+                else:
+                    self._waiting_for = self._wheel.next_tick()
+
+            if due:
+                for timer in due:
+                    try:
+                        timer.callback()
+                    except Exception:
+                        log.exception('Timer callback failed')
+                continue
+
+            timeout = None
+            if self._waiting_for is not None:
+                timeout = max(0, self._origin + self._waiting_for * self.tick - time.time())
+            (readable, writable, errors) = select.select([self._wake_read], [], [], timeout)
+            self.wakeups += 1
+            if readable:
+                os.read(self._wake_read, 64)
+                with self._lock:
+                    self._woken = False
+
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+
+class WheelJob(object):
+    """
+    A job on a TimerWheelScheduler.
+    """
+
+    def __init__(self, trigger, func, args, kwargs, name=None):
+        """
+        @param trigger Trigger that determines the run times
+        @param func Callable to run
+        @param args List of positional arguments to call func with
+        @param kwargs Dict of keyword arguments to call func with
+        @param name Name of the job
+        """
+        self.trigger = trigger
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name or getattr(func, '__name__', repr(func))
+        self.next_run_time = None
+        self.runs = 0
+        self._timer = None
+        # runs handed to the worker thread and not yet finished
+        self._queued = 0
+
+    def __repr__(self):
+        return '<%s (name=%s, trigger=%s)>' % (self.__class__.__name__, self.name, repr(self.trigger))
+
+
+class PolledWheelJob(WheelJob):
+    """
+    A job with a PolledIntervalTrigger, see PolledIntervalJob.
+    """
+
+    def ready_to_run(self):
+        """
+        @retval True if the minimum interval has passed, the trigger is
+        pulled if so
+        """
+        return self.trigger.pull_trigger()
+
+
+class TimerWheelScheduler(object):
+    """
+    Drop in replacement for PolledScheduler with its jobs on a
+    TimerService. Jobs added before start() are scheduled when it is
+    called. Polled job names are unique within a scheduler, schedulers
+    sharing a service don't see each other's jobs. Due jobs are run on
+    the scheduler's worker thread, started with the first run.
+    """
+
+    interval = staticmethod(PolledScheduler.interval)
+
+    def __init__(self, service=None):
+        """
+        @param service TimerService to use, the process wide one if None
+        """
+        if service is None:
+            service = TimerService.shared()
+        self.running = False
+        self._service = service
+        self._lock = threading.RLock()
+        self._jobs = []
+        self._pending_jobs = []
+        self._queue = Queue.Queue()
+        self._worker = None
+
+    def start(self):
+        """
+        Schedule the jobs added so far, and the ones added after as they
+        are added.
+        """
+        with self._lock:
+            self.running = True
+            pending = self._pending_jobs
+            self._pending_jobs = []
+            for job in pending:
+                self._real_add_job(job)
+
+    def shutdown(self):
+        """
+        Unschedule all the jobs and stop the worker thread once the job
+        it is running returns. The service keeps running for others.
+        """
+        with self._lock:
+            self.running = False
+            for job in self._jobs:
+                self._cancel(job)
+            self._jobs = []
+            if self._worker is not None:
+                self._queue.put(None)
+                self._queue = Queue.Queue()
+                self._worker = None
+
+    def add_date_job(self, func, date, args=None, kwargs=None, **options):
+        """
+        Schedule a job to run once at a date.
+        @param func Callable to run
+        @param date datetime or string to run at
+        @retval WheelJob
+        """
+        trigger = SimpleTrigger(date)
+        return self._add_job(WheelJob(trigger, func, args or [], kwargs or {}, options.get('name')))
+
+    def add_interval_job(self, func, weeks=0, days=0, hours=0, minutes=0, seconds=0,
+                         start_date=None, args=None, kwargs=None, **options):
+        """
+        Schedule a job to run at fixed intervals.
+        @param func Callable to run
+        @param start_date When the first interval starts, now if None
+        @retval WheelJob
+        """
+        interval = timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds)
+        trigger = IntervalTrigger(interval, start_date)
+        return self._add_job(WheelJob(trigger, func, args or [], kwargs or {}, options.get('name')))
+
+    def add_cron_job(self, func, year=None, month=None, day=None, week=None, day_of_week=None,
+                     hour=None, minute=None, second=None, start_date=None, args=None, kwargs=None,
+                     **options):
+        """
+        Schedule a job to run at times given in cron style.
+        @param func Callable to run
+        @retval WheelJob
+        """
+        trigger = CronTrigger(year=year, month=month, day=day, week=week, day_of_week=day_of_week,
+                              hour=hour, minute=minute, second=second, start_date=start_date)
+        return self._add_job(WheelJob(trigger, func, args or [], kwargs or {}, options.get('name')))
+
+    def add_polled_job(self, func, name, min_interval, max_interval=None, start_date=None,
+                       args=None, kwargs=None, **options):
+        """
+        Schedule a job that runs when polled with run_polled_job, no more
+        often than min_interval, and if max_interval is given when it
+        hasn't run for that long.
+        @param func Callable to run
+        @param name Name to poll the job by
+        @param min_interval timedelta
+        @param max_interval timedelta or None
+        @retval PolledWheelJob
+        """
+        trigger = PolledIntervalTrigger(min_interval, max_interval, start_date)
+        return self._add_job(PolledWheelJob(trigger, func, args or [], kwargs or {}, name))
+
+    def run_polled_job(self, name):
+        """
+        Run a polled job if its minimum interval has passed. The job runs
+        on the worker thread, after the one running now if there is one.
+        @param name Name of the job
+        @retval True if the job is run, False if it isn't ready
+        @raise LookupError if there is no polled job with the name
+        """
+        with self._lock:
+            job = self.get_polled_job(name)
+            if job is None:
+                raise LookupError("no PolledIntervalJob found named '%s'" % name)
+
+            if not job.ready_to_run():
+                log.debug("Job '%s' is *NOT* ready to run", name)
+                return False
+
+            log.debug("Job '%s' is ready to run", name)
+            self._cancel(job)
+            job._timer = self._service.schedule(time.time(), partial(self._run_job, job, True))
+            return True
+
+    def get_polled_job(self, name):
+        """
+        @param name Name of the job
+        @retval PolledWheelJob with the name or None
+        """
+        with self._lock:
+            for job in self._jobs:
+                if isinstance(job, PolledWheelJob) and job.name == name:
+                    return job
+        return None
+
+    def get_jobs(self):
+        """
+        @retval List of scheduled jobs
+        """
+        with self._lock:
+            return list(self._jobs)
+
+    def unschedule_job(self, job):
+        """
+        @raise KeyError if the job isn't scheduled
+        """
+        with self._lock:
+            if job in self._pending_jobs:
+                self._pending_jobs.remove(job)
+            elif job in self._jobs:
+                self._jobs.remove(job)
+                self._cancel(job)
+            else:
+                raise KeyError('Job "%s" is not scheduled in any job store' % job)
+
+    def unschedule_func(self, func):
+        """
+        Unschedule all the jobs that run func.
+        @raise KeyError if there aren't any
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs + self._pending_jobs if job.func == func]
+            if not jobs:
+                raise KeyError('The given function is not scheduled in this scheduler')
+            for job in jobs:
+                self.unschedule_job(job)
+
+    def _add_job(self, job):
+        with self._lock:
+            if self.running:
+                self._real_add_job(job)
+            else:
+                self._pending_jobs.append(job)
+        return job
+
+    def _real_add_job(self, job):
+        job.next_run_time = job.trigger.get_next_fire_time(datetime.now())
+        # polled jobs without a max interval only run when polled
+        if not isinstance(job, PolledWheelJob) and job.next_run_time is None:
+            raise ValueError('Not adding job since it would never be run')
+        if isinstance(job, PolledWheelJob) and self.get_polled_job(job.name):
+            raise ValueError("Not adding job since a job named '%s' already exists" % job.name)
+
+        self._jobs.append(job)
+        self._schedule(job)
+        log.info('Added job "%s"', job)
+
+    def _schedule(self, job):
+        if job.next_run_time is not None:
+            when = time.mktime(job.next_run_time.timetuple()) + job.next_run_time.microsecond / 1e6
+            job._timer = self._service.schedule(when, partial(self._run_job, job, False))
+
+    def _cancel(self, job):
+        if job._timer is not None:
+            self._service.cancel(job._timer)
+            job._timer = None
+
+    def _run_job(self, job, pulled):
+        """
+        Called on the timer thread when a job's timer fires. Hands the
+        job to the worker thread if it is to run, otherwise schedules the
+        next check.
+        @param pulled True if the trigger of a polled job has been pulled
+        """
+        with self._lock:
+            if job not in self._jobs:
+                return
+            job._timer = None
+            if pulled or not isinstance(job, PolledWheelJob) or job.ready_to_run():
+                job._queued += 1
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._work, args=(self._queue,),
+                                                    name='timer wheel jobs')
+                    self._worker.daemon = True
+                    self._worker.start()
+                self._queue.put(job)
+            else:
+                self._reschedule(job)
+
+    def _work(self, queue):
+        """
+        Worker thread, runs the jobs handed to it in turn until shutdown.
+        """
+        while True:
+            job = queue.get()
+            if job is None:
+                break
+            with self._lock:
+                if job not in self._jobs:
+                    continue
+            try:
+                job.func(*job.args, **job.kwargs)
+            except Exception:
+                log.exception('Job "%s" raised an exception', job)
+
+            with self._lock:
+                job.runs += 1
+                job._queued -= 1
+                self._reschedule(job)
+
+    def _reschedule(self, job):
+        """
+        Schedule the next run of a job, unless it has been removed or is
+        already due to run again.
+        """
+        if job not in self._jobs or job._timer is not None or job._queued:
+            return
+        job.next_run_time = job.trigger.get_next_fire_time(datetime.now() + timedelta(microseconds=1))
+        if job.next_run_time is None and not isinstance(job, PolledWheelJob):
+            self._jobs.remove(job)
+        else:
+            self._schedule(job)
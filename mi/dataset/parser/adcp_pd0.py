@@ -25,6 +25,7 @@ from mi.core.log import get_logger
 
 log = get_logger()
 from mi.core.common import BaseEnum
+from mi.core.instrument.chunker import resumable_sieve
 from mi.core.instrument.data_particle import \
     DataParticle, DataParticleKey, DataParticleValue
 from mi.core.exceptions import SampleException, RecoverableSampleException, \
@@ -1114,24 +1115,33 @@ class AdcpPd0Parser(BufferLoadingParser):
                                                              (len(non_data), non_data)))
             self._increment_state(len(non_data))
 
-    def sieve_function(self, input_buffer):
+    @resumable_sieve
+    def sieve_function(self, input_buffer, start_index=None):
         """
         Sort through the input buffer looking for a data record.
         A data record is considered to be properly framed if there is a
         sync word and the checksum matches.
         Arguments:
           input_buffer - the contents of the input stream
+          start_index - if given, only look for records from this index on
+            (see mi.core.instrument.chunker.resumable_sieve)
         Returns:
-          A list of start,end tuples
+          A list of start,end tuples, or a tuple of that list and the index
+          the next search can resume from if start_index was given
         """
 
         #log.debug("sieve called with buffer of length %d", len(input_buffer))
 
         indices_list = []  # initialize the return list to empty
-        header_iter = ADCPS_PD0_HEADER_MATCHER.finditer(input_buffer[0: -CHECKSUM_BYTES])
+        search_buffer = input_buffer[0: -CHECKSUM_BYTES]
+        header_iter = ADCPS_PD0_HEADER_MATCHER.finditer(search_buffer, start_index or 0)
         #find all occurrences of the record header sentinel
         #don't look in the last 2 bytes because you will not have num bytes
 
+        #a sentinel too close to the end to be found yet, or one whose record
+        #is not all here yet, has to be looked at again next time
+        resume_index = max(len(search_buffer) - 1, 0)
+
         for match in header_iter:
 
             record_start = match.start()
@@ -1147,7 +1157,7 @@ class AdcpPd0Parser(BufferLoadingParser):
             #log.debug("sieve function number of bytes= %d , record end is %d", num_bytes, record_end)
 
             #if there is enough in the buffer check the record
-            if record_end <= len(input_buffer[0: -CHECKSUM_BYTES]):
+            if record_end <= len(search_buffer):
                 #make sure the checksum bytes are in the buffer too
 
                 total = 0
@@ -1166,7 +1176,13 @@ class AdcpPd0Parser(BufferLoadingParser):
 
                     #log.debug("sieve function found record.  Start = %d End = %d", record_start, record_end)
 
-        return indices_list
+            else:
+                resume_index = min(resume_index, record_start)
+
+        if start_index is None:
+            return indices_list
+
+        return (indices_list, max(start_index, resume_index))
 
 
 
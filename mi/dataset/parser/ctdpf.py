@@ -14,13 +14,12 @@ __license__ = 'Apache 2.0'
 
 import copy
 import re
-import time
-import ntplib
 from functools import partial
 from dateutil import parser
 from dateutil import tz
 
 from mi.core.log import get_logger ; log = get_logger()
+from mi.core.time import timestamp_to_ntp
 
 from mi.core.common import BaseEnum
 from mi.core.exceptions import SampleException, DatasetParserException
@@ -178,12 +177,9 @@ class CtdpfParser(BufferLoadingParser):
         )
         log.trace("converted ts '%s' to '%s'", ts_str, zulu_ts)
 
-        localtime_offset = float(parser.parse("1970-01-01T00:00:00.00Z").strftime("%s.%f"))
-        converted_time = float(parser.parse(zulu_ts).strftime("%s.%f"))
-        adjusted_time = round(converted_time - localtime_offset)
-        ntptime = ntplib.system_to_ntp_time(adjusted_time)
+        ntptime = timestamp_to_ntp(zulu_ts)
 
-        log.trace("Converted time \"%s\" (unix: %s) into %s", ts_str, adjusted_time, ntptime)
+        log.trace("Converted time \"%s\" into %s", ts_str, ntptime)
         return ntptime
 
     def _increment_timestamp(self, increment=1):
@@ -13,12 +13,10 @@ __license__ = 'Apache 2.0'
 
 import copy
 import re
-import time
-import ntplib
-from dateutil import parser
 from functools import partial
 
 from mi.core.log import get_logger ; log = get_logger()
+from mi.core.time import timestamp_to_ntp
 
 from mi.core.common import BaseEnum
 from mi.core.exceptions import SampleException, DatasetParserException
@@ -120,10 +118,7 @@ class WfpParticle(DataParticle):
         )
         log.trace("converted ts '%s' to '%s'", ts_string, zulu_ts)
 
-        localtime_offset = float(parser.parse("1970-01-01T00:00:00.00Z").strftime("%s.%f"))
-        converted_time = float(parser.parse(zulu_ts).strftime("%s.%f"))
-        adjusted_time = round(converted_time - localtime_offset)
-        ntptime = ntplib.system_to_ntp_time(adjusted_time)
+        ntptime = timestamp_to_ntp(zulu_ts)
 
         return ntptime
 
@@ -89,6 +89,7 @@ from mi.core.instrument.instrument_driver import DriverEvent
 from mi.core.instrument.instrument_driver import DriverConnectionState
 from mi.core.instrument.instrument_driver import DriverProtocolState
 from mi.core.instrument.instrument_driver import DriverAsyncEvent
+from mi.core.instrument.instrument_driver import event_samples
 from mi.core.tcp_client import TcpClient
 from mi.core.common import BaseEnum
 from mi.core.driver_scheduler import DriverSchedulerConfigKey
@@ -874,8 +875,13 @@ class InstrumentDriverTestCase(MiIntTestCase):
     def event_received(self, evt):
         """
         @brief Simple callback to catch events from the driver for verification.
+        Sample batches are split back into SAMPLE events.
         """
-        self.events.append(evt)
+        if evt['type'] == DriverAsyncEvent.SAMPLE_BATCH:
+            for sample in evt['value']:
+                self.events.append({'type': DriverAsyncEvent.SAMPLE, 'value': sample, 'time': evt['time']})
+        else:
+            self.events.append(evt)
 
     @staticmethod
     def create_serial_comm_config(comm_config):
@@ -1254,9 +1260,7 @@ class InstrumentDriverUnitTestCase(InstrumentDriverTestCase):
         Event call back method sent to the driver.  It simply grabs a sample event and pushes it
         into the data particle queue
         """
-        event_type = event['type']
-        if event_type == DriverAsyncEvent.SAMPLE:
-            sample_value = event['value']
+        for sample_value in event_samples(event):
             particle_dict = json.loads(sample_value)
             self._data_particle_received.append(sample_value)
 
@@ -15,6 +15,7 @@ import mi.core.log
 from mi.core.driver_scheduler import DriverSchedulerConfigKey, TriggerType
 from mi.core.instrument.driver_dict import DriverDictKey
 from mi.core.instrument.port_agent_client import PortAgentClient
+from mi.core.instrument.port_agent_client import PortAgentHub
 from mi.core.instrument.protocol_param_dict import ParameterDictType
 from mi.core.instrument.instrument_protocol import InstrumentProtocol
 from mi.core.instrument.instrument_driver import SingleConnectionInstrumentDriver
@@ -262,7 +263,8 @@ class InstrumentDriver(SingleConnectionInstrumentDriver):
                     cmd_port = config.get('cmd_port')
 
                     if isinstance(addr, str) and isinstance(port, int) and len(addr) > 0:
-                        connections[name] = PortAgentClient(addr, port, cmd_port)
+                        # all slave connections share one I/O thread
+                        connections[name] = PortAgentClient(addr, port, cmd_port, hub=PortAgentHub.instance())
                     else:
                         raise InstrumentParameterException('Invalid comms config dict.')
 
@@ -568,12 +568,14 @@ class McLaneProtocol(CommandResponseInstrumentProtocol):
         log.debug('_do_cmd_resp: %s, timeout=%s, write_delay=%s, response_regex=%s',
                   repr(cmd_line), timeout, write_delay, response_regex)
 
-        for char in cmd_line:
-            self._connection.send(char)
-            time.sleep(write_delay)
+        paced = self._queue_write(cmd_line, write_delay)
 
         # Wait for the prompt, prepare result and return, timeout exception
-        return self._get_response(timeout, response_regex=response_regex)
+        # A paced command is still going out, the response can't be
+        # complete before it is.
+        response = self._get_response(timeout + paced.duration(), response_regex=response_regex)
+        paced.wait()
+        return response
 
     def _do_cmd_home(self):
         """
@@ -5,7 +5,6 @@
 @brief BOTPT
 Release notes:
 """
-import json
 import re
 import time
 import datetime
@@ -16,6 +15,7 @@ from mi.core.instrument.data_particle import DataParticleKey, DataParticleValue
 from mi.core.instrument.protocol_param_dict import ParameterDictVisibility, ParameterDictType
 from mi.core.common import BaseEnum, Units, Prefixes
 from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import TaggedSieve
 from mi.core.instrument.instrument_fsm import ThreadSafeFSM
 from mi.core.instrument.instrument_protocol import CommandResponseInstrumentProtocol, InitializationType
 from mi.core.instrument.instrument_driver import DriverEvent
@@ -329,6 +329,16 @@ class Protocol(CommandResponseInstrumentProtocol):
         # create chunker
         self._chunker = StringChunker(Protocol.sieve_function)
 
+        # chunks are tagged with their particle class by the sieve
+        self._register_particle(particles.LilySampleParticle, particles.LilySampleParticle,
+                                self._check_for_autolevel)
+        self._register_particle(particles.LilyLevelingParticle, particles.LilyLevelingParticle,
+                                self._check_completed_leveling)
+        self._register_particle(particles.HeatSampleParticle, particles.HeatSampleParticle)
+        self._register_particle(particles.IrisSampleParticle, particles.IrisSampleParticle)
+        self._register_particle(particles.NanoSampleParticle, particles.NanoSampleParticle,
+                                self._check_pps_sync)
+
         self._last_data_timestamp = 0
         self.has_pps = True
 
@@ -337,27 +347,15 @@ class Protocol(CommandResponseInstrumentProtocol):
         self._add_scheduler_event(ScheduledJob.ACQUIRE_STATUS, ProtocolEvent.ACQUIRE_STATUS)
         self._add_scheduler_event(ScheduledJob.NANO_TIME_SYNC, ProtocolEvent.NANO_TIME_SYNC)
 
-    @staticmethod
-    def sieve_function(raw_data):
-        """
-        Sort data in the chunker...
-        @param raw_data: Data to be searched for samples
-        @return: list of (start,end) tuples
-        """
-        matchers = []
-        return_list = []
-
-        matchers.append(particles.HeatSampleParticle.regex_compiled())
-        matchers.append(particles.IrisSampleParticle.regex_compiled())
-        matchers.append(particles.NanoSampleParticle.regex_compiled())
-        matchers.append(particles.LilySampleParticle.regex_compiled())
-        matchers.append(particles.LilyLevelingParticle.regex_compiled())
-
-        for matcher in matchers:
-            for match in matcher.finditer(raw_data):
-                return_list.append((match.start(), match.end()))
-
-        return return_list
+    # Sort data in the chunker. All of the sample types are found in a single
+    # pass and each block is tagged with the particle class that matched it.
+    sieve_function = TaggedSieve([
+        (particles.HeatSampleParticle, particles.HeatSampleParticle.regex_compiled()),
+        (particles.IrisSampleParticle, particles.IrisSampleParticle.regex_compiled()),
+        (particles.NanoSampleParticle, particles.NanoSampleParticle.regex_compiled()),
+        (particles.LilySampleParticle, particles.LilySampleParticle.regex_compiled()),
+        (particles.LilyLevelingParticle, particles.LilyLevelingParticle.regex_compiled()),
+    ])
 
     def _got_chunk(self, chunk, ts):
         """
@@ -384,30 +382,17 @@ class Protocol(CommandResponseInstrumentProtocol):
 
         raise InstrumentProtocolException(u'unhandled chunk received by _got_chunk: [{0!r:s}]'.format(chunk))
 
-    def _extract_sample(self, particle_class, regex, line, timestamp, publish=True):
+    def _build_particle(self, particle_class, chunk, timestamp):
         """
         Overridden to set the quality flag for LILY particles that are out of range.
         @param particle_class: Class type for particle
-        @param regex: regular expression to verify data
-        @param line: data
+        @param chunk: data
         @param timestamp: ntp timestamp
-        @param publish: boolean to indicate if sample should be published
-        @return: extracted sample
+        @return: particle
         """
-        sample = None
-        if regex.match(line):
-            if particle_class == particles.LilySampleParticle and self._param_dict.get(Parameter.LEVELING_FAILED):
-                particle = particle_class(line, port_timestamp=timestamp, quality_flag=DataParticleValue.OUT_OF_RANGE)
-            else:
-                particle = particle_class(line, port_timestamp=timestamp)
-            parsed_sample = particle.generate()
-
-            if publish and self._driver_event:
-                self._driver_event(DriverAsyncEvent.SAMPLE, parsed_sample)
-
-            sample = json.loads(parsed_sample)
-
-        return sample
+        if particle_class == particles.LilySampleParticle and self._param_dict.get(Parameter.LEVELING_FAILED):
+            return particle_class(chunk, port_timestamp=timestamp, quality_flag=DataParticleValue.OUT_OF_RANGE)
+        return particle_class(chunk, port_timestamp=timestamp)
 
     def _filter_capabilities(self, events):
         """
@@ -603,21 +588,26 @@ class Protocol(CommandResponseInstrumentProtocol):
         Overriding base class to reduce logging due to NANO high data rate
         @param data: data to be added to buffers
         """
-        # Update the line and prompt buffers.
-        self._linebuf += data
-        self._promptbuf += data
-        self._last_data_timestamp = time.time()
-
-        # If our buffer exceeds the max allowable size then drop the leading
-        # characters on the floor.
-        max_size = self._max_buffer_size()
-        if len(self._linebuf) > max_size:
-            self._linebuf = self._linebuf[max_size * -1:]
-
-        # If our buffer exceeds the max allowable size then drop the leading
-        # characters on the floor.
-        if len(self._promptbuf) > max_size:
-            self._promptbuf = self._linebuf[max_size * -1:]
+        with self._buffer_condition:
+            # Update the line and prompt buffers.
+            self._linebuf += data
+            self._promptbuf += data
+            self._last_data_timestamp = time.time()
+
+            # If our buffer exceeds the max allowable size then drop the leading
+            # characters on the floor.
+            max_size = self._max_buffer_size()
+            if len(self._linebuf) > max_size:
+                self._linebuf = self._linebuf[max_size * -1:]
+
+            # If our buffer exceeds the max allowable size then drop the leading
+            # characters on the floor.
+            if len(self._promptbuf) > max_size:
+                self._promptbuf = self._linebuf[max_size * -1:]
+
+            # Wake anyone waiting for a response.
+            self._buffer_count += len(data)
+            self._buffer_condition.notify_all()
 
     def _max_buffer_size(self):
         """
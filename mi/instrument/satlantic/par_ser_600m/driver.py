@@ -362,6 +362,8 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
         @param cmd The command to execute.
         @param args positional arguments to pass to the build handler.
         @param timeout=timeout optional wakeup timeout.
+        @param write_delay=write_delay optional seconds per character.
+        @retval PacedWrite, wait() on it to know the command has been sent.
         @raises InstrumentTimeoutException if the response did not occur in time.
         @raises InstrumentProtocolException if command could not be built.        
         """
@@ -380,12 +382,7 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
 
         # Send command.
         log.debug('_do_cmd_no_resp: %s, timeout=%s' % (repr(cmd_line), timeout))
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        return self._queue_write(cmd_line, write_delay)
     
     ########################################################################
     # Unknown handlers.
@@ -411,7 +408,7 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
         next_state = None
         result = None
 
-        self._do_cmd_no_resp(Command.EXIT_AND_RESET, None, write_delay=self.write_delay)
+        self._do_cmd_no_resp(Command.EXIT_AND_RESET, None, write_delay=self.write_delay).wait()
         time.sleep(RESET_DELAY)
 
         # Break to command mode, then set next state to command mode
@@ -565,7 +562,7 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
         next_state = None
         result = None
 
-        self._do_cmd_no_resp(Command.EXIT_AND_RESET, None, write_delay=self.write_delay)
+        self._do_cmd_no_resp(Command.EXIT_AND_RESET, None, write_delay=self.write_delay).wait()
         time.sleep(RESET_DELAY)
         self._driver_event(DriverAsyncEvent.STATE_CHANGE)
         next_state = PARProtocolState.AUTOSAMPLE
@@ -586,7 +583,7 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
         
         try:
             # get into auto-sample mode guaranteed, then switch to poll mode
-            self._do_cmd_no_resp(Command.EXIT_AND_RESET, None, write_delay=self.write_delay)
+            self._do_cmd_no_resp(Command.EXIT_AND_RESET, None, write_delay=self.write_delay).wait()
             time.sleep(RESET_DELAY)
             if not self._switch_to_poll():
                 next_state = PARProtocolState.COMMAND
@@ -736,7 +733,7 @@ class SatlanticPARInstrumentProtocol(CommandResponseInstrumentProtocol):
         # This sometimes takes a few seconds, so stall after our sample cmd
         # and before the read/parse
         delay = self.write_delay + 2
-        self._do_cmd_no_resp(Command.SAMPLE, write_delay=delay)
+        self._do_cmd_no_resp(Command.SAMPLE, write_delay=delay).wait()
                 
         return (next_state, (next_agent_state, result))
     
@@ -1350,10 +1350,7 @@ class SBE19Protocol(SBE16Protocol):
             log.debug("KEY = %s VALUE = %s", key, val)
 
             if key in ConfirmedParameter.list():
-                # We add a write delay here because this command has to be sent
-                # twice, the write delay allows it to process the first command
-                # before it receives the beginning of the second.
-                self._do_cmd_resp(Command.SET, key, val, write_delay=0.2)
+                self._do_confirmed_set(key, val)
             elif key not in DriverParameter.list():
                 self._do_cmd_resp(Command.SET, key, val, **kwargs)
 
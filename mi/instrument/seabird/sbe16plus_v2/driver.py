@@ -50,6 +50,10 @@ from mi.instrument.seabird.driver import DEFAULT_ENCODER_KEY
 
 WAKEUP_TIMEOUT = 60
 
+# seconds per character the instrument needs to take in a set command that
+# is sent twice to confirm it
+CONFIRMED_SET_DELAY = 0.2
+
 ###############################################################################
 # Static enumerations for this class
 ###############################################################################
@@ -967,16 +971,25 @@ class SBE16Protocol(SeaBirdProtocol):
             log.debug("KEY = %s VALUE = %s", key, val)
 
             if(key in ConfirmedParameter.list()):
-                # We add a write delay here because this command has to be sent
-                # twice, the write delay allows it to process the first command
-                # before it receives the beginning of the second.
-                response = self._do_cmd_resp(Command.SET, key, val, write_delay=0.2)
+                response = self._do_confirmed_set(key, val)
             else:
                 response = self._do_cmd_resp(Command.SET, key, val, **kwargs)
 
         log.debug("set complete, update params")
         self._update_params()
 
+    def _do_confirmed_set(self, key, val):
+        """
+        Set a parameter whose set command has to be sent twice. The
+        instrument has to process the first command before it receives the
+        beginning of the second, so the command is paced. Each copy goes
+        out in one send, followed by the pause sending it a character at a
+        time would have taken.
+        """
+        set_cmd = self._build_handlers[Command.SET](Command.SET, key, val)
+        return self._do_cmd_resp(Command.SET, key, val, write_delay=CONFIRMED_SET_DELAY,
+                                 write_group=len(set_cmd) / 2)
+
     def _handler_command_acquire_sample(self, *args, **kwargs):
         """
         Acquire sample from SBE16.
@@ -1015,23 +1015,21 @@ class SamiProtocol(CommandResponseInstrumentProtocol):
         log.debug('_do_cmd_resp_no_wakeup: %r, timeout=%s, write_delay=%s, expected_prompt=%s, response_regex=%s',
                   cmd_line, timeout, write_delay, expected_prompt, response_regex)
 
-        if write_delay == 0:
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        paced = self._queue_write(cmd_line, write_delay)
 
         # Wait for the prompt, prepare result and return, timeout exception
+        # A paced command is still going out, the response can't be
+        # complete before it is.
         if response_regex:
             prompt = ""
-            result_tuple = self._get_response(timeout,
+            result_tuple = self._get_response(timeout + paced.duration(),
                                               response_regex=response_regex,
                                               expected_prompt=expected_prompt)
             result = "".join(result_tuple)
         else:
-            (prompt, result) = self._get_response(timeout,
+            (prompt, result) = self._get_response(timeout + paced.duration(),
                                                   expected_prompt=expected_prompt)
+        paced.wait()
 
         resp_handler = self._response_handlers.get((self.get_current_state(), cmd), None) or \
             self._response_handlers.get(cmd, None)
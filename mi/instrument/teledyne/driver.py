@@ -522,16 +522,14 @@ class TeledyneProtocol(CommandResponseInstrumentProtocol):
         # Send command.
         log.debug('_do_cmd_resp: %s' % repr(cmd_line))
 
-        if (write_delay == 0):
-            self._connection.send(cmd_line)
-        else:
-            for char in cmd_line:
-                self._connection.send(char)
-                time.sleep(write_delay)
+        paced = self._queue_write(cmd_line, write_delay)
 
         # Wait for the prompt, prepare result and return, timeout exception
-        (prompt, result) = self._get_response(timeout,
+        # A paced command is still going out, the response can't be
+        # complete before it is.
+        (prompt, result) = self._get_response(timeout + paced.duration(),
                                               expected_prompt=expected_prompt)
+        paced.wait()
         resp_handler = self._response_handlers.get((self.get_current_state(), cmd), None) or \
             self._response_handlers.get(cmd, None)
         resp_result = None
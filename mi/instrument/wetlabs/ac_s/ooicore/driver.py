@@ -32,6 +32,7 @@ from mi.core.instrument.data_particle import DataParticle
 from mi.core.instrument.data_particle import DataParticleKey
 from mi.core.instrument.data_particle import CommonDataParticleType
 from mi.core.instrument.chunker import StringChunker
+from mi.core.instrument.chunker import resumable_sieve
 from mi.core.instrument.driver_dict import DriverDictKey
 
 from struct import pack
@@ -69,6 +70,7 @@ SAMPLE_RECORD_HEADER = (r'^%s' %PACKET_REGISTRATION_PATTERN +
 
 SAMPLE_RECORD_HEADER_REGEX = re.compile(SAMPLE_RECORD_HEADER, re.DOTALL)
 
+STATUS_START = 'AC-Spectra '
 STATUS_PATTERN = r'AC-Spectra .+? quit\.'
 STATUS_REGEX = re.compile(STATUS_PATTERN, re.DOTALL)
         
@@ -404,27 +406,48 @@ class Protocol(CommandResponseInstrumentProtocol):
         self._build_driver_dict()
 
     @staticmethod
-    def sieve_function(raw_data):
+    @resumable_sieve
+    def sieve_function(raw_data, start_index=None):
         """
-        The method that splits samples and status
+        The method that splits samples and status. If start_index is given
+        only look from there on, and also return where the next search can
+        resume from (see mi.core.instrument.chunker.resumable_sieve)
         """
         raw_data_len = len(raw_data)
-        log.debug("sieve_function: raw_data=<%r>, len=%d" %(raw_data.encode('hex'), raw_data_len))
+        log.debug("sieve_function: len=%d, start_index=%s", raw_data_len, start_index)
         return_list = []
+        search_index = start_index or 0
+
+        # a registration pattern too close to the end to be matched yet, or
+        # the start of a packet that is not all here yet, has to be looked at
+        # again next time
+        packet_resume_index = raw_data_len - len(PACKET_REGISTRATION_PATTERN) + 1
         
         # look for samples
-        for match in PACKET_REGISTRATION_REGEX.finditer(raw_data):
+        for match in PACKET_REGISTRATION_REGEX.finditer(raw_data, search_index):
             if match.start() + INDEX_OF_PACKET_RECORD_LENGTH + SIZEOF_PACKET_RECORD_LENGTH < raw_data_len:
                 packet_length = get_two_byte_value(raw_data, match.start() + INDEX_OF_PACKET_RECORD_LENGTH) + SIZEOF_CHECKSUM_PLUS_PAD
                 index = match.start() + INDEX_OF_PACKET_RECORD_LENGTH
                 if match.start() + packet_length <= raw_data_len:
                     return_list.append((match.start(), match.start() + packet_length))
+                    continue
+            packet_resume_index = min(packet_resume_index, match.start())
                     
         # look for status
-        for match in STATUS_REGEX.finditer(raw_data):
+        status_end = search_index
+        for match in STATUS_REGEX.finditer(raw_data, search_index):
             return_list.append((match.start(), match.end()))
-                    
-        return return_list
+            status_end = match.end()
+
+        # same for a status message that has started but not finished
+        status_resume_index = raw_data.find(STATUS_START, status_end)
+        if status_resume_index == -1:
+            status_resume_index = raw_data_len - len(STATUS_START) + 1
+
+        if start_index is None:
+            return return_list
+
+        return (return_list, max(start_index, min(packet_resume_index, status_resume_index)))
 
     def _got_chunk(self, chunk, timestamp):
         """
@@ -62,7 +62,7 @@ from ion.agents.instrument.direct_access.direct_access_server import DirectAcces
 from pyon.agent.agent import ResourceAgentEvent
 from pyon.agent.agent import ResourceAgentState
 
-from struct import pack
+from mi.instrument.wetlabs.ac_s.ooicore.test.sample_data import OPTAA_SAMPLE, OPTAA_STATUS_DATA
 
 def ShortSample():
     short_sample_values = "FF 00 FF 00  02 A8 05 01  53 00 00 82  01 CE FF FF \
@@ -115,57 +115,6 @@ def ShortSample():
         short_sample += chr(int(value, 16))
     return short_sample
 
-raw_sample_1 = pack('200B',\
-0xff,0x00,0xff,0x00,0x02,0xb8,0x05,0x01,0x53,0x00,0x00,0x7b,0x01,0xc4,0xff,0xff,0x02,0xb6,0x6d,0xba,\
-0xa5,0x67,0x01,0xc4,0x02,0xb1,0xca,0x67,0x51,0x4f,0x01,0x53,0x04,0x51,0x03,0x63,0x04,0x54,0x02,0xff,\
-0x05,0x0d,0x04,0x06,0x05,0x29,0x03,0xb6,0x05,0xd9,0x04,0xbc,0x06,0x19,0x04,0x80,0x06,0xb6,0x05,0x80,\
-0x07,0x1e,0x05,0x5b,0x07,0xa2,0x06,0x57,0x08,0x3e,0x06,0x4e,0x08,0xa7,0x07,0x44,0x09,0x7c,0x07,0x5a,\
-0x09,0xc5,0x08,0x4b,0x0a,0xdc,0x08,0x85,0x0a,0xfe,0x09,0x6b,0x0c,0x63,0x09,0xd3,0x0c,0x49,0x0a,0x7c,\
-0x0e,0x09,0x0b,0x0d,0x81,0x0b,0xc9,0x0f,0x90,0x0c,0x9c,0x0f,0x1c,0x0d,0x46,0x8d,0x0e,0x5b,0x10,0xaf,\
-0x0e,0xae,0xa0,0x10,0x10,0x12,0x41,0x10,0x24,0x15,0xa3,0xdd,0xe5,0xb8,0x17,0xc3,0xce,0x15,0xaa,0x68,\
-0x1a,0x0b,0x15,0xe9,0x17,0x92,0x15,0x3a,0x1c,0x87,0x18,0x34,0x19,0x9c,0x17,0x29,0x1f,0x2e,0x1a,0xa5,\
-0x1b,0xc0,0x19,0x3d,0x21,0xfe,0x1d,0x4b,0x1e,0x0b,0x1b,0x76,0x24,0xfe,0x20,0x26,0x20,0x80,0x1d,0xd4,\
-0x28,0x3a,0x23,0x32,0x23,0x16,0x20,0x4f,0x2b,0xa7,0x26,0x6e,0x25,0xc8,0x22,0xe6,0x2f,0x3e,0x29,0xd2)
-
-raw_sample_2 = pack('200B',\
-0x28,0x98,0x25,0x88,0x32,0xfd,0x2d,0x56,0x2b,0x74,0x28,0x34,0x36,0xd6,0x30,0xef,0x2e,0x50,0x2a,0xe1,\
-0x3a,0xb5,0x34,0x98,0x31,0x38,0x2d,0x9b,0x3e,0xa2,0x38,0x59,0x34,0x2d,0x30,0x71,0x42,0xa2,0x3c,0x49,\
-0x37,0x44,0x33,0x78,0x46,0xcd,0x40,0x7e,0x3a,0x8e,0x36,0xb1,0x4b,0x3c,0x44,0xf9,0x3e,0x3a,0x22,0x4f,\
-0xfa,0x49,0xc7,0x41,0xd8,0x3d,0xb5,0x55,0x15,0x4e,0xd0,0x45,0xb7,0x41,0x43,0x5a,0x6b,0x53,0xdc,0x49,\
-0x73,0x44,0xa4,0x5f,0xa0,0x58,0xbb,0x4d,0x1f,0x48,0x05,0x64,0x9c,0x5d,0xa7,0x50,0xd3,0x4b,0x31,0x69,\
-0xcc,0x62,0x58,0x54,0x48,0x4e,0x2e,0x6e,0xaa,0x66,0xd2,0x57,0x8a,0x50,0xf8,0x73,0x3e,0x6b,0x0a,0x5a,\
-0x95,0x53,0x9d,0x77,0x8d,0x6f,0x19,0x5d,0x70,0x56,0x06,0x7b,0xa2,0x72,0xd9,0x60,0x1b,0x58,0x3d,0x7f,\
-0x73,0x76,0x5d,0x62,0x91,0x5a,0x45,0x83,0x04,0x79,0xa6,0x64,0xd3,0x5c,0x1d,0x86,0x4e,0x7c,0xa8,0x67,\
-0x18,0x5e,0x1e,0x89,0x3e,0x80,0x12,0x69,0x15,0x5f,0x9a,0x8c,0x35,0x82,0xad,0x6a,0xce,0x60,0xd2,0x8e,\
-0xdb,0x84,0xf4,0x6c,0x46,0x61,0xc5,0x91,0x27,0x86,0xdd,0x6d,0x80,0x62,0x6b,0x93,0x22,0x88,0x5b,0x6e)
-
-raw_sample_3 = pack('200B',\
-0x66,0x62,0xbf,0x94,0xb2,0x89,0x69,0x6e,0xed,0x62,0xc2,0x95,0xc5,0x89,0xff,0x6f,0x1a,0x62,0x74,0x96,\
-0x57,0x8a,0x25,0x6e,0xf6,0x61,0xdd,0x96,0x81,0x89,0xe0,0x6e,0x7f,0x60,0xfa,0x96,0x35,0x89,0x2b,0x6d,\
-0xb5,0x5f,0xcf,0x95,0x74,0x88,0x0d,0x6c,0x9b,0x5e,0x73,0x94,0x46,0x86,0xa9,0x6b,0x49,0x5c,0xe5,0x92,\
-0xc3,0x84,0xf2,0x69,0xc6,0x5b,0x24,0x90,0xfd,0x82,0xee,0x68,0x06,0x59,0x25,0x8e,0xdf,0x80,0x86,0x66,\
-0x14,0x56,0xfd,0x8c,0x79,0x7d,0xd9,0x63,0xe6,0x54,0xa1,0x89,0xc1,0x7a,0xda,0x61,0x75,0x51,0xfb,0x86,\
-0xb5,0x77,0x66,0x5e,0xae,0x4f,0x37,0x83,0x19,0x73,0xbb,0x5b,0xcd,0x4c,0x4d,0x7f,0x52,0x6f,0xc7,0x58,\
-0xf6,0x49,0x3c,0x7b,0x72,0x6b,0x94,0x56,0x46,0x25,0x77,0xff,0x67,0x47,0x52,0x3e,0x43,0x06,0x72,0xb2,\
-0x62,0xe7,0x4e,0xbb,0x3f,0xec,0x6d,0xe9,0x5e,0x83,0x4b,0x4c,0x3c,0xe2,0x69,0x43,0x5a,0x28,0x47,0xe4,\
-0x39,0xe9,0x64,0x95,0x55,0xe0,0x44,0x99,0x37,0x05,0x60,0x0e,0x51,0xb2,0x41,0x60,0x34,0x3e,0x5b,0xa3,\
-0x4d,0xac,0x3e,0x3e,0x31,0x8f,0x57,0x4b,0x49,0xca,0x3b,0x38,0x2e,0xff,0x53,0x19,0x46,0x0f,0x38,0x4f)
-
-raw_sample_4 = pack('99B',\
-0x2c,0x88,0x4f,0x0c,0x42,0x7c,0x35,0x81,0x2a,0x32,0x4b,0x27,0x3f,0x10,0x32,0xd6,0x27,0xf2,0x47,0x6f,\
-0x3b,0xc7,0x30,0x49,0x25,0xad,0x43,0xe2,0x38,0x74,0x2d,0xc0,0x23,0xc9,0x40,0x6f,0x35,0xaa,0x2b,0x68,\
-0x22,0x1a,0x3c,0xf3,0x33,0x2c,0x29,0x7a,0x20,0x68,0x3a,0x53,0x30,0xb1,0x27,0x83,0x1e,0xcd,0x37,0x99,\
-0x2e,0x51,0x25,0xa1,0x1d,0x49,0x34,0xf2,0x2c,0x15,0x23,0xd8,0x1b,0xdd,0x32,0x71,0x29,0xfb,0x22,0x25,\
-0x19,0x43,0x30,0x26,0x0c,0x73,0x00,0xfe,0x00,0xfe,0x00,0x02,0xb8,0x05,0x01,0x53,0x0f,0x29,0x00)
-
-OPTAA_SAMPLE = raw_sample_1 + raw_sample_2 + raw_sample_3 + raw_sample_4
-
-OPTAA_STATUS_DATA = \
-"AC-Spectra Version 1.10     (May 16 2005 09:40:13)" + NEWLINE +\
-"Persistor CF2 SN:12154   BIOS:2.28   PicoDOS:2.28" + NEWLINE + NEWLINE +\
-"14 A/D samples per bin into 20164 long buffers" + NEWLINE +\
-"Spinning up motor for 10 secs. Hit 'Q' to quit."
-
 # Globals
 raw_stream_received = False
 parsed_stream_received = False